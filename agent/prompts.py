@@ -227,7 +227,7 @@ available_tools = [
         "type": "function",
         "function": {
             "name": "optimize_meal_portions",
-            "description": "Ottimizza automaticamente le porzioni degli alimenti per un pasto specifico. Verifica AUTOMATICAMENTE che tutti gli alimenti siano presenti nel database (usando check_foods_in_db) e calcola le quantità in grammi per rispettare i target nutrizionali dell'utente per quel pasto. Restituisce errore se alimenti non sono nel database.",
+            "description": "Ottimizza automaticamente le porzioni degli alimenti per un pasto specifico. Verifica AUTOMATICAMENTE che tutti gli alimenti siano presenti nel database (usando check_foods_in_db) e calcola le quantità in grammi per rispettare i target nutrizionali dell'utente per quel pasto. Varianti e refusi riconoscibili (es. 'petto di polo') vengono risolti automaticamente; se alimenti non sono nel database restituisce errore con gli alimenti simili suggeriti (campo suggestions).",
             "parameters": {
                 "type": "object",
                 "properties": {
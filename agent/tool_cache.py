@@ -0,0 +1,198 @@
+"""
+Cache dei risultati dei tool puri dell'agente.
+
+Molti tool (LARN, BMI, obiettivo di peso, dispendio sportivo, kcal degli alimenti)
+dipendono solo dagli argomenti e dai dati statici di Dati_processed, e l'assistente
+li richiama spesso con gli stessi argomenti anche nella stessa conversazione.
+ToolResultCache memorizza il risultato (serializzato in JSON) con chiave il nome
+del tool e gli argomenti in JSON canonico (chiavi ordinate), in un LRU con scadenza
+(TTL). Ogni risultato è associato alla versione dei dati in cui è stato calcolato:
+se un file di Dati_processed cambia, i risultati precedenti vengono scartati.
+
+I risultati con errori non vengono memorizzati. Quali tool sono puri è dichiarato in
+ToolHandler (PURE_TOOLS).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# Configurazione della cache condivisa dal processo
+TOOL_CACHE_ENABLED = os.environ.get("NUTRICOACH_TOOL_CACHE", "1") != "0"
+TOOL_CACHE_SIZE = int(os.environ.get("NUTRICOACH_TOOL_CACHE_SIZE", "1024"))
+TOOL_CACHE_TTL_SECONDS = float(os.environ.get("NUTRICOACH_TOOL_CACHE_TTL_SECONDS", "3600"))
+
+DATA_DIR = "Dati_processed"
+
+
+def data_version(path: str = DATA_DIR) -> Tuple:
+    """
+    Calcola la versione dei dati statici dai metadati dei file JSON della directory.
+
+    Args:
+        path: Directory dei dati (default "Dati_processed")
+
+    Returns:
+        tuple: (nome, dimensione, mtime in ns) di ogni file JSON, ordinati per nome
+    """
+    try:
+        with os.scandir(path) as entries:
+            stats = [(entry.name, entry.stat()) for entry in entries
+                     if entry.name.endswith(".json") and entry.is_file()]
+        return tuple(sorted((name, stat.st_size, stat.st_mtime_ns) for name, stat in stats))
+    except OSError:
+        return ()
+
+
+def tool_cache_key(function_name: str, arguments: Dict[str, Any]) -> str:
+    """
+    Calcola la chiave di cache di una chiamata: nome del tool e argomenti in JSON canonico.
+
+    L'ordine delle chiavi degli argomenti non conta, l'ordine delle liste sì.
+    """
+    return json.dumps([function_name, arguments], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def is_cacheable_result(result: Any) -> bool:
+    """Un risultato è memorizzabile se è un dizionario senza errori."""
+    return isinstance(result, dict) and "error" not in result and result.get("success") is not False
+
+
+class ToolResultCache:
+    """Cache LRU con scadenza dei risultati dei tool, invalidata al cambio dei dati. Thread-safe."""
+
+    def __init__(self, maxsize: int = TOOL_CACHE_SIZE, ttl: float = TOOL_CACHE_TTL_SECONDS,
+                 version: Callable[[], Any] = data_version):
+        """
+        Args:
+            maxsize: Numero massimo di risultati memorizzati
+            ttl: Secondi di validità di un risultato
+            version: Funzione che restituisce la versione corrente dei dati
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self._entries = OrderedDict()  # chiave -> (versione, scadenza, risultato JSON)
+        self._lock = threading.Lock()
+        self._tool_stats: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _count(self, function_name: str, counter: str) -> None:
+        stats = self._tool_stats.setdefault(function_name, {"hits": 0, "misses": 0})
+        stats[counter] += 1
+
+    def get(self, function_name: str, arguments: Dict[str, Any], version: Any = None) -> Optional[Any]:
+        """
+        Restituisce una copia del risultato memorizzato per la chiamata, o None.
+
+        Args:
+            function_name: Nome del tool
+            arguments: Argomenti della chiamata
+            version: Versione dei dati (default: calcolata con self.version)
+        """
+        key = tool_cache_key(function_name, arguments)
+        if version is None:
+            version = self.version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, payload = entry
+                if entry_version != version:
+                    del self._entries[key]
+                    self.invalidations += 1
+                elif time.monotonic() >= expires_at:
+                    del self._entries[key]
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._count(function_name, "hits")
+                    return json.loads(payload)
+            self._count(function_name, "misses")
+        return None
+
+    def put(self, function_name: str, arguments: Dict[str, Any], result: Any, version: Any = None) -> bool:
+        """
+        Memorizza il risultato di una chiamata se non contiene errori.
+
+        Returns:
+            bool: True se il risultato è stato memorizzato
+        """
+        if not is_cacheable_result(result):
+            return False
+        try:
+            payload = json.dumps(result)
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Risultato di {function_name} non serializzabile, non memorizzato: {str(e)}")
+            return False
+        key = tool_cache_key(function_name, arguments)
+        if version is None:
+            version = self.version()
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def call(self, function_name: str, arguments: Dict[str, Any], function: Callable[..., Any]) -> Any:
+        """Restituisce il risultato memorizzato o lo calcola con function(**arguments) e lo memorizza."""
+        version = self.version()
+        result = self.get(function_name, arguments, version)
+        if result is None:
+            result = function(**arguments)
+            self.put(function_name, arguments, result, version)
+        return result
+
+    def clear(self) -> None:
+        """Svuota la cache e azzera i contatori."""
+        with self._lock:
+            self._entries.clear()
+            self._tool_stats.clear()
+            self.evictions = self.expirations = self.invalidations = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Restituisce dimensione, contatori e hit rate per tool della cache."""
+        with self._lock:
+            tools = {}
+            for function_name, counters in self._tool_stats.items():
+                lookups = counters["hits"] + counters["misses"]
+                tools[function_name] = dict(counters, hit_rate=counters["hits"] / lookups if lookups else 0.0)
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "tools": tools,
+            }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_tool_cache() -> Optional[ToolResultCache]:
+    """Restituisce la cache condivisa dal processo, o None se disattivata (NUTRICOACH_TOOL_CACHE=0).
+
+    Dimensione e scadenza si configurano con NUTRICOACH_TOOL_CACHE_SIZE e
+    NUTRICOACH_TOOL_CACHE_TTL_SECONDS.
+    """
+    global _shared_cache
+    if not TOOL_CACHE_ENABLED:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ToolResultCache(TOOL_CACHE_SIZE, TOOL_CACHE_TTL_SECONDS)
+        return _shared_cache
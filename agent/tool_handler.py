@@ -6,6 +6,11 @@ inclusi tool per database nutrizionale e dati utente.
 """
 
 import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import streamlit as st
 from agent_tools.nutridb_tool import (
     get_LARN_protein, get_LARN_fibre, 
@@ -21,6 +26,35 @@ from agent_tools.user_data_tool import (
 from agent_tools.meal_optimization_tool import optimize_meal_portions
 from agent_tools.calculate_kcal_from_foods_tool import calculate_kcal_from_foods
 from agent_tools.weekly_diet_generator_tool import generate_6_additional_days
+from agent_tools.nutridb_tool import get_user_id
+from agent_tools.user_context import user_context
+from agent.tool_cache import get_tool_cache
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# Thread del pool condiviso che esegue in parallelo le chiamate ai tool di una run
+TOOL_WORKERS = int(os.environ.get("NUTRICOACH_TOOL_WORKERS", "4"))
+# Tempo massimo (secondi) per una chiamata a un tool
+TOOL_TIMEOUT_SECONDS = float(os.environ.get("NUTRICOACH_TOOL_TIMEOUT_SECONDS", "60"))
+# Tempi massimi specifici dei tool più lenti
+TOOL_TIMEOUTS = {
+    "optimize_meal_portions": 90,
+    "generate_6_additional_days": 150,
+}
+# Tool puri: il risultato dipende solo dagli argomenti e da Dati_processed (vedi tool_cache)
+PURE_TOOLS = frozenset({
+    "get_LARN_protein",
+    "get_LARN_fibre",
+    "get_LARN_lipidi_percentuali",
+    "get_LARN_vitamine",
+    "calculate_weight_goal_calories",
+    "analyze_bmi_and_goals",
+    "calculate_sport_expenditure",
+    "get_protein_multiplier",
+    "calculate_kcal_from_foods",
+})
 
 
 class ToolHandler:
@@ -78,45 +112,99 @@ class ToolHandler:
         st.warning("Uso di user_data_tool legacy - aggiornare alla nuova API")
         return {"warning": "Legacy tool call"}
     
-    def handle_tool_calls(self, run_status):
+    def _call_tool(self, function_name, arguments):
+        """
+        Esegue un tool, usando la cache dei risultati per i tool puri.
+        
+        Args:
+            function_name: Nome del tool (presente in function_map)
+            arguments: Argomenti della chiamata
+            
+        Returns:
+            Risultato del tool
+        """
+        function = self.function_map[function_name]
+        cache = get_tool_cache() if function_name in PURE_TOOLS else None
+        if cache is None:
+            return function(**arguments)
+        return cache.call(function_name, arguments, function)
+    
+    def _execute_tool_call(self, tool_call, user_id):
+        """
+        Esegue una chiamata a un tool per l'utente indicato (nei thread del pool).
+        
+        Args:
+            tool_call: Chiamata richiesta dall'assistente
+            user_id: ID dell'utente per cui eseguire il tool
+            
+        Returns:
+            tuple: (risultato del tool, messaggio di errore da mostrare o None)
+        """
+        function_name = tool_call.function.name
+        try:
+            # Estrai i parametri della chiamata
+            arguments = json.loads(tool_call.function.arguments)
+            
+            # Esegui la funzione appropriata
+            if function_name not in self.function_map:
+                return {"error": f"Tool {function_name} non supportato"}, f"Tool non supportato: {function_name}"
+            with user_context(user_id):
+                return self._call_tool(function_name, arguments), None
+            
+        except Exception as e:
+            error_message = f"Errore nell'esecuzione del tool {function_name}: {str(e)}"
+            return {"error": str(e)}, error_message
+    
+    def handle_tool_calls(self, run_status, user_id=None):
         """
         Gestisce le chiamate ai tool dell'assistente.
         
+        Le chiamate di uno stesso passo della run sono indipendenti tra loro e vengono
+        eseguite in parallelo dal pool condiviso (al più NUTRICOACH_TOOL_WORKERS);
+        l'utente è passato esplicitamente ai thread del pool con user_context, perché
+        lì il session state di Streamlit non è disponibile. Gli output mantengono
+        l'ordine delle chiamate; una chiamata che supera il suo tempo massimo
+        (TOOL_TIMEOUTS o NUTRICOACH_TOOL_TIMEOUT_SECONDS) restituisce un errore.
+        I tool in PURE_TOOLS ripetuti con gli stessi argomenti usano la cache dei risultati.
+        
         Args:
             run_status: Stato della run OpenAI che richiede azioni
+            user_id: ID dell'utente (default: utente della sessione corrente)
             
         Returns:
             list: Lista di output dei tool per OpenAI
         """
         try:
             tool_calls = run_status.required_action.submit_tool_outputs.tool_calls
-            tool_outputs = []
             
-            for tool_call in tool_calls:
+            if user_id is None:
+                try:
+                    user_id = get_user_id()
+                except ValueError:
+                    logger.warning("⚠️ Nessun utente per l'esecuzione dei tool")
+            
+            executor = get_tool_executor()
+            submitted_at = time.monotonic()
+            futures = [executor.submit(self._execute_tool_call, tool_call, user_id) for tool_call in tool_calls]
+            
+            tool_outputs = []
+            for tool_call, future in zip(tool_calls, futures):
+                function_name = tool_call.function.name
+                timeout = TOOL_TIMEOUTS.get(function_name, TOOL_TIMEOUT_SECONDS)
                 try:
-                    # Estrai i parametri della chiamata
-                    function_name = tool_call.function.name
-                    arguments = json.loads(tool_call.function.arguments)
-                    
-                    # Esegui la funzione appropriata
-                    if function_name in self.function_map:
-                        result = self.function_map[function_name](**arguments)
-                    else:
-                        result = {"error": f"Tool {function_name} non supportato"}
-                        st.error(f"Tool non supportato: {function_name}")
-                    
-                    tool_outputs.append({
-                        "tool_call_id": tool_call.id,
-                        "output": json.dumps(result)
-                    })
-                    
-                except Exception as e:
-                    error_message = f"Errore nell'esecuzione del tool {tool_call.function.name}: {str(e)}"
+                    result, error_message = future.result(timeout=max(submitted_at + timeout - time.monotonic(), 0))
+                except FutureTimeoutError:
+                    # Il thread non può essere interrotto: il risultato tardivo viene ignorato
+                    future.cancel()
+                    result = {"error": f"Timeout: il tool {function_name} ha superato {timeout:g} secondi"}
+                    error_message = f"Errore nell'esecuzione del tool {function_name}: timeout"
+                
+                if error_message:
                     st.error(error_message)
-                    tool_outputs.append({
-                        "tool_call_id": tool_call.id,
-                        "output": json.dumps({"error": str(e)})
-                    })
+                tool_outputs.append({
+                    "tool_call_id": tool_call.id,
+                    "output": json.dumps(result)
+                })
             
             return tool_outputs
             
@@ -158,23 +246,42 @@ class ToolHandler:
         """
         try:
             if function_name in self.function_map:
-                return self.function_map[function_name](**arguments)
+                return self._call_tool(function_name, arguments)
             else:
                 return {"error": f"Tool {function_name} non supportato"}
         except Exception as e:
             return {"error": f"Errore nell'esecuzione: {str(e)}"}
 
 
+_tool_executor = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """
+    Restituisce il pool di thread condiviso dal processo per l'esecuzione dei tool.
+    
+    Returns:
+        ThreadPoolExecutor: pool con NUTRICOACH_TOOL_WORKERS thread
+    """
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is None:
+            _tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="agent-tool")
+        return _tool_executor
+
+
 # Funzione di utilità per mantenere compatibilità con app.py
-def handle_tool_calls(run_status):
+def handle_tool_calls(run_status, user_id=None):
     """
     Funzione wrapper per compatibilità con app.py.
     
     Args:
         run_status: Stato della run OpenAI
+        user_id: ID dell'utente (default: utente della sessione corrente)
         
     Returns:
         list: Output dei tool
     """
     tool_handler = ToolHandler()
-    return tool_handler.handle_tool_calls(run_status) 
\ No newline at end of file
+    return tool_handler.handle_tool_calls(run_status, user_id=user_id) 
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Scritture atomiche e lock per file condivisi tra thread e processi.
+
+Più worker Streamlit (e il thread di estrazione DeepSeek) scrivono gli stessi file
+utente. Per evitare aggiornamenti persi e letture di file scritti a metà:
+
+- atomic_write_json scrive su un file temporaneo nella stessa directory e lo
+  sostituisce con os.replace: i lettori vedono il file precedente o quello nuovo,
+  mai uno troncato;
+- file_lock serializza le sezioni lettura-modifica-scrittura con un lock advisory
+  fcntl.flock su un file di lock dedicato (tra processi) e un RLock (tra thread
+  dello stesso processo). Il lock è rientrante nello stesso thread.
+
+Dove fcntl non è disponibile (Windows) il lock vale solo tra i thread del processo.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - solo Windows
+    fcntl = None
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+LOCK_DIR_NAME = ".locks"
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+class _LockState:
+    """Lock di un file per questo processo: RLock tra thread e descrittore del flock."""
+
+    def __init__(self):
+        self.rlock = threading.RLock()
+        self.depth = 0
+        self.fd = None
+
+
+def _lock_state(path):
+    with _thread_locks_guard:
+        state = _thread_locks.get(path)
+        if state is None:
+            state = _LockState()
+            _thread_locks[path] = state
+        return state
+
+
+def lock_path(directory, name):
+    """Percorso del file di lock per una risorsa (es. un utente) in una directory dati."""
+    return Path(directory) / LOCK_DIR_NAME / f"{name}.lock"
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Acquisisce in modo esclusivo il lock su path, tra thread e processi.
+
+    Args:
+        path: Percorso del file di lock (creato se non esiste)
+    """
+    path = os.path.abspath(path)
+    state = _lock_state(path)
+    with state.rlock:
+        if state.depth == 0 and fcntl is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                os.close(fd)
+                raise
+            state.fd = fd
+        state.depth += 1
+        try:
+            yield
+        finally:
+            state.depth -= 1
+            if state.depth == 0 and state.fd is not None:
+                fd, state.fd = state.fd, None
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+
+def atomic_write_text(path, text, fsync=True):
+    """
+    Sostituisce atomicamente il contenuto di un file.
+
+    Args:
+        path: Percorso del file
+        text: Nuovo contenuto
+        fsync: Se True forza i dati su disco prima della sostituzione
+    """
+    path = Path(path)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        # mkstemp crea il file con permessi 0600: si mantengono quelli di un file ordinario
+        os.chmod(temp_path, 0o644)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def atomic_write_json(path, data, fsync=True):
+    """
+    Serializza data in JSON (indentato, UTF-8) e sostituisce atomicamente il file.
+
+    Args:
+        path: Percorso del file
+        data: Dati serializzabili in JSON
+        fsync: Se True forza i dati su disco prima della sostituzione
+    """
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2), fsync=fsync)
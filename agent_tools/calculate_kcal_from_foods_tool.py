@@ -11,16 +11,16 @@ import json
 from typing import Dict, List, Any, Union
 import logging
 
-from .nutridb import NutriDB
+from .nutridb import get_shared_nutridb, format_food_suggestions
 from .nutridb_tool import get_user_id
 
 # Configurazione logging
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# Inizializza il database
+# Usa l'istanza del database condivisa dal processo
 try:
-    db = NutriDB("Dati_processed")
+    db = get_shared_nutridb("Dati_processed")
 except Exception as e:
     logger.error(f"Errore nell'inizializzazione del database: {str(e)}")
     raise
@@ -47,6 +47,8 @@ def calculate_kcal_from_foods(foods_with_grams: Union[List[Dict[str, Union[str,
         - total_nutrients: dict con totali nutrizionali (kcal, proteine_g, carboidrati_g, grassi_g)
         - foods_breakdown: dict con il contributo nutrizionale di ogni alimento
         - foods_not_found: lista degli alimenti non trovati nel database
+        - foods_resolved: dict nome fornito -> alimento riconosciuto per i nomi risolti automaticamente
+        - suggestions: dict alimento non trovato -> alimenti simili suggeriti
         - error_message: messaggio di errore se fallisce (solo in caso di errore)
         
     Examples:
@@ -105,8 +107,12 @@ def calculate_kcal_from_foods(foods_with_grams: Union[List[Dict[str, Union[str,
         # 3. Estrai la lista dei nomi degli alimenti
         food_names = list(foods_dict.keys())
         
-        # 4. Verifica che tutti gli alimenti siano nel database
-        all_found, foods_not_found = db.check_foods_in_db(food_names)
+        # 4. Verifica che tutti gli alimenti siano nel database, risolvendo
+        #    automaticamente varianti e refusi riconoscibili con sicurezza
+        resolved_names, foods_resolved = db.resolve_food_names(food_names)
+        lookup_names = dict(zip(food_names, resolved_names))
+        all_found, not_found_names = db.check_foods_in_db(resolved_names)
+        foods_not_found = [food_name for food_name in food_names if lookup_names[food_name] in not_found_names]
         
         # 5. Calcola i nutrienti per gli alimenti trovati
         foods_breakdown = {}
@@ -117,49 +123,40 @@ def calculate_kcal_from_foods(foods_with_grams: Union[List[Dict[str, Union[str,
             "grassi_g": 0.0
         }
         
-        for food_name, grams in foods_dict.items():
-            if food_name not in foods_not_found:
-                try:
-                    # Ottieni i macronutrienti per 100g dell'alimento
-                    macros_per_100g = db.get_macros(food_name, 100)
-                    
-                    # Verifica che i macronutrienti siano validi
-                    if macros_per_100g is None:
-                        logger.warning(f"Macronutrienti nulli per {food_name}")
-                        if food_name not in foods_not_found:
-                            foods_not_found.append(food_name)
-                        continue
-                    
-                    # Calcola i nutrienti per la quantità specificata
-                    food_nutrients = {
-                        "kcal": float(macros_per_100g.get("energia_kcal", 0)) * grams / 100,
-                        "proteine_g": float(macros_per_100g.get("proteine_g", 0)) * grams / 100,
-                        "carboidrati_g": float(macros_per_100g.get("carboidrati_g", 0)) * grams / 100,
-                        "grassi_g": float(macros_per_100g.get("grassi_g", 0)) * grams / 100
-                    }
-                    
-                    # Verifica che i nutrienti calcolati siano validi
-                    if any(value < 0 for value in food_nutrients.values()):
-                        logger.warning(f"Valori nutrizionali negativi per {food_name}: {food_nutrients}")
-                        if food_name not in foods_not_found:
-                            foods_not_found.append(food_name)
-                        continue
-                    
-                    # Aggiungi al breakdown solo se tutto è valido
-                    foods_breakdown[food_name] = {
-                        "grams": grams,
-                        "nutrients": food_nutrients
-                    }
-                    
-                    # Aggiungi ai totali
-                    for nutrient in total_nutrients:
-                        total_nutrients[nutrient] += food_nutrients[nutrient]
-                        
-                except Exception as e:
-                    logger.warning(f"Errore nel calcolo nutrienti per {food_name}: {str(e)}")
-                    # Aggiungi l'alimento alla lista di quelli non trovati se c'è un errore
-                    if food_name not in foods_not_found:
-                        foods_not_found.append(food_name)
+        found_foods = [food_name for food_name in foods_dict if food_name not in foods_not_found]
+        
+        if found_foods:
+            try:
+                # Calcola i nutrienti di tutti gli alimenti con un solo prodotto matrice-vettore
+                nutrients = db.get_nutrients_many(
+                    [lookup_names[food_name] for food_name in found_foods],
+                    [foods_dict[food_name] for food_name in found_foods]
+                )
+                columns = [db.nutrient_columns[nutrient] for nutrient in ("energia_kcal", "proteine_g", "carboidrati_g", "grassi_g")]
+                rows = nutrients["per_food"][:, columns].tolist()
+            except Exception as e:
+                logger.warning(f"Errore nel calcolo nutrienti per {', '.join(found_foods)}: {str(e)}")
+                foods_not_found.extend(found_foods)
+                rows = []
+            
+            for food_name, row in zip(found_foods, rows):
+                food_nutrients = dict(zip(total_nutrients, row))
+                
+                # Verifica che i nutrienti calcolati siano validi
+                if any(value < 0 for value in food_nutrients.values()):
+                    logger.warning(f"Valori nutrizionali negativi per {food_name}: {food_nutrients}")
+                    foods_not_found.append(food_name)
+                    continue
+                
+                # Aggiungi al breakdown solo se tutto è valido
+                foods_breakdown[food_name] = {
+                    "grams": foods_dict[food_name],
+                    "nutrients": food_nutrients
+                }
+                
+                # Aggiungi ai totali
+                for nutrient in total_nutrients:
+                    total_nutrients[nutrient] += food_nutrients[nutrient]
         
         # 6. Arrotonda i risultati totali a 1 decimale
         for nutrient in total_nutrients:
@@ -175,16 +172,20 @@ def calculate_kcal_from_foods(foods_with_grams: Union[List[Dict[str, Union[str,
         
         # 9. Componi il messaggio di errore se necessario
         error_message = None
+        suggestions = db.get_food_suggestions(foods_not_found)
         if foods_not_found:
             error_message = f"Alimenti non trovati nel database: {', '.join(foods_not_found)}"
             if not success:
                 error_message = f"Tutti gli alimenti non sono stati trovati nel database: {', '.join(foods_not_found)}"
+            error_message += format_food_suggestions(suggestions)
         
         return {
             "success": success,
             "total_nutrients": total_nutrients,
             "foods_breakdown": foods_breakdown,
             "foods_not_found": foods_not_found,
+            "foods_resolved": {name: canonical for name, canonical in foods_resolved.items() if name in foods_breakdown},
+            "suggestions": suggestions,
             "error_message": error_message
         }
         
@@ -0,0 +1,141 @@
+"""
+Indice fuzzy dei nomi degli alimenti.
+
+Indice invertito a trigrammi su tutti gli alias (nomi canonici inclusi) di NutriDB,
+usato per suggerire gli alimenti più simili a un nome sconosciuto (refusi, varianti)
+e per trovare senza scansione completa gli alias che contengono un termine generico.
+"""
+
+from collections import Counter
+from difflib import SequenceMatcher
+
+
+def normalize_food_name(name):
+    """Normalizza un nome per il confronto fuzzy: minuscolo, apostrofi e spazi uniformati."""
+    name = name.lower()
+    for apostrophe in ['`', '‘', '’', '‛', '′']:
+        name = name.replace(apostrophe, "'")
+    return " ".join(name.replace("_", " ").split())
+
+
+def _trigrams(text):
+    """Trigrammi di una stringa (senza padding)."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _padded_trigrams(text):
+    """Trigrammi con padding, così anche i nomi brevi e i bordi delle parole contano."""
+    return _trigrams(f"  {text} ")
+
+
+class FoodNameIndex:
+    """Indice a trigrammi sugli alias degli alimenti.
+
+    Le voci mantengono l'ordine di inserimento del dizionario degli alias, così le
+    ricerche restituiscono i risultati nello stesso ordine di una scansione completa.
+    """
+
+    # Numero di candidati (per similarità di trigrammi) rivalutati con l'edit distance
+    RERANK_CANDIDATES = 30
+
+    def __init__(self, alias_mapping):
+        """
+        Args:
+            alias_mapping: dict alias -> chiave canonica
+        """
+        self.entries = list(alias_mapping.items())
+        self._normalized = []
+        self._normalized_grams = []
+        self._fuzzy_index = {}
+        self._substring_index = {}
+        self._word_index = {}
+
+        for entry_id, (alias_name, _) in enumerate(self.entries):
+            normalized = normalize_food_name(alias_name)
+            grams = _padded_trigrams(normalized)
+            self._normalized.append(normalized)
+            self._normalized_grams.append(grams)
+            for gram in grams:
+                self._fuzzy_index.setdefault(gram, []).append(entry_id)
+            for gram in _trigrams(alias_name):
+                self._substring_index.setdefault(gram, set()).add(entry_id)
+            for word in set(alias_name.lower().split()):
+                self._word_index.setdefault(word, set()).add(entry_id)
+
+    def suggest(self, name, limit=5, min_score=0.0):
+        """Restituisce gli alimenti più simili al nome indicato, ordinati per punteggio.
+
+        Il punteggio è la media tra il coefficiente di Dice sui trigrammi e il rapporto
+        di similarità di difflib (basato sull'edit distance), calcolato solo sui candidati
+        migliori preselezionati tramite l'indice.
+
+        Args:
+            name: Nome dell'alimento da cercare
+            limit: Numero massimo di suggerimenti
+            min_score: Punteggio minimo (0-1) per includere un suggerimento
+
+        Returns:
+            list: Suggerimenti [{"name": alias, "food": chiave canonica, "score": float}],
+                  al massimo uno per chiave canonica
+        """
+        normalized = normalize_food_name(name)
+        if not normalized:
+            return []
+        query_grams = _padded_trigrams(normalized)
+
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._fuzzy_index.get(gram, ()))
+
+        dice = {
+            entry_id: 2.0 * count / (len(query_grams) + len(self._normalized_grams[entry_id]))
+            for entry_id, count in shared.items()
+        }
+        candidates = sorted(dice, key=lambda entry_id: (-dice[entry_id], entry_id))[:self.RERANK_CANDIDATES]
+
+        scored = []
+        for entry_id in candidates:
+            ratio = SequenceMatcher(None, normalized, self._normalized[entry_id]).ratio()
+            scored.append(((dice[entry_id] + ratio) / 2, entry_id))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+
+        suggestions = []
+        seen_foods = set()
+        for score, entry_id in scored:
+            if score < min_score or len(suggestions) >= limit:
+                break
+            alias_name, canonical = self.entries[entry_id]
+            if canonical in seen_foods:
+                continue
+            seen_foods.add(canonical)
+            suggestions.append({"name": alias_name, "food": canonical, "score": round(score, 3)})
+        return suggestions
+
+    def find_containing(self, term):
+        """Trova gli alias che contengono tutte le parole del termine o il termine come sottostringa.
+
+        Equivale alla scansione di tutti gli alias con i due criteri di
+        find_generic_food_variants, ma interroga solo le voci candidate.
+
+        Args:
+            term: Termine generico (es. "yogurt", "pane")
+
+        Returns:
+            list: Coppie (alias, chiave canonica) nell'ordine degli alias
+        """
+        words = term.lower().split()
+        if not words:
+            return list(self.entries)
+
+        # Metodo 1: tutte le parole del termine sono parole dell'alias
+        matches = set.intersection(*(self._word_index.get(word, set()) for word in words))
+
+        # Metodo 2: il termine è una sottostringa dell'alias
+        grams = _trigrams(term)
+        if grams:
+            candidates = set.intersection(*(self._substring_index.get(gram, set()) for gram in grams))
+        else:
+            candidates = range(len(self.entries))
+        matches.update(entry_id for entry_id in candidates if term in self.entries[entry_id][0])
+
+        return [self.entries[entry_id] for entry_id in sorted(matches)]
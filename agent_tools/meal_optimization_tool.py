@@ -9,19 +9,26 @@ import os
 import json
 from typing import Dict, List, Any, Tuple, Optional
 import logging
-from scipy.optimize import minimize
 import numpy as np
 
-from .nutridb import NutriDB
+from .nutridb import get_shared_nutridb, format_food_suggestions
+from .portion_cache import get_portion_cache
+from .user_document_cache import get_user_document
+from .portion_solver import (
+    BATCHED_SOLVERS, DEFAULT_SOLVER, DISCRETE_NODE_BUDGET, DISCRETE_PORTIONS, PORTION_STEP,
+    build_day_problem, build_portion_problem, canonical_problem, portion_error, restore_food_order,
+    solve_lp, solve_portions, solve_portions_batch, solve_portions_discrete, split_day_solution,
+    DiscreteSearchTimeout
+)
 from .nutridb_tool import get_user_id
 
 # Configurazione logging
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# Inizializza il database
+# Usa l'istanza del database condivisa dal processo
 try:
-    db = NutriDB("Dati_processed")
+    db = get_shared_nutridb("Dati_processed")
 except Exception as e:
     logger.error(f"Errore nell'inizializzazione del database: {str(e)}")
     raise
@@ -30,13 +37,33 @@ except Exception as e:
 # get_user_id è ora importato da nutridb_tool
 
 
-def load_user_meal_targets(user_id: str, meal_name: str) -> Dict[str, float]:
+def load_user_data(user_id: str) -> Dict[str, Any]:
+    """
+    Carica il documento dell'utente dalla cache condivisa (vedi user_document_cache).
+    
+    Args:
+        user_id: ID dell'utente (con o senza prefisso 'user_')
+        
+    Returns:
+        Dict con i dati dell'utente (vista in sola lettura)
+        
+    Raises:
+        ValueError: Se il file utente non esiste
+    """
+    user_data = get_user_document(user_id)
+    if user_data is None:
+        raise ValueError(f"File utente {user_id} non trovato.")
+    return user_data
+
+
+def load_user_meal_targets(user_id: str, meal_name: str, user_data: Optional[Dict[str, Any]] = None) -> Dict[str, float]:
     """
     Carica i target nutrizionali per un pasto specifico dal file utente.
     
     Args:
         user_id: ID dell'utente
         meal_name: Nome del pasto (es: 'Colazione', 'Pranzo', etc.)
+        user_data: Dati utente già caricati (opzionale, evita di rileggere il file)
         
     Returns:
         Dict con target di kcal, proteine_g, carboidrati_g, grassi_g
@@ -44,19 +71,8 @@ def load_user_meal_targets(user_id: str, meal_name: str) -> Dict[str, float]:
     Raises:
         ValueError: Se i dati non sono disponibili
     """
-    # Fix: Handle user_id that may already contain 'user_' prefix
-    if user_id.startswith("user_"):
-        user_file_path = f"user_data/{user_id}.json"
-    else:
-        user_file_path = f"user_data/user_{user_id}.json"
-    
-
-    
-    if not os.path.exists(user_file_path):
-        raise ValueError(f"File utente {user_id} non trovato.")
-    
-    with open(user_file_path, 'r', encoding='utf-8') as f:
-        user_data = json.load(f)
+    if user_data is None:
+        user_data = load_user_data(user_id)
     
     nutritional_info = user_data.get("nutritional_info_extracted", {})
     daily_macros = nutritional_info.get("daily_macros", {})
@@ -220,7 +236,6 @@ def get_food_nutrition_per_100g(food_list: List[str]) -> Dict[str, Dict[str, flo
     Raises:
         ValueError: Se alcuni alimenti non sono trovati
     """
-    foods_nutrition = {}
     foods_not_found = []
     
     for food in food_list:
@@ -228,31 +243,27 @@ def get_food_nutrition_per_100g(food_list: List[str]) -> Dict[str, Dict[str, flo
         normalized_food = food.lower().replace("_", " ")
         
         # Controlla se l'alimento è presente negli alias
-        if normalized_food in db.alias:
-            # Ottieni la chiave canonica dell'alimento
-            canonical_key = db.alias[normalized_food]
-            
-            try:
-                # Ottieni i macronutrienti per 100g usando la chiave canonica
-                macros = db.get_macros(food, 100)
-                
-                # Converte esplicitamente a float per evitare errori di tipo, gestendo anche valori None
-                foods_nutrition[food] = {
-                    "energia_kcal": float(macros.get("energia_kcal") or 0),
-                    "proteine_g": float(macros.get("proteine_g") or 0),
-                    "carboidrati_g": float(macros.get("carboidrati_g") or 0),
-                    "grassi_g": float(macros.get("grassi_g") or 0),
-                    "categoria": macros.get("categoria", "alimento_misto")
-                }
-            except (ValueError, TypeError) as e:
-                logger.error(f"Errore conversione dati per {food}: {str(e)}")
-                foods_not_found.append(food)
-        else:
+        if normalized_food not in db.alias:
             foods_not_found.append(food)
     
     if foods_not_found:
         raise ValueError(f"Alimenti non trovati nel database: {', '.join(foods_not_found)}")
     
+    # Estrae le righe per 100g di tutti gli alimenti dalla matrice nutrizionale in un'unica operazione
+    nutrients = db.get_nutrients_many(food_list)
+    columns = [db.nutrient_columns[nutrient] for nutrient in ("energia_kcal", "proteine_g", "carboidrati_g", "grassi_g")]
+    rows = nutrients["per_food"][:, columns].tolist()
+    
+    foods_nutrition = {}
+    for food, canonical_key, row in zip(food_list, nutrients["foods"], rows):
+        foods_nutrition[food] = {
+            "energia_kcal": row[0],
+            "proteine_g": row[1],
+            "carboidrati_g": row[2],
+            "grassi_g": row[3],
+            "categoria": db.alimenti[canonical_key].get("categoria", "alimento_misto")
+        }
+    
     return foods_nutrition
 
 
@@ -292,104 +303,91 @@ def get_portion_constraints():
 
 
 def optimize_portions(target_nutrients: Dict[str, float], 
-                     foods_nutrition: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+                     foods_nutrition: Dict[str, Dict[str, float]],
+                     solver: Optional[str] = None) -> Dict[str, float]:
     """
     Ottimizza le porzioni degli alimenti per raggiungere i target nutrizionali.
     
+    Minimizza la somma pesata degli errori relativi assoluti sui macronutrienti
+    (kcal con peso 3, proteine 2, carboidrati e grassi 1) rispettando i vincoli
+    di porzione per categoria.
+    
     Args:
         target_nutrients: Target di kcal, proteine_g, carboidrati_g, grassi_g
         foods_nutrition: Dati nutrizionali per 100g di ogni alimento
+        solver: Backend di ottimizzazione: "lp" (programma lineare esatto), "lsq"
+                (minimi quadrati vincolati) o "legacy" (L-BFGS-B storico).
+                Default: variabile d'ambiente NUTRICOACH_PORTION_SOLVER o "lp"
         
     Returns:
         Dict con le porzioni ottimizzate in grammi per ogni alimento
     """
-    food_names = list(foods_nutrition.keys())
-    n_foods = len(food_names)
-    constraints = get_portion_constraints()
-    
-    # Estrai i bounds per ogni alimento basati sulla categoria
-    bounds = []
-    initial_values = []
-    
-    for food in food_names:
-        categoria = foods_nutrition[food]["categoria"]
-        constraint = constraints.get(categoria, constraints["alimento_misto"])
-        
-        bounds.append((constraint["min"], constraint["max"]))
-        # Usa il punto medio tra min e max come valore iniziale
-        initial_values.append((constraint["min"] + constraint["max"]) / 2)
-    
-    # Funzione obiettivo: minimizza la differenza dai target nutrizionali
-    def objective(portions):
-        total_kcal = sum(foods_nutrition[food]["energia_kcal"] * portions[i] / 100 
-                        for i, food in enumerate(food_names))
-        total_proteine = sum(foods_nutrition[food]["proteine_g"] * portions[i] / 100 
-                           for i, food in enumerate(food_names))
-        total_carboidrati = sum(foods_nutrition[food]["carboidrati_g"] * portions[i] / 100 
-                              for i, food in enumerate(food_names))
-        total_grassi = sum(foods_nutrition[food]["grassi_g"] * portions[i] / 100 
-                         for i, food in enumerate(food_names))
-        
-        # Calcola gli errori relativi rispetto ai target
-        kcal_error = abs(total_kcal - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1)
-        proteine_error = abs(total_proteine - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1)
-        carboidrati_error = abs(total_carboidrati - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1)
-        grassi_error = abs(total_grassi - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-        
-        # Errore totale pesato (calorie hanno peso maggiore)
-        total_error = (3 * kcal_error + 2 * proteine_error + carboidrati_error + grassi_error)
-        
-        return total_error
-    
-    # Punto di partenza: punto medio tra min e max
-    initial_guess = np.array(initial_values)
-    
-    # Ottimizzazione
-    try:
-        result = minimize(
-            objective,
-            initial_guess,
-            method='L-BFGS-B',
-            bounds=bounds,
-            options={'maxiter': 1000}
-        )
-        
-        if result.success:
-            optimized_portions = result.x
-            logger.info("Ottimizzazione convergente completata")
-        else:
-            # Anche se non converge, confronta il risultato parziale con i valori iniziali
-            if hasattr(result, 'x') and result.x is not None:
-                # Calcola l'errore per il risultato parziale dell'ottimizzatore
-                partial_error = objective(result.x)
-                # Calcola l'errore per i valori iniziali
-                initial_error = objective(initial_guess)
-                
-                if partial_error < initial_error:
-                    # Il risultato parziale è migliore dei valori iniziali
-                    optimized_portions = result.x
-                    logger.warning(f"Ottimizzazione non convergente, ma uso miglior risultato parziale (errore: {partial_error:.3f} vs iniziale: {initial_error:.3f})")
-                else:
-                    # I valori iniziali sono migliori
-                    optimized_portions = initial_guess
-                    logger.warning(f"Ottimizzazione non convergente, uso valori iniziali (errore iniziale: {initial_error:.3f} vs parziale: {partial_error:.3f})")
-            else:
-                # Fallback ai valori iniziali se non c'è result.x
-                optimized_portions = initial_guess
-                logger.warning("Ottimizzazione non convergente senza risultato parziale, uso valori iniziali")
-    except Exception as e:
-        logger.error(f"Errore nell'ottimizzazione: {str(e)}")
-        optimized_portions = initial_guess
+    problem = build_portion_problem(target_nutrients, foods_nutrition, get_portion_constraints())
+    optimized_portions = solve_portions(problem, solver)
     
     # Costruisci il risultato con conversione esplicita a tipi Python nativi
     portions_result = {}
-    for i, food in enumerate(food_names):
+    for i, food in enumerate(problem["foods"]):
         # Converte esplicitamente a float Python nativo per evitare errori di serializzazione JSON
         portions_result[food] = float(round(optimized_portions[i], 1))
     
     return portions_result
 
 
+def optimize_portions_discrete(target_nutrients: Dict[str, float],
+                               foods_nutrition: Dict[str, Dict[str, float]],
+                               fixed_grams: Optional[Dict[str, float]] = None,
+                               relaxed_portions: Optional[Dict[str, float]] = None,
+                               time_budget: Optional[float] = None) -> Dict[str, float]:
+    """
+    Ottimizza le porzioni direttamente su multipli di 10g.
+    
+    A differenza dell'arrotondamento delle porzioni continue, sceglie la combinazione
+    di decine che minimizza l'errore sui macronutrienti, entro un budget di nodi.
+    
+    Il problema viene risolto in forma canonica (alimenti ordinati, target quantizzati a
+    1 kcal / 0.5 g) passando dalla cache condivisa delle soluzioni (vedi portion_cache).
+    
+    Args:
+        target_nutrients: Target di kcal, proteine_g, carboidrati_g, grassi_g
+        foods_nutrition: Dati nutrizionali per 100g di ogni alimento
+        fixed_grams: Alimenti con quantità fissa in grammi (opzionale)
+        relaxed_portions: Porzioni continue già calcolate da usare come punto di partenza (opzionale)
+        time_budget: Tempo massimo di protezione in secondi (default NUTRICOACH_DISCRETE_TIME_BUDGET,
+                     disattivato; la ricerca è limitata da NUTRICOACH_DISCRETE_NODE_BUDGET)
+        
+    Returns:
+        Dict con le porzioni in grammi (multipli di 10, salvo alimenti fissi) per ogni alimento
+        
+    Raises:
+        DiscreteSearchTimeout: Se la ricerca supera time_budget (il risultato non viene memorizzato)
+    """
+    problem, order = canonical_problem(
+        build_portion_problem(target_nutrients, foods_nutrition, get_portion_constraints())
+    )
+    relaxation = None
+    if relaxed_portions is not None and all(food in relaxed_portions for food in problem["foods"]):
+        relaxation = np.array([relaxed_portions[food] for food in problem["foods"]])
+    
+    def solve(canonical):
+        return solve_portions_discrete(
+            canonical, step=PORTION_STEP, fixed_grams=fixed_grams,
+            relaxation=relaxation, time_budget=time_budget
+        )
+    
+    cache = get_portion_cache()
+    if cache is not None:
+        grams = cache.solve(
+            "discrete", problem, solve, step=PORTION_STEP, node_budget=DISCRETE_NODE_BUDGET,
+            fixed_grams=sorted((fixed_grams or {}).items()),
+            relaxation=relaxation if relaxation is not None else "lp"
+        )
+    else:
+        grams = solve(problem)
+    grams = restore_food_order(grams, order)
+    return {food: float(grams[i]) for i, food in enumerate(foods_nutrition)}
+
+
 def calculate_actual_nutrients(portions: Dict[str, float], 
                              foods_nutrition: Dict[str, Dict[str, float]]) -> Dict[str, float]:
     """
@@ -420,6 +418,88 @@ def calculate_actual_nutrients(portions: Dict[str, float],
     }
 
 
+def calculate_meal_error(actual_nutrients: Dict[str, float], target_nutrients: Dict[str, float]) -> float:
+    """
+    Calcola l'errore medio relativo di un pasto sui quattro macronutrienti.
+    
+    Args:
+        actual_nutrients: Valori nutrizionali effettivi (output di calculate_actual_nutrients)
+        target_nutrients: Target di kcal, proteine_g, carboidrati_g, grassi_g
+        
+    Returns:
+        Media degli errori relativi |effettivo - target| / max(target, 1)
+    """
+    return sum([
+        abs(actual_nutrients["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
+        abs(actual_nutrients["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
+        abs(actual_nutrients["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
+        abs(actual_nutrients["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
+    ]) / 4
+
+
+def calculate_food_contributions(portions: Dict[str, float],
+                                 nutrition_data: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Calcola il contributo nutrizionale di ogni alimento per le porzioni indicate.
+    
+    Args:
+        portions: Porzioni in grammi per ogni alimento
+        nutrition_data: Dati nutrizionali per 100g di ogni alimento
+        
+    Returns:
+        Dict alimento -> portion_g, kcal, proteine_g, carboidrati_g, grassi_g, categoria
+    """
+    contributions = {}
+    for food, grams in portions.items():
+        if food in nutrition_data:
+            nutrition = nutrition_data[food]
+            contributions[food] = {
+                "portion_g": grams,
+                "kcal": float(round(nutrition['energia_kcal'] * grams / 100, 1)),
+                "proteine_g": float(round(nutrition['proteine_g'] * grams / 100, 1)),
+                "carboidrati_g": float(round(nutrition['carboidrati_g'] * grams / 100, 1)),
+                "grassi_g": float(round(nutrition['grassi_g'] * grams / 100, 1)),
+                "categoria": nutrition['categoria']
+            }
+    return contributions
+
+
+def calculate_error_percentages(actual_nutrients: Dict[str, float], target_nutrients: Dict[str, float]) -> Dict[str, float]:
+    """
+    Calcola gli errori percentuali per ogni macronutriente.
+    
+    Returns:
+        Dict con chiavi "<nutriente>_error_pct" (0 se il target è nullo)
+    """
+    errors = {}
+    for nutrient in ["kcal", "proteine_g", "carboidrati_g", "grassi_g"]:
+        target = target_nutrients[nutrient]
+        actual = actual_nutrients[nutrient]
+        if target > 0:
+            error_pct = abs(actual - target) / target * 100
+            errors[f"{nutrient}_error_pct"] = float(round(error_pct, 1))
+        else:
+            errors[f"{nutrient}_error_pct"] = 0.0
+    return errors
+
+
+def classify_meal(meal_name: str) -> Tuple[bool, bool, bool]:
+    """
+    Determina il tipo di pasto dal nome.
+    
+    Returns:
+        Tupla (is_lunch_or_dinner, is_breakfast, is_snack)
+    """
+    meal_name_lower = meal_name.lower()
+    is_lunch_or_dinner = any(keyword in meal_name_lower for keyword in 
+                           ["pranzo", "cena", "lunch", "dinner", "Pranzo", "Cena", "Lunch", "Dinner", "PRANZO", "CENA", "LUNCH", "DINNER"])
+    is_breakfast = any(keyword in meal_name_lower for keyword in 
+                      ["colazione", "breakfast", "Colazione", "Breakfast", "COLAZIONE", "BREAKFAST"])
+    is_snack = any(keyword in meal_name_lower for keyword in 
+                  ["spuntino", "merenda", "snack", "Spuntino", "Merenda", "Snack", "SPUNTINO", "MERENDA", "SNACK", "spuntino_pomeridiano", "spuntino_mattutino", "spuntino_serale", "spuntino_pomeriggio", "spuntino_mattina", "spuntino_sera"])
+    return is_lunch_or_dinner, is_breakfast, is_snack
+
+
 def get_category_mappings():
     """
     Definisce i mappings delle categorie alimentari.
@@ -627,19 +707,10 @@ def find_generic_food_variants(generic_term: str) -> List[str]:
             if food in db.alias.values() or db.alias.get(food.lower().replace("_", " ")):
                 variants.append(food)
     
-    # Se non ci sono mappature esplicite, cerca dinamicamente in tutti gli alias
+    # Se non ci sono mappature esplicite, cerca gli alias che contengono il termine
+    # (tutte le parole o sottostringa) tramite l'indice dei nomi
     if not variants:
-        for alias_name, canonical_name in db.alias.items():
-            # Verifica se l'alias contiene il termine generico (come parola intera o sottostringa)
-            alias_words = alias_name.lower().split()
-            generic_words = generic_term.lower().split()
-            
-            # Metodo 1: Controlla se tutte le parole del termine generico sono presenti nell'alias
-            if all(generic_word in alias_words for generic_word in generic_words):
-                variants.append(canonical_name)
-            # Metodo 2: Controlla se il termine generico è una sottostringa dell'alias
-            elif generic_term in alias_name:
-                variants.append(canonical_name)
+        variants = [canonical_name for _, canonical_name in db.name_index.find_containing(generic_term)]
     
     # Rimuovi duplicati mantenendo l'ordine
     variants = list(dict.fromkeys(variants))
@@ -647,28 +718,23 @@ def find_generic_food_variants(generic_term: str) -> List[str]:
     return variants
 
 
-def load_user_excluded_foods(user_id: str) -> List[str]:
+def load_user_excluded_foods(user_id: str, user_data: Optional[Dict[str, Any]] = None) -> List[str]:
     """
     Carica gli alimenti esclusi dall'utente dal file JSON.
     
     Args:
         user_id: ID dell'utente
+        user_data: Dati utente già caricati (opzionale, evita di rileggere il file)
         
     Returns:
         Lista degli alimenti esclusi (normalizzati usando alias del database)
     """
-    # Fix: Handle user_id that may already contain 'user_' prefix
-    if user_id.startswith("user_"):
-        user_file_path = f"user_data/{user_id}.json"
-    else:
-        user_file_path = f"user_data/user_{user_id}.json"
-    
-    if not os.path.exists(user_file_path):
-        return []
-    
     try:
-        with open(user_file_path, 'r', encoding='utf-8') as f:
-            user_data = json.load(f)
+        if user_data is None:
+            try:
+                user_data = load_user_data(user_id)
+            except ValueError:
+                return []
         
         user_preferences = user_data.get("user_preferences", {})
         excluded_foods_raw = user_preferences.get("excluded_foods", [])
@@ -1144,14 +1210,261 @@ def calculate_forced_substitute_portion(
     return max(min_portion, min(max_portion, equivalent_portion_rounded))
 
 
-def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str = None) -> Dict[str, Any]:
+# Varianti usate dalle euristiche di optimize_meal_portions per capire se un alimento è già nel pasto
+OIL_VARIANTS = ["olio", "olio_oliva", "olio d'oliva", "olio di oliva"]
+ALMOND_VARIANTS = ["mandorle", "mandorla", "mandorle_sgusciate", "mandorle sgusciate"]
+PROTEIN_POWDER_VARIANTS = ["iso_fuji_yamamoto", "pro_milk_20g_proteine", "proteine", "proteine in polvere", "iso"]
+CHICKEN_VARIANTS = ["pollo", "petto_pollo", "petto di pollo", "pollo_petto"]
+BREAD_VARIANTS = ["pane", "pane_bianco", "pane_integrale", "pane bianco", "pane integrale"]
+
+# Sostituzioni di carboidrati provate quando l'errore sui carboidrati è elevato
+CARB_SUBSTITUTIONS = [
+    # Sostituire pasta con riso
+    {"from": ["pasta", "pasta_normale", "pasta normale"], "to": "riso", "type": "pasta→riso"},
+    # Sostituire riso con pasta
+    {"from": ["riso", "riso_bianco", "riso bianco"], "to": "pasta", "type": "riso→pasta"},
+    # Sostituire patate con pane
+    {"from": ["patate", "patata", "patate_lesse", "patate lesse"], "to": "pane", "type": "patate→pane"},
+    # Sostituire pane con patate
+    {"from": ["pane", "pane_bianco", "pane_integrale", "pane bianco", "pane integrale"], "to": "patate", "type": "pane→patate"}
+]
+
+
+def contains_food_variant(food_list: List[str], variants: List[str]) -> bool:
+    """Verifica se almeno un alimento della lista contiene una delle varianti indicate."""
+    return any(any(variant in food.lower() for variant in variants) for food in food_list)
+
+
+def find_removable_protein_sources(food_list: List[str], foods_nutrition: Dict[str, Dict[str, float]]) -> List[str]:
+    """
+    Identifica le fonti proteiche rimuovibili (categoria proteine_animali o >15g proteine/100g).
+    
+    Args:
+        food_list: Lista degli alimenti del pasto
+        foods_nutrition: Dati nutrizionali per 100g degli alimenti
+        
+    Returns:
+        Lista delle fonti proteiche nell'ordine del pasto
+    """
+    protein_sources = []
+    for food in food_list:
+        if food in foods_nutrition:
+            food_data = foods_nutrition[food]
+            is_protein_source = (
+                food_data.get("categoria") == "proteine_animali" or
+                food_data.get("proteine_g", 0) > 15
+            )
+            if is_protein_source:
+                protein_sources.append(food)
+    return protein_sources
+
+
+def find_carb_substitutions(food_list: List[str]) -> List[Tuple[Dict[str, Any], str, List[str]]]:
+    """
+    Elenca le sostituzioni di carboidrati applicabili a un pasto.
+    
+    Args:
+        food_list: Lista degli alimenti del pasto
+        
+    Returns:
+        Lista di tuple (sostituzione, alimento sostituito, nuova lista di alimenti)
+    """
+    substitutions = []
+    for substitution in CARB_SUBSTITUTIONS:
+        # Trova l'alimento da sostituire nella lista corrente
+        food_to_replace = None
+        for food in food_list:
+            if any(variant in food.lower() for variant in substitution["from"]):
+                food_to_replace = food
+                break
+        
+        # L'alimento di sostituzione non deve essere già presente
+        if food_to_replace and not contains_food_variant(food_list, [substitution["to"]]):
+            test_food_list = [substitution["to"] if food == food_to_replace else food for food in food_list]
+            substitutions.append((substitution, food_to_replace, test_food_list))
+    return substitutions
+
+
+def build_meal_candidate_lists(food_list: List[str], is_lunch_or_dinner: bool,
+                               is_breakfast: bool, is_snack: bool) -> List[List[str]]:
+    """
+    Elenca in anticipo tutte le liste di alimenti che le euristiche di optimize_meal_portions
+    possono provare, per qualunque esito dei passi precedenti.
+    
+    Le soglie di accettazione dipendono dai risultati dell'ottimizzazione, quindi qui
+    non vengono applicate: la lista è un soprainsieme dei tentativi effettivi.
+    
+    Args:
+        food_list: Lista degli alimenti richiesti
+        is_lunch_or_dinner: True per pranzo/cena (olio, proteine, carboidrati)
+        is_breakfast: True per colazione (mandorle, proteine in polvere)
+        is_snack: True per spuntini (mandorle)
+        
+    Returns:
+        Lista delle liste candidate, senza duplicati
+    """
+    candidates = [food_list]
+    if is_lunch_or_dinner and not contains_food_variant(food_list, OIL_VARIANTS):
+        candidates.append(food_list + ["olio_oliva"])
+    
+    if is_breakfast:
+        candidates += [foods + ["mandorle"] for foods in candidates if not contains_food_variant(foods, ALMOND_VARIANTS)]
+        candidates += [foods + ["iso_fuji_yamamoto"] for foods in candidates if not contains_food_variant(foods, PROTEIN_POWDER_VARIANTS)]
+    
+    if is_snack:
+        candidates += [foods + ["mandorle"] for foods in candidates if not contains_food_variant(foods, ALMOND_VARIANTS)]
+    
+    if is_lunch_or_dinner:
+        protein_candidates = []
+        for foods in candidates:
+            if not contains_food_variant(foods, CHICKEN_VARIANTS):
+                protein_candidates.append(foods + ["pollo"])
+            for protein_food in find_removable_protein_sources(foods, get_food_nutrition_per_100g(foods)):
+                reduced = [food for food in foods if food != protein_food]
+                if len(reduced) >= 2:
+                    protein_candidates.append(reduced)
+        candidates += protein_candidates
+        
+        carb_candidates = []
+        for foods in candidates:
+            if not contains_food_variant(foods, BREAD_VARIANTS):
+                carb_candidates.append(foods + ["pane"])
+            carb_candidates += [test_food_list for _, _, test_food_list in find_carb_substitutions(foods)]
+        candidates += carb_candidates
+    
+    unique_candidates = {}
+    for foods in candidates:
+        unique_candidates.setdefault(tuple(foods), foods)
+    return list(unique_candidates.values())
+
+
+class MealCandidateEvaluator:
+    """
+    Valuta le liste di alimenti candidate di un pasto e ne memorizza i risultati.
+    
+    prefetch() risolve un insieme di liste con un'unica chiamata al solver (vedi
+    solve_portions_batch); evaluate() restituisce il risultato memorizzato, risolvendo
+    al momento solo le liste non precalcolate. Con backend non vettorizzati il
+    prefetch non fa nulla e le liste vengono risolte solo quando servono.
+    """
+    
+    def __init__(self, target_nutrients: Dict[str, float], solver: Optional[str] = None):
+        self.target_nutrients = target_nutrients
+        self.solver = solver or DEFAULT_SOLVER
+        self.solve_calls = 0
+        self._results = {}
+    
+    def prefetch(self, food_lists: List[List[str]]) -> None:
+        """Risolve insieme le liste non ancora valutate (solo con backend vettorizzati)."""
+        prefetch_meal_candidates([(self, food_lists)])
+    
+    def evaluate(self, food_list: List[str]) -> Dict[str, Any]:
+        """
+        Restituisce il risultato dell'ottimizzazione di una lista di alimenti.
+        
+        Returns:
+            Dict con portions, actual_nutrients, food_list ed error (calculate_meal_error)
+            
+        Raises:
+            ValueError: Se alcuni alimenti non sono trovati
+        """
+        key = tuple(food_list)
+        if key not in self._results:
+            _solve_meal_candidates([(self, [food_list])])
+        return self._results[key]
+
+
+def prefetch_meal_candidates(jobs: List[Tuple[MealCandidateEvaluator, List[List[str]]]]) -> None:
+    """
+    Risolve con un'unica chiamata al solver le liste candidate di uno o più pasti.
+    
+    Usata da optimize_day_meals per valutare insieme i candidati di tutti i pasti
+    di un giorno. Le liste già valutate o con alimenti non presenti nel database
+    vengono saltate, così come i valutatori con backend non vettorizzati.
+    
+    Args:
+        jobs: Lista di coppie (valutatore del pasto, liste di alimenti candidate)
+    """
+    pending_jobs = []
+    for evaluator, food_lists in jobs:
+        if evaluator.solver not in BATCHED_SOLVERS:
+            continue
+        
+        pending = {}
+        for foods in food_lists:
+            key = tuple(foods)
+            if key not in evaluator._results and key not in pending:
+                all_found, _ = db.check_foods_in_db(foods)
+                if all_found:
+                    pending[key] = foods
+        if pending:
+            pending_jobs.append((evaluator, list(pending.values())))
+    
+    if pending_jobs:
+        try:
+            _solve_meal_candidates(pending_jobs)
+        except Exception as e:
+            # Le liste non precalcolate verranno risolte singolarmente da evaluate()
+            logger.warning(f"Errore nella valutazione in blocco dei candidati: {str(e)}")
+
+
+def _solve_meal_candidates(jobs: List[Tuple[MealCandidateEvaluator, List[List[str]]]]) -> None:
+    """Risolve le liste di più valutatori (stesso backend) e ne memorizza i risultati."""
+    constraints = get_portion_constraints()
+    all_foods = list(dict.fromkeys(food for _, food_lists in jobs for foods in food_lists for food in foods))
+    nutrition = get_food_nutrition_per_100g(all_foods)
+    
+    solver = jobs[0][0].solver
+    entries = []
+    for evaluator, food_lists in jobs:
+        for foods in food_lists:
+            foods_nutrition = {food: nutrition[food] for food in foods}
+            problem = build_portion_problem(evaluator.target_nutrients, foods_nutrition, constraints)
+            entries.append((evaluator, foods, foods_nutrition, problem))
+    
+    cache = get_portion_cache()
+    if solver == "legacy":
+        # Il risolutore storico lavora sui problemi originali, per il confronto A/B
+        solutions = solve_portions_batch([entry[3] for entry in entries], solver)
+    else:
+        # Forma canonica (alimenti ordinati, target quantizzati) e cache condivisa delle soluzioni
+        canonical = [canonical_problem(entry[3]) for entry in entries]
+        problems = [problem for problem, _ in canonical]
+        if cache is not None:
+            solutions = cache.solve_batch(
+                "continuous", problems, lambda pending: solve_portions_batch(pending, solver), solver=solver
+            )
+        else:
+            solutions = solve_portions_batch(problems, solver)
+        solutions = [restore_food_order(grams, order) for grams, (_, order) in zip(solutions, canonical)]
+    for evaluator, _ in jobs:
+        evaluator.solve_calls += 1
+    
+    for (evaluator, foods, foods_nutrition, problem), grams in zip(entries, solutions):
+        # Stesso arrotondamento di optimize_portions
+        portions = {food: float(round(grams[i], 1)) for i, food in enumerate(problem["foods"])}
+        actual_nutrients = calculate_actual_nutrients(portions, foods_nutrition)
+        evaluator._results[tuple(foods)] = {
+            "portions": portions,
+            "actual_nutrients": actual_nutrients,
+            "food_list": foods,
+            "error": calculate_meal_error(actual_nutrients, evaluator.target_nutrients)
+        }
+
+
+def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str = None,
+                           user_data: Optional[Dict[str, Any]] = None,
+                           excluded_foods: Optional[List[str]] = None,
+                           evaluator: Optional["MealCandidateEvaluator"] = None,
+                           include_substitutes: bool = True) -> Dict[str, Any]:
     """
     Ottimizza automaticamente le porzioni degli alimenti per un pasto specifico.
     
     Verifica automaticamente che tutti gli alimenti siano presenti nel database,
     calcola le quantità in grammi per rispettare i target nutrizionali 
-    dell'utente per quel pasto, e infine arrotonda le quantità alla decina
-    più vicina (es. 118.7g diventa 120g).
+    dell'utente per quel pasto, e infine porta le quantità su multipli di 10g
+    scegliendo la combinazione di decine con l'errore minore (con il solver
+    "legacy" arrotonda alla decina più vicina, es. 118.7g diventa 120g).
     
     Per i pasti di colazione, esegue ottimizzazioni intelligenti:
     1. Se deficit di grassi >3g e >15%, prova ad aggiungere mandorle
@@ -1171,6 +1484,11 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
         meal_name: Nome del pasto (es: 'Colazione', 'Pranzo', 'Cena', 'Spuntino')
         food_list: Lista degli alimenti da includere nel pasto
         user_id: ID dell'utente (opzionale, usa get_user_id() se None - per compatibilità con test)
+        user_data: Dati utente già caricati (opzionale, evita di rileggere il file)
+        excluded_foods: Alimenti esclusi già caricati (opzionale)
+        evaluator: Valutatore con i candidati del pasto già risolti (opzionale, vedi
+                   prefetch_meal_candidates); i target vengono presi da evaluator
+        include_substitutes: Se False non calcola i sostituti
         
     Returns:
         Dict contenente:
@@ -1191,15 +1509,22 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
         # 1. Estrai l'ID utente e carica i target nutrizionali
         if user_id is None:
             user_id = get_user_id()
-        target_nutrients = load_user_meal_targets(user_id, meal_name)
+        if evaluator is not None:
+            target_nutrients = evaluator.target_nutrients
+        else:
+            target_nutrients = load_user_meal_targets(user_id, meal_name, user_data)
         
-        # 2. Verifica che tutti gli alimenti originali siano nel database
+        # 2. Verifica che tutti gli alimenti originali siano nel database, risolvendo
+        #    automaticamente varianti e refusi riconoscibili con sicurezza
+        food_list, resolved_foods = db.resolve_food_names(food_list)
         all_found, foods_not_found = db.check_foods_in_db(food_list)
         
         if not all_found:
+            suggestions = db.get_food_suggestions(foods_not_found)
             return {
                 "success": False,
-                "error_message": f"I seguenti alimenti non sono stati trovati nel database: {', '.join(foods_not_found)}",
+                "error_message": f"I seguenti alimenti non sono stati trovati nel database: {', '.join(foods_not_found)}{format_food_suggestions(suggestions)}",
+                "suggestions": suggestions,
                 "portions": {},
                 "target_nutrients": {},
                 "actual_nutrients": {},
@@ -1212,18 +1537,21 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
         # 3. Estrai i dati nutrizionali degli alimenti originali
         foods_nutrition_original = get_food_nutrition_per_100g(food_list)
         
-        # 4. Determina se dobbiamo testare anche con l'olio (solo per pranzo/cena)
-        meal_name_lower = meal_name.lower()
-        is_lunch_or_dinner = any(keyword in meal_name_lower for keyword in 
-                               ["pranzo", "cena", "lunch", "dinner", "Pranzo", "Cena", "Lunch", "Dinner", "PRANZO", "CENA", "LUNCH", "DINNER"])
+        # 4. Determina il tipo di pasto e se dobbiamo testare anche con l'olio (solo per pranzo/cena)
+        is_lunch_or_dinner, is_breakfast, is_snack = classify_meal(meal_name)
         
         # Controlla se c'è già olio nella lista
-        oil_variants = ["olio", "olio_oliva", "olio d'oliva", "olio di oliva"]
-        oil_already_present = any(any(oil_variant in food.lower() for oil_variant in oil_variants) for food in food_list)
+        oil_already_present = contains_food_variant(food_list, OIL_VARIANTS)
         
         should_test_oil = is_lunch_or_dinner and not oil_already_present
         
-        # 5. Se necessario, prepara i dati nutrizionali anche con l'olio
+        # 5. Valuta in un unico passaggio tutte le liste candidate che le euristiche
+        #    successive potrebbero provare; i test seguenti leggono i risultati già calcolati
+        if evaluator is None:
+            evaluator = MealCandidateEvaluator(target_nutrients)
+            evaluator.prefetch(build_meal_candidate_lists(food_list, is_lunch_or_dinner, is_breakfast, is_snack))
+        
+        # Se necessario, prepara i dati nutrizionali anche con l'olio
         foods_nutrition_with_oil = None
         if should_test_oil:
             food_list_with_oil = food_list + ["olio_oliva"]
@@ -1233,16 +1561,10 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
                 foods_nutrition_with_oil = get_food_nutrition_per_100g(food_list_with_oil)
         
         # 6. Ottimizza senza olio
-        optimized_portions_original = optimize_portions(target_nutrients, foods_nutrition_original)
-        actual_nutrients_original = calculate_actual_nutrients(optimized_portions_original, foods_nutrition_original)
-        
-        # Calcola errore originale
-        original_error = sum([
-            abs(actual_nutrients_original["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-            abs(actual_nutrients_original["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-            abs(actual_nutrients_original["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-            abs(actual_nutrients_original["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-        ]) / 4
+        original_trial = evaluator.evaluate(food_list)
+        optimized_portions_original = original_trial["portions"]
+        actual_nutrients_original = original_trial["actual_nutrients"]
+        original_error = original_trial["error"]
         
         # 7. Se necessario, ottimizza anche con l'olio e confronta
         oil_added = False
@@ -1253,16 +1575,8 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
         
         if should_test_oil and foods_nutrition_with_oil is not None and original_error > 0.1:
             # Ottimizza con olio
-            optimized_portions_with_oil = optimize_portions(target_nutrients, foods_nutrition_with_oil)
-            actual_nutrients_with_oil = calculate_actual_nutrients(optimized_portions_with_oil, foods_nutrition_with_oil)
-            
-            # Calcola errore con olio
-            error_with_oil = sum([
-                abs(actual_nutrients_with_oil["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                abs(actual_nutrients_with_oil["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                abs(actual_nutrients_with_oil["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                abs(actual_nutrients_with_oil["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-            ]) / 4
+            oil_trial = evaluator.evaluate(food_list_with_oil)
+            error_with_oil = oil_trial["error"]
             
             # Calcola miglioramento
             improvement = original_error - error_with_oil
@@ -1270,18 +1584,14 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
             # Usa la versione con olio se il miglioramento è significativo
             if improvement > 0.05 or (improvement > 0.02 and original_error > 0.15):
                 oil_added = True
-                final_portions = optimized_portions_with_oil
-                final_actual_nutrients = actual_nutrients_with_oil
+                final_portions = oil_trial["portions"]
+                final_actual_nutrients = oil_trial["actual_nutrients"]
                 final_food_list = food_list_with_oil
         
         # 8. Step aggiuntivo: ottimizzazione grassi per colazione
         fat_added = False
         fat_adjustment_food = None
         
-        # Determina se è colazione
-        is_breakfast = any(keyword in meal_name_lower for keyword in 
-                          ["colazione", "breakfast", "Colazione", "Breakfast", "COLAZIONE", "BREAKFAST"])
-        
         if is_breakfast:
             # Calcola errore sui grassi attuale
             fat_target = target_nutrients["grassi_g"]
@@ -1292,42 +1602,19 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
             # Se c'è un deficit significativo di grassi (>15%), prova ad aggiungere mandorle
             if fat_deficit > 3 and fat_error_pct > 15:  # Deficit significativo (>3g e >15%)
                 # Controlla se le mandorle non sono già presenti
-                almond_variants = ["mandorle", "mandorla", "mandorle_sgusciate", "mandorle sgusciate"]
-                almonds_already_present = any(any(variant in food.lower() for variant in almond_variants) for food in final_food_list)
-                
-                if not almonds_already_present:
+                if not contains_food_variant(final_food_list, ALMOND_VARIANTS):
                     test_food_list_almonds = final_food_list + ["mandorle"]
                     almonds_found, _ = db.check_foods_in_db(["mandorle"])
                     
                     if almonds_found:
                         try:
-                            # Calcola i dati nutrizionali per la lista con mandorle aggiunte
-                            foods_nutrition_almonds = get_food_nutrition_per_100g(test_food_list_almonds)
-                            
-                            optimized_portions_almonds = optimize_portions(target_nutrients, foods_nutrition_almonds)
-                            actual_nutrients_almonds = calculate_actual_nutrients(optimized_portions_almonds, foods_nutrition_almonds)
-                            
-                            # Calcola errore con mandorle aggiunte
-                            error_with_almonds = sum([
-                                abs(actual_nutrients_almonds["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                abs(actual_nutrients_almonds["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                abs(actual_nutrients_almonds["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                abs(actual_nutrients_almonds["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                            ]) / 4
-                            
-                            # Calcola errore attuale
-                            current_error = sum([
-                                abs(final_actual_nutrients["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                abs(final_actual_nutrients["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                abs(final_actual_nutrients["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                abs(final_actual_nutrients["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                            ]) / 4
+                            almonds_trial = evaluator.evaluate(test_food_list_almonds)
                             
                             # Se aggiungere mandorle migliora significativamente
-                            if error_with_almonds < current_error - 0.03:
+                            if almonds_trial["error"] < calculate_meal_error(final_actual_nutrients, target_nutrients) - 0.03:
                                 fat_added = True
-                                final_portions = optimized_portions_almonds
-                                final_actual_nutrients = actual_nutrients_almonds
+                                final_portions = almonds_trial["portions"]
+                                final_actual_nutrients = almonds_trial["actual_nutrients"]
                                 final_food_list = test_food_list_almonds
                                 fat_adjustment_food = "mandorle"
                                 
@@ -1348,42 +1635,19 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
             # Se c'è un deficit significativo di proteine (>15%), prova ad aggiungere proteine in polvere
             if protein_deficit > 10 and protein_error_pct > 15:  # Deficit significativo (>5g e >15%)
                 # Controlla se le proteine in polvere non sono già presenti
-                protein_variants = ["iso_fuji_yamamoto", "pro_milk_20g_proteine", "proteine", "proteine in polvere", "iso"]
-                protein_already_present = any(any(variant in food.lower() for variant in protein_variants) for food in final_food_list)
-                
-                if not protein_already_present:
+                if not contains_food_variant(final_food_list, PROTEIN_POWDER_VARIANTS):
                     test_food_list_protein = final_food_list + ["iso_fuji_yamamoto"]
                     protein_found, _ = db.check_foods_in_db(["iso_fuji_yamamoto"])
                     
                     if protein_found:
                         try:
-                            # Calcola i dati nutrizionali per la lista con proteine in polvere aggiunte
-                            foods_nutrition_protein = get_food_nutrition_per_100g(test_food_list_protein)
-                            
-                            optimized_portions_protein = optimize_portions(target_nutrients, foods_nutrition_protein)
-                            actual_nutrients_protein = calculate_actual_nutrients(optimized_portions_protein, foods_nutrition_protein)
-                            
-                            # Calcola errore con proteine in polvere aggiunte
-                            error_with_protein = sum([
-                                abs(actual_nutrients_protein["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                abs(actual_nutrients_protein["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                abs(actual_nutrients_protein["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                abs(actual_nutrients_protein["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                            ]) / 4
-                            
-                            # Calcola errore attuale
-                            current_error = sum([
-                                abs(final_actual_nutrients["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                abs(final_actual_nutrients["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                abs(final_actual_nutrients["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                abs(final_actual_nutrients["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                            ]) / 4
+                            protein_trial = evaluator.evaluate(test_food_list_protein)
                             
                             # Se aggiungere proteine in polvere migliora significativamente
-                            if error_with_protein < current_error - 0.03:
+                            if protein_trial["error"] < calculate_meal_error(final_actual_nutrients, target_nutrients) - 0.03:
                                 protein_added_breakfast = True
-                                final_portions = optimized_portions_protein
-                                final_actual_nutrients = actual_nutrients_protein
+                                final_portions = protein_trial["portions"]
+                                final_actual_nutrients = protein_trial["actual_nutrients"]
                                 final_food_list = test_food_list_protein
                                 protein_adjustment_food_breakfast = "iso_fuji_yamamoto"
                                 
@@ -1391,10 +1655,6 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
                             logger.warning(f"Errore nel test con proteine in polvere aggiunte: {str(e)}")
 
         # 8.1. Step aggiuntivo: ottimizzazione grassi per spuntini
-        # Determina se è uno spuntino
-        is_snack = any(keyword in meal_name_lower for keyword in 
-                      ["spuntino", "merenda", "snack", "Spuntino", "Merenda", "Snack", "SPUNTINO", "MERENDA", "SNACK", "spuntino_pomeridiano", "spuntino_mattutino", "spuntino_serale", "spuntino_pomeriggio", "spuntino_mattina", "spuntino_sera"])
-        
         if is_snack and not fat_added:  # Solo se non abbiamo già aggiunto grassi per la colazione
             # Calcola errore sui grassi attuale
             fat_target = target_nutrients["grassi_g"]
@@ -1405,42 +1665,19 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
             # Se c'è un deficit significativo di grassi (>15%), prova ad aggiungere mandorle
             if fat_deficit > 2 and fat_error_pct > 15:  # Soglia più bassa per spuntini (>2g e >15%)
                 # Controlla se le mandorle non sono già presenti
-                almond_variants = ["mandorle", "mandorla", "mandorle_sgusciate", "mandorle sgusciate"]
-                almonds_already_present = any(any(variant in food.lower() for variant in almond_variants) for food in final_food_list)
-                
-                if not almonds_already_present:
+                if not contains_food_variant(final_food_list, ALMOND_VARIANTS):
                     test_food_list_almonds = final_food_list + ["mandorle"]
                     almonds_found, _ = db.check_foods_in_db(["mandorle"])
                     
                     if almonds_found:
                         try:
-                            # Calcola i dati nutrizionali per la lista con mandorle aggiunte
-                            foods_nutrition_almonds = get_food_nutrition_per_100g(test_food_list_almonds)
-                            
-                            optimized_portions_almonds = optimize_portions(target_nutrients, foods_nutrition_almonds)
-                            actual_nutrients_almonds = calculate_actual_nutrients(optimized_portions_almonds, foods_nutrition_almonds)
-                            
-                            # Calcola errore con mandorle aggiunte
-                            error_with_almonds = sum([
-                                abs(actual_nutrients_almonds["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                abs(actual_nutrients_almonds["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                abs(actual_nutrients_almonds["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                abs(actual_nutrients_almonds["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                            ]) / 4
-                            
-                            # Calcola errore attuale
-                            current_error = sum([
-                                abs(final_actual_nutrients["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                abs(final_actual_nutrients["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                abs(final_actual_nutrients["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                abs(final_actual_nutrients["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                            ]) / 4
+                            almonds_trial = evaluator.evaluate(test_food_list_almonds)
                             
                             # Se aggiungere mandorle migliora significativamente
-                            if error_with_almonds < current_error - 0.03:
+                            if almonds_trial["error"] < calculate_meal_error(final_actual_nutrients, target_nutrients) - 0.03:
                                 fat_added = True
-                                final_portions = optimized_portions_almonds
-                                final_actual_nutrients = actual_nutrients_almonds
+                                final_portions = almonds_trial["portions"]
+                                final_actual_nutrients = almonds_trial["actual_nutrients"]
                                 final_food_list = test_food_list_almonds
                                 fat_adjustment_food = "mandorle"
                                 
@@ -1471,37 +1708,17 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
                 # CASO 1: Deficit proteico - prova ad aggiungere pollo
                 if protein_deficit > 5:  # Deficit significativo (>5g)
                     # Controlla se il pollo non è già presente
-                    chicken_variants = ["pollo", "petto_pollo", "petto di pollo", "pollo_petto"]
-                    chicken_already_present = any(any(variant in food.lower() for variant in chicken_variants) for food in final_food_list)
-                    
-                    if not chicken_already_present:
+                    if not contains_food_variant(final_food_list, CHICKEN_VARIANTS):
                         test_food_list_protein = final_food_list + ["pollo"]
                         chicken_found, _ = db.check_foods_in_db(["pollo"])
                         
                         if chicken_found:
                             try:
-                                # Calcola i dati nutrizionali per la lista con pollo aggiunto
-                                foods_nutrition_protein = get_food_nutrition_per_100g(test_food_list_protein)
-                                
-                                optimized_portions_protein = optimize_portions(target_nutrients, foods_nutrition_protein)
-                                actual_nutrients_protein = calculate_actual_nutrients(optimized_portions_protein, foods_nutrition_protein)
-                                
-                                # Calcola errore con pollo aggiunto
-                                error_with_protein = sum([
-                                    abs(actual_nutrients_protein["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                    abs(actual_nutrients_protein["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                    abs(actual_nutrients_protein["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                    abs(actual_nutrients_protein["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                                ]) / 4
+                                protein_trial = evaluator.evaluate(test_food_list_protein)
                                 
                                 # Se aggiungere pollo migliora significativamente
-                                if error_with_protein < best_solution["error"] - 0.03:
-                                    best_solution = {
-                                        "portions": optimized_portions_protein,
-                                        "actual_nutrients": actual_nutrients_protein,
-                                        "food_list": test_food_list_protein,
-                                        "error": error_with_protein
-                                    }
+                                if protein_trial["error"] < best_solution["error"] - 0.03:
+                                    best_solution = protein_trial
                                     protein_added = True
                                     protein_adjustment_food = "pollo"
                                     
@@ -1513,43 +1730,17 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
                     # Identifica fonti proteiche rimuovibili (categoria proteine_animali o >15g proteine/100g)
                     nutrition_data = foods_nutrition_with_oil if oil_added else foods_nutrition_original
                     
-                    protein_sources = []
-                    for food in final_food_list:
-                        if food in nutrition_data:
-                            food_data = nutrition_data[food]
-                            is_protein_source = (
-                                food_data.get("categoria") == "proteine_animali" or
-                                food_data.get("proteine_g", 0) > 15
-                            )
-                            if is_protein_source:
-                                protein_sources.append(food)
-                    
                     # Testa rimuovendo ogni fonte proteica e scegli la migliore
-                    for protein_food in protein_sources:
+                    for protein_food in find_removable_protein_sources(final_food_list, nutrition_data):
                         test_food_list_no_protein = [f for f in final_food_list if f != protein_food]
                         
                         if len(test_food_list_no_protein) >= 2:  # Mantieni almeno 2 alimenti
                             try:
-                                foods_nutrition_no_protein = get_food_nutrition_per_100g(test_food_list_no_protein)
-                                optimized_portions_no_protein = optimize_portions(target_nutrients, foods_nutrition_no_protein)
-                                actual_nutrients_no_protein = calculate_actual_nutrients(optimized_portions_no_protein, foods_nutrition_no_protein)
-                                
-                                # Calcola errore senza questa proteina
-                                error_no_protein = sum([
-                                    abs(actual_nutrients_no_protein["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                    abs(actual_nutrients_no_protein["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                    abs(actual_nutrients_no_protein["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                    abs(actual_nutrients_no_protein["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                                ]) / 4
+                                no_protein_trial = evaluator.evaluate(test_food_list_no_protein)
                                 
                                 # Se rimuovere questa proteina migliora significativamente
-                                if error_no_protein < best_solution["error"] - 0.03:
-                                    best_solution = {
-                                        "portions": optimized_portions_no_protein,
-                                        "actual_nutrients": actual_nutrients_no_protein,
-                                        "food_list": test_food_list_no_protein,
-                                        "error": error_no_protein
-                                    }
+                                if no_protein_trial["error"] < best_solution["error"] - 0.03:
+                                    best_solution = no_protein_trial
                                     protein_removed = True
                                     protein_adjustment_food = protein_food
                                     
@@ -1580,152 +1771,81 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
                     "portions": final_portions,
                     "actual_nutrients": final_actual_nutrients,
                     "food_list": final_food_list,
-                    "error": sum([
-                        abs(final_actual_nutrients["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                        abs(final_actual_nutrients["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                        abs(final_actual_nutrients["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                        abs(final_actual_nutrients["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                    ]) / 4
+                    "error": calculate_meal_error(final_actual_nutrients, target_nutrients)
                 }
                 
                 # STRATEGIA 1: Aggiungere pane se necessario per deficit di carboidrati
                 if carb_deficit > 10:  # Deficit significativo (>10g)
-                    bread_variants = ["pane", "pane_bianco", "pane_integrale", "pane bianco", "pane integrale"]
-                    bread_already_present = any(any(variant in food.lower() for variant in bread_variants) for food in final_food_list)
-                    
-                    if not bread_already_present:
+                    if not contains_food_variant(final_food_list, BREAD_VARIANTS):
                         test_food_list_bread = final_food_list + ["pane"]
                         bread_found, _ = db.check_foods_in_db(["pane"])
                         
                         if bread_found:
                             try:
-                                foods_nutrition_bread = get_food_nutrition_per_100g(test_food_list_bread)
-                                optimized_portions_bread = optimize_portions(target_nutrients, foods_nutrition_bread)
-                                actual_nutrients_bread = calculate_actual_nutrients(optimized_portions_bread, foods_nutrition_bread)
-                                
-                                error_with_bread = sum([
-                                    abs(actual_nutrients_bread["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                    abs(actual_nutrients_bread["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                    abs(actual_nutrients_bread["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                    abs(actual_nutrients_bread["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                                ]) / 4
+                                bread_trial = evaluator.evaluate(test_food_list_bread)
                                 
-                                if error_with_bread < best_carb_solution["error"] - 0.03:
-                                    best_carb_solution = {
-                                        "portions": optimized_portions_bread,
-                                        "actual_nutrients": actual_nutrients_bread,
-                                        "food_list": test_food_list_bread,
-                                        "error": error_with_bread
-                                    }
+                                if bread_trial["error"] < best_carb_solution["error"] - 0.03:
+                                    best_carb_solution = bread_trial
                                     carb_added = True
                                     carb_adjustment_food = "pane"
                                     
                             except Exception as e:
                                 logger.warning(f"Errore nel test con pane aggiunto: {str(e)}")
                 
-                # STRATEGIA 2: Sostituzioni di carboidrati
-                substitution_tests = [
-                    # Sostituire pasta con riso
-                    {"from": ["pasta", "pasta_normale", "pasta normale"], "to": "riso", "type": "pasta→riso"},
-                    # Sostituire riso con pasta
-                    {"from": ["riso", "riso_bianco", "riso bianco"], "to": "pasta", "type": "riso→pasta"},
-                    # Sostituire patate con pane
-                    {"from": ["patate", "patata", "patate_lesse", "patate lesse"], "to": "pane", "type": "patate→pane"},
-                    # Sostituire pane con patate
-                    {"from": ["pane", "pane_bianco", "pane_integrale", "pane bianco", "pane integrale"], "to": "patate", "type": "pane→patate"}
-                ]
-                
-                for substitution in substitution_tests:
-                    # Trova l'alimento da sostituire nella lista corrente
-                    food_to_replace = None
-                    for food in final_food_list:
-                        if any(variant in food.lower() for variant in substitution["from"]):
-                            food_to_replace = food
-                            break
+                # STRATEGIA 2: Sostituzioni di carboidrati (pasta↔riso, patate↔pane)
+                for substitution, food_to_replace, test_food_list_sub in find_carb_substitutions(final_food_list):
+                    # Verifica che l'alimento sostituto sia nel database
+                    substitute_found, _ = db.check_foods_in_db([substitution["to"]])
                     
-                    if food_to_replace:
-                        # Controlla se l'alimento di sostituzione non è già presente
-                        substitute_already_present = any(substitution["to"] in food.lower() for food in final_food_list)
-                        
-                        if not substitute_already_present:
-                            # Crea la nuova lista sostituendo l'alimento
-                            test_food_list_sub = [substitution["to"] if food == food_to_replace else food for food in final_food_list]
-                            
-                            # Verifica che l'alimento sostituto sia nel database
-                            substitute_found, _ = db.check_foods_in_db([substitution["to"]])
+                    if substitute_found:
+                        try:
+                            sub_trial = evaluator.evaluate(test_food_list_sub)
                             
-                            if substitute_found:
-                                try:
-                                    foods_nutrition_sub = get_food_nutrition_per_100g(test_food_list_sub)
-                                    optimized_portions_sub = optimize_portions(target_nutrients, foods_nutrition_sub)
-                                    actual_nutrients_sub = calculate_actual_nutrients(optimized_portions_sub, foods_nutrition_sub)
-                                    
-                                    error_with_sub = sum([
-                                        abs(actual_nutrients_sub["kcal"] - target_nutrients["kcal"]) / max(target_nutrients["kcal"], 1),
-                                        abs(actual_nutrients_sub["proteine_g"] - target_nutrients["proteine_g"]) / max(target_nutrients["proteine_g"], 1),
-                                        abs(actual_nutrients_sub["carboidrati_g"] - target_nutrients["carboidrati_g"]) / max(target_nutrients["carboidrati_g"], 1),
-                                        abs(actual_nutrients_sub["grassi_g"] - target_nutrients["grassi_g"]) / max(target_nutrients["grassi_g"], 1)
-                                    ]) / 4
-                                    
-                                    if error_with_sub < best_carb_solution["error"] - 0.03:
-                                        best_carb_solution = {
-                                            "portions": optimized_portions_sub,
-                                            "actual_nutrients": actual_nutrients_sub,
-                                            "food_list": test_food_list_sub,
-                                            "error": error_with_sub
-                                        }
-                                        carb_substituted = True
-                                        carb_adjustment_food = food_to_replace
-                                        carb_substitution_type = substitution["type"]
-                                        
-                                except Exception as e:
-                                    logger.warning(f"Errore nel test sostituzione {substitution['type']}: {str(e)}")
+                            if sub_trial["error"] < best_carb_solution["error"] - 0.03:
+                                best_carb_solution = sub_trial
+                                carb_substituted = True
+                                carb_adjustment_food = food_to_replace
+                                carb_substitution_type = substitution["type"]
+                                
+                        except Exception as e:
+                            logger.warning(f"Errore nel test sostituzione {substitution['type']}: {str(e)}")
                 
                 # Applica la migliore soluzione per i carboidrati trovata
                 final_portions = best_carb_solution["portions"]
                 final_actual_nutrients = best_carb_solution["actual_nutrients"]
                 final_food_list = best_carb_solution["food_list"]
         
-        # 9. Arrotonda le porzioni alla decina più vicina
-        optimized_portions_rounded = {
-            food: float(10 * np.floor(grams / 10 + 0.5)) for food, grams in final_portions.items()
-        }
-        
-        # 10. Calcola i contributi individuali di ogni alimento per le porzioni arrotondate
-        individual_contributions = {}
-        
         # Usa i dati nutrizionali corretti (considerando olio e aggiustamenti proteici)
         nutrition_data = get_food_nutrition_per_100g(final_food_list)
-            
-        for food, grams in optimized_portions_rounded.items():
-            if food in nutrition_data:
-                nutrition = nutrition_data[food]
-                
-                individual_contributions[food] = {
-                    "portion_g": grams,
-                    "kcal": float(round(nutrition['energia_kcal'] * grams / 100, 1)),
-                    "proteine_g": float(round(nutrition['proteine_g'] * grams / 100, 1)),
-                    "carboidrati_g": float(round(nutrition['carboidrati_g'] * grams / 100, 1)),
-                    "grassi_g": float(round(nutrition['grassi_g'] * grams / 100, 1)),
-                    "categoria": nutrition['categoria']
-                }
+        
+        # 9. Porta le porzioni su multipli di 10g: ottimizzazione discreta partendo dalle
+        #    porzioni continue, oppure semplice arrotondamento con il solver storico
+        discrete_portions = DISCRETE_PORTIONS and evaluator.solver != "legacy"
+        if discrete_portions:
+            try:
+                optimized_portions_rounded = optimize_portions_discrete(
+                    target_nutrients, nutrition_data, relaxed_portions=final_portions
+                )
+            except DiscreteSearchTimeout:
+                # Tempo massimo di protezione superato: arrotondamento delle porzioni continue
+                discrete_portions = False
+        if not discrete_portions:
+            optimized_portions_rounded = {
+                food: float(10 * np.floor(grams / 10 + 0.5)) for food, grams in final_portions.items()
+            }
+        
+        # 10. Calcola i contributi individuali di ogni alimento per le porzioni finali
+        individual_contributions = calculate_food_contributions(optimized_portions_rounded, nutrition_data)
         
         # 11. Ricalcola i nutrienti effettivi dalle porzioni arrotondate per coerenza
         final_actual_nutrients_rounded = calculate_actual_nutrients(optimized_portions_rounded, nutrition_data)
         
         # 12. Calcola gli errori percentuali
-        errors = {}
-        for nutrient in ["kcal", "proteine_g", "carboidrati_g", "grassi_g"]:
-            target = target_nutrients[nutrient]
-            actual = final_actual_nutrients_rounded[nutrient]
-            if target > 0:
-                error_pct = abs(actual - target) / target * 100
-                errors[f"{nutrient}_error_pct"] = float(round(error_pct, 1))
-            else:
-                errors[f"{nutrient}_error_pct"] = 0.0
+        errors = calculate_error_percentages(final_actual_nutrients_rounded, target_nutrients)
         
         # 13. Gestisci gli alimenti esclusi dall'utente
-        excluded_foods = load_user_excluded_foods(user_id)
+        if excluded_foods is None:
+            excluded_foods = load_user_excluded_foods(user_id, user_data)
         excluded_replacements = {}
         found_excluded_foods = []
         
@@ -1743,41 +1863,24 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
                 final_food_list_updated = list(optimized_portions_rounded.keys())
                 nutrition_data_updated = get_food_nutrition_per_100g(final_food_list_updated)
                 
-                # Ricalcola i nutrienti effettivi
                 final_actual_nutrients_rounded = calculate_actual_nutrients(optimized_portions_rounded, nutrition_data_updated)
-                
-                # Ricalcola i contributi individuali
-                individual_contributions = {}
-                for food, grams in optimized_portions_rounded.items():
-                    if food in nutrition_data_updated:
-                        nutrition = nutrition_data_updated[food]
-                        individual_contributions[food] = {
-                            "portion_g": grams,
-                            "kcal": float(round(nutrition['energia_kcal'] * grams / 100, 1)),
-                            "proteine_g": float(round(nutrition['proteine_g'] * grams / 100, 1)),
-                            "carboidrati_g": float(round(nutrition['carboidrati_g'] * grams / 100, 1)),
-                            "grassi_g": float(round(nutrition['grassi_g'] * grams / 100, 1)),
-                            "categoria": nutrition['categoria']
-                        }
-                
-                # Ricalcola gli errori percentuali
-                errors = {}
-                for nutrient in ["kcal", "proteine_g", "carboidrati_g", "grassi_g"]:
-                    target = target_nutrients[nutrient]
-                    actual = final_actual_nutrients_rounded[nutrient]
-                    if target > 0:
-                        error_pct = abs(actual - target) / target * 100
-                        errors[f"{nutrient}_error_pct"] = float(round(error_pct, 1))
-                    else:
-                        errors[f"{nutrient}_error_pct"] = 0.0
+                individual_contributions = calculate_food_contributions(optimized_portions_rounded, nutrition_data_updated)
+                errors = calculate_error_percentages(final_actual_nutrients_rounded, target_nutrients)
         
         # 14. Calcola i sostituti per ogni alimento (con filtro esclusioni integrato)
-        food_substitutes = calculate_food_substitutes(optimized_portions_rounded, meal_name, user_id)
+        food_substitutes = {}
+        if include_substitutes:
+            food_substitutes = calculate_food_substitutes(
+                optimized_portions_rounded, meal_name, user_id, excluded_foods=excluded_foods
+            )
         
         # 15. Prepara il messaggio di summary con tutte le ottimizzazioni
         final_food_count = len(optimized_portions_rounded)
         summary_parts = [f"Ottimizzazione completata per {meal_name} con {final_food_count} alimenti"]
         
+        if resolved_foods:
+            summary_parts.append("riconosciuti " + ", ".join(f"{name} come {canonical}" for name, canonical in resolved_foods.items()))
+        
         if oil_added:
             summary_parts.append(f"olio aggiunto automaticamente (miglioramento: {improvement:.1%})")
         
@@ -1812,7 +1915,10 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
             else:
                 summary_parts.append(f"{excluded_count} alimenti esclusi rimossi")
         
-        summary_parts.append("Porzioni arrotondate alla decina più vicina")
+        if discrete_portions:
+            summary_parts.append("Porzioni ottimizzate su multipli di 10g")
+        else:
+            summary_parts.append("Porzioni arrotondate alla decina più vicina")
         
         optimization_summary = ". ".join(summary_parts) + "."
         
@@ -1842,6 +1948,167 @@ def optimize_meal_portions(meal_name: str, food_list: List[str], user_id: str =
         }
 
 
+def optimize_day_meals(day_meals: Dict[str, List[str]], user_id: str = None,
+                       include_substitutes: bool = True,
+                       daily_food_limits: Optional[Dict[str, float]] = None,
+                       joint: bool = True) -> Dict[str, Dict[str, Any]]:
+    """
+    Ottimizza insieme tutti i pasti di un giorno.
+    
+    Il file utente viene letto una sola volta e le liste candidate di tutti i pasti
+    (olio, mandorle, proteine, sostituzioni dei carboidrati) vengono risolte con
+    un'unica chiamata al solver; le euristiche di ogni pasto sono quelle di
+    optimize_meal_portions. Le porzioni finali vengono poi scelte risolvendo un
+    unico problema congiunto (vedi build_day_problem) con i target di ogni pasto,
+    i totali giornalieri e gli eventuali limiti giornalieri per alimento, così i
+    piccoli errori dei singoli pasti non si sommano in un errore giornaliero.
+    
+    Args:
+        day_meals: Dict nome pasto -> lista alimenti (i pasti vuoti vengono saltati)
+        user_id: ID dell'utente (opzionale, usa get_user_id() se None)
+        include_substitutes: Se True calcola i sostituti sulle porzioni finali
+        daily_food_limits: Dict alimento -> grammi massimi al giorno su tutti i pasti (opzionale)
+        joint: Se False mantiene le porzioni ottimizzate pasto per pasto
+        
+    Returns:
+        Dict nome pasto -> risultato nello stesso formato di optimize_meal_portions
+    """
+    if user_id is None:
+        user_id = get_user_id()
+    
+    # 1. Un'unica lettura del file utente per target ed esclusioni di tutti i pasti
+    try:
+        user_data = load_user_data(user_id)
+    except ValueError:
+        user_data = None
+    excluded_foods = load_user_excluded_foods(user_id, user_data) if user_data is not None else []
+    
+    # 2. Candidati di tutti i pasti risolti con un'unica chiamata al solver
+    evaluators = {}
+    jobs = []
+    for meal_name, food_list in day_meals.items():
+        if not food_list or user_data is None:
+            continue
+        try:
+            target_nutrients = load_user_meal_targets(user_id, meal_name, user_data)
+        except ValueError:
+            # L'errore viene riportato da optimize_meal_portions
+            continue
+        resolved_list, _ = db.resolve_food_names(food_list)
+        if not db.check_foods_in_db(resolved_list)[0]:
+            continue
+        evaluator = MealCandidateEvaluator(target_nutrients)
+        evaluators[meal_name] = evaluator
+        jobs.append((evaluator, build_meal_candidate_lists(resolved_list, *classify_meal(meal_name))))
+    prefetch_meal_candidates(jobs)
+    
+    # 3. Euristiche di ogni pasto sui risultati già calcolati
+    results = {}
+    for meal_name, food_list in day_meals.items():
+        if not food_list:
+            continue
+        results[meal_name] = optimize_meal_portions(
+            meal_name, food_list, user_id,
+            user_data=user_data,
+            excluded_foods=excluded_foods,
+            evaluator=evaluators.get(meal_name),
+            include_substitutes=False
+        )
+    
+    # 4. Porzioni finali dal problema congiunto del giorno
+    if joint and DEFAULT_SOLVER != "legacy" and DISCRETE_PORTIONS:
+        try:
+            balance_day_portions(results, daily_food_limits)
+        except Exception as e:
+            logger.warning(f"Ottimizzazione congiunta del giorno non riuscita, uso le porzioni dei singoli pasti: {str(e)}")
+    
+    # 5. Sostituti calcolati sulle porzioni finali
+    if include_substitutes:
+        for meal_name, result in results.items():
+            if result.get("success", False):
+                result["substitutes"] = calculate_food_substitutes(
+                    result["portions"], meal_name, user_id, excluded_foods=excluded_foods
+                )
+    
+    return results
+
+
+def balance_day_portions(meal_results: Dict[str, Dict[str, Any]],
+                         daily_food_limits: Optional[Dict[str, float]] = None) -> bool:
+    """
+    Ricalcola insieme le porzioni dei pasti riusciti di un giorno.
+    
+    Risolve il problema congiunto (rilassamento lineare e ricerca sulla griglia da 10g)
+    mantenendo gli alimenti scelti per ogni pasto, e aggiorna in place porzioni,
+    nutrienti, errori e contributi. Le porzioni dei singoli pasti vengono mantenute se
+    la soluzione congiunta non è migliore sull'obiettivo del giorno.
+    
+    Args:
+        meal_results: Dict nome pasto -> risultato di optimize_meal_portions (modificato in place)
+        daily_food_limits: Dict alimento -> grammi massimi al giorno (opzionale)
+        
+    Returns:
+        True se le porzioni sono state aggiornate
+    """
+    meals = [
+        meal_name for meal_name, result in meal_results.items()
+        if result.get("success", False) and result.get("portions")
+    ]
+    if not meals:
+        return False
+    
+    constraints = get_portion_constraints()
+    all_foods = list(dict.fromkeys(food for meal_name in meals for food in meal_results[meal_name]["portions"]))
+    nutrition = get_food_nutrition_per_100g(all_foods)
+    
+    # Problemi dei pasti in forma canonica, così il giorno può essere servito dalla cache
+    canonical = [
+        canonical_problem(build_portion_problem(
+            meal_results[meal_name]["target_nutrients"],
+            {food: nutrition[food] for food in meal_results[meal_name]["portions"]},
+            constraints
+        ))
+        for meal_name in meals
+    ]
+    meal_problems = [problem for problem, _ in canonical]
+    day_problem = build_day_problem(meal_problems, food_limits=daily_food_limits)
+    
+    current = np.array([
+        meal_results[meal_name]["portions"][food]
+        for meal_name, problem in zip(meals, meal_problems) for food in problem["foods"]
+    ])
+    
+    def solve(problem):
+        return solve_portions_discrete(problem, relaxation=solve_lp(problem))
+    
+    cache = get_portion_cache()
+    if cache is not None:
+        grams = cache.solve("day", day_problem, solve, step=PORTION_STEP, node_budget=DISCRETE_NODE_BUDGET)
+    else:
+        grams = solve(day_problem)
+    
+    # Le porzioni dei singoli pasti restano valide se rispettano i limiti e non sono peggiori
+    current_feasible = day_problem["limit_matrix"] is None or np.all(
+        day_problem["limit_matrix"] @ current <= day_problem["limit_values"] + 1e-9
+    )
+    if current_feasible and portion_error(day_problem, current) <= portion_error(day_problem, grams):
+        return False
+    
+    for meal_name, (_, order), meal_grams in zip(meals, canonical, split_day_solution(day_problem, grams)):
+        result = meal_results[meal_name]
+        foods = list(result["portions"])
+        foods_nutrition = {food: nutrition[food] for food in foods}
+        meal_grams = restore_food_order(meal_grams, order)
+        portions = {food: float(meal_grams[i]) for i, food in enumerate(foods)}
+        
+        result["portions"] = portions
+        result["actual_nutrients"] = calculate_actual_nutrients(portions, foods_nutrition)
+        result["errors"] = calculate_error_percentages(result["actual_nutrients"], result["target_nutrients"])
+        result["macro_single_foods"] = calculate_food_contributions(portions, foods_nutrition)
+        result["optimization_summary"] = result["optimization_summary"].rstrip(".") + ". Porzioni bilanciate sul totale giornaliero."
+    return True
+
+
 def load_substitutes_data() -> Dict[str, Any]:
     """
     Carica i dati dei sostituti alimentari dal file alimenti_sostitutivi.json.
@@ -1866,7 +2133,8 @@ def load_substitutes_data() -> Dict[str, Any]:
         raise ValueError(f"Errore nella lettura del file sostituti: {str(e)}")
 
 
-def calculate_food_substitutes(optimized_portions: Dict[str, float], meal_name: str, user_id: str = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+def calculate_food_substitutes(optimized_portions: Dict[str, float], meal_name: str, user_id: str = None,
+                               excluded_foods: Optional[List[str]] = None) -> Dict[str, Dict[str, Dict[str, float]]]:
     """
     Calcola i sostituti per ogni alimento con le grammature corrette.
     
@@ -1879,6 +2147,7 @@ def calculate_food_substitutes(optimized_portions: Dict[str, float], meal_name:
         meal_name: Nome del pasto
         user_id: ID dell'utente per caricare gli alimenti esclusi 
                 (opzionale, usa get_user_id() se None)
+        excluded_foods: Alimenti esclusi già caricati (opzionale, evita di rileggere il file)
         
     Returns:
         Dict con struttura: {
@@ -1892,19 +2161,19 @@ def calculate_food_substitutes(optimized_portions: Dict[str, float], meal_name:
         substitutes_data = load_substitutes_data()
         substitutes_db = substitutes_data.get("substitutes", {})
         
-        # Carica gli alimenti esclusi dall'utente
-        excluded_foods = []
-        try:
-            # Se user_id non è fornito, tenta di ottenerlo automaticamente
-            if not user_id:
-                user_id = get_user_id()
-            
-            # Carica gli alimenti esclusi usando l'user_id ottenuto
-            excluded_foods = load_user_excluded_foods(user_id)
-        except Exception as e:
-            # Se non riusciamo a ottenere user_id o caricare excluded_foods, procediamo senza esclusioni
-            print(f"   ⚠️  Impossibile caricare excluded_foods: {str(e)}")
-            excluded_foods = []
+        # Carica gli alimenti esclusi dall'utente (se non già forniti)
+        if excluded_foods is None:
+            try:
+                # Se user_id non è fornito, tenta di ottenerlo automaticamente
+                if not user_id:
+                    user_id = get_user_id()
+                
+                # Carica gli alimenti esclusi usando l'user_id ottenuto
+                excluded_foods = load_user_excluded_foods(user_id)
+            except Exception as e:
+                # Se non riusciamo a ottenere user_id o caricare excluded_foods, procediamo senza esclusioni
+                print(f"   ⚠️  Impossibile caricare excluded_foods: {str(e)}")
+                excluded_foods = []
         
         result = {}
         
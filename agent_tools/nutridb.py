@@ -1,70 +1,190 @@
+import functools
+import hashlib
 import json
+import logging
 import os
+import pickle
+import re
+import threading
+import numpy as np
 import streamlit as st
 
+from .food_name_index import FoodNameIndex
+from .user_context import current_user_id
+from .user_document_cache import get_user_document
+
+logger = logging.getLogger(__name__)
+
+
+# Colonne della matrice nutrizionale (valori per 100g)
+MACRO_COLUMNS = [
+    "energia_kcal", "proteine_g", "carboidrati_g", "zuccheri_g",
+    "grassi_g", "grassi_saturi_g", "fibra_g"
+]
+VITAMIN_COLUMNS = [
+    "vitamina_C_mg", "tiamina_mg", "riboflavina_mg", "niacina_mg",
+    "acido_pantotenico_mg", "vitamina_B6_mg", "biotina_ug", "folati_ug",
+    "vitamina_B12_ug", "vitamina_A_ug", "vitamina_D_ug", "vitamina_E_mg", "vitamina_K_ug"
+]
+NUTRIENT_COLUMNS = MACRO_COLUMNS + VITAMIN_COLUMNS
+
+# File JSON di Dati_processed letti da NutriDB (l'hash del loro contenuto invalida lo snapshot)
+SOURCE_FILES = [
+    "banca_alimenti_crea_60alimenti.json", "fattori_conversione_cottura.json",
+    "larn_proteine.json", "larn_energy_18-60_anni.json", "larn_carboidrati_e_fibre.json",
+    "larn_lipidi.json", "larn_vitamine.json", "porzioni_standard.json",
+    "peso_per_volume.json", "alimenti_sostitutivi.json"
+]
+
+# Snapshot binario precompilato di Dati_processed
+SNAPSHOT_FILENAME = ".nutridb_snapshot.pkl"
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Soglie dei suggerimenti fuzzy: punteggio minimo per proporre un alimento e per
+# risolverlo automaticamente (con un distacco minimo dal secondo candidato)
+SUGGESTION_MIN_SCORE = 0.5
+AUTO_RESOLVE_SCORE = 0.8
+AUTO_RESOLVE_MARGIN = 0.08
+
 
 class SmartAliasDict(dict):
-    """Dizionario intelligente per alias che implementa ricerca a 3 step"""
+    """Dizionario intelligente per alias che implementa ricerca a 3 step.
+    
+    Il resolver è precompilato alla costruzione: gli apostrofi sono normalizzati con
+    una tabella di traduzione, le parole di preparazione sono riconosciute con un'unica
+    regex in alternanza e i risultati (anche negativi) sono memorizzati in una cache LRU.
+    """
+    
+    # Tutti i tipi di apostrofi/quote da ricondurre all'apostrofo ASCII
+    APOSTROPHES = [
+        '\u0060',   # U+0060 GRAVE ACCENT (backtick) - usato da DeepSeek
+        '\u2018',   # U+2018 LEFT SINGLE QUOTATION MARK
+        '\u2019',   # U+2019 RIGHT SINGLE QUOTATION MARK  
+        '\u201B',   # U+201B SINGLE HIGH-REVERSED-9 QUOTATION MARK
+        '\u2032',   # U+2032 PRIME
+    ]
+    _APOSTROPHE_TABLE = str.maketrans({apostrophe: "'" for apostrophe in APOSTROPHES})
+    
+    # Numero massimo di nomi grezzi memorizzati nella cache del resolver
+    RESOLVE_CACHE_SIZE = 4096
     
     def __init__(self, base_mapping, preparation_words):
         super().__init__(base_mapping)
         self.preparation_words = preparation_words
+        # Regex unica per sapere se un nome contiene almeno una parola di preparazione
+        self._preparation_pattern = re.compile(
+            "|".join(re.escape(word) for word in sorted(preparation_words, key=len, reverse=True))
+        ) if preparation_words else None
+        self._resolve_cached = functools.lru_cache(maxsize=self.RESOLVE_CACHE_SIZE)(self._resolve)
     
     def _normalize_apostrophes(self, text):
         """
         Normalizza tutti i tipi di apostrofi al normale apostrofo ASCII.
         Questo risolve il problema con DeepSeek che usa caratteri diversi.
         """
-        # Sostituisci tutti i tipi di apostrofi/quote con l'apostrofo normale
-        apostrophes = [
-            '\u0060',   # U+0060 GRAVE ACCENT (backtick) - usato da DeepSeek
-            '\u2018',   # U+2018 LEFT SINGLE QUOTATION MARK
-            '\u2019',   # U+2019 RIGHT SINGLE QUOTATION MARK  
-            '\u201B',   # U+201B SINGLE HIGH-REVERSED-9 QUOTATION MARK
-            '\u2032',   # U+2032 PRIME
-        ]
-        
-        for apostrophe in apostrophes:
-            text = text.replace(apostrophe, "'")
-        
-        return text
+        return text.translate(self._APOSTROPHE_TABLE)
+    
+    def _remove_preparation_words(self, text):
+        """Rimuove le parole di preparazione con la stessa semantica sequenziale storica.
         
-    def get(self, key, default=None):
-        """
-        Ricerca intelligente a 4 step:
-        0. Normalizza apostrofi (risolve problema DeepSeek)  
-        1. Ricerca diretta
-        2. Sostituisce _ con spazi e riprova
-        3. Rimuove parole di preparazione e riprova
+        Storicamente ogni parola veniva sostituita in ordine, seguita da strip e
+        compattazione degli spazi. Dopo la prima iterazione la stringa è già compatta,
+        quindi le iterazioni successive hanno effetto solo se la parola è presente:
+        la regex permette di saltare del tutto il ciclo nel caso comune.
         """
+        if not self.preparation_words:
+            return text
+        
+        first_word = self.preparation_words[0]
+        cleaned = " ".join(text.replace(first_word, "").split())
+        if self._preparation_pattern.search(cleaned) is None:
+            return cleaned
+        
+        for prep_word in self.preparation_words[1:]:
+            if prep_word in cleaned:
+                cleaned = " ".join(cleaned.replace(prep_word, "").split())
+        return cleaned
+    
+    def _resolve(self, key):
+        """Risolve un nome grezzo nella chiave canonica, o None se non trovato."""
         # STEP 0: Normalizza apostrofi
         key = self._normalize_apostrophes(key)
         
         # STEP 1: Ricerca diretta
-        result = super().get(key, None)
+        result = dict.get(self, key, None)
         if result is not None:
             return result
             
         # STEP 2: Sostituisce _ con spazi e riprova
         key_with_spaces = key.replace("_", " ")
-        result = super().get(key_with_spaces, None)
+        result = dict.get(self, key_with_spaces, None)
         if result is not None:
             return result
             
         # STEP 3: Rimuove parole di preparazione e riprova
-        cleaned_key = key_with_spaces
-        for prep_word in self.preparation_words:
-            cleaned_key = cleaned_key.replace(prep_word, "").strip()
-            # Rimuovi spazi multipli
-            cleaned_key = " ".join(cleaned_key.split())
+        cleaned_key = self._remove_preparation_words(key_with_spaces)
         
         # Solo se è cambiato qualcosa, riprova la ricerca
         if cleaned_key != key_with_spaces and cleaned_key:
-            result = super().get(cleaned_key, None)
-            if result is not None:
-                return result
+            return dict.get(self, cleaned_key, None)
         
+        return None
+    
+    def get(self, key, default=None):
+        """
+        Ricerca intelligente a 4 step:
+        0. Normalizza apostrofi (risolve problema DeepSeek)  
+        1. Ricerca diretta
+        2. Sostituisce _ con spazi e riprova
+        3. Rimuove parole di preparazione e riprova
+        """
+        result = self._resolve_cached(key)
+        return default if result is None else result
+    
+    def cache_info(self):
+        """Statistiche della cache del resolver (hits, misses, maxsize, currsize)."""
+        return self._resolve_cached.cache_info()
+    
+    def __reduce__(self):
+        # La cache LRU non è serializzabile: si ricostruisce dal mapping
+        return (self.__class__, (dict(self), self.preparation_words))
+    
+    # Ogni modifica del mapping invalida i risultati memorizzati
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._resolve_cached.cache_clear()
+    
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._resolve_cached.cache_clear()
+    
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._resolve_cached.cache_clear()
+    
+    def __ior__(self, other):
+        self.update(other)
+        return self
+    
+    def pop(self, key, *default):
+        result = super().pop(key, *default)
+        self._resolve_cached.cache_clear()
+        return result
+    
+    def popitem(self):
+        item = super().popitem()
+        self._resolve_cached.cache_clear()
+        return item
+    
+    def setdefault(self, key, default=None):
+        if key in self:
+            return dict.__getitem__(self, key)
+        self[key] = default
         return default
+    
+    def clear(self):
+        super().clear()
+        self._resolve_cached.cache_clear()
 
 
 class NutriDB:
@@ -79,7 +199,10 @@ class NutriDB:
         self.porzioni = self._load_json(os.path.join(path, "porzioni_standard.json"))
         self.peso_volume = self._load_json(os.path.join(path, "peso_per_volume.json"))
         self.alias = self._build_alias()
+        self.name_index = FoodNameIndex(self.alias)
         self.data_dir = path
+        self.food_index, self.nutrient_matrix = self._build_nutrient_matrix()
+        self.nutrient_columns = {name: i for i, name in enumerate(NUTRIENT_COLUMNS)}
         
         # Carica il database dei sostituti se disponibile
         try:
@@ -90,6 +213,93 @@ class NutriDB:
     def _load_json(self, filepath):
         with open(filepath, 'r', encoding='utf-8') as f:
             return json.load(f)
+
+    # Attributi serializzati nello snapshot (tabelle sorgente + indici precalcolati)
+    _SNAPSHOT_ATTRIBUTES = [
+        "alimenti", "conversioni", "larn_proteine", "larn_energy_18_60", "larn_fibre_carboidrati",
+        "larn_lipidi", "larn_vitamine", "porzioni", "peso_volume", "substitutes",
+        "food_index", "nutrient_matrix", "nutrient_columns"
+    ]
+
+    @staticmethod
+    def compute_source_hash(path):
+        """Calcola l'hash SHA-256 del contenuto dei file sorgente e del codice di NutriDB.
+        
+        Il codice del modulo è incluso perché gli alias manuali sono definiti qui:
+        modificarli deve invalidare lo snapshot come una modifica ai JSON.
+        """
+        digest = hashlib.sha256(f"format:{SNAPSHOT_FORMAT_VERSION}".encode())
+        for filename in SOURCE_FILES:
+            digest.update(filename.encode())
+            try:
+                with open(os.path.join(path, filename), 'rb') as f:
+                    digest.update(f.read())
+            except FileNotFoundError:
+                digest.update(b"<missing>")
+        with open(__file__, 'rb') as f:
+            digest.update(f.read())
+        return digest.hexdigest()
+
+    @classmethod
+    def from_snapshot(cls, path, snapshot_path=None):
+        """Crea un NutriDB dallo snapshot binario, ricompilandolo se i sorgenti sono cambiati.
+        
+        Args:
+            path: Directory dei dati (Dati_processed)
+            snapshot_path: Percorso del file snapshot (default: <path>/.nutridb_snapshot.pkl,
+                           sovrascrivibile con la variabile d'ambiente NUTRIDB_SNAPSHOT_PATH)
+        
+        Returns:
+            NutriDB: Istanza caricata dallo snapshot o costruita dai JSON
+        """
+        if snapshot_path is None:
+            snapshot_path = os.environ.get("NUTRIDB_SNAPSHOT_PATH") or os.path.join(path, SNAPSHOT_FILENAME)
+        source_hash = cls.compute_source_hash(path)
+        
+        try:
+            with open(snapshot_path, 'rb') as f:
+                state = pickle.load(f)
+            if state.get("source_hash") == source_hash:
+                db = cls.__new__(cls)
+                db._restore_snapshot_state(state, path)
+                return db
+            logger.info("Snapshot NutriDB obsoleto, ricompilazione in corso")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Snapshot NutriDB non leggibile ({snapshot_path}): {str(e)}")
+        
+        db = cls(path)
+        db.save_snapshot(snapshot_path, source_hash)
+        return db
+
+    def save_snapshot(self, snapshot_path, source_hash=None):
+        """Scrive lo snapshot binario in modo atomico. Gli errori di scrittura non sono fatali."""
+        if source_hash is None:
+            source_hash = self.compute_source_hash(self.data_dir)
+        state = {attribute: getattr(self, attribute) for attribute in self._SNAPSHOT_ATTRIBUTES}
+        state["alias_mapping"] = dict(self.alias)
+        state["preparation_words"] = self.alias.preparation_words
+        state["source_hash"] = source_hash
+        
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, snapshot_path)
+        except OSError as e:
+            logger.warning(f"Impossibile scrivere lo snapshot NutriDB ({snapshot_path}): {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _restore_snapshot_state(self, state, path):
+        """Ripristina gli attributi dell'istanza da uno snapshot già validato."""
+        for attribute in self._SNAPSHOT_ATTRIBUTES:
+            setattr(self, attribute, state[attribute])
+        self.nutrient_matrix.setflags(write=False)
+        self.alias = SmartAliasDict(state["alias_mapping"], state["preparation_words"])
+        self.name_index = FoodNameIndex(self.alias)
+        self.data_dir = path
         
     def _build_alias(self):
         """Costruisce un dizionario di alias intelligente per i nomi degli alimenti.
@@ -336,8 +546,88 @@ class NutriDB:
         # Ritorna il dizionario intelligente che implementa ricerca a 3 step
         return SmartAliasDict(base_mapping, preparation_words)
 
+    def _build_nutrient_matrix(self):
+        """Costruisce la matrice densa alimenti × nutrienti (valori per 100g).
+        
+        Le righe seguono l'ordine di self.alimenti, le colonne NUTRIENT_COLUMNS.
+        I valori mancanti o non numerici valgono 0.
+        
+        Returns:
+            tuple: (food_index, matrix)
+                - food_index: dict chiave canonica -> indice di riga
+                - matrix: np.ndarray float64 di forma (n_alimenti, n_nutrienti)
+        """
+        food_index = {}
+        matrix = np.zeros((len(self.alimenti), len(NUTRIENT_COLUMNS)), dtype=np.float64)
+        
+        for row, (key, info) in enumerate(self.alimenti.items()):
+            food_index[key] = row
+            for col, nutrient in enumerate(NUTRIENT_COLUMNS):
+                value = info.get(nutrient)
+                if isinstance(value, bool) or value is None:
+                    continue
+                try:
+                    matrix[row, col] = float(value)
+                except (ValueError, TypeError):
+                    continue
+        
+        # La matrice è condivisa tra le chiamate: la rendiamo di sola lettura
+        matrix.setflags(write=False)
+        return food_index, matrix
+
+    def resolve_food_key(self, alimento):
+        """Restituisce la chiave canonica di un alimento tramite gli alias, o None."""
+        return self.alias.get(alimento.lower().replace("_", " "))
+
+    def get_nutrients_many(self, alimenti, quantità=None):
+        """Calcola in blocco i nutrienti di più alimenti con un solo prodotto matrice-vettore.
+        
+        Args:
+            alimenti: Lista di nomi di alimenti (risolti tramite alias)
+            quantità: Lista di grammi per ogni alimento (default 100g ciascuno)
+        
+        Returns:
+            dict: Contiene:
+                - foods: chiavi canoniche nell'ordine di input
+                - columns: nomi delle colonne (NUTRIENT_COLUMNS)
+                - per_food: np.ndarray (n_alimenti, n_nutrienti) con i nutrienti per alimento
+                - totals: np.ndarray (n_nutrienti,) con i totali
+        
+        Raises:
+            ValueError: se uno o più alimenti non sono trovati
+        """
+        keys = []
+        not_found = []
+        for alimento in alimenti:
+            key = self.resolve_food_key(alimento)
+            if key is None or key not in self.food_index:
+                not_found.append(alimento)
+            else:
+                keys.append(key)
+        if not_found:
+            raise ValueError(f"Alimenti non trovati nel database: {', '.join(not_found)}")
+        
+        return self._nutrients_for_keys(keys, quantità)
+
+    def _nutrients_for_keys(self, keys, quantità=None):
+        """Come get_nutrients_many, ma su chiavi canoniche già risolte."""
+        rows = self.nutrient_matrix[[self.food_index[key] for key in keys]]
+        if quantità is None:
+            grams = np.full(len(keys), 100.0)
+        else:
+            grams = np.asarray(quantità, dtype=np.float64)
+            if grams.shape != (len(keys),):
+                raise ValueError("Il numero di quantità deve corrispondere al numero di alimenti")
+        
+        return {
+            "foods": keys,
+            "columns": NUTRIENT_COLUMNS,
+            "per_food": rows * grams[:, None] / 100.0,
+            "totals": grams @ rows / 100.0
+        }
+
     def get_macros(self, alimento, quantità=100):
-        key = self.alias.get(alimento.lower().replace("_", " "))
+        key = self.resolve_food_key(alimento)
         if not key:
             raise ValueError(f"Alimento '{alimento}' non trovato.")
         info = self.alimenti[key]
@@ -585,25 +875,20 @@ class NutriDB:
             return self.larn_vitamine["femmine_18_29"] if età < 30 else self.larn_vitamine["femmine_30_59"]
 
     def _get_user_id(self):
-        """Estrae l'ID dell'utente dalla sessione Streamlit."""
+        """Estrae l'ID dell'utente impostato con user_context o dalla sessione Streamlit."""
+        user_id = current_user_id()
+        if user_id:
+            return user_id
         if "user_info" not in st.session_state or "id" not in st.session_state.user_info:
             raise ValueError("Nessun utente autenticato. ID utente non disponibile.")
         return st.session_state.user_info["id"]
 
     def _extract_foods_from_user_data(self, user_id):
         """Estrae gli alimenti e le quantità dal file dell'utente."""
-        # Fix: Handle user_id that may already contain 'user_' prefix
-        if user_id.startswith("user_"):
-            user_file_path = f"user_data/{user_id}.json"
-        else:
-            user_file_path = f"user_data/user_{user_id}.json"
-        
-        if not os.path.exists(user_file_path):
+        user_data = get_user_document(user_id)
+        if user_data is None:
             raise ValueError(f"File utente {user_id} non trovato.")
         
-        with open(user_file_path, 'r', encoding='utf-8') as f:
-            user_data = json.load(f)
-        
         foods_with_grams = {}
         
         # Cerca nella struttura ottimizzazioni_pasti
@@ -999,20 +1284,12 @@ class NutriDB:
                 - recommendations: raccomandazioni specifiche
         """
         try:
-            # Carica i dati degli alimenti
-            foods_data = self.alimenti
-            
-            # Carica i LARN delle vitamine
-            larn_vitamine_path = os.path.join(self.data_dir, "larn_vitamine.json")
-            with open(larn_vitamine_path, 'r', encoding='utf-8') as f:
-                larn_data = json.load(f)
-            
             # Determina la categoria LARN appropriata
             larn_category = self._get_larn_vitamin_category(sesso, età)
             
-            # Naviga nella struttura JSON per trovare i requisiti
+            # Naviga nella struttura JSON (già caricata all'avvio) per trovare i requisiti
             category_parts = larn_category.split('/')
-            larn_requirements = larn_data["vitamine"]
+            larn_requirements = self.larn_vitamine
             for part in category_parts:
                 if part in larn_requirements:
                     larn_requirements = larn_requirements[part]
@@ -1022,29 +1299,19 @@ class NutriDB:
             if not isinstance(larn_requirements, dict) or "vitamina_C_mg" not in larn_requirements:
                 raise ValueError(f"Dati LARN non validi per categoria: {larn_category}")
             
-            # Inizializza i totali vitaminici
+            # Separa gli alimenti presenti nel database da quelli non trovati
+            found_foods = [food for food in foods_with_grams if food in self.food_index]
+            foods_not_found = [food for food in foods_with_grams if food not in self.food_index]
+            
+            # Calcola i totali vitaminici con un unico prodotto matrice-vettore
+            totals = self._nutrients_for_keys(
+                found_foods, [float(foods_with_grams[food]) for food in found_foods]
+            )["totals"]
             total_vitamins = {
-                "vitamina_C_mg": 0.0, "tiamina_mg": 0.0, "riboflavina_mg": 0.0, "niacina_mg": 0.0,
-                "acido_pantotenico_mg": 0.0, "vitamina_B6_mg": 0.0, "biotina_ug": 0.0, "folati_ug": 0.0,
-                "vitamina_B12_ug": 0.0, "vitamina_A_ug": 0.0, "vitamina_D_ug": 0.0, "vitamina_E_mg": 0.0, "vitamina_K_ug": 0.0
+                vitamin: round(float(totals[self.nutrient_columns[vitamin]]), 2)
+                for vitamin in VITAMIN_COLUMNS
             }
             
-            # Calcola i totali per ogni alimento
-            foods_not_found = []
-            for food_name, grams in foods_with_grams.items():
-                if food_name in foods_data:
-                    food_data = foods_data[food_name]
-                    # Calcola l'apporto vitaminico per la quantità specificata
-                    for vitamin in total_vitamins.keys():
-                        if vitamin in food_data:
-                            total_vitamins[vitamin] += (food_data[vitamin] * grams) / 100.0
-                else:
-                    foods_not_found.append(food_name)
-            
-            # Arrotonda i valori
-            for vitamin in total_vitamins:
-                total_vitamins[vitamin] = round(total_vitamins[vitamin], 2)
-            
             # Confronta con i LARN e determina lo stato
             vitamin_status = {}
             warnings = []
@@ -1295,5 +1562,118 @@ class NutriDB:
                 foods_not_found.append(food)
         
         all_found = len(foods_not_found) == 0
-        
+
         return all_found, foods_not_found
+
+    def suggest_foods(self, food_name, limit=5, min_score=SUGGESTION_MIN_SCORE):
+        """Suggerisce gli alimenti del database più simili a un nome sconosciuto.
+
+        Args:
+            food_name: Nome dell'alimento (anche con refusi o varianti)
+            limit: Numero massimo di suggerimenti
+            min_score: Punteggio minimo di similarità (0-1)
+
+        Returns:
+            list: [{"name": alias, "food": chiave canonica, "score": float}] ordinati per punteggio
+        """
+        return self.name_index.suggest(food_name, limit=limit, min_score=min_score)
+
+    def resolve_food_name(self, food_name):
+        """Risolve un nome di alimento nella chiave canonica, tollerando varianti e refusi.
+
+        Prova prima la ricerca intelligente degli alias (parole di preparazione comprese),
+        poi il miglior suggerimento fuzzy, accettato solo se supera AUTO_RESOLVE_SCORE
+        e stacca di almeno AUTO_RESOLVE_MARGIN il suggerimento successivo.
+
+        Args:
+            food_name: Nome dell'alimento
+
+        Returns:
+            str: Chiave canonica, o None se il nome è ambiguo o sconosciuto
+        """
+        canonical = self.resolve_food_key(food_name)
+        if canonical:
+            return canonical
+
+        suggestions = self.suggest_foods(food_name, limit=2, min_score=0.0)
+        if not suggestions or suggestions[0]["score"] < AUTO_RESOLVE_SCORE:
+            return None
+        if len(suggestions) > 1 and suggestions[0]["score"] - suggestions[1]["score"] < AUTO_RESOLVE_MARGIN:
+            return None
+        return suggestions[0]["food"]
+
+    def resolve_food_names(self, food_list):
+        """Sostituisce i nomi non presenti negli alias con la chiave canonica risolta.
+
+        I nomi già riconosciuti da check_foods_in_db restano invariati; quelli che
+        non si riescono a risolvere con sicurezza restano invariati e verranno
+        segnalati come non trovati.
+
+        Args:
+            food_list: Lista di nomi di alimenti
+
+        Returns:
+            tuple: (resolved_list, resolved_foods)
+                - resolved_list: lista con i nomi risolti, nello stesso ordine
+                - resolved_foods: dict nome originale -> chiave canonica per i nomi sostituiti
+        """
+        resolved_list = []
+        resolved_foods = {}
+        for food in food_list:
+            if food.lower().replace("_", " ") not in self.alias:
+                canonical = self.resolve_food_name(food)
+                if canonical:
+                    resolved_foods[food] = canonical
+                    food = canonical
+            resolved_list.append(food)
+        return resolved_list, resolved_foods
+
+    def get_food_suggestions(self, food_list, limit=3):
+        """Restituisce i suggerimenti per ciascun alimento non trovato.
+
+        Args:
+            food_list: Lista di nomi non trovati
+            limit: Numero massimo di suggerimenti per alimento
+
+        Returns:
+            dict: nome -> lista di chiavi canoniche suggerite
+        """
+        return {
+            food: [suggestion["food"] for suggestion in self.suggest_foods(food, limit=limit)]
+            for food in food_list
+        }
+
+
+def format_food_suggestions(suggestions):
+    """Formatta i suggerimenti per i messaggi di errore dei tool (stringa vuota se assenti)."""
+    parts = [f"{food} → {', '.join(foods)}" for food, foods in suggestions.items() if foods]
+    if not parts:
+        return ""
+    return f". Forse intendevi: {'; '.join(parts)}"
+
+
+_shared_instances = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_nutridb(path="Dati_processed"):
+    """Restituisce l'istanza NutriDB condivisa dal processo per la directory indicata.
+    
+    L'istanza viene creata alla prima richiesta a partire dallo snapshot binario
+    (ricompilato solo se cambia il contenuto dei JSON) e riutilizzata da tutti i tool.
+    
+    Args:
+        path: Directory dei dati (default "Dati_processed")
+        
+    Returns:
+        NutriDB: Istanza condivisa
+    """
+    key = os.path.abspath(path)
+    db = _shared_instances.get(key)
+    if db is None:
+        with _shared_lock:
+            db = _shared_instances.get(key)
+            if db is None:
+                db = NutriDB.from_snapshot(path)
+                _shared_instances[key] = db
+    return db
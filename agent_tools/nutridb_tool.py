@@ -1,4 +1,6 @@
-from .nutridb import NutriDB
+from .nutridb import get_shared_nutridb
+from .user_context import current_user_id
+from .user_document_cache import get_user_document
 import logging
 from typing import Dict, Any, Union, List, Optional
 import json
@@ -8,9 +10,9 @@ import os
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# Inizializza il database
+# Usa l'istanza del database condivisa dal processo
 try:
-    db = NutriDB("Dati_processed")
+    db = get_shared_nutridb("Dati_processed")
 except Exception as e:
     logger.error(f"Errore nell'inizializzazione del database: {str(e)}")
     raise
@@ -441,7 +443,8 @@ def get_LARN_vitamine(sesso: str, età: int) -> Dict[str, Any]:
 
 def get_user_id() -> str:
     """
-    Ottiene l'ID dell'utente dal session state di Streamlit o dal thread name.
+    Ottiene l'ID dell'utente impostato con user_context, dal thread name o dal
+    session state di Streamlit.
     
     Returns:
         str: ID dell'utente
@@ -453,6 +456,11 @@ def get_user_id() -> str:
     import os
     import glob
     
+    # Strategia 0: utente esplicito (tool eseguiti dal pool di ToolHandler)
+    user_id = current_user_id()
+    if user_id:
+        return user_id
+    
     # Strategia 1: Estrai dall'user_id dal nome del thread (per DeepSeek)
     import threading
     thread_name = threading.current_thread().name
@@ -510,21 +518,16 @@ def load_user_basic_data(user_id: Optional[str] = None) -> Dict[str, Any]:
         user_id = get_user_id()
     
     # Fix: Handle user_id that may already contain 'user_' prefix
-    if user_id.startswith("user_"):
-        user_file_path = f"user_data/{user_id}.json"
-    else:
-        user_file_path = f"user_data/user_{user_id}.json"
+    document_id = user_id if user_id.startswith("user_") else f"user_{user_id}"
     
     logger.info(f"🔍 DEBUG load_user_basic_data:")
     logger.info(f"   📁 User ID: {user_id}")
-    logger.info(f"   📄 File path: {user_file_path}")
+    logger.info(f"   📄 Documento: {document_id}")
     
-    if not os.path.exists(user_file_path):
+    user_data = get_user_document(document_id)
+    if user_data is None:
         raise ValueError(f"File utente {user_id} non trovato.")
     
-    with open(user_file_path, 'r', encoding='utf-8') as f:
-        user_data = json.load(f)
-    
     logger.info(f"   ✅ File caricato con successo")
     
     # Estrai i dati di base dell'utente (prova multiple sezioni)
@@ -0,0 +1,227 @@
+"""
+Cache delle soluzioni del risolutore delle porzioni.
+
+Molti utenti condividono le strutture dei pasti predefiniti e hanno target in fasce
+ristrette, quindi lo stesso problema (alimenti + target quantizzati) viene risolto
+più volte tra utenti e rigenerazioni. PortionCache memorizza le soluzioni in un LRU
+in memoria e, opzionalmente, in un database SQLite che sopravvive ai riavvii ed è
+condiviso tra processi (es. i worker di optimize_days).
+
+La chiave è l'hash del problema numerico completo (alimenti, valori nutrizionali,
+bounds, target, pesi) e dei parametri del risolutore: una modifica ai dati o ai
+vincoli produce chiavi diverse, senza bisogno di invalidazione esplicita.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# Versione del formato delle chiavi: va incrementata se cambia il significato delle soluzioni
+CACHE_FORMAT_VERSION = 1
+
+# Configurazione della cache condivisa dal processo
+PORTION_CACHE_ENABLED = os.environ.get("NUTRICOACH_PORTION_CACHE", "1") != "0"
+PORTION_CACHE_SIZE = int(os.environ.get("NUTRICOACH_PORTION_CACHE_SIZE", "4096"))
+PORTION_CACHE_PATH = os.environ.get("NUTRICOACH_PORTION_CACHE_PATH") or None
+
+
+def problem_key(kind, problem, **params):
+    """Calcola la chiave di cache di un problema.
+
+    Args:
+        kind: Tipo di soluzione (es. "continuous", "discrete", "day")
+        problem: Problema costruito da build_portion_problem o build_day_problem
+        **params: Parametri del risolutore che influenzano la soluzione (array numpy ammessi)
+
+    Returns:
+        str: digest esadecimale SHA-256
+    """
+    digest = hashlib.sha256(f"v{CACHE_FORMAT_VERSION}:{kind}:{problem['foods']!r}".encode())
+    for name in ("nutrients", "targets", "scales", "lower", "upper", "limit_matrix", "limit_values"):
+        value = problem.get(name)
+        if value is not None:
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(value, dtype=np.float64).tobytes())
+    for name in sorted(params):
+        value = params[name]
+        digest.update(name.encode())
+        if isinstance(value, np.ndarray):
+            digest.update(np.ascontiguousarray(value, dtype=np.float64).tobytes())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+class PortionCache:
+    """Cache LRU delle soluzioni (array di grammi) con livello opzionale su SQLite.
+
+    Thread-safe: il livello in memoria è protetto da un lock, il database usa una
+    connessione per thread in modalità WAL. Gli errori del livello su disco non sono
+    fatali: vengono registrati e il livello viene disattivato.
+    """
+
+    def __init__(self, maxsize=PORTION_CACHE_SIZE, path=None):
+        """
+        Args:
+            maxsize: Numero massimo di soluzioni in memoria
+            path: Percorso del database SQLite (opzionale, None = solo memoria)
+        """
+        self.maxsize = maxsize
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path:
+            try:
+                self._connection().execute(
+                    "CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, grams BLOB NOT NULL, created REAL NOT NULL)"
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Cache su disco non disponibile ({path}): {str(e)}")
+                self.path = None
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _disable_disk(self, error):
+        logger.warning(f"Errore della cache su disco, la disattivo: {str(error)}")
+        self.path = None
+
+    def get(self, key):
+        """Restituisce una copia della soluzione memorizzata, o None."""
+        with self._lock:
+            grams = self._entries.get(key)
+            if grams is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return grams.copy()
+
+        if self.path:
+            try:
+                row = self._connection().execute("SELECT grams FROM solutions WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                self._disable_disk(e)
+                row = None
+            if row is not None:
+                grams = np.frombuffer(row[0], dtype=np.float64).copy()
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store(key, grams)
+                return grams.copy()
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, grams):
+        """Memorizza una soluzione in memoria e, se configurato, su disco."""
+        grams = np.array(grams, dtype=np.float64)
+        with self._lock:
+            self._store(key, grams)
+
+        if self.path:
+            try:
+                self._connection().execute(
+                    "INSERT OR REPLACE INTO solutions (key, grams, created) VALUES (?, ?, ?)",
+                    (key, grams.tobytes(), time.time())
+                )
+            except sqlite3.Error as e:
+                self._disable_disk(e)
+
+    def _store(self, key, grams):
+        self._entries[key] = grams
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self, disk=False):
+        """Svuota la cache in memoria (e su disco se disk=True) e azzera i contatori."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = self.evictions = 0
+        if disk and self.path:
+            try:
+                self._connection().execute("DELETE FROM solutions")
+            except sqlite3.Error as e:
+                self._disable_disk(e)
+
+    def stats(self):
+        """Restituisce dimensione, contatori e hit rate della cache."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "disk_path": self.path,
+            }
+
+    def solve(self, kind, problem, solve, **params):
+        """Restituisce la soluzione memorizzata o la calcola con solve(problem) e la memorizza."""
+        key = problem_key(kind, problem, **params)
+        grams = self.get(key)
+        if grams is None:
+            grams = np.asarray(solve(problem), dtype=np.float64)
+            self.put(key, grams)
+            grams = grams.copy()
+        return grams
+
+    def solve_batch(self, kind, problems, solve_batch, **params):
+        """Come solve, ma risolve con un'unica chiamata solve_batch(problemi) solo i problemi mancanti."""
+        keys = [problem_key(kind, problem, **params) for problem in problems]
+        solutions = [self.get(key) for key in keys]
+        missing = [i for i, grams in enumerate(solutions) if grams is None]
+        if missing:
+            for i, grams in zip(missing, solve_batch([problems[i] for i in missing])):
+                grams = np.asarray(grams, dtype=np.float64)
+                self.put(keys[i], grams)
+                solutions[i] = grams.copy()
+        return solutions
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_portion_cache():
+    """Restituisce la cache condivisa dal processo, o None se disattivata (NUTRICOACH_PORTION_CACHE=0).
+
+    Dimensione e percorso su disco si configurano con NUTRICOACH_PORTION_CACHE_SIZE e
+    NUTRICOACH_PORTION_CACHE_PATH (senza percorso la cache è solo in memoria).
+    """
+    global _shared_cache
+    if not PORTION_CACHE_ENABLED:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = PortionCache(PORTION_CACHE_SIZE, PORTION_CACHE_PATH)
+        return _shared_cache
@@ -0,0 +1,633 @@
+"""
+Risolutori numerici per l'ottimizzazione delle porzioni.
+
+Il problema di optimize_portions (somma pesata degli errori relativi assoluti sui
+macronutrienti, con porzioni limitate per categoria) viene formulato come:
+
+- "lp": programma lineare esatto, in cui i valori assoluti diventano variabili di
+  scarto (HiGHS tramite scipy.optimize.linprog);
+- "lsq": minimi quadrati vincolati sugli errori relativi pesati (scipy.optimize.lsq_linear);
+- "legacy": discesa L-BFGS-B con gradienti alle differenze finite, mantenuta per confronto A/B.
+
+solve_portions_discrete ottimizza direttamente le porzioni finali sulla griglia da 10g
+(ricerca locale e branch-and-bound a partire dalla soluzione continua, con budget di nodi e di tempo).
+
+build_day_problem affianca i pasti di un giorno in un unico problema congiunto (target
+per pasto, totali giornalieri e limiti giornalieri per alimento), risolvibile con "lp"
+e con solve_portions_discrete come un problema singolo.
+"""
+
+import functools
+import itertools
+import logging
+import os
+import time
+
+import numpy as np
+from scipy.optimize import linprog, lsq_linear, minimize
+from scipy.sparse import block_diag
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# Macronutrienti del target (chiavi di target_nutrients) e relative colonne in foods_nutrition
+TARGET_KEYS = ("kcal", "proteine_g", "carboidrati_g", "grassi_g")
+NUTRITION_KEYS = ("energia_kcal", "proteine_g", "carboidrati_g", "grassi_g")
+
+# Pesi dell'errore relativo (le calorie hanno peso maggiore)
+OBJECTIVE_WEIGHTS = np.array([3.0, 2.0, 1.0, 1.0])
+
+SOLVERS = ("lp", "lsq", "legacy")
+# Backend che risolvono più problemi con un'unica chiamata (solve_portions_batch)
+BATCHED_SOLVERS = ("lp",)
+DEFAULT_SOLVER = os.environ.get("NUTRICOACH_PORTION_SOLVER", "lp")
+
+# Passo delle porzioni finali (grammi) e limiti della ricerca discreta: il numero di
+# nodi del branch-and-bound e di mosse della ricerca locale sono le uniche regole di
+# arresto, così il risultato dipende solo dal problema e non dal carico (circa 20ms).
+# Il tempo massimo (secondi, disattivato se vuoto) è solo una protezione: se scatta la
+# ricerca fallisce con DiscreteSearchTimeout e il chiamante usa il proprio ripiego.
+PORTION_STEP = 10
+DISCRETE_NODE_BUDGET = int(os.environ.get("NUTRICOACH_DISCRETE_NODE_BUDGET", "500"))
+DISCRETE_MOVE_BUDGET = int(os.environ.get("NUTRICOACH_DISCRETE_MOVE_BUDGET", "200"))
+DISCRETE_TIME_BUDGET = float(os.environ.get("NUTRICOACH_DISCRETE_TIME_BUDGET") or "inf")
+# Se disattivato (NUTRICOACH_DISCRETE_PORTIONS=0) le porzioni continue vengono solo arrotondate
+DISCRETE_PORTIONS = os.environ.get("NUTRICOACH_DISCRETE_PORTIONS", "1") != "0"
+
+# Quantizzazione dei target (kcal, proteine, carboidrati, grassi) nei problemi canonici
+TARGET_QUANTUM = np.array([1.0, 0.5, 0.5, 0.5])
+
+# Peso dell'errore sui totali giornalieri in build_day_problem, moltiplicato per il
+# numero di pasti: con 1.0 il totale del giorno conta quanto tutti i pasti insieme
+DAILY_TOTAL_WEIGHT = 1.0
+
+# Peso (relativo all'obiettivo) della distanza dal punto medio dei bounds, usato solo
+# per scegliere la soluzione più equilibrata quando il programma lineare ha più ottimi
+TIEBREAK_WEIGHT = 1e-4
+
+
+def build_portion_problem(target_nutrients, foods_nutrition, constraints):
+    """Costruisce le matrici del problema a partire dai dati per 100g e dai vincoli per categoria.
+
+    Args:
+        target_nutrients: Target di kcal, proteine_g, carboidrati_g, grassi_g
+        foods_nutrition: Dati nutrizionali per 100g di ogni alimento (con "categoria")
+        constraints: Vincoli min/max per categoria (get_portion_constraints)
+
+    Returns:
+        dict: Contiene:
+            - foods: nomi degli alimenti (ordine delle colonne)
+            - per_100g: valori per 100g originali (usati dal risolutore storico)
+            - nutrients: np.ndarray (4, n_alimenti) con i macronutrienti per grammo
+            - targets: np.ndarray (4,) con i target
+            - scales: np.ndarray (4,) pesi / max(target, 1) degli errori relativi
+            - lower, upper: np.ndarray (n_alimenti,) con i bounds in grammi
+    """
+    foods = list(foods_nutrition.keys())
+    per_100g = [tuple(foods_nutrition[food][key] for key in NUTRITION_KEYS) for food in foods]
+    nutrients = np.array(per_100g, dtype=np.float64).reshape(len(foods), len(NUTRITION_KEYS)).T / 100.0
+    targets = np.array([target_nutrients[key] for key in TARGET_KEYS], dtype=np.float64)
+
+    fallback = constraints["alimento_misto"]
+    limits = [constraints.get(foods_nutrition[food]["categoria"], fallback) for food in foods]
+
+    return {
+        "foods": foods,
+        "per_100g": per_100g,
+        "nutrients": nutrients,
+        "targets": targets,
+        "scales": OBJECTIVE_WEIGHTS / np.maximum(targets, 1.0),
+        "lower": np.array([limit["min"] for limit in limits], dtype=np.float64),
+        "upper": np.array([limit["max"] for limit in limits], dtype=np.float64),
+    }
+
+
+def portion_error(problem, grams):
+    """Errore pesato dell'obiettivo: Σ peso · |totale - target| / max(target, 1)."""
+    return float(problem["scales"] @ np.abs(problem["nutrients"] @ grams - problem["targets"]))
+
+
+def canonical_problem(problem):
+    """Restituisce la forma canonica di un problema, usata come chiave della cache delle soluzioni.
+
+    Gli alimenti vengono ordinati per nome e i target quantizzati (1 kcal, 0.5 g), così
+    problemi equivalenti di utenti diversi coincidono e la soluzione non dipende
+    dall'ordine in cui gli alimenti sono stati indicati.
+
+    Returns:
+        tuple: (problema canonico, indici delle colonne originali per restore_food_order)
+    """
+    order = np.array(sorted(range(len(problem["foods"])), key=lambda i: problem["foods"][i]), dtype=int)
+    targets = np.round(problem["targets"] / TARGET_QUANTUM) * TARGET_QUANTUM
+    canonical = dict(
+        problem,
+        foods=[problem["foods"][i] for i in order],
+        nutrients=problem["nutrients"][:, order],
+        targets=targets,
+        scales=OBJECTIVE_WEIGHTS / np.maximum(targets, 1.0),
+        lower=problem["lower"][order],
+        upper=problem["upper"][order],
+    )
+    if "per_100g" in problem:
+        canonical["per_100g"] = [problem["per_100g"][i] for i in order]
+    return canonical, order
+
+
+def restore_food_order(grams, order):
+    """Riporta i grammi di un problema canonico nell'ordine degli alimenti originale."""
+    restored = np.empty(len(order))
+    restored[order] = grams
+    return restored
+
+
+def build_day_problem(meal_problems, daily_weight=DAILY_TOTAL_WEIGHT, food_limits=None):
+    """Affianca i problemi dei pasti di un giorno in un unico problema congiunto.
+
+    Le righe dei nutrienti sono quelle di ogni pasto (a blocchi) più quattro righe per
+    i totali del giorno, con target pari alla somma dei target dei pasti: così piccoli
+    errori dello stesso segno nei singoli pasti non si sommano in un errore giornaliero.
+    I limiti giornalieri per alimento valgono sulla somma delle porzioni dello stesso
+    alimento in tutti i pasti.
+
+    Args:
+        meal_problems: Problemi dei pasti costruiti da build_portion_problem
+        daily_weight: Peso dell'errore relativo sui totali giornalieri (moltiplicato per il numero di pasti)
+        food_limits: dict alimento -> grammi massimi al giorno (opzionale)
+
+    Returns:
+        dict: Stesse chiavi di build_portion_problem (tranne per_100g), con foods come
+              coppie (indice pasto, alimento), più:
+            - meal_slices: colonne di ogni pasto
+            - limit_matrix, limit_values: vincoli L x <= l dei limiti giornalieri (o None)
+    """
+    foods = [(index, food) for index, problem in enumerate(meal_problems) for food in problem["foods"]]
+    meal_nutrients = [problem["nutrients"] for problem in meal_problems]
+    daily_targets = np.sum([problem["targets"] for problem in meal_problems], axis=0)
+
+    meal_slices = []
+    offset = 0
+    for problem in meal_problems:
+        meal_slices.append(slice(offset, offset + len(problem["foods"])))
+        offset += len(problem["foods"])
+
+    nutrients = np.vstack([block_diag(meal_nutrients).toarray(), np.hstack(meal_nutrients)])
+    daily_scales = daily_weight * len(meal_problems) * OBJECTIVE_WEIGHTS / np.maximum(daily_targets, 1.0)
+
+    limit_matrix = limit_values = None
+    limited = [food for food in (food_limits or {}) if any(name == food for _, name in foods)]
+    if limited:
+        limit_matrix = np.array([[1.0 if name == food else 0.0 for _, name in foods] for food in limited])
+        limit_values = np.array([float(food_limits[food]) for food in limited])
+
+    return {
+        "foods": foods,
+        "nutrients": nutrients,
+        "targets": np.concatenate([problem["targets"] for problem in meal_problems] + [daily_targets]),
+        "scales": np.concatenate([problem["scales"] for problem in meal_problems] + [daily_scales]),
+        "lower": np.concatenate([problem["lower"] for problem in meal_problems]),
+        "upper": np.concatenate([problem["upper"] for problem in meal_problems]),
+        "meal_slices": meal_slices,
+        "limit_matrix": limit_matrix,
+        "limit_values": limit_values,
+    }
+
+
+def split_day_solution(day_problem, grams):
+    """Divide i grammi della soluzione congiunta tra i pasti, nell'ordine di build_day_problem."""
+    return [grams[meal_slice] for meal_slice in day_problem["meal_slices"]]
+
+
+def _lp_program(problem):
+    """Costruisce costi, vincoli e bounds del programma lineare di un singolo problema.
+
+    Variabili: grammi x (n), scarti e (4) con e >= |A x - t|, e distanze d (n) dal punto
+    medio dei bounds, penalizzate con TIEBREAK_WEIGHT per rendere la soluzione unica.
+    Se il problema ha limiti condivisi (build_day_problem) vengono aggiunti come vincoli.
+    """
+    nutrients, targets = problem["nutrients"], problem["targets"]
+    lower, upper = problem["lower"], problem["upper"]
+    n_nutrients, n_foods = nutrients.shape
+    midpoint = (lower + upper) / 2
+    spans = np.maximum(upper - lower, 1.0)
+
+    # A x - e <= t, -A x - e <= -t, x - d <= mid, -x - d <= -mid
+    a_ub = np.zeros((2 * (n_nutrients + n_foods), 2 * n_foods + n_nutrients))
+    slack = slice(n_foods, n_foods + n_nutrients)
+    distance = slice(n_foods + n_nutrients, None)
+    identity_n = np.eye(n_nutrients)
+    identity_f = np.eye(n_foods)
+    a_ub[:n_nutrients, :n_foods] = nutrients
+    a_ub[n_nutrients:2 * n_nutrients, :n_foods] = -nutrients
+    a_ub[:2 * n_nutrients, slack] = np.vstack([-identity_n, -identity_n])
+    a_ub[2 * n_nutrients:, :n_foods] = np.vstack([identity_f, -identity_f])
+    a_ub[2 * n_nutrients:, distance] = np.vstack([-identity_f, -identity_f])
+
+    b_ub = np.concatenate([targets, -targets, midpoint, -midpoint])
+    if problem.get("limit_matrix") is not None:
+        # Limiti condivisi sulle somme di porzioni: L x <= l
+        limit_rows = np.zeros((len(problem["limit_values"]), a_ub.shape[1]))
+        limit_rows[:, :n_foods] = problem["limit_matrix"]
+        a_ub = np.vstack([a_ub, limit_rows])
+        b_ub = np.concatenate([b_ub, problem["limit_values"]])
+    cost = np.concatenate([np.zeros(n_foods), problem["scales"], TIEBREAK_WEIGHT / spans])
+    n_free = n_nutrients + n_foods
+    bounds = np.column_stack([
+        np.concatenate([lower, np.zeros(n_free)]),
+        np.concatenate([upper, np.full(n_free, np.inf)])
+    ])
+    return cost, a_ub, b_ub, bounds
+
+
+def solve_lp_batch(problems):
+    """Risolve più problemi indipendenti con un'unica chiamata al solver lineare.
+
+    I programmi vengono affiancati in un unico LP a blocchi diagonali: l'obiettivo è
+    la somma di obiettivi che non condividono variabili, quindi l'ottimo del problema
+    complessivo coincide con l'ottimo di ciascun blocco.
+
+    Returns:
+        list: grammi ottimali per ogni problema, nello stesso ordine
+
+    Raises:
+        RuntimeError: se il solver non trova una soluzione
+    """
+    programs = [_lp_program(problem) for problem in problems]
+    if len(programs) == 1:
+        a_ub = programs[0][1]
+    else:
+        a_ub = block_diag([program[1] for program in programs], format="csr")
+    result = linprog(
+        np.concatenate([program[0] for program in programs]),
+        A_ub=a_ub,
+        b_ub=np.concatenate([program[2] for program in programs]),
+        bounds=np.vstack([program[3] for program in programs]),
+        method="highs"
+    )
+    if result.status != 0:
+        raise RuntimeError(f"Programma lineare non risolto: {result.message}")
+
+    solutions = []
+    offset = 0
+    for problem, program in zip(problems, programs):
+        n_foods = len(problem["foods"])
+        solutions.append(np.clip(result.x[offset:offset + n_foods], problem["lower"], problem["upper"]))
+        offset += len(program[0])
+    return solutions
+
+
+def solve_lp(problem):
+    """Risolve il problema come programma lineare con variabili di scarto per i valori assoluti."""
+    return solve_lp_batch([problem])[0]
+
+
+def solve_lsq(problem):
+    """Risolve il problema come minimi quadrati vincolati sugli errori relativi pesati."""
+    lower, upper = problem["lower"], problem["upper"]
+    weighted = problem["nutrients"] * problem["scales"][:, None]
+    grams = lower.copy()
+
+    # lsq_linear richiede bounds non degeneri: le porzioni fisse (min == max) vanno nel termine noto
+    free = upper > lower
+    if free.any():
+        residual_target = problem["targets"] * problem["scales"] - weighted[:, ~free] @ lower[~free]
+        result = lsq_linear(weighted[:, free], residual_target, bounds=(lower[free], upper[free]), method="bvls")
+        grams[free] = result.x
+    return np.clip(grams, lower, upper)
+
+
+def solve_legacy(problem):
+    """Risolutore storico: L-BFGS-B sull'obiettivo non liscio partendo dal punto medio."""
+    lower, upper = problem["lower"], problem["upper"]
+    initial_guess = (lower + upper) / 2
+
+    per_100g = problem["per_100g"]
+    targets = problem["targets"].tolist()
+
+    # Obiettivo calcolato come nella versione storica, per risultati identici nel confronto A/B
+    def objective(portions):
+        totals = [sum(row[k] * portions[i] / 100 for i, row in enumerate(per_100g)) for k in range(len(targets))]
+        errors = [abs(total - target) / max(target, 1) for total, target in zip(totals, targets)]
+        return 3 * errors[0] + 2 * errors[1] + errors[2] + errors[3]
+
+    try:
+        result = minimize(
+            objective,
+            initial_guess,
+            method='L-BFGS-B',
+            bounds=list(zip(lower, upper)),
+            options={'maxiter': 1000}
+        )
+
+        if result.success:
+            logger.info("Ottimizzazione convergente completata")
+            return result.x
+
+        # Anche se non converge, confronta il risultato parziale con i valori iniziali
+        if getattr(result, 'x', None) is not None:
+            partial_error = objective(result.x)
+            initial_error = objective(initial_guess)
+            if partial_error < initial_error:
+                logger.warning(f"Ottimizzazione non convergente, ma uso miglior risultato parziale (errore: {partial_error:.3f} vs iniziale: {initial_error:.3f})")
+                return result.x
+            logger.warning(f"Ottimizzazione non convergente, uso valori iniziali (errore iniziale: {initial_error:.3f} vs parziale: {partial_error:.3f})")
+        else:
+            logger.warning("Ottimizzazione non convergente senza risultato parziale, uso valori iniziali")
+    except Exception as e:
+        logger.error(f"Errore nell'ottimizzazione: {str(e)}")
+
+    return initial_guess
+
+
+_SOLVER_FUNCTIONS = {
+    "lp": solve_lp,
+    "lsq": solve_lsq,
+    "legacy": solve_legacy,
+}
+
+
+def solve_portions(problem, solver=None):
+    """Risolve il problema con il backend indicato.
+
+    Args:
+        problem: Problema costruito da build_portion_problem
+        solver: "lp", "lsq" o "legacy" (default DEFAULT_SOLVER, impostabile con
+                la variabile d'ambiente NUTRICOACH_PORTION_SOLVER)
+
+    Returns:
+        np.ndarray: grammi per alimento, nell'ordine di problem["foods"]
+
+    Raises:
+        ValueError: se il solver non è supportato
+    """
+    solver = solver or DEFAULT_SOLVER
+    if solver not in _SOLVER_FUNCTIONS:
+        raise ValueError(f"Solver non supportato: {solver}. Valori ammessi: {', '.join(SOLVERS)}")
+
+    if solver == "legacy":
+        return solve_legacy(problem)
+
+    try:
+        return _SOLVER_FUNCTIONS[solver](problem)
+    except Exception as e:
+        # Il risolutore storico resta disponibile come rete di sicurezza
+        logger.error(f"Errore nel solver '{solver}', uso il risolutore storico: {str(e)}")
+        return solve_legacy(problem)
+
+
+def solve_portions_batch(problems, solver=None):
+    """Risolve un insieme di problemi indipendenti.
+
+    Con il backend "lp" tutti i problemi vengono risolti con un'unica chiamata al solver
+    (vedi solve_lp_batch); con gli altri backend vengono risolti uno alla volta.
+
+    Args:
+        problems: Lista di problemi costruiti da build_portion_problem
+        solver: Backend come in solve_portions
+
+    Returns:
+        list: grammi per alimento di ogni problema, nello stesso ordine
+    """
+    solver = solver or DEFAULT_SOLVER
+    if solver in BATCHED_SOLVERS and len(problems) > 1:
+        try:
+            return solve_lp_batch(problems)
+        except Exception as e:
+            logger.error(f"Errore nella risoluzione a blocchi, risolvo i problemi singolarmente: {str(e)}")
+    return [solve_portions(problem, solver) for problem in problems]
+
+
+def round_to_step(grams, step=PORTION_STEP):
+    """Arrotonda i grammi al multiplo di step più vicino (metà per eccesso), come l'arrotondamento storico."""
+    return step * np.floor(np.asarray(grams, dtype=np.float64) / step + 0.5)
+
+
+def fix_portions(problem, fixed_grams):
+    """Restituisce una copia del problema con le porzioni indicate bloccate al valore dato.
+
+    Args:
+        problem: Problema costruito da build_portion_problem
+        fixed_grams: dict alimento -> grammi fissi (gli alimenti non presenti vengono ignorati)
+    """
+    lower, upper = problem["lower"].copy(), problem["upper"].copy()
+    for i, food in enumerate(problem["foods"]):
+        if food in fixed_grams:
+            lower[i] = upper[i] = float(fixed_grams[food])
+    return dict(problem, lower=lower, upper=upper)
+
+
+@functools.lru_cache(maxsize=16)
+def _grid_moves(n_foods):
+    """Mosse della ricerca locale: ±1 passo su un alimento o su due alimenti insieme."""
+    moves = []
+    for i in range(n_foods):
+        for delta in (-1, 1):
+            move = np.zeros(n_foods)
+            move[i] = delta
+            moves.append(move)
+    for i, j in itertools.combinations(range(n_foods), 2):
+        for delta_i in (-1, 1):
+            for delta_j in (-1, 1):
+                move = np.zeros(n_foods)
+                move[i], move[j] = delta_i, delta_j
+                moves.append(move)
+    moves = np.array(moves).reshape(-1, n_foods)
+    moves.setflags(write=False)
+    return moves
+
+
+def _repair_limits(steps, lower, limit_matrix, limit_values):
+    """Riduce le porzioni più grandi finché i limiti condivisi sono rispettati (se possibile)."""
+    steps = steps.copy()
+    while True:
+        excess = limit_matrix @ steps - limit_values
+        violated = np.flatnonzero(excess > 1e-9)
+        if not len(violated):
+            return steps
+        reducible = (limit_matrix[violated[0]] > 0) & (steps > lower)
+        if not reducible.any():
+            return steps
+        index = np.flatnonzero(reducible)[np.argmax(steps[reducible])]
+        steps[index] -= 1
+
+
+class DiscreteSearchTimeout(RuntimeError):
+    """La ricerca discreta ha superato il tempo massimo di protezione (DISCRETE_TIME_BUDGET)."""
+
+
+def _check_deadline(deadline):
+    if time.perf_counter() > deadline:
+        raise DiscreteSearchTimeout("Tempo massimo della ricerca discreta superato")
+
+
+def _local_search(nutrients, targets, scales, lower, upper, start, deadline,
+                  limit_matrix=None, limit_values=None, move_budget=DISCRETE_MOVE_BUDGET):
+    """Discesa sulla griglia: applica la mossa migliore finché l'errore diminuisce (al più move_budget mosse)."""
+    current = start
+    error = scales @ np.abs(nutrients @ current - targets)
+    if limit_matrix is not None and np.any(limit_matrix @ current > limit_values + 1e-9):
+        error = np.inf
+    moves = _grid_moves(len(start))
+
+    for _ in range(move_budget):
+        _check_deadline(deadline)
+        candidates = current + moves
+        feasible = np.all((candidates >= lower) & (candidates <= upper), axis=1)
+        if limit_matrix is not None:
+            feasible &= np.all(candidates @ limit_matrix.T <= limit_values + 1e-9, axis=1)
+        candidates = candidates[feasible]
+        if not len(candidates):
+            break
+        errors = np.abs(candidates @ nutrients.T - targets) @ scales
+        best = np.argmin(errors)
+        if errors[best] >= error - 1e-12:
+            break
+        current, error = candidates[best], errors[best]
+    return current, error
+
+
+def _branch_and_bound(nutrients, targets, scales, lower, upper, relaxed, incumbent, incumbent_error, deadline,
+                      limit_matrix=None, limit_values=None, node_budget=None):
+    """Ricerca esatta in profondità sui passi di ogni alimento, entro il budget di nodi.
+
+    Il bound di un ramo somma, per ogni nutriente, la distanza minima del target dai
+    valori raggiungibili con gli alimenti non ancora assegnati (tutti i nutrienti sono
+    non negativi, quindi l'intervallo raggiungibile è [Σ a·min, Σ a·max]). I valori di
+    ogni alimento vengono provati a partire dal più vicino alla soluzione continua.
+    Con limiti condivisi vengono scartati i valori che, anche con gli alimenti restanti
+    al minimo, li supererebbero.
+
+    Returns:
+        tuple: (passi migliori, errore, True se la ricerca è stata completata)
+
+    Raises:
+        DiscreteSearchTimeout: Se la scadenza di protezione viene superata
+    """
+    n_foods = len(lower)
+    # Prima gli alimenti con l'impatto maggiore sull'errore, per potare presto
+    order = np.argsort(-(scales @ (nutrients * (upper - lower))))
+    nutrients, lower, upper, relaxed = nutrients[:, order], lower[order], upper[order], relaxed[order]
+    if limit_matrix is None:
+        limit_matrix, limit_values = np.zeros((0, n_foods)), np.zeros(0)
+    limit_matrix = limit_matrix[:, order]
+
+    # Intervalli raggiungibili con gli alimenti da depth in poi
+    reach_min = np.zeros((n_foods + 1, len(targets)))
+    reach_max = np.zeros((n_foods + 1, len(targets)))
+    limit_min = np.zeros((n_foods + 1, len(limit_values)))
+    for depth in range(n_foods - 1, -1, -1):
+        reach_min[depth] = reach_min[depth + 1] + nutrients[:, depth] * lower[depth]
+        reach_max[depth] = reach_max[depth + 1] + nutrients[:, depth] * upper[depth]
+        limit_min[depth] = limit_min[depth + 1] + limit_matrix[:, depth] * lower[depth]
+
+    best = {"steps": incumbent[order], "error": incumbent_error, "nodes": 0}
+    assignment = np.zeros(n_foods)
+
+    def search(depth, partial, used):
+        best["nodes"] += 1
+        if node_budget is not None and best["nodes"] > node_budget:
+            return False
+        _check_deadline(deadline)
+        values = np.arange(lower[depth], upper[depth] + 1)
+        totals = partial + values[:, None] * nutrients[:, depth]
+        gaps = targets - totals
+        distances = np.maximum(0, np.maximum(reach_min[depth + 1] - gaps, gaps - reach_max[depth + 1]))
+        bounds = distances @ scales
+        usages = used + values[:, None] * limit_matrix[:, depth]
+        bounds[np.any(usages + limit_min[depth + 1] > limit_values + 1e-9, axis=1)] = np.inf
+
+        if depth == n_foods - 1:
+            # All'ultimo livello il bound coincide con l'errore esatto
+            index = np.argmin(bounds)
+            if bounds[index] < best["error"] - 1e-12:
+                assignment[depth] = values[index]
+                best["steps"], best["error"] = assignment.copy(), bounds[index]
+            return True
+
+        for index in np.argsort(np.abs(values - relaxed[depth])):
+            if bounds[index] >= best["error"] - 1e-12:
+                continue
+            assignment[depth] = values[index]
+            if not search(depth + 1, totals[index], usages[index]):
+                return False
+        return True
+
+    complete = search(0, np.zeros(len(targets)), np.zeros(len(limit_values)))
+    steps = np.empty(n_foods)
+    steps[order] = best["steps"]
+    return steps, best["error"], complete
+
+
+def solve_portions_discrete(problem, step=PORTION_STEP, fixed_grams=None, relaxation=None,
+                            time_budget=None, node_budget=None, move_budget=None):
+    """Ottimizza le porzioni direttamente su multipli di step grammi.
+
+    Parte dall'arrotondamento della soluzione continua (rilassamento), lo migliora con
+    una ricerca locale sulla griglia (al più move_budget mosse) e poi con un
+    branch-and-bound che termina dopo node_budget nodi restituendo la migliore
+    soluzione trovata: il risultato dipende solo dal problema. I bounds di
+    categoria vengono arrotondati alla griglia come faceva l'arrotondamento storico,
+    quindi il risultato non è mai peggiore del semplice arrotondamento (se il problema
+    ha limiti condivisi, l'arrotondamento viene prima ridotto fino a rispettarli).
+
+    Args:
+        problem: Problema costruito da build_portion_problem o build_day_problem
+        step: Passo della griglia in grammi
+        fixed_grams: dict alimento -> grammi fissi, anche non multipli di step (opzionale)
+        relaxation: Soluzione continua già calcolata (opzionale, altrimenti risolta con "lp")
+        time_budget: Tempo massimo di protezione in secondi (default DISCRETE_TIME_BUDGET)
+        node_budget: Numero massimo di nodi del branch-and-bound (default DISCRETE_NODE_BUDGET)
+        move_budget: Numero massimo di mosse della ricerca locale (default DISCRETE_MOVE_BUDGET)
+
+    Returns:
+        np.ndarray: grammi per alimento, nell'ordine di problem["foods"]
+
+    Raises:
+        DiscreteSearchTimeout: Se la ricerca supera time_budget (nessun risultato parziale)
+    """
+    time_budget = DISCRETE_TIME_BUDGET if time_budget is None else time_budget
+    deadline = time.perf_counter() + time_budget
+    node_budget = DISCRETE_NODE_BUDGET if node_budget is None else node_budget
+    move_budget = DISCRETE_MOVE_BUDGET if move_budget is None else move_budget
+    fixed_grams = fixed_grams or {}
+    if fixed_grams:
+        problem = fix_portions(problem, fixed_grams)
+    fixed = np.array([food in fixed_grams for food in problem["foods"]], dtype=bool)
+    free = ~fixed
+
+    grams = problem["lower"].copy()
+    if not free.any():
+        return grams
+
+    if relaxation is None:
+        relaxation = solve_portions(problem, "lp")
+
+    # Le porzioni fisse entrano nel termine noto; si cercano solo i passi degli alimenti liberi
+    nutrients = problem["nutrients"][:, free] * step
+    targets = problem["targets"] - problem["nutrients"][:, fixed] @ grams[fixed]
+    scales = problem["scales"]
+    lower = np.floor(problem["lower"][free] / step + 0.5)
+    upper = np.floor(problem["upper"][free] / step + 0.5)
+    relaxed = np.asarray(relaxation, dtype=np.float64)[free] / step
+    start = np.clip(np.floor(relaxed + 0.5), lower, upper)
+
+    limit_matrix = limit_values = None
+    if problem.get("limit_matrix") is not None:
+        limit_matrix = problem["limit_matrix"][:, free] * step
+        limit_values = problem["limit_values"] - problem["limit_matrix"][:, fixed] @ grams[fixed]
+        start = _repair_limits(start, lower, limit_matrix, limit_values)
+
+    try:
+        steps, error = _local_search(nutrients, targets, scales, lower, upper, start, deadline,
+                                     limit_matrix, limit_values, move_budget)
+        steps, error, complete = _branch_and_bound(nutrients, targets, scales, lower, upper, relaxed, steps, error,
+                                                   deadline, limit_matrix, limit_values, node_budget)
+    except DiscreteSearchTimeout:
+        logger.warning(f"Ricerca discreta interrotta dal tempo massimo ({time_budget:g}s) "
+                       f"con {len(start)} alimenti: il risultato dipenderebbe dal carico, uso il ripiego del chiamante")
+        raise
+    if not complete:
+        logger.info("Ricerca discreta interrotta dal budget di nodi, uso la migliore soluzione trovata")
+
+    grams[free] = steps * step
+    return grams
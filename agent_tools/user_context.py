@@ -0,0 +1,35 @@
+"""
+Utente per cui vengono eseguiti i tool dell'agente.
+
+I tool ricavavano l'utente dal session state di Streamlit o dal nome del thread
+(estrazione DeepSeek), informazioni non disponibili nei thread del pool che
+esegue in parallelo le chiamate ai tool. user_context imposta esplicitamente
+l'utente per il codice eseguito al suo interno (ContextVar: ogni thread e ogni
+contesto asincrono vede il proprio valore); get_user_id lo consulta per primo.
+"""
+
+import contextvars
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+_current_user_id: contextvars.ContextVar = contextvars.ContextVar("nutricoach_user_id", default=None)
+
+
+@contextmanager
+def user_context(user_id: Optional[str]) -> Iterator[None]:
+    """
+    Esegue il blocco con user_id come utente corrente.
+
+    Args:
+        user_id: ID dell'utente (None: nessun utente esplicito)
+    """
+    token = _current_user_id.set(user_id)
+    try:
+        yield
+    finally:
+        _current_user_id.reset(token)
+
+
+def current_user_id() -> Optional[str]:
+    """Restituisce l'utente impostato con user_context, o None."""
+    return _current_user_id.get()
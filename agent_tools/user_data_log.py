@@ -0,0 +1,296 @@
+"""
+Log append-only della chat e delle domande/risposte dell'agente.
+
+Ogni messaggio della chat, domanda/risposta dell'agente o interazione viene
+aggiunto come una riga JSON in user_data/<user_id>.log.jsonl, invece di
+riscrivere (e sincronizzare) l'intero documento utente: il costo per messaggio
+è costante. Periodicamente il log viene compattato nel documento principale.
+
+Ogni record ha un numero di sequenza crescente; il documento compattato salva in
+"log_seq" l'ultimo record incluso, così i record già compattati vengono ignorati
+anche se il log non è stato ancora rimosso (es. interruzione durante la compattazione).
+Chi legge il documento deve usare load_user_document per vedere la vista unificata.
+
+Append e compattazione avvengono sotto il lock per utente di atomic_files (tra
+thread e processi) e il documento compattato viene sostituito atomicamente: più
+processi possono scrivere lo stesso utente senza perdere né duplicare record.
+"""
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from .atomic_files import file_lock, lock_path
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+LOG_SUFFIX = ".log.jsonl"
+
+# Politica di compattazione: si compatta quando i record in attesa sono almeno
+# COMPACT_MIN_RECORDS e almeno COMPACT_RATIO volte le voci già compattate, così il
+# costo della riscrittura del documento resta costante in media per messaggio.
+COMPACT_MIN_RECORDS = int(os.environ.get("NUTRICOACH_USER_LOG_COMPACT_MIN", "32"))
+COMPACT_RATIO = float(os.environ.get("NUTRICOACH_USER_LOG_COMPACT_RATIO", "0.5"))
+
+
+def compaction_due(pending, compacted_size):
+    """Politica di compattazione: costo della riscrittura costante in media per record.
+
+    Args:
+        pending: Record aggiunti dall'ultima compattazione
+        compacted_size: Voci già presenti nel documento compattato
+
+    Returns:
+        bool: True se conviene compattare
+    """
+    return pending >= max(COMPACT_MIN_RECORDS, COMPACT_RATIO * compacted_size)
+
+
+def log_path(data_dir, user_id):
+    """Percorso del log di un utente."""
+    return Path(data_dir) / f"{user_id}{LOG_SUFFIX}"
+
+
+def read_log_records(path):
+    """Legge i record di un log, ignorando le righe incomplete o non valide.
+
+    Args:
+        path: Percorso del file di log
+
+    Returns:
+        list: Record nell'ordine di scrittura (lista vuota se il log non esiste)
+    """
+    records = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Tipicamente l'ultima riga di una scrittura interrotta
+                    logger.warning(f"Riga non valida ignorata nel log {path}")
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def apply_log_records(data, records):
+    """Applica i record del log a un documento utente (in place).
+
+    I record con sequenza non superiore a data["log_seq"] sono già inclusi nel
+    documento e vengono ignorati; al termine "log_seq" indica l'ultimo record applicato.
+
+    Args:
+        data: Documento utente (dict caricato da <user_id>.json)
+        records: Record letti dal log
+
+    Returns:
+        dict: Lo stesso documento, aggiornato
+    """
+    applied_seq = data.get("log_seq", 0)
+    for record in records:
+        seq = record.get("seq", 0)
+        if seq <= applied_seq:
+            continue
+        record_type = record.get("type")
+        if record_type == "chat":
+            data.setdefault("chat_history", []).append({
+                "role": record["role"],
+                "content": record["content"],
+                "timestamp": record["timestamp"]
+            })
+        elif record_type == "qa":
+            if data.get("nutritional_info"):
+                data["nutritional_info"].setdefault("agent_qa", []).append({
+                    "question": record["question"],
+                    "answer": record["answer"],
+                    "timestamp": record["timestamp"]
+                })
+        elif record_type == "interaction":
+            data["interazioni"] = data.get("interazioni", 0) + 1
+        else:
+            logger.warning(f"Tipo di record sconosciuto nel log: {record_type}")
+        applied_seq = seq
+    if records:
+        data["log_seq"] = applied_seq
+    return data
+
+
+def load_user_document(user_id, data_dir="user_data"):
+    """Carica il documento di un utente unito ai record non ancora compattati.
+
+    Args:
+        user_id: ID dell'utente
+        data_dir: Directory dei dati utente
+
+    Returns:
+        dict: Documento unificato, o None se non esistono né documento né log
+    """
+    user_file = Path(data_dir) / f"{user_id}.json"
+    # Il log va letto prima del documento: se nel frattempo una compattazione sostituisce
+    # il documento, i record già letti vengono ignorati grazie a "log_seq"
+    records = read_log_records(log_path(data_dir, user_id))
+    if user_file.exists():
+        with open(user_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    elif records:
+        data = {}
+    else:
+        return None
+    return apply_log_records(data, records)
+
+
+class UserDataLog:
+    """Log append-only per utente, con compattazione nel documento principale.
+
+    Thread-safe e multi-processo: append e compattazione sono serializzati dal lock
+    per utente, così nessun record viene aggiunto tra la scrittura del documento e la
+    rimozione del log. Sequenza e record in attesa sono tenuti in memoria e riletti
+    dal disco quando un altro processo ha modificato documento o log.
+    """
+
+    def __init__(self, data_dir="user_data"):
+        """
+        Args:
+            data_dir: Directory dei dati utente
+        """
+        self.data_dir = Path(data_dir)
+        self._lock = threading.RLock()
+        self._last_seq = {}
+        self._pending = {}
+        # Stato dei file dopo l'ultima operazione di questo processo, per utente
+        self._file_states = {}
+
+    def _file_state(self, user_id):
+        """Identità e dimensione di documento e log (cambiano a ogni scrittura)."""
+        state = []
+        for path in (self.data_dir / f"{user_id}.json", log_path(self.data_dir, user_id)):
+            try:
+                stat = path.stat()
+                state.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    @contextmanager
+    def locked(self, user_id):
+        """Lock esclusivo sui file dell'utente (tra thread e processi), con stato aggiornato."""
+        with self._lock, file_lock(lock_path(self.data_dir, user_id)):
+            if user_id in self._last_seq and self._file_states.get(user_id) != self._file_state(user_id):
+                # Un altro processo ha scritto documento o log: si rilegge lo stato
+                del self._last_seq[user_id]
+            self._init_user(user_id)
+            try:
+                yield
+            finally:
+                self._file_states[user_id] = self._file_state(user_id)
+
+    def _init_user(self, user_id):
+        """Recupera ultima sequenza e record in attesa dal documento e dal log esistenti."""
+        if user_id in self._last_seq:
+            return
+        last_seq = 0
+        user_file = self.data_dir / f"{user_id}.json"
+        if user_file.exists():
+            try:
+                with open(user_file, 'r', encoding='utf-8') as f:
+                    last_seq = json.load(f).get("log_seq", 0)
+            except (json.JSONDecodeError, OSError) as e:
+                logger.warning(f"Impossibile leggere log_seq per {user_id}: {str(e)}")
+        pending = [r for r in read_log_records(log_path(self.data_dir, user_id)) if r.get("seq", 0) > last_seq]
+        if pending:
+            last_seq = pending[-1]["seq"]
+        self._last_seq[user_id] = last_seq
+        self._pending[user_id] = len(pending)
+
+    def append(self, user_id, record_type, **fields):
+        """Aggiunge un record al log dell'utente.
+
+        Args:
+            user_id: ID dell'utente
+            record_type: "chat", "qa" o "interaction"
+            **fields: Campi del record (es. role, content, timestamp)
+
+        Returns:
+            int: Numero di record in attesa di compattazione
+        """
+        return self.append_many(user_id, [(record_type, fields)])
+
+    def append_many(self, user_id, records):
+        """Aggiunge più record al log dell'utente con un'unica scrittura.
+
+        Args:
+            user_id: ID dell'utente
+            records: Coppie (record_type, campi) nell'ordine in cui applicarle
+
+        Returns:
+            int: Numero di record in attesa di compattazione
+        """
+        with self.locked(user_id):
+            seq = self._last_seq[user_id]
+            lines = []
+            for record_type, fields in records:
+                seq += 1
+                lines.append(json.dumps({"seq": seq, "type": record_type, **fields}, ensure_ascii=False) + "\n")
+            if lines:
+                with open(log_path(self.data_dir, user_id), 'a', encoding='utf-8') as f:
+                    f.write("".join(lines))
+            self._last_seq[user_id] = seq
+            self._pending[user_id] += len(lines)
+            return self._pending[user_id]
+
+    def pending(self, user_id):
+        """Numero di record dell'utente non ancora compattati."""
+        with self._lock:
+            self._init_user(user_id)
+            return self._pending[user_id]
+
+    def should_compact(self, user_id, compacted_size):
+        """Indica se è il momento di compattare il log.
+
+        Args:
+            user_id: ID dell'utente
+            compacted_size: Numero di voci (chat + QA) già presenti nel documento
+
+        Returns:
+            bool: True se i record in attesa giustificano la riscrittura del documento
+        """
+        return compaction_due(self.pending(user_id), compacted_size)
+
+    def compact(self, user_id, write_document, upto=None):
+        """Scrive il documento compattato e rimuove il log.
+
+        Args:
+            user_id: ID dell'utente
+            write_document: Funzione che riceve l'ultima sequenza inclusa e scrive il
+                documento completo (con "log_seq" uguale a quella sequenza)
+            upto: Ultima sequenza già inclusa nel documento (default: tutte). Se il
+                documento è meno recente del log, i record successivi restano nel log.
+        """
+        with self.locked(user_id):
+            last_seq = self._last_seq[user_id]
+            included = last_seq if upto is None else min(upto, last_seq)
+            write_document(included)
+            if included < last_seq:
+                records = read_log_records(log_path(self.data_dir, user_id))
+                self._pending[user_id] = sum(1 for r in records if r.get("seq", 0) > included)
+                return
+            try:
+                log_path(self.data_dir, user_id).unlink()
+            except FileNotFoundError:
+                pass
+            self._pending[user_id] = 0
+
+    def last_seq(self, user_id):
+        """Ultima sequenza assegnata per l'utente."""
+        with self._lock:
+            self._init_user(user_id)
+            return self._last_seq[user_id]
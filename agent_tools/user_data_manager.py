@@ -1,6 +1,9 @@
 import json
+import os
 import time
 import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import Dict, List, Set, Union, Optional, Tuple, Any
 from dataclasses import dataclass, asdict
@@ -14,10 +17,21 @@ except ImportError:
     def auto_sync_user_data(user_id: str, user_data: Dict[str, Any]) -> None:
         pass
 
+from .user_directory import UserDirectory, user_record
+from .user_storage import UserStorage, get_user_storage
+from .user_write_buffer import USER_FLUSH_INTERVAL_MS, WriteBehindUserStorage, get_write_behind_storage
+
 # Configurazione logging
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Memoria massima (MB, stima in byte JSON) per lo stato in memoria degli utenti caricati
+USER_STATE_CACHE_MB = float(os.environ.get("NUTRICOACH_USER_STATE_CACHE_MB", "64"))
+# Intervallo minimo tra due download della lista utenti da Supabase (utente non trovato)
+SUPABASE_USERS_REFRESH_SECONDS = 30
+# Stima minima per un utente caricato senza dati
+EMPTY_USER_STATE_BYTES = 256
+
 @dataclass
 class User:
     username: str
@@ -25,6 +39,7 @@ class User:
     password_hash: str
     user_id: str
     created_at: float
+    google_id: Optional[str] = None
 
 @dataclass
 class UserPreferences:
@@ -77,17 +92,52 @@ class UserNutritionalInfo:
             self.agent_qa = []  # Initialize empty list if None
 
 class UserDataManager:
-    def __init__(self, data_dir: str = "user_data"):
+    """Gestore di utenti e dati utente, condiviso dal processo (vedi get_user_data_manager).
+
+    Lo stato in memoria di un utente (preferenze, chat, informazioni nutrizionali) viene
+    caricato al primo accesso e rimosso in ordine LRU quando la stima della memoria
+    occupata supera max_state_bytes, e viene ricaricato quando la versione del documento
+    nel backend cambia (scritture di altri processi o di altri componenti). All'avvio non si scaricano i dati di tutti gli
+    utenti da Supabase: un utente assente in locale viene scaricato al primo accesso,
+    la lista utenti quando un login o un ID non vengono trovati.
+    """
+
+    def __init__(self, data_dir: str = "user_data", storage: Optional[UserStorage] = None,
+                 max_state_bytes: Optional[int] = None):
+        """
+        Args:
+            data_dir: Directory dei dati utente
+            storage: Backend di persistenza (default: get_user_storage(data_dir), vedi user_storage).
+                Se NUTRICOACH_USER_FLUSH_MS > 0 le scritture passano dal buffer write-behind
+                condiviso del backend (vedi user_write_buffer): chiamare flush a fine turno.
+            max_state_bytes: Memoria massima per lo stato degli utenti caricati
+                (default: NUTRICOACH_USER_STATE_CACHE_MB)
+        """
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True)
-        self._users: Dict[str, User] = {}  # username -> User
+        self._users: Optional[UserDirectory] = None  # username -> User, con indici per ID/email/Google
         self._user_preferences: Dict[str, UserPreferences] = {}
         self._chat_history: Dict[str, List[ChatMessage]] = {}
         self._nutritional_info: Dict[str, UserNutritionalInfo] = {}
-        
-        # Sincronizzazione iniziale con Supabase
-        self._sync_from_supabase_on_startup()
-        
+        # Utenti caricati in memoria (ordine LRU) -> stima in byte del loro stato
+        self._loaded: "OrderedDict[str, int]" = OrderedDict()
+        # Versione del documento (UserStorage.document_version) da cui è stato caricato lo stato
+        self._versions: Dict[str, Any] = {}
+        self._loaded_bytes = 0
+        self._max_state_bytes = max_state_bytes if max_state_bytes is not None else int(USER_STATE_CACHE_MB * 1024 * 1024)
+        self._evictions = 0
+        self._state_lock = threading.RLock()
+        # Utenti già cercati su Supabase e ultimo download della lista utenti
+        self._remote_checked: Set[str] = set()
+        self._users_refreshed_at = 0.0
+        # Persistenza (file JSON con log append-only o SQLite)
+        self._storage = storage or get_user_storage(str(self.data_dir))
+        if USER_FLUSH_INTERVAL_MS > 0 and not isinstance(self._storage, WriteBehindUserStorage):
+            # Un'unica scrittura e sincronizzazione Supabase per flush
+            self._storage = get_write_behind_storage(
+                self._storage, USER_FLUSH_INTERVAL_MS / 1000, on_flush=auto_sync_user_data
+            )
+
         self._load_users()
 
     def _hash_password(self, password: str) -> str:
@@ -95,35 +145,26 @@ class UserDataManager:
         return hashlib.sha256(password.encode()).hexdigest()
 
     def _load_users(self) -> None:
-        """Carica la lista degli utenti dal file"""
-        users_file = self.data_dir / "users.json"
-        if users_file.exists():
-            with open(users_file, 'r', encoding='utf-8') as f:
-                users_data = json.load(f)
-                self._users = {
-                    username: User(**user_data)
-                    for username, user_data in users_data.items()
-                }
+        """Carica la lista degli utenti"""
+        self._users = UserDirectory(self._storage, User)
+
+    def add_user(self, user: User) -> None:
+        """
+        Aggiunge un utente registrato: salva solo la sua riga e la sincronizza con Supabase
+
+        Args:
+            user: Utente da aggiungere
+        """
+        self._users.add(user)
 
-    def _save_users(self) -> None:
-        """Salva la lista degli utenti su file e sincronizza con Supabase"""
-        users_file = self.data_dir / "users.json"
-        users_data = {
-            username: asdict(user)
-            for username, user in self._users.items()
-        }
-        with open(users_file, 'w', encoding='utf-8') as f:
-            json.dump(users_data, f, ensure_ascii=False, indent=2)
-        
         # Sincronizzazione automatica con Supabase
-        try:
-            from services.supabase_service import get_supabase_service
-            supabase_service = get_supabase_service()
-            if supabase_service.is_available():
-                supabase_service.sync_users_to_supabase(users_data)
-                logger.info("✅ Utenti sincronizzati automaticamente con Supabase")
-        except Exception as e:
-            logger.warning(f"⚠️ Errore nella sincronizzazione automatica utenti: {str(e)}")
+        supabase_service = self._get_supabase_service()
+        if supabase_service is not None:
+            try:
+                if supabase_service.sync_user_to_supabase(user.username, user_record(user)):
+                    logger.info(f"✅ Utente {user.username} sincronizzato automaticamente con Supabase")
+            except Exception as e:
+                logger.warning(f"⚠️ Errore nella sincronizzazione automatica utente: {str(e)}")
 
     def register_user(self, username: str, email: str, password: str) -> Tuple[bool, str]:
         """
@@ -137,17 +178,20 @@ class UserDataManager:
         Returns:
             Tuple[bool, str]: (successo, messaggio)
         """
+        # Utenti registrati da altri processi sulla stessa directory e da altre istanze dell'app
+        self._users.refresh()
+        self._refresh_users_from_supabase()
+
         if username in self._users:
             return False, "Username già in uso"
-        
+
         # Validazione email
         if not email or "@" not in email or "." not in email.split("@")[-1]:
             return False, "Email non valida"
         
         # Verifica unicità email
-        for user in self._users.values():
-            if hasattr(user, 'email') and user.email == email:
-                return False, "Email già in uso"
+        if self._users.get_by_email(email) is not None:
+            return False, "Email già in uso"
         
         if len(password) < 8:
             return False, "La password deve essere di almeno 8 caratteri"
@@ -161,8 +205,7 @@ class UserDataManager:
             created_at=time.time()
         )
         
-        self._users[username] = user
-        self._save_users()
+        self.add_user(user)
         return True, user_id
 
     def login_user(self, username: str, password: str) -> Tuple[bool, str]:
@@ -176,10 +219,10 @@ class UserDataManager:
         Returns:
             Tuple[bool, str]: (successo, user_id)
         """
-        if username not in self._users:
+        user = self._find_user(self._users.get, username)
+        if user is None:
             return False, "Utente non trovato"
-        
-        user = self._users[username]
+
         if user.password_hash != self._hash_password(password):
             return False, "Password non corretta"
         
@@ -189,10 +232,30 @@ class UserDataManager:
 
     def get_user_by_id(self, user_id: str) -> Optional[User]:
         """Recupera un utente dal suo ID"""
-        for user in self._users.values():
-            if user.user_id == user_id:
-                return user
-        return None
+        return self._find_user(self._users.get_by_id, user_id)
+
+    def get_user_by_google_id(self, google_id: str) -> Optional[User]:
+        """Recupera un utente dal suo ID Google"""
+        return self._find_user(self._users.get_by_google_id, google_id)
+
+    def is_username_taken(self, username: str) -> bool:
+        """Indica se lo username è già registrato"""
+        if username not in self._users:
+            # Utente registrato da un altro processo
+            self._users.refresh()
+        return username in self._users
+
+    def _find_user(self, lookup, key: str) -> Optional[User]:
+        """
+        Cerca un utente con una ricerca della directory; se non lo trova ricarica gli utenti
+        registrati da altri processi (backend locale) e da altre istanze (Supabase)
+        """
+        user = lookup(key)
+        if user is None and self._users.refresh():
+            user = lookup(key)
+        if user is None and self._refresh_users_from_supabase():
+            user = lookup(key)
+        return user
 
     def update_user_preferences(self, user_id: str, preferences: Dict[str, Union[List[str], Dict[str, str]]]) -> None:
         """
@@ -202,30 +265,32 @@ class UserDataManager:
             user_id: ID dell'utente
             preferences: Dizionario con le nuove preferenze
         """
-        if user_id not in self._user_preferences:
-            self._user_preferences[user_id] = UserPreferences(
-                excluded_foods=[],
-                preferred_foods=[],
-                user_notes=[]
-            )
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            if user_id not in self._user_preferences:
+                self._user_preferences[user_id] = UserPreferences(
+                    excluded_foods=[],
+                    preferred_foods=[],
+                    user_notes=[]
+                )
+
+            current_prefs = self._user_preferences[user_id]
+
+            # Convert any sets to lists before updating
+            for category, items in preferences.items():
+                if hasattr(current_prefs, category):
+                    if isinstance(items, (list, set)):
+                        setattr(current_prefs, category, list(items))
+                    elif isinstance(items, dict):
+                        getattr(current_prefs, category).update(items)
+                    else:
+                        setattr(current_prefs, category, [items] if items else [])
 
-        current_prefs = self._user_preferences[user_id]
-        
-        # Convert any sets to lists before updating
-        for category, items in preferences.items():
-            if hasattr(current_prefs, category):
-                if isinstance(items, (list, set)):
-                    setattr(current_prefs, category, list(items))
-                elif isinstance(items, dict):
-                    getattr(current_prefs, category).update(items)
-                else:
-                    setattr(current_prefs, category, [items] if items else [])
-
-        self._save_user_data(user_id)
+            self._save_user_data(user_id, "user_preferences")
 
     def get_user_preferences(self, user_id: str) -> Optional[Dict]:
         """
-        Recupera le preferenze dell'utente dal file JSON
+        Recupera le preferenze dell'utente salvate
         
         Args:
             user_id: ID dell'utente
@@ -233,14 +298,8 @@ class UserDataManager:
         Returns:
             Dict con le preferenze o None se non trovato
         """
-        user_file = self.data_dir / f"{user_id}.json"
-        if not user_file.exists():
-            return None
-            
         try:
-            with open(user_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get("user_preferences")
+            return self._storage.get_field(user_id, "user_preferences")
         except Exception:
             return None
 
@@ -254,23 +313,23 @@ class UserDataManager:
             role: Ruolo del messaggio ('user' o 'assistant')
             content: Contenuto del messaggio
         """
-        if user_id not in self._chat_history:
-            self._chat_history[user_id] = []
-        
         message = ChatMessage(
             role=role,
             content=content,
             timestamp=time.time()
         )
-        
-        self._chat_history[user_id].append(message)
+
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            self._chat_history.setdefault(user_id, []).append(message)
+            self._grow_state(user_id, len(content))
+        sync_due = self._storage.append_chat_message(user_id, asdict(message))
         
         # Incrementa il contatore interazioni solo per i messaggi dell'utente
         if role == "user":
             self.increment_interactions(user_id)
-        else:
-            # Per i messaggi dell'assistente, salva solo i dati senza incrementare
-            self._save_user_data(user_id)
+        if sync_due:
+            self._sync_user_data(user_id)
 
     def get_chat_history(self, user_id: str) -> List[ChatMessage]:
         """
@@ -282,7 +341,9 @@ class UserDataManager:
         Returns:
             Lista di messaggi della chat
         """
-        return self._chat_history.get(user_id, [])
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            return self._chat_history.get(user_id, [])
 
     def clear_chat_history(self, user_id: str) -> None:
         """
@@ -291,9 +352,13 @@ class UserDataManager:
         Args:
             user_id: ID dell'utente
         """
-        if user_id in self._chat_history:
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            if user_id not in self._chat_history:
+                return
             self._chat_history[user_id] = []
-            self._save_user_data(user_id)
+        self._storage.update_fields(user_id, {"chat_history": []})
+        self._sync_user_data(user_id)
 
     def clear_agent_qa(self, user_id: str) -> None:
         """
@@ -302,9 +367,12 @@ class UserDataManager:
         Args:
             user_id: ID dell'utente
         """
-        if user_id in self._nutritional_info:
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            if user_id not in self._nutritional_info:
+                return
             self._nutritional_info[user_id].agent_qa = []
-            self._save_user_data(user_id)
+            self._save_user_data(user_id, "nutritional_info", keep_agent_qa=False)
 
     def save_agent_qa(self, user_id: str, question: str, answer: str) -> None:
         """
@@ -315,20 +383,24 @@ class UserDataManager:
             question: Domanda dell'agente
             answer: Risposta dell'utente
         """
-        if user_id not in self._nutritional_info:
-            return
-        
-        if not hasattr(self._nutritional_info[user_id], 'agent_qa'):
-            self._nutritional_info[user_id].agent_qa = []
-        
         qa = AgentQA(
             question=question,
             answer=answer,
             timestamp=time.time()
         )
-        
-        self._nutritional_info[user_id].agent_qa.append(qa)
-        self._save_user_data(user_id)
+
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            if user_id not in self._nutritional_info:
+                return
+
+            if not hasattr(self._nutritional_info[user_id], 'agent_qa'):
+                self._nutritional_info[user_id].agent_qa = []
+
+            self._nutritional_info[user_id].agent_qa.append(qa)
+            self._grow_state(user_id, len(question) + len(answer))
+        if self._storage.append_agent_qa(user_id, asdict(qa)):
+            self._sync_user_data(user_id)
 
     def get_agent_qa(self, user_id: str) -> List[AgentQA]:
         """
@@ -340,9 +412,11 @@ class UserDataManager:
         Returns:
             Lista di domande e risposte
         """
-        if user_id not in self._nutritional_info:
-            return []
-        return getattr(self._nutritional_info[user_id], 'agent_qa', [])
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            if user_id not in self._nutritional_info:
+                return []
+            return getattr(self._nutritional_info[user_id], 'agent_qa', [])
 
     def save_nutritional_info(self, user_id: str, info: Dict) -> None:
         """
@@ -352,24 +426,26 @@ class UserDataManager:
             user_id: ID dell'utente
             info: Dizionario con le informazioni nutrizionali
         """
-        # Mantieni le domande e risposte dell'agente esistenti
-        existing_qa = []
-        if user_id in self._nutritional_info:
-            existing_qa = getattr(self._nutritional_info[user_id], 'agent_qa', [])
-        
-        nutritional_info = UserNutritionalInfo(
-            età=info["età"],
-            sesso=info["sesso"],
-            peso=info["peso"],
-            altezza=info["altezza"],
-            attività=info["attività"],
-            obiettivo=info["obiettivo"],
-            nutrition_answers=info.get("nutrition_answers", {}),
-            agent_qa=existing_qa  # Mantieni le domande e risposte esistenti
-        )
-        
-        self._nutritional_info[user_id] = nutritional_info
-        self._save_user_data(user_id)
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            # Mantieni le domande e risposte dell'agente esistenti
+            existing_qa = []
+            if user_id in self._nutritional_info:
+                existing_qa = getattr(self._nutritional_info[user_id], 'agent_qa', [])
+
+            nutritional_info = UserNutritionalInfo(
+                età=info["età"],
+                sesso=info["sesso"],
+                peso=info["peso"],
+                altezza=info["altezza"],
+                attività=info["attività"],
+                obiettivo=info["obiettivo"],
+                nutrition_answers=info.get("nutrition_answers", {}),
+                agent_qa=existing_qa  # Mantieni le domande e risposte esistenti
+            )
+
+            self._nutritional_info[user_id] = nutritional_info
+            self._save_user_data(user_id, "nutritional_info")
 
     def get_nutritional_info(self, user_id: str) -> Optional[UserNutritionalInfo]:
         """
@@ -381,158 +457,217 @@ class UserDataManager:
         Returns:
             UserNutritionalInfo o None se non trovato
         """
-        return self._nutritional_info.get(user_id)
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            return self._nutritional_info.get(user_id)
 
-    def _save_user_data(self, user_id: str) -> None:
-        """Salva i dati dell'utente su file preservando sempre i dati DeepSeek e sincronizza con Supabase"""
-        user_file = self.data_dir / f"{user_id}.json"
-        
-        # PRESERVA i dati DeepSeek, costi, privacy e interazioni esistenti se presenti
-        existing_deepseek_data = None
-        existing_cost_data = None
-        existing_last_cost_update = None
-        existing_privacy_consent = None
-        existing_interazioni = None
-        if user_file.exists():
-            try:
-                with open(user_file, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-                    existing_deepseek_data = existing_data.get("nutritional_info_extracted")
-                    existing_cost_data = existing_data.get("conversation_costs")
-                    existing_last_cost_update = existing_data.get("last_cost_update")
-                    existing_privacy_consent = existing_data.get("privacy_consent")
-                    existing_interazioni = existing_data.get("interazioni")
-            except Exception as e:
-                print(f"[USER_DATA_MANAGER] Errore nel leggere dati esistenti: {str(e)}")
-        
-        # Converti le preferenze utente per la serializzazione JSON
-        user_preferences = None
-        if user_id in self._user_preferences:
-            prefs = self._user_preferences[user_id]
-            user_preferences = {
-                "excluded_foods": prefs.excluded_foods,  # Already a list
-                "preferred_foods": prefs.preferred_foods,  # Already a list
-                "user_notes": prefs.user_notes  # Already a list
-            }
-        
-        data = {
-            "user_preferences": user_preferences,
-            "chat_history": [
-                asdict(message) for message in self._chat_history.get(user_id, [])
-            ],
-            "nutritional_info": asdict(self._nutritional_info.get(user_id)) if user_id in self._nutritional_info else None
-        }
-        
-        # RESTAURA i dati DeepSeek se esistevano
-        if existing_deepseek_data:
-            data["nutritional_info_extracted"] = existing_deepseek_data
-        
-        # RESTAURA i dati dei costi se esistevano
-        if existing_cost_data:
-            data["conversation_costs"] = existing_cost_data
-            data["last_cost_update"] = existing_last_cost_update
-        
-        # RESTAURA il consenso privacy se esisteva
-        if existing_privacy_consent:
-            data["privacy_consent"] = existing_privacy_consent
+    def flush(self, user_id: Optional[str] = None) -> None:
+        """
+        Scrive subito le modifiche in attesa nel buffer write-behind (da chiamare a fine turno)
         
-        # INIZIALIZZA o RESTAURA il contatore interazioni
-        if existing_interazioni is not None:
-            data["interazioni"] = existing_interazioni
-        else:
-            # Per nuovi utenti, inizializza con 0
-            data["interazioni"] = 0
- 
-        with open(user_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        Args:
+            user_id: ID dell'utente (default: tutti gli utenti)
+        """
+        if isinstance(self._storage, WriteBehindUserStorage):
+            self._storage.flush(user_id)
+
+    def _sync_user_data(self, user_id: str) -> None:
+        """Sincronizza con Supabase il documento completo dell'utente"""
+        if isinstance(self._storage, WriteBehindUserStorage):
+            # La sincronizzazione avviene al flush del buffer
+            return
+        data = self._storage.load_document(user_id)
+        if data is not None:
+            auto_sync_user_data(user_id, data)
+
+    def _save_user_data(self, user_id: str, *fields: str, keep_agent_qa: bool = True) -> None:
+        """
+        Salva i campi modificati dello stato in memoria preservando gli altri campi del
+        documento (dati DeepSeek, costi, privacy, interazioni) e sincronizza con Supabase.
+
+        Chat history e agent_qa non vengono riscritti dalla memoria: si aggiungono con
+        append_chat_message e append_agent_qa, anche da altri processi, e riscriverli
+        cancellerebbe i record aggiunti dopo il caricamento dello stato.
+
+        Args:
+            user_id: ID dell'utente
+            fields: Campi modificati ("user_preferences", "nutritional_info")
+            keep_agent_qa: Se False, nutritional_info viene salvato con agent_qa vuoti
+        """
+        updates = {}
+        nutritional_info = None
+        with self._state_lock:
+            # Converti le preferenze utente per la serializzazione JSON
+            if "user_preferences" in fields and user_id in self._user_preferences:
+                prefs = self._user_preferences[user_id]
+                updates["user_preferences"] = {
+                    "excluded_foods": prefs.excluded_foods,  # Already a list
+                    "preferred_foods": prefs.preferred_foods,  # Already a list
+                    "user_notes": prefs.user_notes  # Already a list
+                }
+            if "nutritional_info" in fields and user_id in self._nutritional_info:
+                nutritional_info = asdict(self._nutritional_info[user_id])
+                nutritional_info.pop("agent_qa", None)
+
+        if nutritional_info is not None:
+            def with_saved_agent_qa(current):
+                saved_qa = (current or {}).get("agent_qa") or []
+                return dict(nutritional_info, agent_qa=saved_qa if keep_agent_qa else [])
+
+            # Lettura-modifica-scrittura atomica: mantiene gli agent_qa salvati
+            self._storage.modify_field(user_id, "nutritional_info", with_saved_agent_qa)
+
+        # Per nuovi utenti, inizializza il contatore interazioni a 0
+        self._storage.update_fields(user_id, updates, defaults={"interazioni": 0})
         
         # Sincronizzazione automatica con Supabase
-        auto_sync_user_data(user_id, data)
+        self._sync_user_data(user_id)
 
-    def _sync_from_supabase_on_startup(self) -> None:
-        """Sincronizza i dati da Supabase all'avvio dell'applicazione"""
+    def _get_supabase_service(self):
+        """Restituisce il servizio Supabase se disponibile, altrimenti None"""
         try:
             from services.supabase_service import get_supabase_service
             supabase_service = get_supabase_service()
-            
-            if supabase_service.is_available():
-                logger.info("🔄 Sincronizzazione iniziale da Supabase...")
-                
-                # Scarica solo se non ci sono dati locali o se i dati Supabase sono più recenti
-                should_download = self._should_download_from_supabase()
-                
-                if should_download:
-                    success = supabase_service.download_all_data_from_supabase()
-                    if success:
-                        logger.info("✅ Dati sincronizzati da Supabase all'avvio")
-                    else:
-                        logger.warning("⚠️ Sincronizzazione da Supabase parzialmente fallita")
-                else:
-                    logger.info("📋 Dati locali aggiornati, sincronizzazione saltata")
-            else:
-                logger.info("📴 Supabase non disponibile, uso dati locali")
-                
+            return supabase_service if supabase_service.is_available() else None
         except Exception as e:
-            logger.warning(f"⚠️ Errore nella sincronizzazione iniziale da Supabase: {str(e)}")
-            logger.info("📁 Continuando con i dati locali disponibili")
+            logger.warning(f"⚠️ Supabase non utilizzabile: {str(e)}")
+            return None
 
-    def _should_download_from_supabase(self) -> bool:
+    def _refresh_users_from_supabase(self) -> bool:
         """
-        Determina se scaricare i dati da Supabase basandosi sulla presenza e freshness dei dati locali.
-        
+        Aggiunge agli utenti locali quelli registrati su Supabase da altre istanze.
+        Il download avviene al più una volta ogni SUPABASE_USERS_REFRESH_SECONDS.
+
         Returns:
-            bool: True se dovrebbe scaricare da Supabase
+            bool: True se sono stati aggiunti nuovi utenti
         """
-        users_file = self.data_dir / "users.json"
-        
-        # Se non ci sono utenti locali, scarica sempre
-        if not users_file.exists():
-            logger.info("📥 Nessun file utenti locale trovato, scaricando da Supabase")
-            return True
-        
-        # Se ci sono pochi file utente, potrebbe esserci uno stato incompleto
-        user_files = list(self.data_dir.glob("*.json"))
-        if len(user_files) <= 1:  # Solo users.json o nessun file
-            logger.info("📥 Pochi dati locali trovati, scaricando da Supabase")
-            return True
-        
-        # Per ora, scarichiamo sempre per essere sicuri
-        # In futuro si potrebbe aggiungere un controllo del timestamp
-        logger.info("📥 Verifica aggiornamenti da Supabase")
-        return True
+        now = time.monotonic()
+        if self._users_refreshed_at and now - self._users_refreshed_at < SUPABASE_USERS_REFRESH_SECONDS:
+            return False
+        self._users_refreshed_at = now
 
-    def _load_user_data(self, user_id: str) -> None:
-        """Carica i dati dell'utente da file"""
-        user_file = self.data_dir / f"{user_id}.json"
-        
-        if not user_file.exists():
+        supabase_service = self._get_supabase_service()
+        if supabase_service is None:
+            return False
+        try:
+            remote_users = supabase_service.download_users_from_supabase() or {}
+            # Solo salvataggio locale: gli utenti sono già su Supabase
+            added = self._users.merge(remote_users)
+            if added:
+                logger.info(f"✅ {added} utenti aggiunti da Supabase")
+            return added > 0
+        except Exception as e:
+            logger.warning(f"⚠️ Errore nel download degli utenti da Supabase: {str(e)}")
+            return False
+
+    def _download_user_from_supabase(self, user_id: str) -> None:
+        """Scarica da Supabase i dati di un utente assente in locale (una volta per processo)"""
+        if user_id in self._remote_checked:
+            return
+        self._remote_checked.add(user_id)
+        if self._storage.user_exists(user_id):
+            return
+
+        supabase_service = self._get_supabase_service()
+        if supabase_service is None:
             return
+        try:
+            data = supabase_service.download_user_data_from_supabase(user_id)
+            if data is not None:
+                self._storage.save_document(user_id, data)
+                logger.info(f"✅ Dati utente {user_id} scaricati da Supabase al primo accesso")
+        except Exception as e:
+            logger.warning(f"⚠️ Errore nel download dei dati di {user_id} da Supabase: {str(e)}")
+
+    def _ensure_loaded(self, user_id: str) -> None:
+        """
+        Carica in memoria lo stato dell'utente al primo accesso, o lo ricarica se il documento
+        è cambiato nel backend, e lo segna come usato di recente
+        """
+        with self._state_lock:
+            if user_id in self._loaded and self._storage.document_version(user_id) == self._versions.get(user_id):
+                self._loaded.move_to_end(user_id)
+                return
+            self._load_user_data(user_id)
+
+    def _grow_state(self, user_id: str, size: int) -> None:
+        """Aggiorna la stima della memoria di un utente caricato ed eventualmente libera memoria"""
+        with self._state_lock:
+            if user_id in self._loaded:
+                self._loaded[user_id] += size
+                self._loaded_bytes += size
+                self._evict()
+
+    def _evict(self) -> None:
+        """Rimuove dalla memoria gli utenti usati meno di recente oltre il limite di memoria"""
+        # L'utente usato più di recente resta sempre caricato
+        while self._loaded_bytes > self._max_state_bytes and len(self._loaded) > 1:
+            user_id, size = self._loaded.popitem(last=False)
+            self._loaded_bytes -= size
+            self._versions.pop(user_id, None)
+            self._user_preferences.pop(user_id, None)
+            self._chat_history.pop(user_id, None)
+            self._nutritional_info.pop(user_id, None)
+            self._evictions += 1
+
+    def state_stats(self) -> Dict[str, Any]:
+        """Restituisce utenti caricati, memoria stimata e rimozioni dello stato in memoria"""
+        with self._state_lock:
+            return {
+                "loaded_users": len(self._loaded),
+                "state_bytes": self._loaded_bytes,
+                "max_state_bytes": self._max_state_bytes,
+                "evictions": self._evictions
+            }
 
-        with open(user_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        # Carica preferenze
-        if data.get("user_preferences"):
-            prefs_data = data["user_preferences"]
-            # No need to convert to sets anymore
-            self._user_preferences[user_id] = UserPreferences(**prefs_data)
-
-        # Carica history chat
-        self._chat_history[user_id] = [
-            ChatMessage(**message_data)
-            for message_data in data.get("chat_history", [])
-        ]
-
-        # Carica informazioni nutrizionali
-        if data.get("nutritional_info"):
-            nutritional_data = data["nutritional_info"]
-            # Converti le domande e risposte dell'agente
-            if "agent_qa" in nutritional_data:
-                nutritional_data["agent_qa"] = [
-                    AgentQA(**qa_data)
-                    for qa_data in nutritional_data["agent_qa"]
-                ]
-            self._nutritional_info[user_id] = UserNutritionalInfo(**nutritional_data)
+    def _load_user_data(self, user_id: str) -> None:
+        """Carica i dati dell'utente"""
+        self._download_user_from_supabase(user_id)
+        with self._state_lock:
+            # Versione letta prima del documento: una scrittura intermedia causa un nuovo caricamento
+            self._versions[user_id] = self._storage.document_version(user_id)
+            data = self._storage.load_document(user_id)
+            self._user_preferences.pop(user_id, None)
+            self._chat_history.pop(user_id, None)
+            self._nutritional_info.pop(user_id, None)
+
+            previous_size = self._loaded.pop(user_id, 0)
+            self._loaded_bytes -= previous_size
+            size = EMPTY_USER_STATE_BYTES
+            if data is not None:
+                size += len(json.dumps(
+                    [data.get("user_preferences"), data.get("chat_history"), data.get("nutritional_info")],
+                    ensure_ascii=False, default=str
+                ))
+            self._loaded[user_id] = size
+            self._loaded_bytes += size
+            self._evict()
+
+            if data is None:
+                return
+
+            # Carica preferenze
+            if data.get("user_preferences"):
+                prefs_data = data["user_preferences"]
+                # No need to convert to sets anymore
+                self._user_preferences[user_id] = UserPreferences(**prefs_data)
+
+            # Carica history chat
+            self._chat_history[user_id] = [
+                ChatMessage(**message_data)
+                for message_data in data.get("chat_history", [])
+            ]
+
+            # Carica informazioni nutrizionali
+            if data.get("nutritional_info"):
+                nutritional_data = data["nutritional_info"]
+                # Converti le domande e risposte dell'agente
+                if "agent_qa" in nutritional_data:
+                    nutritional_data["agent_qa"] = [
+                        AgentQA(**qa_data)
+                        for qa_data in nutritional_data["agent_qa"]
+                    ]
+                self._nutritional_info[user_id] = UserNutritionalInfo(**nutritional_data)
 
     def clear_user_preferences(self, user_id: str) -> None:
         """
@@ -541,15 +676,17 @@ class UserDataManager:
         Args:
             user_id: ID dell'utente
         """
-        # Resetta le preferenze in memoria
-        self._user_preferences[user_id] = UserPreferences(
-            excluded_foods=[],
-            preferred_foods=[],
-            user_notes=[]
-        )
-        
-        # Forza il salvataggio su file
-        self._save_user_data(user_id)
+        with self._state_lock:
+            self._ensure_loaded(user_id)
+            # Resetta le preferenze in memoria
+            self._user_preferences[user_id] = UserPreferences(
+                excluded_foods=[],
+                preferred_foods=[],
+                user_notes=[]
+            )
+
+            # Forza il salvataggio su file
+            self._save_user_data(user_id, "user_preferences")
     
     def save_cost_stats(self, user_id: str, stats: Dict) -> None:
         """
@@ -559,21 +696,11 @@ class UserDataManager:
             user_id: ID dell'utente
             stats: Dizionario con le statistiche dei token e costi
         """
-        user_file = self.data_dir / f"{user_id}.json"
-        
-        # Carica i dati esistenti
-        data = {}
-        if user_file.exists():
-            with open(user_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        
         # Sovrascrivi con le statistiche più recenti (non accumulare)
-        data["conversation_costs"] = stats
-        data["last_cost_update"] = stats.get("timestamp", "")
-        
-        # Salva i dati aggiornati
-        with open(user_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        self._storage.update_fields(user_id, {
+            "conversation_costs": stats,
+            "last_cost_update": stats.get("timestamp", "")
+        })
     
     def increment_interactions(self, user_id: str) -> None:
         """
@@ -583,30 +710,9 @@ class UserDataManager:
         Args:
             user_id: ID dell'utente
         """
-        user_file = self.data_dir / f"{user_id}.json"
-        
-        # Carica i dati esistenti
-        data = {}
-        if user_file.exists():
-            try:
-                with open(user_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            except Exception as e:
-                print(f"[USER_DATA_MANAGER] Errore nel leggere dati per incremento interazioni: {str(e)}")
-                data = {}
-        
-        # Incrementa il contatore interazioni
-        current_interactions = data.get("interazioni", 0)
-        data["interazioni"] = current_interactions + 1
-        
-        # Salva i dati aggiornati
         try:
-            with open(user_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
-            # Sincronizzazione automatica con Supabase
-            auto_sync_user_data(user_id, data)
-            
+            if self._storage.increment_interactions(user_id):
+                self._sync_user_data(user_id)
         except Exception as e:
             print(f"[USER_DATA_MANAGER] Errore nel salvare incremento interazioni: {str(e)}")
     
@@ -620,16 +726,34 @@ class UserDataManager:
         Returns:
             int: Numero totale di interazioni
         """
-        user_file = self.data_dir / f"{user_id}.json"
-        
-        if not user_file.exists():
-            return 0
-        
         try:
-            with open(user_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get("interazioni", 0)
+            return self._storage.get_field(user_id, "interazioni", 0)
         except Exception as e:
             print(f"[USER_DATA_MANAGER] Errore nel leggere contatore interazioni: {str(e)}")
             return 0
-         
\ No newline at end of file
+
+
+_managers: Dict[str, UserDataManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_user_data_manager(data_dir: str = "user_data") -> UserDataManager:
+    """
+    Restituisce il UserDataManager condiviso dal processo per una directory dati.
+
+    Le sessioni Streamlit e i tool degli agenti usano la stessa istanza: gli utenti
+    vengono caricati al primo accesso, non a ogni nuova sessione.
+
+    Args:
+        data_dir: Directory dei dati utente
+
+    Returns:
+        UserDataManager: gestore condiviso
+    """
+    key = os.path.abspath(data_dir)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = UserDataManager(data_dir)
+            _managers[key] = manager
+        return manager
@@ -1,8 +1,8 @@
 from typing import Dict, List, Optional, Union
-from .user_data_manager import UserDataManager
+from .user_data_manager import get_user_data_manager
 
-# Singleton instance of UserDataManager
-_user_data_manager = UserDataManager()
+# Shared process-wide instance of UserDataManager
+_user_data_manager = get_user_data_manager()
 
 def get_user_preferences(user_id: str) -> Dict:
     """
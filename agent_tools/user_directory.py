@@ -0,0 +1,166 @@
+"""
+Directory degli utenti registrati con indici hash.
+
+Login, registrazione e autenticazione Google cercavano gli utenti scorrendo
+l'intero insieme (unicità dell'email, ricerca per user_id) e ogni registrazione
+riscriveva tutto users.json. UserDirectory tiene in memoria gli utenti per
+username con indici per user_id, email e Google ID, così ogni ricerca costa O(1),
+e persiste un nuovo utente con UserStorage.save_user (una riga nel log delle
+modifiche di users.json o una riga della tabella SQLite).
+
+Si comporta come un dict username -> utente in sola lettura (in, [], len, values,
+items): le modifiche passano da add e merge, che aggiornano anche gli indici.
+Gli utenti registrati da altri processi sulla stessa directory (o database) si
+vedono con refresh, che ricarica tutto solo se UserStorage.users_version è cambiata.
+"""
+
+import logging
+import threading
+from dataclasses import asdict
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .user_storage import UserStorage
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+INDEXED_FIELDS = ("user_id", "email", "google_id")
+
+
+def user_record(user: Any) -> Dict[str, Any]:
+    """Converte un utente (dataclass) nel dict salvato in users.json, senza i campi vuoti."""
+    return {key: value for key, value in asdict(user).items() if value is not None}
+
+
+class UserDirectory:
+    """Utenti registrati indicizzati per username, user_id, email e Google ID.
+
+    Thread-safe: indici e persistenza sono serializzati da un lock.
+    """
+
+    def __init__(self, storage: UserStorage, factory: Callable[..., Any]):
+        """
+        Args:
+            storage: Backend da cui caricare e su cui salvare gli utenti
+            factory: Costruttore degli utenti a partire dai dati salvati (es. User)
+        """
+        self._storage = storage
+        self._factory = factory
+        self._lock = threading.RLock()
+        self._by_username: Dict[str, Any] = {}
+        self._indexes: Dict[str, Dict[str, Any]] = {field: {} for field in INDEXED_FIELDS}
+        self._version = None
+        self.reload()
+
+    def reload(self) -> None:
+        """Ricarica tutti gli utenti dal backend e ricostruisce gli indici."""
+        with self._lock:
+            # Versione letta prima degli utenti: una modifica intermedia causa un nuovo caricamento
+            self._version = self._storage.users_version()
+            users = self._storage.load_users()
+            self._by_username = {}
+            self._indexes = {field: {} for field in INDEXED_FIELDS}
+            for username, user_data in users.items():
+                self._index(self._factory(**user_data))
+
+    def refresh(self) -> bool:
+        """
+        Ricarica gli utenti se sono cambiati nel backend (es. registrati da un altro processo).
+
+        Returns:
+            bool: True se gli utenti sono stati ricaricati
+        """
+        with self._lock:
+            if self._storage.users_version() == self._version:
+                return False
+            self.reload()
+            return True
+
+    def _index(self, user: Any) -> None:
+        previous = self._by_username.get(user.username)
+        if previous is not None:
+            for field in INDEXED_FIELDS:
+                value = getattr(previous, field, None)
+                if value and self._indexes[field].get(value) is previous:
+                    del self._indexes[field][value]
+        self._by_username[user.username] = user
+        for field in INDEXED_FIELDS:
+            value = getattr(user, field, None)
+            if value:
+                self._indexes[field][value] = user
+
+    # ==================== RICERCHE ====================
+
+    def get(self, username: str) -> Optional[Any]:
+        """Restituisce l'utente con lo username indicato, o None."""
+        return self._by_username.get(username)
+
+    def get_by_id(self, user_id: str) -> Optional[Any]:
+        """Restituisce l'utente con lo user_id indicato, o None."""
+        return self._indexes["user_id"].get(user_id)
+
+    def get_by_email(self, email: str) -> Optional[Any]:
+        """Restituisce l'utente con l'email indicata, o None."""
+        return self._indexes["email"].get(email)
+
+    def get_by_google_id(self, google_id: str) -> Optional[Any]:
+        """Restituisce l'utente collegato all'account Google indicato, o None."""
+        return self._indexes["google_id"].get(google_id)
+
+    def __contains__(self, username: object) -> bool:
+        return username in self._by_username
+
+    def __getitem__(self, username: str) -> Any:
+        return self._by_username[username]
+
+    def __len__(self) -> int:
+        return len(self._by_username)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._by_username))
+
+    def values(self) -> List[Any]:
+        return list(self._by_username.values())
+
+    def items(self) -> List[Any]:
+        return list(self._by_username.items())
+
+    # ==================== MODIFICHE ====================
+
+    def add(self, user: Any) -> None:
+        """
+        Aggiunge (o sostituisce) un utente e salva solo la sua riga.
+
+        Args:
+            user: Utente da aggiungere
+        """
+        with self._lock:
+            self._storage.save_user(user.username, user_record(user))
+            self._index(user)
+
+    def merge(self, users: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Aggiunge gli utenti non ancora presenti (es. scaricati da Supabase), con
+        un'unica scrittura del backend.
+
+        Args:
+            users: Utenti nel formato di users.json (username -> dati utente)
+
+        Returns:
+            int: Numero di utenti aggiunti
+        """
+        with self._lock:
+            # La riscrittura completa non deve perdere gli utenti aggiunti da altri processi
+            self.refresh()
+            new_users = [
+                self._factory(**user_data)
+                for username, user_data in users.items()
+                if username not in self._by_username
+            ]
+            if not new_users:
+                return 0
+            for user in new_users:
+                self._index(user)
+            self._storage.save_users({username: user_record(user) for username, user in self._by_username.items()})
+            return len(new_users)
@@ -0,0 +1,232 @@
+"""
+Cache in memoria dei documenti utente, condivisa dal processo.
+
+Durante una richiesta lo stesso documento utente viene letto da molte funzioni
+(target dei pasti, alimenti esclusi, dati di base, proteine giornaliere, struttura
+dei pasti, PDF, privacy, pagine Piano/Home): una generazione settimanale lo
+rilegge decine di volte. UserDocumentCache conserva il documento già letto e lo
+restituisce come vista in sola lettura (ReadOnlyDict/ReadOnlyList, sottoclassi di
+dict/list che rifiutano le modifiche), condivisa tra i lettori.
+
+L'invalidazione usa UserStorage.document_version: un contatore incrementato a ogni
+scrittura del processo più mtime/dimensione dei file (JSON) o updated_at (SQLite),
+così anche le scritture di altri processi invalidano la voce. Chi deve modificare i
+dati usa load_document del backend (o thaw sulla vista) e li salva con update_fields.
+
+Se il buffer write-behind è attivo (NUTRICOACH_USER_FLUSH_MS > 0) la cache condivisa
+legge attraverso lo stesso buffer di UserDataManager: le modifiche non ancora scritte
+sono già visibili e la versione del documento include il contatore delle modifiche
+in attesa. flush_user_document le scrive prima di passare il lavoro ad altri processi.
+
+Dimensione dell'LRU: NUTRICOACH_USER_DOC_CACHE_SIZE (default 128 documenti).
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .user_storage import UserStorage, get_user_storage
+from .user_write_buffer import USER_FLUSH_INTERVAL_MS, WriteBehindUserStorage, get_write_behind_storage
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+USER_DOC_CACHE_SIZE = int(os.environ.get("NUTRICOACH_USER_DOC_CACHE_SIZE", "128"))
+
+
+def _read_only(*args, **kwargs):
+    raise TypeError("Documento utente in sola lettura: usare load_document o thaw per una copia modificabile")
+
+
+class ReadOnlyDict(dict):
+    """Dict in sola lettura restituito dalla cache (serializzabile come un dict)."""
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return dict, (thaw(self),)
+
+
+class ReadOnlyList(list):
+    """Lista in sola lettura restituita dalla cache (serializzabile come una lista)."""
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return list, (thaw(self),)
+
+
+def freeze(value: Any) -> Any:
+    """Converte ricorsivamente dict e liste in viste in sola lettura."""
+    if isinstance(value, dict):
+        return ReadOnlyDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return ReadOnlyList(freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Restituisce una copia modificabile (dict e liste ordinari) di una vista della cache."""
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [thaw(item) for item in value]
+    return value
+
+
+class UserDocumentCache:
+    """Cache LRU dei documenti utente di un backend, invalidata dalla versione del documento.
+
+    Thread-safe: l'LRU è protetto da un lock; la lettura dal backend avviene fuori dal lock.
+    """
+
+    def __init__(self, storage: UserStorage, maxsize: int = USER_DOC_CACHE_SIZE):
+        """
+        Args:
+            storage: Backend di persistenza da cui leggere i documenti
+            maxsize: Numero massimo di documenti in memoria
+        """
+        self.storage = storage
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: str) -> Optional[ReadOnlyDict]:
+        """
+        Restituisce il documento dell'utente come vista in sola lettura.
+
+        Args:
+            user_id: ID del documento
+
+        Returns:
+            ReadOnlyDict: Documento (condiviso, da non modificare), o None se non esiste
+        """
+        # La versione va letta prima del documento: una scrittura intermedia produce
+        # una versione diversa alla lettura successiva, mai una voce obsoleta
+        version = self.storage.document_version(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        document = self.storage.load_document(user_id)
+        view = freeze(document) if document is not None else None
+        with self._lock:
+            self._entries[user_id] = (version, view)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return view
+
+    def get_field(self, user_id: str, field: str, default: Any = None) -> Any:
+        """Restituisce un campo del documento in cache (default se assente)."""
+        document = self.get(user_id)
+        if document is None:
+            return default
+        return document.get(field, default)
+
+    def invalidate(self, user_id: Optional[str] = None) -> None:
+        """Rimuove un documento (o tutti se user_id è None) dalla cache."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Restituisce dimensione, contatori e hit rate della cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_document_cache(storage: Optional[UserStorage] = None) -> UserDocumentCache:
+    """
+    Restituisce la cache condivisa per un backend.
+
+    Con il buffer write-behind attivo la cache legge attraverso il buffer condiviso
+    del backend, così vede anche le modifiche non ancora scritte.
+
+    Args:
+        storage: Backend di persistenza (default: get_user_storage())
+
+    Returns:
+        UserDocumentCache: cache condivisa dal processo
+    """
+    storage = storage or get_user_storage()
+    if USER_FLUSH_INTERVAL_MS > 0 and not isinstance(storage, WriteBehindUserStorage):
+        storage = get_write_behind_storage(storage)
+    with _caches_lock:
+        cache = _caches.get(id(storage))
+        if cache is None or cache.storage is not storage:
+            cache = UserDocumentCache(storage)
+            _caches[id(storage)] = cache
+        return cache
+
+
+def get_user_document(user_id: str) -> Optional[ReadOnlyDict]:
+    """
+    Restituisce il documento dell'utente dalla cache condivisa, in sola lettura.
+
+    Accetta l'ID con o senza prefisso "user_" (come i lettori storici dei file utente).
+
+    Args:
+        user_id: ID dell'utente
+
+    Returns:
+        ReadOnlyDict: Documento dell'utente, o None se non esiste
+    """
+    return get_document_cache().get(_document_id(user_id))
+
+
+def _document_id(user_id: str) -> str:
+    return user_id if user_id.startswith("user_") else f"user_{user_id}"
+
+
+def flush_user_document(user_id: str) -> None:
+    """
+    Scrive sul backend le modifiche in attesa nel buffer write-behind per l'utente.
+
+    Da chiamare prima di passare l'utente a un altro processo, che legge solo dal backend.
+
+    Args:
+        user_id: ID dell'utente (con o senza prefisso "user_")
+    """
+    storage = get_document_cache().storage
+    if isinstance(storage, WriteBehindUserStorage):
+        storage.flush(_document_id(user_id))
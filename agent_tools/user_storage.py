@@ -0,0 +1,846 @@
+"""
+Livello di persistenza dei dati utente.
+
+UserStorage definisce le operazioni usate da UserDataManager e dagli altri
+componenti che leggono o scrivono i dati utente (estrazione DeepSeek, PDF,
+privacy, contatore interazioni). Due implementazioni:
+
+- JsonUserStorage: il formato storico, un file JSON per utente più users.json,
+  con il log append-only di chat/QA/interazioni (vedi user_data_log). I file sono
+  sostituiti atomicamente e ogni scrittura avviene sotto il lock per utente di
+  atomic_files, quindi più processi possono condividere la directory. I nuovi
+  utenti (save_user) sono righe di users.changes.jsonl, compattato in users.json.
+- SQLiteUserStorage: un database SQLite in modalità WAL con tabelle per utenti,
+  campi del documento (colonne JSON), messaggi della chat e QA dell'agente.
+  Aggiornamenti di singoli campi e append sono singole istruzioni indicizzate,
+  e i lettori concorrenti non bloccano gli scrittori.
+
+Il backend si sceglie con NUTRICOACH_USER_STORAGE (json | sqlite); il database
+SQLite è in NUTRICOACH_USER_DB_PATH (default user_data/user_data.db).
+migrate_user_storage copia tutti i dati da un backend all'altro.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .atomic_files import atomic_write_json, file_lock, lock_path
+from .user_data_log import (
+    UserDataLog, compaction_due, load_user_document, log_path, read_log_records, LOG_SUFFIX
+)
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+USER_STORAGE_BACKEND = os.environ.get("NUTRICOACH_USER_STORAGE", "json")
+USER_DB_PATH = os.environ.get("NUTRICOACH_USER_DB_PATH") or None
+USER_STORAGE_BACKENDS = ("json", "sqlite")
+
+# Campi del documento con una rappresentazione dedicata nel backend SQLite
+CHAT_FIELD = "chat_history"
+NUTRITIONAL_INFO_FIELD = "nutritional_info"
+INTERACTIONS_FIELD = "interazioni"
+
+# Log delle modifiche di users.json (utenti salvati singolarmente)
+USERS_LOG_NAME = "users.changes.jsonl"
+
+
+def _file_version(path: Path) -> Any:
+    """Restituisce (mtime in ns, dimensione) del file, o None se non esiste."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def merge_batch(data: Dict[str, Any], fields: Optional[Dict[str, Any]] = None,
+                defaults: Optional[Dict[str, Any]] = None, chat_messages: List[Dict[str, Any]] = (),
+                agent_qa: List[Dict[str, Any]] = (), interactions: int = 0) -> Dict[str, Any]:
+    """
+    Applica a un documento utente gli stessi aggiornamenti di UserStorage.apply_batch.
+
+    Le liste di chat e QA vengono copiate prima di aggiungere i record, così i valori
+    passati in fields non vengono modificati.
+
+    Args:
+        data: Documento utente (modificato in place)
+        fields, defaults, chat_messages, agent_qa, interactions: Vedi apply_batch
+
+    Returns:
+        dict: Lo stesso documento, aggiornato
+    """
+    data.update(fields or {})
+    for field, value in (defaults or {}).items():
+        data.setdefault(field, value)
+    if chat_messages:
+        data[CHAT_FIELD] = list(data.get(CHAT_FIELD) or []) + list(chat_messages)
+    # Come nel log, gli agent_qa esistono solo insieme a nutritional_info
+    if agent_qa and data.get(NUTRITIONAL_INFO_FIELD):
+        info = dict(data[NUTRITIONAL_INFO_FIELD])
+        info["agent_qa"] = list(info.get("agent_qa") or []) + list(agent_qa)
+        data[NUTRITIONAL_INFO_FIELD] = info
+    if interactions:
+        data[INTERACTIONS_FIELD] = data.get(INTERACTIONS_FIELD, 0) + interactions
+    return data
+
+
+class UserStorage(ABC):
+    """Interfaccia dei backend di persistenza dei dati utente.
+
+    Un documento utente è il dict storico di user_data/<user_id>.json (preferenze,
+    chat_history, nutritional_info con agent_qa, nutritional_info_extracted, costi,
+    privacy_consent, interazioni, ...). I metodi append_* restituiscono True quando i
+    record accumulati giustificano una sincronizzazione del documento completo.
+    Un backend deve implementare tutti i metodi astratti; save_user, get_field e
+    apply_batch hanno un'implementazione di default basata sugli altri.
+    """
+
+    @abstractmethod
+    def load_users(self) -> Dict[str, Dict[str, Any]]:
+        """Restituisce gli utenti registrati (username -> dati utente)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_users(self, users: Dict[str, Dict[str, Any]]) -> None:
+        """Sostituisce gli utenti registrati."""
+        raise NotImplementedError
+
+    def save_user(self, username: str, user: Dict[str, Any]) -> None:
+        """Aggiunge o sostituisce un singolo utente registrato."""
+        users = self.load_users()
+        users[username] = user
+        self.save_users(users)
+
+    @abstractmethod
+    def users_version(self) -> Any:
+        """Restituisce un token che cambia a ogni modifica degli utenti registrati (vedi user_directory)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_user_ids(self) -> List[str]:
+        """Restituisce gli ID degli utenti che hanno un documento."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def user_exists(self, user_id: str) -> bool:
+        """Indica se esiste il documento dell'utente."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_document(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Restituisce il documento completo dell'utente, o None se non esiste."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def document_version(self, user_id: str) -> Any:
+        """Restituisce un token che cambia a ogni scrittura del documento (vedi user_document_cache)."""
+        raise NotImplementedError
+
+    def get_field(self, user_id: str, field: str, default: Any = None) -> Any:
+        """Restituisce un singolo campo del documento (default se assente)."""
+        data = self.load_document(user_id)
+        if data is None:
+            return default
+        return data.get(field, default)
+
+    @abstractmethod
+    def save_document(self, user_id: str, data: Dict[str, Any]) -> None:
+        """Sostituisce l'intero documento dell'utente."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_fields(self, user_id: str, fields: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> None:
+        """Aggiorna solo i campi indicati, creando il documento se non esiste.
+
+        Args:
+            user_id: ID dell'utente
+            fields: Campi da sovrascrivere
+            defaults: Campi da scrivere solo se non già presenti (es. contatori iniziali)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def modify_field(self, user_id: str, field: str, modify: Callable[[Any], Any], default: Any = None) -> Any:
+        """Legge, modifica e riscrive un campo in modo atomico rispetto agli altri scrittori.
+
+        Da usare per gli aggiornamenti che dipendono dal valore corrente (es. merge dei
+        dati estratti), che altrimenti potrebbero perdere scritture concorrenti.
+
+        Args:
+            user_id: ID dell'utente
+            field: Campo da modificare
+            modify: Funzione che riceve il valore corrente (default se assente) e
+                restituisce il nuovo valore; se restituisce None il campo non viene scritto
+            default: Valore passato a modify se il campo non esiste
+
+        Returns:
+            Il valore restituito da modify
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_fields(self, user_id: str, fields: List[str]) -> None:
+        """Rimuove i campi indicati dal documento (se esiste)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def append_chat_message(self, user_id: str, message: Dict[str, Any]) -> bool:
+        """Aggiunge un messaggio (role, content, timestamp) alla chat history."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def append_agent_qa(self, user_id: str, qa: Dict[str, Any]) -> bool:
+        """Aggiunge una domanda/risposta (question, answer, timestamp) agli agent_qa."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def increment_interactions(self, user_id: str) -> bool:
+        """Incrementa di uno il contatore interazioni."""
+        raise NotImplementedError
+
+    def apply_batch(self, user_id: str, fields: Optional[Dict[str, Any]] = None,
+                    defaults: Optional[Dict[str, Any]] = None, chat_messages: List[Dict[str, Any]] = (),
+                    agent_qa: List[Dict[str, Any]] = (), interactions: int = 0) -> None:
+        """Applica in un'unica scrittura aggiornamenti di campi e record accumulati.
+
+        I campi vengono scritti prima dei record: messaggi e QA si aggiungono alla
+        chat_history e agli agent_qa risultanti. L'implementazione di default esegue
+        le singole operazioni; i backend la specializzano in una sola scrittura.
+
+        Args:
+            user_id: ID dell'utente
+            fields: Campi da sovrascrivere
+            defaults: Campi da scrivere solo se non già presenti
+            chat_messages: Messaggi da aggiungere alla chat history
+            agent_qa: Domande/risposte da aggiungere agli agent_qa
+            interactions: Incremento del contatore interazioni
+        """
+        if fields or defaults:
+            self.update_fields(user_id, fields or {}, defaults)
+        for message in chat_messages:
+            self.append_chat_message(user_id, message)
+        for qa in agent_qa:
+            self.append_agent_qa(user_id, qa)
+        for _ in range(interactions):
+            self.increment_interactions(user_id)
+
+
+class JsonUserStorage(UserStorage):
+    """Backend storico: un file JSON per utente, users.json e log append-only."""
+
+    def __init__(self, data_dir: str = "user_data"):
+        """
+        Args:
+            data_dir: Directory dei dati utente
+        """
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._log = UserDataLog(self.data_dir)
+        # Voci (chat + QA) presenti nei documenti compattati, per la politica di compattazione
+        self._compacted_size = {}
+        # Scritture per utente di questo processo (le scritture di altri processi cambiano mtime/dimensione)
+        self._versions = {}
+        # Utenti presenti in users.json all'ultima lettura o riscrittura
+        self._users_compacted = None
+
+    def _user_file(self, user_id: str) -> Path:
+        return self.data_dir / f"{user_id}.json"
+
+    def load_users(self) -> Dict[str, Dict[str, Any]]:
+        # Il log va letto prima di users.json: una riscrittura intermedia include già i suoi record
+        records = read_log_records(self.data_dir / USERS_LOG_NAME)
+        users_file = self.data_dir / "users.json"
+        users = {}
+        if users_file.exists():
+            with open(users_file, 'r', encoding='utf-8') as f:
+                users = json.load(f)
+        self._users_compacted = len(users)
+        # Utenti salvati singolarmente dopo l'ultima riscrittura di users.json
+        for record in records:
+            users[record["username"]] = record["user"]
+        return users
+
+    def save_users(self, users: Dict[str, Dict[str, Any]]) -> None:
+        with file_lock(lock_path(self.data_dir, "users")):
+            self._write_users(users)
+
+    def _write_users(self, users: Dict[str, Dict[str, Any]]) -> None:
+        atomic_write_json(self.data_dir / "users.json", users)
+        self._users_compacted = len(users)
+        try:
+            (self.data_dir / USERS_LOG_NAME).unlink()
+        except FileNotFoundError:
+            pass
+
+    def save_user(self, username: str, user: Dict[str, Any]) -> None:
+        # Una riga nel log delle modifiche; users.json viene riscritto con la stessa
+        # politica di compattazione dei documenti (o subito se non esiste ancora)
+        with file_lock(lock_path(self.data_dir, "users")):
+            users_log = self.data_dir / USERS_LOG_NAME
+            with open(users_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"username": username, "user": user}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if (self._users_compacted is None or not (self.data_dir / "users.json").exists()
+                    or compaction_due(len(read_log_records(users_log)), self._users_compacted)):
+                self._write_users(self.load_users())
+
+    def users_version(self) -> Any:
+        # Cambia anche con le scritture di altri processi (mtime e dimensione dei file)
+        return _file_version(self.data_dir / "users.json"), _file_version(self.data_dir / USERS_LOG_NAME)
+
+    def list_user_ids(self) -> List[str]:
+        user_ids = {path.stem for path in self.data_dir.glob("*.json") if path.name != "users.json"}
+        user_ids.update(path.name[:-len(LOG_SUFFIX)] for path in self.data_dir.glob(f"*{LOG_SUFFIX}"))
+        return sorted(user_ids)
+
+    def user_exists(self, user_id: str) -> bool:
+        return self._user_file(user_id).exists() or log_path(self.data_dir, user_id).exists()
+
+    def document_version(self, user_id: str) -> Any:
+        return (self._versions.get(user_id, 0), _file_version(self._user_file(user_id)),
+                _file_version(log_path(self.data_dir, user_id)))
+
+    def load_document(self, user_id: str) -> Optional[Dict[str, Any]]:
+        # Il documento conserva "log_seq": salvato di nuovo (o sincronizzato e riscaricato)
+        # non perde né duplica i record aggiunti nel frattempo
+        return load_user_document(user_id, self.data_dir)
+
+    def _write(self, user_id: str, data: Dict[str, Any], log_seq: int) -> None:
+        data = dict(data, log_seq=log_seq)
+        atomic_write_json(self._user_file(user_id), data)
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        qa = (data.get(NUTRITIONAL_INFO_FIELD) or {}).get("agent_qa") or []
+        self._compacted_size[user_id] = len(data.get(CHAT_FIELD) or []) + len(qa)
+
+    def save_document(self, user_id: str, data: Dict[str, Any]) -> None:
+        # Senza "log_seq" il documento sostituisce anche tutti i record del log
+        self._log.compact(user_id, lambda log_seq: self._write(user_id, data, log_seq), upto=data.get("log_seq"))
+
+    def update_fields(self, user_id: str, fields: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> None:
+        def write(log_seq):
+            data = self.load_document(user_id) or {}
+            data.update(fields)
+            for field, value in (defaults or {}).items():
+                data.setdefault(field, value)
+            self._write(user_id, data, log_seq)
+
+        self._log.compact(user_id, write)
+
+    def modify_field(self, user_id: str, field: str, modify: Callable[[Any], Any], default: Any = None) -> Any:
+        with self._log.locked(user_id):
+            data = self.load_document(user_id) or {}
+            value = modify(data.get(field, default))
+            if value is not None:
+                data[field] = value
+                self._log.compact(user_id, lambda log_seq: self._write(user_id, data, log_seq))
+            return value
+
+    def remove_fields(self, user_id: str, fields: List[str]) -> None:
+        with self._log.locked(user_id):
+            data = self.load_document(user_id)
+            if data is None or not any(field in data for field in fields):
+                return
+            for field in fields:
+                data.pop(field, None)
+            self._log.compact(user_id, lambda log_seq: self._write(user_id, data, log_seq))
+
+    def _append(self, user_id: str, record_type: str, **fields) -> bool:
+        return self._append_records(user_id, [(record_type, fields)])
+
+    def _append_records(self, user_id: str, records) -> bool:
+        pending = self._log.append_many(user_id, records)
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        if user_id not in self._compacted_size:
+            data = load_user_document(user_id, self.data_dir) or {}
+            qa = (data.get(NUTRITIONAL_INFO_FIELD) or {}).get("agent_qa") or []
+            self._compacted_size[user_id] = max(len(data.get(CHAT_FIELD) or []) + len(qa) - pending, 0)
+        if not compaction_due(pending, self._compacted_size[user_id]):
+            return False
+        self.update_fields(user_id, {})
+        return True
+
+    def append_chat_message(self, user_id: str, message: Dict[str, Any]) -> bool:
+        return self._append(user_id, "chat", **message)
+
+    def append_agent_qa(self, user_id: str, qa: Dict[str, Any]) -> bool:
+        return self._append(user_id, "qa", **qa)
+
+    def increment_interactions(self, user_id: str) -> bool:
+        return self._append(user_id, "interaction")
+
+    def apply_batch(self, user_id: str, fields: Optional[Dict[str, Any]] = None,
+                    defaults: Optional[Dict[str, Any]] = None, chat_messages: List[Dict[str, Any]] = (),
+                    agent_qa: List[Dict[str, Any]] = (), interactions: int = 0) -> None:
+        if not fields and not defaults:
+            # Solo record: un'unica append al log
+            records = [("chat", message) for message in chat_messages]
+            records += [("qa", qa) for qa in agent_qa]
+            records += [("interaction", {})] * interactions
+            if records:
+                self._append_records(user_id, records)
+            return
+
+        def write(log_seq):
+            data = merge_batch(self.load_document(user_id) or {}, fields, defaults, chat_messages, agent_qa, interactions)
+            self._write(user_id, data, log_seq)
+
+        self._log.compact(user_id, write)
+
+
+class SQLiteUserStorage(UserStorage):
+    """Backend SQLite (WAL): tabelle per utenti, campi JSON, chat e QA.
+
+    Thread-safe: ogni thread usa la propria connessione, le scritture composte sono
+    transazioni BEGIN IMMEDIATE e più processi possono condividere lo stesso file.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL UNIQUE,
+            email TEXT,
+            password_hash TEXT,
+            created_at REAL,
+            extra TEXT
+        );
+        CREATE INDEX IF NOT EXISTS users_email ON users (email);
+        CREATE TABLE IF NOT EXISTS users_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO users_version (id, version) VALUES (0, 0);
+        CREATE TABLE IF NOT EXISTS user_documents (
+            user_id TEXT PRIMARY KEY,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS user_fields (
+            user_id TEXT NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (user_id, field)
+        );
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp REAL
+        );
+        CREATE INDEX IF NOT EXISTS chat_messages_user ON chat_messages (user_id, id);
+        CREATE TABLE IF NOT EXISTS agent_qa (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            question TEXT,
+            answer TEXT,
+            timestamp REAL
+        );
+        CREATE INDEX IF NOT EXISTS agent_qa_user ON agent_qa (user_id, id);
+    """
+
+    USER_COLUMNS = ("username", "user_id", "email", "password_hash", "created_at")
+
+    def __init__(self, path: str = "user_data/user_data.db"):
+        """
+        Args:
+            path: Percorso del database SQLite
+        """
+        self.path = str(path)
+        self._local = threading.local()
+        # Record aggiunti per utente dall'ultima sincronizzazione e righe di chat/QA
+        # per utente (solo in memoria, per la politica di sincronizzazione)
+        self._pending = {}
+        self._row_counts = {}
+        self._pending_lock = threading.Lock()
+        # Scritture per utente di questo processo (quelle di altri processi cambiano updated_at)
+        self._versions = {}
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    # ==================== UTENTI ====================
+
+    def load_users(self) -> Dict[str, Dict[str, Any]]:
+        users = {}
+        rows = self._connection().execute(
+            "SELECT username, user_id, email, password_hash, created_at, extra FROM users ORDER BY rowid"
+        )
+        for row in rows:
+            user = dict(zip(self.USER_COLUMNS, row[:5]))
+            if row[5]:
+                user.update(json.loads(row[5]))
+            users[user["username"]] = user
+        return users
+
+    def save_users(self, users: Dict[str, Dict[str, Any]]) -> None:
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM users")
+            for username, user in users.items():
+                self._insert_user(connection, username, user)
+            self._bump_users_version(connection)
+
+    def save_user(self, username: str, user: Dict[str, Any]) -> None:
+        with self._transaction() as connection:
+            self._insert_user(connection, username, user)
+            self._bump_users_version(connection)
+
+    def _bump_users_version(self, connection):
+        # Contatore nel database: vede anche le modifiche degli altri processi
+        connection.execute("UPDATE users_version SET version = version + 1 WHERE id = 0")
+
+    def users_version(self) -> Any:
+        return self._connection().execute("SELECT version FROM users_version WHERE id = 0").fetchone()[0]
+
+    def _insert_user(self, connection, username, user):
+        extra = {k: v for k, v in user.items() if k not in self.USER_COLUMNS}
+        connection.execute(
+            "INSERT OR REPLACE INTO users (username, user_id, email, password_hash, created_at, extra) VALUES (?, ?, ?, ?, ?, ?)",
+            (username, user["user_id"], user.get("email"), user.get("password_hash"),
+             user.get("created_at"), json.dumps(extra, ensure_ascii=False) if extra else None)
+        )
+
+    def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Ricerca indicizzata di un utente per email (username incluso nel risultato)."""
+        row = self._connection().execute(
+            "SELECT username, user_id, email, password_hash, created_at FROM users WHERE email = ?", (email,)
+        ).fetchone()
+        return dict(zip(self.USER_COLUMNS, row)) if row else None
+
+    # ==================== DOCUMENTI ====================
+
+    def list_user_ids(self) -> List[str]:
+        rows = self._connection().execute("SELECT user_id FROM user_documents ORDER BY user_id")
+        return [row[0] for row in rows]
+
+    def user_exists(self, user_id: str) -> bool:
+        row = self._connection().execute("SELECT 1 FROM user_documents WHERE user_id = ?", (user_id,)).fetchone()
+        return row is not None
+
+    def _chat_history(self, connection, user_id):
+        rows = connection.execute(
+            "SELECT role, content, timestamp FROM chat_messages WHERE user_id = ? ORDER BY id", (user_id,)
+        )
+        return [{"role": role, "content": content, "timestamp": timestamp} for role, content, timestamp in rows]
+
+    def _agent_qa(self, connection, user_id):
+        rows = connection.execute(
+            "SELECT question, answer, timestamp FROM agent_qa WHERE user_id = ? ORDER BY id", (user_id,)
+        )
+        return [{"question": question, "answer": answer, "timestamp": timestamp} for question, answer, timestamp in rows]
+
+    def _field(self, connection, user_id, field):
+        """Legge un campo: (True, valore) se presente, (False, None) altrimenti."""
+        if field == CHAT_FIELD:
+            return True, self._chat_history(connection, user_id)
+        row = connection.execute(
+            "SELECT value FROM user_fields WHERE user_id = ? AND field = ?", (user_id, field)
+        ).fetchone()
+        if row is None:
+            return False, None
+        value = json.loads(row[0])
+        if field == NUTRITIONAL_INFO_FIELD and isinstance(value, dict):
+            value["agent_qa"] = self._agent_qa(connection, user_id)
+        return True, value
+
+    def load_document(self, user_id: str) -> Optional[Dict[str, Any]]:
+        connection = self._connection()
+        # Lettura coerente di tutte le tabelle (snapshot WAL)
+        connection.execute("BEGIN")
+        try:
+            if not self.user_exists(user_id):
+                return None
+            data = {}
+            rows = connection.execute("SELECT field, value FROM user_fields WHERE user_id = ? ORDER BY rowid", (user_id,))
+            for field, value in rows.fetchall():
+                data[field] = json.loads(value)
+            data[CHAT_FIELD] = self._chat_history(connection, user_id)
+            if isinstance(data.get(NUTRITIONAL_INFO_FIELD), dict):
+                data[NUTRITIONAL_INFO_FIELD]["agent_qa"] = self._agent_qa(connection, user_id)
+            return data
+        finally:
+            connection.execute("COMMIT")
+
+    def document_version(self, user_id: str) -> Any:
+        row = self._connection().execute("SELECT updated_at FROM user_documents WHERE user_id = ?", (user_id,)).fetchone()
+        return self._versions.get(user_id, 0), row[0] if row else None
+
+    def get_field(self, user_id: str, field: str, default: Any = None) -> Any:
+        if not self.user_exists(user_id):
+            return default
+        found, value = self._field(self._connection(), user_id, field)
+        return value if found else default
+
+    def _write_fields(self, connection, user_id, fields):
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        connection.execute(
+            "INSERT INTO user_documents (user_id, updated_at) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (user_id, time.time())
+        )
+        for field, value in fields.items():
+            if field == "log_seq":
+                continue
+            if field == CHAT_FIELD:
+                connection.execute("DELETE FROM chat_messages WHERE user_id = ?", (user_id,))
+                connection.executemany(
+                    "INSERT INTO chat_messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                    [(user_id, m.get("role"), m.get("content"), m.get("timestamp")) for m in value or []]
+                )
+                continue
+            if field == NUTRITIONAL_INFO_FIELD:
+                qa = []
+                if isinstance(value, dict):
+                    value = dict(value)
+                    qa = value.pop("agent_qa", None) or []
+                connection.execute("DELETE FROM agent_qa WHERE user_id = ?", (user_id,))
+                connection.executemany(
+                    "INSERT INTO agent_qa (user_id, question, answer, timestamp) VALUES (?, ?, ?, ?)",
+                    [(user_id, q.get("question"), q.get("answer"), q.get("timestamp")) for q in qa]
+                )
+            connection.execute(
+                "INSERT INTO user_fields (user_id, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, field) DO UPDATE SET value = excluded.value",
+                (user_id, field, json.dumps(value, ensure_ascii=False))
+            )
+
+    def save_document(self, user_id: str, data: Dict[str, Any]) -> None:
+        self._forget_counts(user_id)
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM user_fields WHERE user_id = ?", (user_id,))
+            connection.execute("DELETE FROM chat_messages WHERE user_id = ?", (user_id,))
+            connection.execute("DELETE FROM agent_qa WHERE user_id = ?", (user_id,))
+            self._write_fields(connection, user_id, data)
+
+    def update_fields(self, user_id: str, fields: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> None:
+        self._forget_counts(user_id)
+        with self._transaction() as connection:
+            self._write_fields(connection, user_id, fields)
+            for field, value in (defaults or {}).items():
+                connection.execute(
+                    "INSERT OR IGNORE INTO user_fields (user_id, field, value) VALUES (?, ?, ?)",
+                    (user_id, field, json.dumps(value, ensure_ascii=False))
+                )
+
+    def modify_field(self, user_id: str, field: str, modify: Callable[[Any], Any], default: Any = None) -> Any:
+        with self._transaction() as connection:
+            found, value = self._field(connection, user_id, field) if self.user_exists(user_id) else (False, None)
+            value = modify(value if found else default)
+            if value is not None:
+                if field in (CHAT_FIELD, NUTRITIONAL_INFO_FIELD):
+                    self._forget_counts(user_id)
+                self._write_fields(connection, user_id, {field: value})
+            return value
+
+    def remove_fields(self, user_id: str, fields: List[str]) -> None:
+        self._forget_counts(user_id)
+        with self._transaction() as connection:
+            if not self.user_exists(user_id):
+                return
+            self._write_fields(connection, user_id, {})
+            for field in fields:
+                connection.execute("DELETE FROM user_fields WHERE user_id = ? AND field = ?", (user_id, field))
+                if field == CHAT_FIELD:
+                    connection.execute("DELETE FROM chat_messages WHERE user_id = ?", (user_id,))
+                elif field == NUTRITIONAL_INFO_FIELD:
+                    connection.execute("DELETE FROM agent_qa WHERE user_id = ?", (user_id,))
+
+    def _record_append(self, user_id: str, table: Optional[str]) -> bool:
+        """Conta i record aggiunti e indica quando sincronizzare il documento completo."""
+        if table is not None and (user_id, table) not in self._row_counts:
+            count = self._connection().execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (user_id,)).fetchone()[0]
+        with self._pending_lock:
+            pending = self._pending.get(user_id, 0) + 1
+            self._pending[user_id] = pending
+            if table is not None:
+                if (user_id, table) in self._row_counts:
+                    self._row_counts[(user_id, table)] += 1
+                else:
+                    self._row_counts[(user_id, table)] = count
+            rows = sum(self._row_counts.get((user_id, name), 0) for name in ("chat_messages", "agent_qa"))
+            if not compaction_due(pending, max(rows - pending, 0)):
+                return False
+            self._pending[user_id] = 0
+            return True
+
+    def _forget_counts(self, user_id: str) -> None:
+        with self._pending_lock:
+            self._row_counts.pop((user_id, "chat_messages"), None)
+            self._row_counts.pop((user_id, "agent_qa"), None)
+
+    def append_chat_message(self, user_id: str, message: Dict[str, Any]) -> bool:
+        with self._transaction() as connection:
+            self._write_fields(connection, user_id, {})
+            connection.execute(
+                "INSERT INTO chat_messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                (user_id, message.get("role"), message.get("content"), message.get("timestamp"))
+            )
+        return self._record_append(user_id, "chat_messages")
+
+    def append_agent_qa(self, user_id: str, qa: Dict[str, Any]) -> bool:
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT value FROM user_fields WHERE user_id = ? AND field = ?", (user_id, NUTRITIONAL_INFO_FIELD)
+            ).fetchone()
+            # Come nel documento JSON, gli agent_qa esistono solo insieme a nutritional_info
+            if row is None or not isinstance(json.loads(row[0]), dict):
+                return False
+            self._write_fields(connection, user_id, {})
+            connection.execute(
+                "INSERT INTO agent_qa (user_id, question, answer, timestamp) VALUES (?, ?, ?, ?)",
+                (user_id, qa.get("question"), qa.get("answer"), qa.get("timestamp"))
+            )
+        return self._record_append(user_id, "agent_qa")
+
+    def _add_interactions(self, connection, user_id, count):
+        connection.execute(
+            "INSERT INTO user_fields (user_id, field, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, field) DO UPDATE SET value = CAST(CAST(value AS INTEGER) + ? AS TEXT)",
+            (user_id, INTERACTIONS_FIELD, str(count), count)
+        )
+
+    def increment_interactions(self, user_id: str) -> bool:
+        with self._transaction() as connection:
+            self._write_fields(connection, user_id, {})
+            self._add_interactions(connection, user_id, 1)
+        return self._record_append(user_id, None)
+
+    def apply_batch(self, user_id: str, fields: Optional[Dict[str, Any]] = None,
+                    defaults: Optional[Dict[str, Any]] = None, chat_messages: List[Dict[str, Any]] = (),
+                    agent_qa: List[Dict[str, Any]] = (), interactions: int = 0) -> None:
+        self._forget_counts(user_id)
+        with self._transaction() as connection:
+            self._write_fields(connection, user_id, fields or {})
+            for field, value in (defaults or {}).items():
+                connection.execute(
+                    "INSERT OR IGNORE INTO user_fields (user_id, field, value) VALUES (?, ?, ?)",
+                    (user_id, field, json.dumps(value, ensure_ascii=False))
+                )
+            connection.executemany(
+                "INSERT INTO chat_messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                [(user_id, m.get("role"), m.get("content"), m.get("timestamp")) for m in chat_messages]
+            )
+            if agent_qa:
+                row = connection.execute(
+                    "SELECT value FROM user_fields WHERE user_id = ? AND field = ?", (user_id, NUTRITIONAL_INFO_FIELD)
+                ).fetchone()
+                if row is not None and isinstance(json.loads(row[0]), dict):
+                    connection.executemany(
+                        "INSERT INTO agent_qa (user_id, question, answer, timestamp) VALUES (?, ?, ?, ?)",
+                        [(user_id, q.get("question"), q.get("answer"), q.get("timestamp")) for q in agent_qa]
+                    )
+            if interactions:
+                self._add_interactions(connection, user_id, interactions)
+
+
+def migrate_user_storage(source: UserStorage, target: UserStorage) -> Dict[str, Any]:
+    """
+    Copia utenti e documenti da un backend all'altro (es. dalla directory JSON a SQLite).
+
+    I documenti già presenti nel backend di destinazione vengono sostituiti; i documenti
+    che non si riescono a leggere vengono saltati e riportati negli errori.
+
+    Args:
+        source: Backend di origine
+        target: Backend di destinazione
+
+    Returns:
+        Dict con success, users, documents, errors ed error_message
+    """
+    errors = []
+    try:
+        users = source.load_users()
+        target.save_users(users)
+    except Exception as e:
+        return {
+            "success": False,
+            "users": 0,
+            "documents": 0,
+            "errors": [],
+            "error_message": f"Errore nella migrazione degli utenti: {str(e)}"
+        }
+
+    documents = 0
+    for user_id in source.list_user_ids():
+        try:
+            data = source.load_document(user_id)
+            if data is None:
+                continue
+            target.save_document(user_id, data)
+            documents += 1
+        except Exception as e:
+            logger.warning(f"Documento {user_id} non migrato: {str(e)}")
+            errors.append({"user_id": user_id, "error": str(e)})
+
+    return {
+        "success": not errors,
+        "users": len(users),
+        "documents": documents,
+        "errors": errors,
+        "error_message": f"{len(errors)} documenti non migrati" if errors else None
+    }
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_user_storage(data_dir: str = "user_data", backend: Optional[str] = None) -> UserStorage:
+    """
+    Restituisce il backend di persistenza condiviso dal processo.
+
+    Args:
+        data_dir: Directory dei dati utente (il database SQLite è data_dir/user_data.db
+            se NUTRICOACH_USER_DB_PATH non è impostato)
+        backend: "json" o "sqlite" (default: NUTRICOACH_USER_STORAGE, "json")
+
+    Returns:
+        UserStorage: istanza condivisa per backend e percorso
+
+    Raises:
+        ValueError: Se il backend non è supportato
+    """
+    backend = backend or USER_STORAGE_BACKEND
+    if backend not in USER_STORAGE_BACKENDS:
+        raise ValueError(f"Backend di persistenza non supportato: {backend}. Valori ammessi: {USER_STORAGE_BACKENDS}")
+
+    if backend == "sqlite":
+        location = os.path.abspath(USER_DB_PATH or os.path.join(data_dir, "user_data.db"))
+    else:
+        location = os.path.abspath(data_dir)
+
+    with _storages_lock:
+        storage = _storages.get((backend, location))
+        if storage is None:
+            storage = SQLiteUserStorage(location) if backend == "sqlite" else JsonUserStorage(location)
+            _storages[(backend, location)] = storage
+        return storage
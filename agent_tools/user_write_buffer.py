@@ -0,0 +1,373 @@
+"""
+Persistenza write-behind dei documenti utente.
+
+Durante un turno di chat UserDataManager salva il messaggio dell'utente, le
+statistiche dei costi, la risposta dell'assistente e la domanda/risposta
+dell'agente: con la scrittura immediata sono circa cinque scritture su disco
+(e altrettante sincronizzazioni). WriteBehindUserStorage accumula queste
+modifiche in un buffer per utente, unendo gli aggiornamenti degli stessi campi,
+e le scrive con un'unica apply_batch del backend:
+
+- alla fine del turno, con flush(user_id) esplicito;
+- al più tardi dopo NUTRICOACH_USER_FLUSH_MS millisecondi (default 2000) dalla
+  prima modifica in attesa, tramite un thread in background;
+- alla chiusura del processo (atexit), così nessuna modifica va persa in uno
+  spegnimento regolare.
+
+Dopo ogni flush viene chiamata on_flush(user_id, documento), usata per
+un'unica sincronizzazione con Supabase per turno. Le letture tramite il buffer
+vedono già le modifiche in attesa, anche mentre vengono scritte: il flush scrive
+fuori dal lock del buffer, quindi non rallenta letture e scritture degli altri utenti. Con NUTRICOACH_USER_FLUSH_MS=0 UserDataManager
+scrive direttamente sul backend.
+"""
+
+import atexit
+import copy
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from .user_storage import (
+    UserStorage, merge_batch, CHAT_FIELD, NUTRITIONAL_INFO_FIELD, INTERACTIONS_FIELD
+)
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+USER_FLUSH_INTERVAL_MS = int(os.environ.get("NUTRICOACH_USER_FLUSH_MS", "2000"))
+
+
+@dataclass
+class PendingWrites:
+    """Modifiche in attesa per un utente, nella forma attesa da apply_batch."""
+    fields: Dict[str, Any] = field(default_factory=dict)
+    defaults: Dict[str, Any] = field(default_factory=dict)
+    chat_messages: List[Dict[str, Any]] = field(default_factory=list)
+    agent_qa: List[Dict[str, Any]] = field(default_factory=list)
+    interactions: int = 0
+    due: float = 0.0
+    # Versione del documento nel backend letta prima della scrittura del batch
+    base_version: Any = None
+
+    def as_batch(self) -> Dict[str, Any]:
+        return {
+            "fields": self.fields,
+            "defaults": self.defaults,
+            "chat_messages": self.chat_messages,
+            "agent_qa": self.agent_qa,
+            "interactions": self.interactions
+        }
+
+    def add_fields(self, fields: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> None:
+        """Aggiunge aggiornamenti di campi dopo le modifiche già accumulate."""
+        self.fields.update(fields)
+        # Una chat_history o nutritional_info completa include già i record precedenti
+        if CHAT_FIELD in fields:
+            self.chat_messages = []
+        if NUTRITIONAL_INFO_FIELD in fields:
+            self.agent_qa = []
+        if INTERACTIONS_FIELD in fields:
+            self.interactions = 0
+        for name, value in (defaults or {}).items():
+            if name not in self.fields:
+                self.defaults.setdefault(name, copy.deepcopy(value))
+
+    def extend(self, newer: "PendingWrites") -> None:
+        """Accoda le modifiche successive di un altro buffer dello stesso utente."""
+        self.add_fields(newer.fields, newer.defaults)
+        self.chat_messages.extend(newer.chat_messages)
+        self.agent_qa.extend(newer.agent_qa)
+        self.interactions += newer.interactions
+
+
+class WriteBehindUserStorage(UserStorage):
+    """Buffer write-behind per utente davanti a un backend UserStorage.
+
+    Thread-safe: il lock protegge solo i buffer in memoria. Le scritture sul backend,
+    le letture e la callback on_flush avvengono fuori dal lock, quindi il flush di un
+    utente non blocca gli altri; i batch di uno stesso utente sono scritti uno alla
+    volta e in ordine, e le letture uniscono il batch in scrittura finché non è scritto.
+    Tra processi diversi le scritture sono serializzate dal lock per utente del backend.
+    """
+
+    def __init__(self, storage: UserStorage, flush_interval: float = USER_FLUSH_INTERVAL_MS / 1000,
+                 on_flush: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+        """
+        Args:
+            storage: Backend su cui scrivere le modifiche
+            flush_interval: Secondi massimi di attesa di una modifica prima del flush
+            on_flush: Funzione chiamata con (user_id, documento) dopo ogni flush
+        """
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self._pending: Dict[str, PendingWrites] = {}
+        # Batch in scrittura sul backend, scritture iniziate e modifiche ricevute per utente
+        self._in_flight: Dict[str, PendingWrites] = {}
+        self._started: Dict[str, int] = {}
+        self._writes: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._condition = threading.Condition(self._lock)
+        self._worker = None
+        self._closed = False
+        atexit.register(self.close)
+
+    # ==================== BUFFER ====================
+
+    def _buffer(self, user_id: str) -> PendingWrites:
+        """Restituisce le modifiche in attesa dell'utente e pianifica il flush."""
+        pending = self._pending.get(user_id)
+        if pending is None:
+            pending = PendingWrites(due=time.monotonic() + self.flush_interval)
+            self._pending[user_id] = pending
+            self._start_worker()
+            self._condition.notify_all()
+        self._writes[user_id] = self._writes.get(user_id, 0) + 1
+        return pending
+
+    def _start_worker(self) -> None:
+        if self._worker is None and not self._closed:
+            self._worker = threading.Thread(target=self._run, name="user-write-behind", daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        """Thread in background: scrive le modifiche in attesa da più di flush_interval."""
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = [user_id for user_id, pending in self._pending.items() if pending.due <= now]
+                if not due:
+                    timeout = min((p.due for p in self._pending.values()), default=now + 60) - now
+                    self._condition.wait(timeout)
+                    continue
+            for user_id in due:
+                self.flush(user_id)
+
+    def flush(self, user_id: Optional[str] = None) -> int:
+        """
+        Scrive subito le modifiche in attesa.
+
+        Args:
+            user_id: Utente da scrivere (default: tutti)
+
+        Returns:
+            int: Numero di utenti scritti
+        """
+        with self._lock:
+            user_ids = list(self._pending) if user_id is None else [user_id]
+        return sum(1 for uid in user_ids if self._flush_user(uid))
+
+    def _begin_write(self, user_id: str, batch: PendingWrites) -> None:
+        """Segna il batch come in scrittura (da chiamare con il lock, senza altri batch in scrittura)."""
+        self._in_flight[user_id] = batch
+        self._started[user_id] = self._started.get(user_id, 0) + 1
+
+    def _end_write(self, user_id: str) -> None:
+        with self._condition:
+            del self._in_flight[user_id]
+            self._condition.notify_all()
+
+    def _flush_user(self, user_id: str) -> bool:
+        while True:
+            # Versione letta fuori dal lock, prima della scrittura (vedi load_document)
+            base_version = self.storage.document_version(user_id)
+            with self._condition:
+                if user_id not in self._in_flight:
+                    pending = self._pending.pop(user_id, None)
+                    if pending is None:
+                        return False
+                    pending.base_version = base_version
+                    self._begin_write(user_id, pending)
+                    break
+                # Un solo batch per utente in scrittura: l'ordine delle modifiche è preservato
+                self._condition.wait()
+
+        try:
+            self.storage.apply_batch(user_id, **pending.as_batch())
+        except Exception as e:
+            # Le modifiche restano in attesa, prima di quelle arrivate nel frattempo, e
+            # vengono riprovate al prossimo flush
+            logger.error(f"Errore nella scrittura dei dati dell'utente {user_id}: {str(e)}")
+            with self._condition:
+                del self._in_flight[user_id]
+                newer = self._pending.pop(user_id, None)
+                if newer is not None:
+                    pending.extend(newer)
+                pending.due = time.monotonic() + self.flush_interval
+                self._pending[user_id] = pending
+                self._condition.notify_all()
+            return False
+        self._end_write(user_id)
+
+        if self.on_flush:
+            try:
+                document = self.storage.load_document(user_id)
+                if document is not None:
+                    self.on_flush(user_id, document)
+            except Exception as e:
+                logger.warning(f"⚠️ Errore nella callback di flush per {user_id}: {str(e)}")
+        return True
+
+    def close(self) -> None:
+        """Scrive tutte le modifiche in attesa e ferma il thread in background."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._worker is not None and self._worker is not threading.current_thread():
+            self._worker.join()
+        self.flush()
+
+    def has_pending(self, user_id: str) -> bool:
+        """Indica se l'utente ha modifiche non ancora scritte (in attesa o in scrittura)."""
+        with self._lock:
+            return user_id in self._pending or user_id in self._in_flight
+
+    # ==================== LETTURE ====================
+
+    def load_users(self) -> Dict[str, Dict[str, Any]]:
+        return self.storage.load_users()
+
+    def save_users(self, users: Dict[str, Dict[str, Any]]) -> None:
+        self.storage.save_users(users)
+
+    def save_user(self, username: str, user: Dict[str, Any]) -> None:
+        self.storage.save_user(username, user)
+
+    def users_version(self) -> Any:
+        return self.storage.users_version()
+
+    def list_user_ids(self) -> List[str]:
+        with self._lock:
+            buffered = set(self._pending) | set(self._in_flight)
+        return sorted(set(self.storage.list_user_ids()) | buffered)
+
+    def user_exists(self, user_id: str) -> bool:
+        return self.has_pending(user_id) or self.storage.user_exists(user_id)
+
+    def document_version(self, user_id: str) -> Any:
+        # Cambia a ogni modifica ricevuta e quando un batch viene scritto sul backend
+        with self._lock:
+            writes = self._writes.get(user_id, 0)
+        return self.storage.document_version(user_id), writes
+
+    def load_document(self, user_id: str) -> Optional[Dict[str, Any]]:
+        while True:
+            with self._lock:
+                started = self._started.get(user_id, 0)
+                in_flight = self._in_flight.get(user_id)
+                base_version = in_flight.base_version if in_flight else None
+                batches = [copy.deepcopy(batch.as_batch()) for batch in (in_flight, self._pending.get(user_id)) if batch]
+            version = self.storage.document_version(user_id)
+            data = self.storage.load_document(user_id)
+            with self._lock:
+                unchanged = self._started.get(user_id, 0) == started
+            # Ripete la lettura se nel frattempo è iniziata o è stata scritta un'altra scrittura
+            if unchanged and self.storage.document_version(user_id) == version:
+                break
+
+        if in_flight is not None and (base_version is None or version != base_version):
+            # Il batch in scrittura è già nel documento letto (o è una scrittura diretta)
+            batches.pop(0)
+        if not batches:
+            return data
+        data = data or {}
+        for batch in batches:
+            data = merge_batch(data, **batch)
+        return data
+
+    def get_field(self, user_id: str, field: str, default: Any = None) -> Any:
+        if not self.has_pending(user_id):
+            return self.storage.get_field(user_id, field, default)
+        return super().get_field(user_id, field, default)
+
+    # ==================== SCRITTURE ====================
+
+    def save_document(self, user_id: str, data: Dict[str, Any]) -> None:
+        # Il documento completo sostituisce anche le modifiche in attesa
+        with self._condition:
+            while user_id in self._in_flight:
+                self._condition.wait()
+            self._pending.pop(user_id, None)
+            self._begin_write(user_id, PendingWrites())
+        try:
+            self.storage.save_document(user_id, data)
+        finally:
+            self._end_write(user_id)
+
+    def update_fields(self, user_id: str, fields: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> None:
+        # Copia dei valori: il chiamante può continuare a modificare le proprie liste
+        fields = copy.deepcopy(fields)
+        with self._lock:
+            self._buffer(user_id).add_fields(fields, defaults)
+
+    def modify_field(self, user_id: str, field: str, modify: Callable[[Any], Any], default: Any = None) -> Any:
+        # Le modifiche in attesa vanno scritte prima: modify deve vedere il valore corrente
+        self._flush_user(user_id)
+        return self.storage.modify_field(user_id, field, modify, default)
+
+    def remove_fields(self, user_id: str, fields: List[str]) -> None:
+        self._flush_user(user_id)
+        self.storage.remove_fields(user_id, fields)
+
+    def append_chat_message(self, user_id: str, message: Dict[str, Any]) -> bool:
+        with self._lock:
+            self._buffer(user_id).chat_messages.append(dict(message))
+        return False
+
+    def append_agent_qa(self, user_id: str, qa: Dict[str, Any]) -> bool:
+        with self._lock:
+            self._buffer(user_id).agent_qa.append(dict(qa))
+        return False
+
+    def increment_interactions(self, user_id: str) -> bool:
+        with self._lock:
+            self._buffer(user_id).interactions += 1
+        return False
+
+    def apply_batch(self, user_id: str, fields: Optional[Dict[str, Any]] = None,
+                    defaults: Optional[Dict[str, Any]] = None, chat_messages: List[Dict[str, Any]] = (),
+                    agent_qa: List[Dict[str, Any]] = (), interactions: int = 0) -> None:
+        fields = copy.deepcopy(fields or {})
+        with self._lock:
+            pending = self._buffer(user_id)
+            pending.add_fields(fields, defaults)
+            pending.chat_messages.extend(dict(m) for m in chat_messages)
+            pending.agent_qa.extend(dict(q) for q in agent_qa)
+            pending.interactions += interactions
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_write_behind_storage(storage: UserStorage, flush_interval: float = USER_FLUSH_INTERVAL_MS / 1000,
+                             on_flush: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> WriteBehindUserStorage:
+    """
+    Restituisce il buffer write-behind condiviso per un backend.
+
+    Tutti i gestori dello stesso backend (es. una sessione Streamlit per utente
+    collegato) condividono il buffer, così le letture vedono le modifiche in attesa.
+
+    Args:
+        storage: Backend di persistenza
+        flush_interval: Secondi massimi di attesa prima del flush (solo alla creazione)
+        on_flush: Funzione chiamata dopo ogni flush (impostata se il buffer non ne ha già una)
+
+    Returns:
+        WriteBehindUserStorage: buffer condiviso
+    """
+    with _buffers_lock:
+        buffer = _buffers.get(id(storage))
+        if buffer is None or buffer.storage is not storage:
+            buffer = WriteBehindUserStorage(storage, flush_interval, on_flush)
+            _buffers[id(storage)] = buffer
+        elif on_flush is not None and buffer.on_flush is None:
+            # Il buffer può essere stato creato prima da un lettore (es. la cache dei documenti)
+            buffer.on_flush = on_flush
+        return buffer
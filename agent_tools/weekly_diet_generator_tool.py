@@ -4,15 +4,30 @@ Tool per la generazione automatica di 6 giorni aggiuntivi di dieta.
 
 import os
 import json
+import atexit
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
 
-from .meal_optimization_tool import optimize_meal_portions
+from .meal_optimization_tool import optimize_day_meals
 from .nutridb_tool import get_user_id
+from .user_document_cache import get_user_document, flush_user_document
 
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Ottimizzazione parallela dei giorni: numero di worker (1 = sequenziale) e tipo di pool,
+# "process" (i giorni sono CPU-bound e in gran parte Python) oppure "thread"
+DAY_WORKERS = int(os.environ.get("NUTRICOACH_DAY_WORKERS", str(min(6, os.cpu_count() or 1))))
+DAY_EXECUTOR = os.environ.get("NUTRICOACH_DAY_EXECUTOR", "process")
+DAY_EXECUTORS = ("process", "thread")
+
+# Pool riutilizzati tra le chiamate, per (tipo, numero di worker)
+_day_pools = {}
+_day_pools_lock = threading.Lock()
+
 def normalize_meal_name(name):
     """Normalizza un nome di pasto per il confronto"""
     return name.lower().strip().replace(" ", "_").replace("-", "_")
@@ -264,19 +279,11 @@ def calculate_user_daily_proteins(user_id: str) -> float:
         Proteine totali giornaliere in grammi
     """
     try:
-        # Fix: Handle user_id that may already contain 'user_' prefix
-        if user_id.startswith("user_"):
-            user_file_path = f"user_data/{user_id}.json"
-        else:
-            user_file_path = f"user_data/user_{user_id}.json"
-        
-        if not os.path.exists(user_file_path):
+        user_data = get_user_document(user_id)
+        if user_data is None:
             logger.warning(f"File utente {user_id} non trovato, uso default 100g proteine")
             return 100.0
         
-        with open(user_file_path, 'r', encoding='utf-8') as f:
-            user_data = json.load(f)
-        
         # Estrai i totali giornalieri
         nutritional_info = user_data.get("nutritional_info_extracted", {})
         daily_macros = nutritional_info.get("daily_macros", {})
@@ -317,19 +324,11 @@ def extract_day1_meal_structure(user_id: str) -> Optional[Dict[str, List[str]]]:
     Returns:
         Dict con la struttura dei pasti o None se errore/file non trovato
     """
-    # Fix: Handle user_id that may already contain 'user_' prefix
-    if user_id.startswith("user_"):
-        user_file_path = f"user_data/{user_id}.json"
-    else:
-        user_file_path = f"user_data/user_{user_id}.json"
-    
-    if not os.path.exists(user_file_path):
-        logger.error(f"File utente {user_id} non trovato.")
-        return None
-    
     try:
-        with open(user_file_path, 'r', encoding='utf-8') as f:
-            user_data = json.load(f)
+        user_data = get_user_document(user_id)
+        if user_data is None:
+            logger.error(f"File utente {user_id} non trovato.")
+            return None
         
         # Estrai la struttura dai daily_macros invece che da weekly_diet_day_1
         nutritional_info = user_data.get("nutritional_info_extracted", {})
@@ -412,19 +411,11 @@ def extract_day1_real_meals(user_id: str) -> Optional[Dict[str, List[str]]]:
     Returns:
         Dict con liste di alimenti reali per ogni pasto o None se errore
     """
-    # Fix: Handle user_id that may already contain 'user_' prefix
-    if user_id.startswith("user_"):
-        user_file_path = f"user_data/{user_id}.json"
-    else:
-        user_file_path = f"user_data/user_{user_id}.json"
-    
-    if not os.path.exists(user_file_path):
-        logger.error(f"File utente {user_id} non trovato.")
-        return None
-    
     try:
-        with open(user_file_path, 'r', encoding='utf-8') as f:
-            user_data = json.load(f)
+        user_data = get_user_document(user_id)
+        if user_data is None:
+            logger.error(f"File utente {user_id} non trovato.")
+            return None
         
         # Estrai i pasti reali dal weekly_diet_day_1
         nutritional_info = user_data.get("nutritional_info_extracted", {})
@@ -640,49 +631,151 @@ def apply_special_rules_for_days_357(days_dict: Dict[str, Dict[str, List[str]]],
 
 
 def optimize_day_portions(day_meals: Dict[str, List[str]], user_id: str, include_substitutes: bool = True) -> Dict[str, Any]:
-    """Ottimizza le porzioni per tutti i pasti di un giorno."""
+    """
+    Ottimizza le porzioni per tutti i pasti di un giorno.
+    
+    I pasti vengono ottimizzati insieme con optimize_day_meals: una sola lettura del
+    file utente, un'unica risoluzione dei candidati di tutti i pasti e porzioni finali
+    scelte sul problema congiunto del giorno (target per pasto e totali giornalieri).
+    """
     optimized_day = {}
     
+    try:
+        day_results = optimize_day_meals(day_meals, user_id, include_substitutes=include_substitutes)
+    except Exception as e:
+        logger.error(f"Errore nell'ottimizzazione del giorno: {str(e)}")
+        day_results = {
+            meal_name: {"success": False, "error_message": str(e)}
+            for meal_name, food_list in day_meals.items() if food_list
+        }
+    
     for meal_name, food_list in day_meals.items():
         if not food_list:
             continue
+        
+        optimization_result = day_results.get(meal_name, {})
+        if optimization_result.get("success", False):
+            meal_data = {
+                "alimenti": optimization_result.get("portions", {}),
+                "target_nutrients": optimization_result.get("target_nutrients", {}),
+                "actual_nutrients": optimization_result.get("actual_nutrients", {}),
+                "macro_single_foods": optimization_result.get("macro_single_foods", {}),
+                "optimization_summary": optimization_result.get("optimization_summary", "")
+            }
             
-        try:
-            optimization_result = optimize_meal_portions(meal_name, food_list, user_id)
+            # Includi i sostituti solo se richiesto
+            if include_substitutes:
+                meal_data["substitutes"] = optimization_result.get("substitutes", {})
             
-            if optimization_result.get("success", False):
-                meal_data = {
-                    "alimenti": optimization_result.get("portions", {}),
-                    "target_nutrients": optimization_result.get("target_nutrients", {}),
-                    "actual_nutrients": optimization_result.get("actual_nutrients", {}),
-                    "macro_single_foods": optimization_result.get("macro_single_foods", {}),
-                    "optimization_summary": optimization_result.get("optimization_summary", "")
-                }
-                
-                # Includi i sostituti solo se richiesto
-                if include_substitutes:
-                    meal_data["substitutes"] = optimization_result.get("substitutes", {})
-                
-                optimized_day[meal_name] = meal_data
-                logger.info(f"Ottimizzato con successo {meal_name}")
-            else:
-                error_msg = optimization_result.get("error_message", "Errore sconosciuto")
-                logger.error(f"Errore nell'ottimizzazione di {meal_name}: {error_msg}")
-                optimized_day[meal_name] = {
-                    "error": error_msg,
-                    "alimenti_originali": food_list
-                }
-                
-        except Exception as e:
-            logger.error(f"Errore nell'ottimizzazione di {meal_name}: {str(e)}")
+            optimized_day[meal_name] = meal_data
+            logger.info(f"Ottimizzato con successo {meal_name}")
+        else:
+            error_msg = optimization_result.get("error_message", "Errore sconosciuto")
+            logger.error(f"Errore nell'ottimizzazione di {meal_name}: {error_msg}")
             optimized_day[meal_name] = {
-                "error": str(e),
+                "error": error_msg,
                 "alimenti_originali": food_list
             }
     
     return optimized_day
 
 
+def _get_day_pool(executor: str, workers: int):
+    """Restituisce il pool per l'ottimizzazione dei giorni, creandolo al primo utilizzo.
+    
+    I processi vengono creati con forkserver (con questo modulo precaricato, così ogni
+    worker parte senza reimportare NutriDB e scipy) o con spawn dove non è disponibile;
+    mai con fork, che non è sicuro in un processo con thread attivi come Streamlit.
+    """
+    with _day_pools_lock:
+        pool = _day_pools.get((executor, workers))
+        if pool is None:
+            if executor == "thread":
+                pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="day_optimizer")
+            else:
+                if "forkserver" in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context("forkserver")
+                    context.set_forkserver_preload([__name__])
+                else:
+                    context = multiprocessing.get_context("spawn")
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _day_pools[(executor, workers)] = pool
+        return pool
+
+
+def shutdown_day_pools() -> None:
+    """Chiude i pool dell'ottimizzazione dei giorni (anche alla chiusura del processo)."""
+    with _day_pools_lock:
+        pools = list(_day_pools.values())
+        _day_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_day_pools)
+
+
+def optimize_days(days: Dict[str, Dict[str, List[str]]], user_id: str, include_substitutes: bool = True,
+                  workers: Optional[int] = None, executor: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Ottimizza più giorni in parallelo con optimize_day_portions.
+    
+    I giorni sono indipendenti, quindi vengono distribuiti su un pool di worker; il
+    risultato mantiene l'ordine di days e non dipende dal numero di worker (la ricerca
+    discreta delle porzioni è limitata da un budget di nodi, non dal tempo). Se il pool
+    non è utilizzabile, i giorni mancanti vengono ottimizzati nel processo corrente.
+    
+    Args:
+        days: Dict giorno -> pasti del giorno (nome pasto -> lista alimenti)
+        user_id: ID dell'utente
+        include_substitutes: Se True include i sostituti per ogni pasto
+        workers: Numero di worker (default NUTRICOACH_DAY_WORKERS o il numero di CPU, max 6)
+        executor: "process" o "thread" (default NUTRICOACH_DAY_EXECUTOR o "process")
+        
+    Returns:
+        Dict giorno -> pasti ottimizzati, nello stesso ordine di days
+        
+    Raises:
+        ValueError: Se executor non è supportato
+    """
+    workers = DAY_WORKERS if workers is None else workers
+    executor = executor or DAY_EXECUTOR
+    if executor not in DAY_EXECUTORS:
+        raise ValueError(f"Executor non supportato: {executor}. Valori ammessi: {', '.join(DAY_EXECUTORS)}")
+    
+    day_keys = list(days.keys())
+    workers = min(workers, len(day_keys))
+    futures = {}
+    if workers > 1:
+        if executor == "process":
+            # I worker leggono i dati utente solo dal disco
+            flush_user_document(user_id)
+        try:
+            pool = _get_day_pool(executor, workers)
+            futures = {
+                day_key: pool.submit(optimize_day_portions, days[day_key], user_id, include_substitutes)
+                for day_key in day_keys
+            }
+        except Exception as e:
+            logger.warning(f"Pool di ottimizzazione non disponibile, procedo in sequenza: {str(e)}")
+    
+    results = {}
+    for day_key in day_keys:
+        if day_key in futures:
+            try:
+                results[day_key] = futures[day_key].result()
+                continue
+            except Exception as e:
+                # Es. BrokenProcessPool: il pool viene ricreato alla prossima chiamata
+                logger.warning(f"Errore del worker per {day_key}, lo ottimizzo nel processo corrente: {str(e)}")
+                with _day_pools_lock:
+                    _day_pools.pop((executor, workers), None)
+        logger.info(f"Ottimizzazione {day_key}...")
+        results[day_key] = optimize_day_portions(days[day_key], user_id, include_substitutes)
+    
+    return results
+
+
 def generate_6_additional_days(user_id: Optional[str] = None, day_range: Optional[str] = None) -> Dict[str, Any]:
     """
     Genera automaticamente giorni aggiuntivi di dieta per l'utente.
@@ -696,7 +789,7 @@ def generate_6_additional_days(user_id: Optional[str] = None, day_range: Optiona
     3. Carica i 6 giorni predefiniti dal file JSON
     4. Adatta ogni giorno predefinito alla struttura del giorno 1
     5. Applica regole speciali per giorni 3, 5, 7 (copia colazione e spuntini dal giorno 1)
-    6. Ottimizza le porzioni di ogni pasto per ogni giorno
+    6. Ottimizza le porzioni di ogni giorno, in parallelo (vedi optimize_days)
     7. Include nei risultati finali solo i giorni richiesti
     
     STRUTTURA INPUT UTENTE (esempio):
@@ -820,7 +913,7 @@ def generate_6_additional_days(user_id: Optional[str] = None, day_range: Optiona
         adapted_days = apply_special_rules_for_days_357(adapted_days, day1_structure, user_id)
         logger.info("Applicate regole speciali per giorni 3, 5, 7")
         
-        final_days = {}
+        days_to_optimize = {}
         for day_key, day_meals in adapted_days.items():
             # Estrai il numero del giorno dalla chiave (es. "giorno_2" → 2)
             day_number = int(day_key.split("_")[1])
@@ -830,8 +923,10 @@ def generate_6_additional_days(user_id: Optional[str] = None, day_range: Optiona
                 logger.info(f"Saltato {day_key} (non nel range richiesto)")
                 continue
             
-            logger.info(f"Ottimizzazione {day_key}...")
-            final_days[day_key] = optimize_day_portions(day_meals, user_id, include_substitutes=False)
+            days_to_optimize[day_key] = day_meals
+        
+        # I giorni sono indipendenti: vengono ottimizzati in parallelo, in ordine
+        final_days = optimize_days(days_to_optimize, user_id, include_substitutes=False)
         
         logger.info("Generazione completata con successo")
         
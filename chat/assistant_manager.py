@@ -3,11 +3,152 @@ Modulo per la gestione dell'assistente OpenAI.
 
 Gestisce la creazione, configurazione e mantenimento dell'assistente
 utilizzato per le conversazioni nutrizionali.
+
+Gli assistenti sono condivisi da tutte le sessioni e dai riavvii: AssistantRegistry
+associa l'hash della configurazione (nome, istruzioni, schema dei tool, modello)
+all'ID dell'assistente OpenAI creato per essa, salvato in
+NUTRICOACH_ASSISTANT_REGISTRY_PATH (default .nutricoach_assistants.json). Un nuovo
+assistente viene creato solo quando la configurazione cambia.
 """
 
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
 import streamlit as st
 from agent import available_tools, system_prompt
 from agent.prompts import system_prompt_pdf_diet
+from agent_tools.atomic_files import atomic_write_json, file_lock, lock_path
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+ASSISTANT_MODEL = "gpt-4.1"
+ASSISTANT_REGISTRY_PATH = os.environ.get("NUTRICOACH_ASSISTANT_REGISTRY_PATH", ".nutricoach_assistants.json")
+
+
+def assistant_config_hash(name: str, instructions: str, tools: List[Dict[str, Any]], model: str) -> str:
+    """Hash della configurazione di un assistente (JSON canonico)."""
+    config = {"name": name, "instructions": instructions, "tools": tools, "model": model}
+    canonical = json.dumps(config, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class AssistantRegistry:
+    """Assistenti OpenAI condivisi dal processo, indicizzati per hash della configurazione.
+
+    Il file del registro è letto e scritto sotto un lock tra processi, quindi più
+    worker che partono insieme creano un solo assistente per configurazione.
+    """
+
+    def __init__(self, path: str = ASSISTANT_REGISTRY_PATH):
+        """
+        Args:
+            path: File JSON del registro (hash -> ID dell'assistente)
+        """
+        self.path = path
+        self._lock_path = lock_path(os.path.dirname(os.path.abspath(path)), os.path.basename(path))
+        self._assistants = {}
+        self._lock = threading.Lock()
+
+    def _read_entries(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Registro assistenti non leggibile ({self.path}): {str(e)}")
+            return {}
+
+    def get_or_create(self, openai_client, name: str, instructions: str,
+                      tools: List[Dict[str, Any]], model: str = ASSISTANT_MODEL):
+        """
+        Restituisce l'assistente per la configurazione, creandolo solo se non esiste.
+
+        Args:
+            openai_client: Client OpenAI configurato
+            name: Nome dell'assistente
+            instructions: System prompt
+            tools: Schema dei tool disponibili
+            model: Modello OpenAI
+
+        Returns:
+            Assistant OpenAI
+
+        Raises:
+            Exception: Se la creazione o il recupero dell'assistente falliscono
+        """
+        config_hash = assistant_config_hash(name, instructions, tools, model)
+        with self._lock:
+            assistant = self._assistants.get(config_hash)
+            if assistant is not None:
+                return assistant
+
+            with file_lock(self._lock_path):
+                entries = self._read_entries()
+                entry = entries.get(config_hash)
+                if entry is not None:
+                    try:
+                        assistant = openai_client.beta.assistants.retrieve(entry["assistant_id"])
+                    except Exception as e:
+                        # Assistente eliminato dall'account: se ne crea uno nuovo
+                        if getattr(e, "status_code", None) != 404:
+                            raise
+                        logger.warning(f"⚠️ Assistente {entry['assistant_id']} non trovato, verrà ricreato")
+
+                if assistant is None:
+                    assistant = openai_client.beta.assistants.create(
+                        name=name,
+                        instructions=instructions,
+                        tools=tools,
+                        model=model,
+                        metadata={"config_hash": config_hash}
+                    )
+                    entries[config_hash] = {
+                        "assistant_id": assistant.id,
+                        "name": name,
+                        "model": model,
+                        "created_at": time.time()
+                    }
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    atomic_write_json(self.path, entries)
+                    logger.info(f"✅ Creato assistente {name} ({assistant.id})")
+
+            self._assistants[config_hash] = assistant
+            return assistant
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_assistant_registry(path: str = None) -> AssistantRegistry:
+    """
+    Restituisce il registro degli assistenti condiviso dal processo.
+
+    Args:
+        path: File del registro (default: NUTRICOACH_ASSISTANT_REGISTRY_PATH)
+
+    Returns:
+        AssistantRegistry: istanza condivisa per percorso
+    """
+    path = path or ASSISTANT_REGISTRY_PATH
+    key = os.path.abspath(path)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = AssistantRegistry(path)
+            _registries[key] = registry
+        return registry
 
 
 class AssistantManager:
@@ -47,6 +188,7 @@ class AssistantManager:
         """
         Crea o recupera l'assistente dalla sessione.
         Sceglie il tipo di assistente in base a se l'utente ha caricato un PDF.
+        L'assistente è condiviso tra le sessioni (vedi AssistantRegistry).
         
         Returns:
             Assistant OpenAI o None in caso di errore
@@ -60,25 +202,26 @@ class AssistantManager:
         
         if assistant_key not in st.session_state:
             try:
+                registry = get_assistant_registry()
                 if has_pdf:
-                    # Crea assistente per analisi PDF con tool limitati
+                    # Assistente per analisi PDF con tool limitati
                     limited_tools = [tool for tool in available_tools 
                                    if tool["function"]["name"] in ["calculate_kcal_from_foods"]]
                     
-                    st.session_state[assistant_key] = self.openai_client.beta.assistants.create(
+                    st.session_state[assistant_key] = registry.get_or_create(
+                        self.openai_client,
                         name="NutrAICoach PDF Analyzer",
                         instructions=system_prompt_pdf_diet,
-                        tools=limited_tools,
-                        model="gpt-4.1"
+                        tools=limited_tools
                     )
                     st.session_state.assistant_type = "pdf_diet"
                 else:
-                    # Crea assistente standard
-                    st.session_state[assistant_key] = self.openai_client.beta.assistants.create(
+                    # Assistente standard
+                    st.session_state[assistant_key] = registry.get_or_create(
+                        self.openai_client,
                         name="NutrAICoach Assistant",
                         instructions=system_prompt,
-                        tools=available_tools,
-                        model="gpt-4.1"
+                        tools=available_tools
                     )
                     st.session_state.assistant_type = "standard"
                 
@@ -196,6 +196,9 @@ Il mio compito è creare un piano alimentare su misura per te, basato sui tuoi d
                     full_response
                 )
                 
+                # Scrive su disco (e sincronizza) in un'unica operazione i dati del turno
+                st.session_state.user_data_manager.flush(st.session_state.user_info["id"])
+                
                 # Controlla se è necessario estrarre dati nutrizionali con DeepSeek per la prima risposta
                 st.session_state.deepseek_manager.check_and_extract_if_needed(
                     user_id=st.session_state.user_info["id"],
@@ -284,10 +287,17 @@ def handle_user_input():
         user_input = st.session_state.pending_user_input
         st.session_state.pending_user_input = None  # Clear the pending input
         
+        # Segnaposto in cui la risposta compare man mano che viene generata
+        with st.chat_message("assistant"):
+            response_placeholder = st.empty()
+        
         with st.spinner("L'assistente sta elaborando la risposta..."):
             try:
                 # Usa il chat manager per la conversazione
-                response = st.session_state.chat_manager.chat_with_assistant(user_input)
+                response = st.session_state.chat_manager.chat_with_assistant(
+                    user_input,
+                    on_text=lambda text: response_placeholder.markdown(text + "▌")
+                )
                 st.session_state.messages.append({"role": "assistant", "content": response})
                 
                 # Traccia la risposta dell'assistente
@@ -315,6 +325,9 @@ def handle_user_input():
                     response
                 )
                 
+                # Scrive su disco (e sincronizza) in un'unica operazione i dati del turno
+                st.session_state.user_data_manager.flush(st.session_state.user_info["id"])
+                
                 # Controlla se è necessario estrarre dati nutrizionali con DeepSeek
                 st.session_state.deepseek_manager.check_and_extract_if_needed(
                     user_id=st.session_state.user_info["id"],
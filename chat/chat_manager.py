@@ -6,11 +6,13 @@ delle conversazioni con retry logic e gestione degli errori.
 """
 
 import streamlit as st
+import os
 import time
 import io
 from agent.tool_handler import handle_tool_calls
 from frontend.nutrition_questions import NUTRITION_QUESTIONS
 from agent.prompts import get_initial_prompt, get_initial_prompt_pdf_diet
+from chat.thread_pool import get_thread_pool
 
 # Try to import PDF processing libraries
 try:
@@ -23,6 +25,22 @@ except ImportError:
     except ImportError:
         PDF_EXTRACTION_AVAILABLE = False
 
+# Run dell'assistente in streaming (eventi SSE) invece del polling dello stato ogni secondo
+ASSISTANT_STREAMING = os.environ.get("NUTRICOACH_ASSISTANT_STREAMING", "1") != "0"
+# Durata massima di una run (secondi), tool compresi
+RUN_TIMEOUT_SECONDS = 180
+RUN_TIMEOUT_MESSAGE = "Mi dispiace, l'operazione è durata troppo a lungo. Per favore, riprova."
+RUN_FAILED_EVENTS = {
+    "thread.run.failed": "failed",
+    "thread.run.expired": "expired",
+    "thread.run.cancelled": "cancelled",
+    "thread.run.incomplete": "incomplete",
+}
+
+
+class RunError(Exception):
+    """Run dell'assistente fallita: run cancellata e nuovo thread già creato."""
+
 
 class ChatManager:
     """Gestisce le conversazioni chat con l'assistente"""
@@ -204,12 +222,14 @@ ISTRUZIONI PER L'AGENTE:
         - Chat history (messaggi precedenti)
         - Nutritional info (età, sesso, peso, altezza, attività, obiettivo, nutrition_answers, agent_qa)
         
+        Il thread vuoto è preso dal pool di thread pre-creati (vedi thread_pool).
+        
         Returns:
             str: ID del thread creato o None in caso di errore
         """
         try:
-            thread = self.openai_client.beta.threads.create()
-            st.session_state.thread_id = thread.id
+            thread_id = get_thread_pool(self.openai_client).acquire()
+            st.session_state.thread_id = thread_id
             st.session_state.current_run_id = None
             
             # Mantieni la chat history e le risposte nutrizionali presenti nel file utente
@@ -286,7 +306,7 @@ ISTRUZIONI PER L'AGENTE:
                 st.session_state.current_question = 0
                 st.session_state.nutrition_answers = {}
             
-            return thread.id
+            return thread_id
         except Exception as e:
             st.error(f"Errore nella creazione del thread: {str(e)}")
             return None
@@ -299,7 +319,7 @@ ISTRUZIONI PER L'AGENTE:
                     thread_id=st.session_state.thread_id,
                     run_id=st.session_state.current_run_id
                 )
-                if run.status in ['active', 'requires_action', 'failed', 'expired']:
+                if run.status in ['queued', 'in_progress', 'active', 'requires_action', 'failed', 'expired']:
                     self.openai_client.beta.threads.runs.cancel(
                         thread_id=st.session_state.thread_id,
                         run_id=st.session_state.current_run_id
@@ -309,12 +329,182 @@ ISTRUZIONI PER L'AGENTE:
             finally:
                 st.session_state.current_run_id = None
     
-    def chat_with_assistant(self, user_input):
+    def _fail_run(self, message):
+        """Cancella la run corrente, crea un nuovo thread e solleva l'errore."""
+        self.check_and_cancel_run()
+        self.create_new_thread()
+        raise RunError(message)
+    
+    def _run_tools(self, run):
+        """
+        Esegue i tool richiesti da una run in stato requires_action.
+        
+        Args:
+            run: Run OpenAI con required_action
+            
+        Returns:
+            list: Output dei tool da inviare alla run
+        """
+        user_info = st.session_state.get('user_info') or {}
+        tool_outputs = handle_tool_calls(run, user_id=user_info.get("id"))
+        if not tool_outputs:
+            self._fail_run("Errore nella gestione dei tool")
+        return tool_outputs
+    
+    def _run_with_polling(self, start_time, timeout):
+        """
+        Crea una run e ne attende il completamento controllando lo stato ogni secondo.
+        
+        Args:
+            start_time: Istante di inizio della run (time.time())
+            timeout: Durata massima della run in secondi
+            
+        Returns:
+            str: Risposta dell'assistente o messaggio di timeout
+        """
+        run = self.openai_client.beta.threads.runs.create(
+            thread_id=st.session_state.thread_id,
+            assistant_id=st.session_state.assistant.id
+        )
+        st.session_state.current_run_id = run.id
+        
+        with st.empty():
+            while True:
+                if time.time() - start_time > timeout:
+                    self.check_and_cancel_run()
+                    self.create_new_thread()  # Crea un nuovo thread dopo il timeout
+                    return RUN_TIMEOUT_MESSAGE
+                
+                try:
+                    run_status = self.openai_client.beta.threads.runs.retrieve(
+                        thread_id=st.session_state.thread_id,
+                        run_id=run.id
+                    )
+                except Exception:
+                    self._fail_run("Errore nel recupero dello stato della run")
+                
+                if run_status.status == 'completed':
+                    st.session_state.current_run_id = None
+                    break
+                elif run_status.status in ['failed', 'expired', 'cancelled']:
+                    self._fail_run(f"Run {run_status.status}")
+                elif run_status.status == 'requires_action':
+                    # Gestisci le chiamate ai tool
+                    tool_outputs = self._run_tools(run_status)
+                    try:
+                        # Invia i risultati e continua
+                        self.openai_client.beta.threads.runs.submit_tool_outputs(
+                            thread_id=st.session_state.thread_id,
+                            run_id=run.id,
+                            tool_outputs=tool_outputs
+                        )
+                    except Exception:
+                        self._fail_run("Errore nell'invio dei risultati dei tool")
+                
+                # Breve pausa prima del prossimo controllo
+                time.sleep(1)
+        
+        return self._last_assistant_message()
+    
+    def _run_with_streaming(self, start_time, timeout, on_text=None):
+        """
+        Crea una run in streaming e ne elabora gli eventi man mano che arrivano.
+        
+        I frammenti di testo (thread.message.delta) vengono passati subito a on_text;
+        quando la run richiede l'esecuzione di tool (thread.run.requires_action) i
+        risultati vengono inviati con submit_tool_outputs_stream e lo streaming
+        prosegue sul nuovo flusso di eventi, senza attese tra un controllo e l'altro.
+        
+        Args:
+            start_time: Istante di inizio della run (time.time())
+            timeout: Durata massima della run in secondi
+            on_text: Funzione chiamata con il testo parziale del messaggio in corso
+            
+        Returns:
+            str: Risposta dell'assistente o messaggio di timeout
+        """
+        runs = self.openai_client.beta.threads.runs
+        stream_manager = runs.stream(
+            thread_id=st.session_state.thread_id,
+            assistant_id=st.session_state.assistant.id,
+            timeout=timeout
+        )
+        text = ""
+        final_text = None
+        completed = False
+        
+        while stream_manager is not None:
+            next_stream = None
+            try:
+                with stream_manager as stream:
+                    for event in stream:
+                        if time.time() - start_time > timeout:
+                            self.check_and_cancel_run()
+                            self.create_new_thread()  # Crea un nuovo thread dopo il timeout
+                            return RUN_TIMEOUT_MESSAGE
+                        
+                        if event.event in ("thread.run.created", "thread.run.in_progress"):
+                            st.session_state.current_run_id = event.data.id
+                        elif event.event == "thread.message.created":
+                            text = ""
+                        elif event.event == "thread.message.delta":
+                            for block in event.data.delta.content or []:
+                                if block.type == "text" and block.text and block.text.value:
+                                    text += block.text.value
+                                    if on_text is not None:
+                                        on_text(text)
+                        elif event.event == "thread.message.completed":
+                            final_text = "".join(
+                                block.text.value for block in event.data.content if block.type == "text"
+                            )
+                        elif event.event == "thread.run.requires_action":
+                            tool_outputs = self._run_tools(event.data)
+                            remaining = max(timeout - (time.time() - start_time), 1)
+                            # La run resta in attesa dei risultati: lo stream corrente termina qui
+                            next_stream = runs.submit_tool_outputs_stream(
+                                thread_id=st.session_state.thread_id,
+                                run_id=event.data.id,
+                                tool_outputs=tool_outputs,
+                                timeout=remaining
+                            )
+                            break
+                        elif event.event == "thread.run.completed":
+                            st.session_state.current_run_id = None
+                            completed = True
+                        elif event.event in RUN_FAILED_EVENTS:
+                            self._fail_run(f"Run {RUN_FAILED_EVENTS[event.event]}")
+                        elif event.event == "error":
+                            self._fail_run(f"Errore nello streaming della run: {event.data}")
+            except RunError:
+                raise
+            except Exception as e:
+                self._fail_run(f"Errore nello streaming della run: {str(e)}")
+            stream_manager = next_stream
+        
+        if not completed:
+            self._fail_run("Streaming della run interrotto")
+        if final_text is not None:
+            return final_text
+        return self._last_assistant_message()
+    
+    def _last_assistant_message(self):
+        """Restituisce l'ultimo messaggio del thread."""
+        try:
+            messages = self.openai_client.beta.threads.messages.list(
+                thread_id=st.session_state.thread_id
+            )
+            return messages.data[0].content[0].text.value
+        except Exception:
+            self._fail_run("Errore nel recupero dei messaggi")
+    
+    def chat_with_assistant(self, user_input, on_text=None):
         """
         Gestisce la conversazione con l'assistente.
         
         Args:
             user_input: Messaggio dell'utente
+            on_text: Funzione chiamata con il testo parziale della risposta durante lo
+                streaming (ignorata con NUTRICOACH_ASSISTANT_STREAMING=0)
             
         Returns:
             str: Risposta dell'assistente
@@ -358,74 +548,11 @@ ISTRUZIONI PER L'AGENTE:
             
             while retry_count < max_retries:
                 try:
-                    # Crea una run
-                    run = self.openai_client.beta.threads.runs.create(
-                        thread_id=st.session_state.thread_id,
-                        assistant_id=st.session_state.assistant.id
-                    )
-                    st.session_state.current_run_id = run.id
-                    
-                    # Attendi il completamento con timeout più lungo
+                    # Crea una run e attendi il completamento con timeout più lungo
                     start_time = time.time()
-                    timeout = 180  # aumentato a 180 secondi (3 minuti)
-                    
-                    with st.empty():
-                        while True:
-                            if time.time() - start_time > timeout:
-                                self.check_and_cancel_run()
-                                self.create_new_thread()  # Crea un nuovo thread dopo il timeout
-                                return "Mi dispiace, l'operazione è durata troppo a lungo. Per favore, riprova."
-                            
-                            try:
-                                run_status = self.openai_client.beta.threads.runs.retrieve(
-                                    thread_id=st.session_state.thread_id,
-                                    run_id=run.id
-                                )
-                            except Exception:
-                                self.check_and_cancel_run()
-                                self.create_new_thread()
-                                raise Exception("Errore nel recupero dello stato della run")
-                            
-                            if run_status.status == 'completed':
-                                st.session_state.current_run_id = None
-                                break
-                            elif run_status.status in ['failed', 'expired', 'cancelled']:
-                                self.check_and_cancel_run()
-                                self.create_new_thread()
-                                raise Exception(f"Run {run_status.status}")
-                            elif run_status.status == 'requires_action':
-                                # Gestisci le chiamate ai tool
-                                tool_outputs = handle_tool_calls(run_status)
-                                if tool_outputs:
-                                    try:
-                                        # Invia i risultati e continua
-                                        self.openai_client.beta.threads.runs.submit_tool_outputs(
-                                            thread_id=st.session_state.thread_id,
-                                            run_id=run.id,
-                                            tool_outputs=tool_outputs
-                                        )
-                                    except Exception:
-                                        self.check_and_cancel_run()
-                                        self.create_new_thread()
-                                        raise Exception("Errore nell'invio dei risultati dei tool")
-                                else:
-                                    self.check_and_cancel_run()
-                                    self.create_new_thread()
-                                    raise Exception("Errore nella gestione dei tool")
-                            
-                            # Breve pausa prima del prossimo controllo
-                            time.sleep(1)
-                    
-                    # Ottieni la risposta
-                    try:
-                        messages = self.openai_client.beta.threads.messages.list(
-                            thread_id=st.session_state.thread_id
-                        )
-                        return messages.data[0].content[0].text.value
-                    except Exception:
-                        self.check_and_cancel_run()
-                        self.create_new_thread()
-                        raise Exception("Errore nel recupero dei messaggi")
+                    if ASSISTANT_STREAMING:
+                        return self._run_with_streaming(start_time, RUN_TIMEOUT_SECONDS, on_text)
+                    return self._run_with_polling(start_time, RUN_TIMEOUT_SECONDS)
                     
                 except Exception as e:
                     retry_count += 1
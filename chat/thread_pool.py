@@ -0,0 +1,159 @@
+"""
+Thread OpenAI pre-creati per le nuove conversazioni.
+
+ChatManager.create_new_thread chiamava beta.threads.create() in modo sincrono
+all'inizio di ogni conversazione e dopo ogni timeout o errore della run.
+PrewarmedThreadPool tiene pronti NUTRICOACH_PREWARMED_THREADS thread vuoti
+(default 2), creati da un thread in background e reintegrati dopo ogni
+prelievo: acquire restituisce subito un thread pronto e crea un thread in modo
+sincrono solo se il pool è vuoto. I thread più vecchi di
+THREAD_POOL_MAX_AGE_SECONDS vengono scartati ed eliminati.
+
+Il pool è condiviso dal processo per chiave API (get_thread_pool): i thread
+pronti sono vuoti, quindi possono essere assegnati a qualsiasi sessione.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+PREWARMED_THREADS = int(os.environ.get("NUTRICOACH_PREWARMED_THREADS", "2"))
+THREAD_POOL_MAX_AGE_SECONDS = 3600
+
+
+class PrewarmedThreadPool:
+    """Pool di thread OpenAI vuoti, reintegrato in background. Thread-safe."""
+
+    def __init__(self, openai_client, size: int = PREWARMED_THREADS,
+                 max_age: float = THREAD_POOL_MAX_AGE_SECONDS):
+        """
+        Args:
+            openai_client: Client OpenAI configurato
+            size: Numero di thread da tenere pronti (0 disattiva il pool)
+            max_age: Secondi dopo i quali un thread pronto viene scartato
+        """
+        self.openai_client = openai_client
+        self.size = size
+        self.max_age = max_age
+        self._ready = deque()  # (thread_id, istante di creazione)
+        self._lock = threading.Lock()
+        self._refilling = False
+        # Metriche
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.failures = 0
+
+    def _create(self) -> str:
+        thread = self.openai_client.beta.threads.create()
+        with self._lock:
+            self.created += 1
+        return thread.id
+
+    def acquire(self) -> str:
+        """
+        Restituisce l'ID di un thread vuoto, pre-creato se disponibile.
+
+        Returns:
+            str: ID del thread
+
+        Raises:
+            Exception: Se il pool è vuoto e la creazione sincrona fallisce
+        """
+        now = time.monotonic()
+        thread_id = None
+        stale = []
+        with self._lock:
+            while self._ready and thread_id is None:
+                candidate, created_at = self._ready.popleft()
+                if now - created_at <= self.max_age:
+                    thread_id = candidate
+                else:
+                    stale.append(candidate)
+            if thread_id is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        self._start_refill(stale)
+        if thread_id is None:
+            thread_id = self._create()
+        return thread_id
+
+    def warm(self) -> None:
+        """Avvia in background la creazione dei thread mancanti."""
+        self._start_refill([])
+
+    def _start_refill(self, stale: List[str]) -> None:
+        with self._lock:
+            if self._refilling or (len(self._ready) >= self.size and not stale):
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, args=(stale,), name="openai-thread-prewarm", daemon=True).start()
+
+    def _refill(self, stale: List[str]) -> None:
+        for thread_id in stale:
+            try:
+                self.openai_client.beta.threads.delete(thread_id)
+            except Exception as e:
+                logger.debug(f"Thread {thread_id} scaduto non eliminato: {str(e)}")
+
+        while True:
+            with self._lock:
+                if len(self._ready) >= self.size:
+                    self._refilling = False
+                    return
+            try:
+                thread_id = self._create()
+            except Exception as e:
+                logger.warning(f"⚠️ Creazione di un thread di riserva non riuscita: {str(e)}")
+                with self._lock:
+                    self.failures += 1
+                    self._refilling = False
+                return
+            with self._lock:
+                self._ready.append((thread_id, time.monotonic()))
+
+    def stats(self) -> Dict[str, int]:
+        """Restituisce thread pronti e contatori del pool."""
+        with self._lock:
+            return {
+                "ready": len(self._ready),
+                "hits": self.hits,
+                "misses": self.misses,
+                "created": self.created,
+                "failures": self.failures,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_thread_pool(openai_client) -> PrewarmedThreadPool:
+    """
+    Restituisce il pool di thread condiviso dal processo per la chiave API del client.
+
+    Alla creazione il pool inizia subito a preparare i thread in background.
+
+    Args:
+        openai_client: Client OpenAI configurato
+
+    Returns:
+        PrewarmedThreadPool: pool condiviso
+    """
+    key = (getattr(openai_client, "api_key", None), str(getattr(openai_client, "base_url", "")))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = PrewarmedThreadPool(openai_client, size=PREWARMED_THREADS)
+            _pools[key] = pool
+            pool.warm()
+        return pool
@@ -218,6 +218,9 @@ def process_coach_response():
                     stats
                 )
                 
+                # Scrive su disco (e sincronizza) in un'unica operazione i dati del turno
+                st.session_state.user_data_manager.flush(st.session_state.user_info["id"])
+                
                 # Rimuovi lo stato di generazione
                 st.session_state.coach_generating = False
                 
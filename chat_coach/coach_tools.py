@@ -20,6 +20,7 @@ logger = logging.getLogger(__name__)
 # Import del tool esistente
 from agent_tools.meal_optimization_tool import optimize_meal_portions as meal_optimization_optimize_meal_portions
 from agent_tools.nutridb_tool import get_user_id
+from agent_tools.user_storage import get_user_storage
 
 
 def extract_substitutes_from_text(text_content: str) -> List[str]:
@@ -62,18 +63,13 @@ def get_user_meal_configuration(user_id: str) -> Dict[str, Any]:
     """
     try:
         # Fix: Handle user_id that may already contain 'user_' prefix
-        if user_id.startswith("user_"):
-            user_file_path = f"user_data/{user_id}.json"
-        else:
-            user_file_path = f"user_data/user_{user_id}.json"
+        file_user_id = user_id if user_id.startswith("user_") else f"user_{user_id}"
         
-        if not os.path.exists(user_file_path):
+        user_data = get_user_storage().load_document(file_user_id)
+        if user_data is None:
             logger.error(f"File utente {user_id} non trovato")
             return {}
         
-        with open(user_file_path, 'r', encoding='utf-8') as f:
-            user_data = json.load(f)
-        
         # Recupera la configurazione pasti dall'anamnesi iniziale
         nutritional_info = user_data.get("nutritional_info_extracted", {})
         daily_macros = nutritional_info.get("daily_macros", {})
@@ -136,18 +132,13 @@ def get_user_weekly_diet(user_id: str) -> Dict[str, Any]:
     """
     try:
         # Fix: Handle user_id that may already contain 'user_' prefix
-        if user_id.startswith("user_"):
-            user_file_path = f"user_data/{user_id}.json"
-        else:
-            user_file_path = f"user_data/user_{user_id}.json"
+        file_user_id = user_id if user_id.startswith("user_") else f"user_{user_id}"
         
-        if not os.path.exists(user_file_path):
+        user_data = get_user_storage().load_document(file_user_id)
+        if user_data is None:
             logger.error(f"File utente {user_id} non trovato")
             return {}
         
-        with open(user_file_path, 'r', encoding='utf-8') as f:
-            user_data = json.load(f)
-        
         nutritional_info = user_data.get("nutritional_info_extracted", {})
         
         # Recupera i dati della dieta settimanale
@@ -15,6 +15,8 @@ from datetime import datetime
 
 # Import del servizio PDF
 from services.pdf_service import PDFGenerator
+from agent_tools.user_storage import get_user_storage
+from agent_tools.user_document_cache import get_document_cache
 
 
 class PianoNutrizionale:
@@ -221,27 +223,21 @@ class PianoNutrizionale:
             dict: Dati nutrizionali estratti o None se non trovati
         """
         # Gestisci diversi formati di user_id
-        possible_paths = [
-            f"user_data/{user_id}.json",
-            f"user_data/user_{user_id}.json"
-        ]
+        storage = get_user_storage()
+        possible_ids = [user_id, f"user_{user_id}"]
         
-        user_file_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                user_file_path = path
-                break
+        document_id = next((candidate for candidate in possible_ids if storage.user_exists(candidate)), None)
         
-        if not user_file_path:
+        if not document_id:
             st.warning(f"📝 File utente non trovato per ID: {user_id}")
-            st.info("💡 Possibili percorsi cercati:")
-            for path in possible_paths:
-                st.info(f"   • {path}")
+            st.info("💡 Possibili ID cercati:")
+            for candidate in possible_ids:
+                st.info(f"   • {candidate}")
             return None
             
         try:
-            with open(user_file_path, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
+            # Vista in sola lettura dalla cache condivisa dei documenti utente
+            user_data = get_document_cache(storage).get(document_id)
             
             extracted_data = user_data.get("nutritional_info_extracted", {})
             
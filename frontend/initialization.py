@@ -13,7 +13,7 @@ from openai import OpenAI
 from dotenv import load_dotenv
 
 # Import dei manager e servizi (evitando importazioni circolari)
-from agent_tools.user_data_manager import UserDataManager
+from agent_tools.user_data_manager import get_user_data_manager
 from services.deep_seek_service import DeepSeekManager
 from services.preferences_service import PreferencesManager
 
@@ -82,7 +82,8 @@ def initialize_app():
         st.session_state.supabase_service = SupabaseUserService()
 
     if "user_data_manager" not in st.session_state:
-        st.session_state.user_data_manager = UserDataManager()
+        # Istanza condivisa dal processo: gli utenti vengono caricati al primo accesso
+        st.session_state.user_data_manager = get_user_data_manager()
 
     # === INIZIALIZZAZIONE MANAGER CHAT ===
     # Import qui per evitare importazioni circolari
@@ -96,6 +97,9 @@ def initialize_app():
             st.session_state.openai_client,
             st.session_state.user_data_manager
         )
+        # Prepara in background i thread per le nuove conversazioni
+        from chat.thread_pool import get_thread_pool
+        get_thread_pool(st.session_state.openai_client)
 
     # === INIZIALIZZAZIONE SERVIZIO DEEPSEEK ===
     if "deepseek_manager" not in st.session_state:
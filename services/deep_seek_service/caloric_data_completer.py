@@ -8,7 +8,7 @@ utilizzando gli stessi algoritmi e funzioni dell'agente NutrAICoach.
 import json
 import os
 from typing import Dict, Any, Optional, List
-from agent_tools.nutridb import NutriDB
+from agent_tools.nutridb import get_shared_nutridb
 from agent_tools.nutridb_tool import compute_Harris_Benedict_Equation, calculate_sport_expenditure
 from .field_mapper import FieldMapper, get_field, set_field, has_field, ensure_section
 
@@ -28,7 +28,7 @@ class CaloricDataCompleter:
     """
     
     def __init__(self):
-        self.nutri_db = NutriDB("Dati_processed")
+        self.nutri_db = get_shared_nutridb("Dati_processed")
         self.field_mapper = FieldMapper()
         
     def complete_caloric_data(
@@ -16,6 +16,8 @@ import queue
 import os
 import json
 
+from agent_tools.user_storage import get_user_storage
+
 
 class DeepSeekManager:
     """Manager principale per il servizio DeepSeek."""
@@ -56,14 +58,11 @@ class DeepSeekManager:
             Lista delle conversazioni agent_qa o lista vuota se errore
         """
         try:
-            user_file_path = f"user_data/{user_id}.json"
+            user_data = get_user_storage().load_document(user_id)
             
-            if not os.path.exists(user_file_path):
-                print(f"[DEEPSEEK_MANAGER] File utente non trovato: {user_file_path}")
+            if user_data is None:
+                print(f"[DEEPSEEK_MANAGER] File utente non trovato: user_data/{user_id}.json")
                 return []
-                
-            with open(user_file_path, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
             
             conversations = user_data.get('nutritional_info', {}).get('agent_qa', [])
             return conversations
@@ -302,11 +301,9 @@ class DeepSeekManager:
         # Ottieni info utente dal file
         user_info = None
         try:
-            user_file_path = f"user_data/{user_id}.json"
-            if os.path.exists(user_file_path):
-                with open(user_file_path, 'r', encoding='utf-8') as f:
-                    user_data = json.load(f)
-                    user_info = user_data.get('nutritional_info', {})
+            user_data = get_user_storage().load_document(user_id)
+            if user_data is not None:
+                user_info = user_data.get('nutritional_info', {})
         except Exception as e:
             print(f"[DEEPSEEK_MANAGER] Errore nel caricamento dati utente {user_id}: {str(e)}")
             
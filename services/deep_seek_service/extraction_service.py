@@ -5,6 +5,7 @@ import time
 from typing import Dict, Any, List, Optional
 from .deepseek_client import DeepSeekClient
 from .caloric_data_completer import CaloricDataCompleter
+from agent_tools.user_storage import get_user_storage
 
 
 
@@ -110,21 +111,15 @@ class NutritionalDataExtractor:
         results = []
         
         try:
-            # Controlla la cartella user_data per i file con nutritional_info_extracted
-            user_data_dir = "user_data"
-            if os.path.exists(user_data_dir):
-                for filename in os.listdir(user_data_dir):
-                    if filename.endswith('.json'):
-                        user_id = filename[:-5]  # Rimuovi .json
-                        
-                        with open(f"{user_data_dir}/{filename}", 'r', encoding='utf-8') as f:
-                            user_data = json.load(f)
-                            
-                        if "nutritional_info_extracted" in user_data:
-                            results.append({
-                                "user_id": user_id,
-                                "data": user_data["nutritional_info_extracted"]
-                            })
+            # Controlla i dati utente con nutritional_info_extracted
+            storage = get_user_storage()
+            for user_id in storage.list_user_ids():
+                extracted = storage.get_field(user_id, "nutritional_info_extracted")
+                if extracted is not None:
+                    results.append({
+                        "user_id": user_id,
+                        "data": extracted
+                    })
         except Exception as e:
             print(f"[EXTRACTION_SERVICE] Errore nel recupero risultati: {str(e)}")
             
@@ -141,14 +136,7 @@ class NutritionalDataExtractor:
             Dati completi dell'utente o None se non trovati
         """
         try:
-            user_file_path = f"user_data/{user_id}.json"
-            
-            if os.path.exists(user_file_path):
-                with open(user_file_path, 'r', encoding='utf-8') as f:
-                    user_data = json.load(f)
-                    return user_data
-            else:
-                return None
+            return get_user_storage().load_document(user_id)
                 
         except Exception as e:
             print(f"[EXTRACTION_SERVICE] Errore nel caricamento dati utente {user_id}: {str(e)}")
@@ -166,31 +154,20 @@ class NutritionalDataExtractor:
             True se il salvataggio è riuscito
         """
         try:
-            user_file_path = f"user_data/{user_id}.json"
-            
-            # Crea la cartella se non esiste
-            os.makedirs("user_data", exist_ok=True)
+            storage = get_user_storage()
             
             with self.file_access_lock:
-                # Carica dati esistenti o crea nuovo file
-                if os.path.exists(user_file_path):
-                    with open(user_file_path, 'r', encoding='utf-8') as f:
-                        user_data = json.load(f)
-                else:
-                    user_data = {}
-                
-                # Merge intelligente dei dati
-                if "nutritional_info_extracted" in user_data:
-                    existing_data = user_data["nutritional_info_extracted"]
-                    merged = self._merge_extracted_data(existing_data, extracted_data, user_id)
-                    if merged:
-                        user_data["nutritional_info_extracted"] = existing_data
-                else:
-                    user_data["nutritional_info_extracted"] = extracted_data
+                def merge(existing_data):
+                    # Merge intelligente dei dati (sul posto) con quelli già estratti
+                    if existing_data is None:
+                        return extracted_data
+                    self._merge_extracted_data(existing_data, extracted_data, user_id)
+                    return existing_data
                 
-                # Salva il file aggiornato
-                with open(user_file_path, 'w', encoding='utf-8') as f:
-                    json.dump(user_data, f, indent=2, ensure_ascii=False)
+                # Lettura, merge e scrittura della sola sezione estratta sotto il lock
+                # dell'utente: le scritture concorrenti (chat, PDF, altri worker) non vanno perse
+                storage.modify_field(user_id, "nutritional_info_extracted", merge)
+                user_data = storage.load_document(user_id) or {}
                 
                 # Sincronizzazione automatica con Supabase
                 try:
@@ -1131,30 +1108,15 @@ class NutritionalDataExtractor:
             True se la cancellazione è riuscita, False altrimenti
         """
         try:
-            user_file_path = f"user_data/{user_id}.json"
+            storage = get_user_storage()
             
-            # Se il file non esiste, considera l'operazione riuscita
-            if not os.path.exists(user_file_path):
+            # Se l'utente non esiste, considera l'operazione riuscita
+            if not storage.user_exists(user_id):
                 return True
             
-            # Carica i dati esistenti
-            user_data = self._load_complete_user_data(user_id)
-            if not user_data:
-                print(f"[EXTRACTION_SERVICE] Impossibile caricare dati utente {user_id} per cancellazione")
-                return False
-            
             # Cancella solo la sezione nutritional_info_extracted se esiste
-            if "nutritional_info_extracted" in user_data:
-                del user_data["nutritional_info_extracted"]
-                
-                # Salva i dati aggiornati (senza la sezione estratta)
-                with open(user_file_path, 'w', encoding='utf-8') as f:
-                    import json
-                    json.dump(user_data, f, indent=2, ensure_ascii=False)
-            
-                return True
-            else:
-                return True
+            storage.remove_fields(user_id, ["nutritional_info_extracted"])
+            return True
                 
         except Exception as e:
             print(f"[EXTRACTION_SERVICE] Errore nella cancellazione dati utente {user_id}: {str(e)}")
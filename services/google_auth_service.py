@@ -222,17 +222,22 @@ class GoogleAuthService:
             # Crea un ID utente univoco
             user_id = self.create_google_user_id(google_id, email)
             
-            # Verifica se l'utente esiste già
-            existing_user = user_data_manager.get_user_by_id(user_id)
+            # Verifica se l'utente esiste già (ricerche indicizzate)
+            existing_user = user_data_manager.get_user_by_google_id(google_id) or user_data_manager.get_user_by_id(user_id)
             
             if existing_user:
                 # Login utente esistente
-                user_data_manager._load_user_data(user_id)
-                return True, user_id
+                user_data_manager._load_user_data(existing_user.user_id)
+                return True, existing_user.user_id
             else:
                 # Registra nuovo utente
                 # Crea un username basato sul nome e email
-                username = self._create_username_from_email(email, name)
+                base_username = self._create_username_from_email(email, name)
+                username = base_username
+                suffix = 1
+                while user_data_manager.is_username_taken(username):
+                    suffix += 1
+                    username = f"{base_username}_{suffix}"
                 
                 # Salva l'utente nel sistema
                 success = self._save_google_user(
@@ -302,12 +307,12 @@ class GoogleAuthService:
                 email=email,
                 password_hash="GOOGLE_AUTH",  # Placeholder per utenti Google
                 user_id=user_id,
-                created_at=time.time()
+                created_at=time.time(),
+                google_id=google_id
             )
             
-            # Salva l'utente
-            user_data_manager._users[username] = user
-            user_data_manager._save_users()
+            # Salva l'utente (una sola riga, in locale e su Supabase)
+            user_data_manager.add_user(user)
             
             # Salva informazioni aggiuntive Google in un file separato
             self._save_google_user_info(user_id, google_id, name)
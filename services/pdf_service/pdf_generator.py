@@ -19,6 +19,9 @@ from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak, CondPageBreak
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 
+from agent_tools.user_storage import get_user_storage
+from agent_tools.user_document_cache import get_document_cache, thaw
+
 # Importa la funzione per calcolare i sostituti automaticamente
 try:
     from agent_tools.meal_optimization_tool import calculate_food_substitutes
@@ -234,13 +237,13 @@ class PDFGenerator:
         
         # Importa NutriDB per utilizzare il sistema di alias esistente
         try:
-            from agent_tools.nutridb import NutriDB
+            from agent_tools.nutridb import get_shared_nutridb
             import os
             
-            # Carica il database se non già disponibile
+            # Usa l'istanza condivisa del database se non già disponibile
             if not hasattr(self, '_nutridb'):
                 dati_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "Dati_processed")
-                self._nutridb = NutriDB(dati_path)
+                self._nutridb = get_shared_nutridb(dati_path)
             
             # Normalizza il nome come fa NutriDB
             normalized_name = nome_alimento.lower().replace("_", " ").strip()
@@ -616,10 +619,29 @@ class PDFGenerator:
         
         return pdf_bytes
     
+    def _find_user_document(self, user_id: str):
+        """
+        Trova il documento dell'utente gestendo entrambi i formati di ID: {user_id} e user_{user_id}
+        
+        Args:
+            user_id: ID dell'utente
+            
+        Returns:
+            tuple: (ID del documento, dati dell'utente) o (None, None) se non trovato
+        """
+        storage = get_user_storage()
+        for document_id in (user_id, f"user_{user_id}"):
+            try:
+                if storage.user_exists(document_id):
+                    return document_id, storage.load_document(document_id)
+            except Exception as e:
+                print(f"[PDF_ERROR] Errore lettura dati utente {document_id}: {str(e)}")
+        return None, None
+    
     def _load_user_nutritional_data(self, user_id: str) -> Optional[Dict[str, Any]]:
         """
-        Carica i dati nutrizionali dell'utente dal file JSON.
-        Gestisce entrambi i formati di file: user_data/{user_id}.json e user_data/user_{user_id}.json
+        Carica i dati nutrizionali dell'utente.
+        Gestisce entrambi i formati di ID: {user_id} e user_{user_id}
         
         Args:
             user_id: ID dell'utente
@@ -627,29 +649,13 @@ class PDFGenerator:
         Returns:
             dict: Dati nutrizionali estratti o None se non trovati
         """
-        # Percorsi possibili per il file utente
-        possible_paths = [
-            f"user_data/{user_id}.json",
-            f"user_data/user_{user_id}.json"
-        ]
-        
-        user_data = None
-        
-        # Prova i percorsi possibili
-        for user_file_path in possible_paths:
-            if os.path.exists(user_file_path):
-                try:
-                    with open(user_file_path, 'r', encoding='utf-8') as f:
-                        user_data = json.load(f)
-        
-                    break
-                except (json.JSONDecodeError, Exception) as e:
-                    print(f"[PDF_ERROR] Errore lettura {user_file_path}: {str(e)}")
-                    continue
+        # Lettura dalla cache condivisa dei documenti utente
+        cache = get_document_cache()
+        user_data = cache.get(user_id) or cache.get(f"user_{user_id}")
         
         if not user_data:
             print(f"[PDF_ERROR] File utente non trovato per user_id: {user_id}")
-            print(f"[PDF_ERROR] Percorsi cercati: {possible_paths}")
+            print(f"[PDF_ERROR] ID cercati: {[user_id, f'user_{user_id}']}")
             return None
         
         # Estrai i dati nutrizionali
@@ -659,12 +665,12 @@ class PDFGenerator:
             print(f"[PDF_ERROR] Nessun dato nutrizionale estratto trovato per user_id: {user_id}")
             return None
         
-
-        return nutritional_data
+        # Copia modificabile: la generazione del PDF completa i pasti mancanti sul posto
+        return thaw(nutritional_data)
     
     def _save_user_data_to_file(self, user_id: str, data: Dict[str, Any]) -> bool:
         """
-        Salva i dati dell'utente nel file JSON.
+        Salva i dati dell'utente (aggiorna solo i campi indicati).
         
         Args:
             user_id: ID dell'utente
@@ -673,37 +679,16 @@ class PDFGenerator:
         Returns:
             bool: True se il salvataggio è riuscito, False altrimenti
         """
-        # Percorsi possibili per il file utente
-        possible_paths = [
-            f"user_data/{user_id}.json",
-            f"user_data/user_{user_id}.json"
-        ]
-        
-        user_file_path = None
-        
-        # Trova il file esistente
-        for path in possible_paths:
-            if os.path.exists(path):
-                user_file_path = path
-                break
+        document_id, _ = self._find_user_document(user_id)
         
-        if not user_file_path:
+        if not document_id:
             print(f"[PDF_ERROR] File utente non trovato per user_id: {user_id}")
             return False
         
         try:
-            # Carica i dati esistenti
-            with open(user_file_path, 'r', encoding='utf-8') as f:
-                existing_data = json.load(f)
+            get_user_storage().update_fields(document_id, data)
             
-            # Unisci i dati esistenti con i nuovi dati
-            existing_data.update(data)
-            
-            # Salva i dati aggiornati
-            with open(user_file_path, 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, ensure_ascii=False, indent=2)
-            
-            print(f"[PDF_INFO] Dati salvati con successo nel file utente: {user_file_path}")
+            print(f"[PDF_INFO] Dati salvati con successo per l'utente: {document_id}")
             return True
             
         except Exception as e:
@@ -726,85 +711,71 @@ class PDFGenerator:
             bool: True se il salvataggio è riuscito, False altrimenti
         """
         try:
-            # Percorsi possibili per il file utente
-            possible_paths = [
-                f"user_data/{user_id}.json",
-                f"user_data/user_{user_id}.json"
-            ]
+            document_id, _ = self._find_user_document(user_id)
             
-            user_file_path = None
-            
-            # Trova il file esistente
-            for path in possible_paths:
-                if os.path.exists(path):
-                    user_file_path = path
-                    break
-            
-            if not user_file_path:
+            if not document_id:
                 print(f"[PDF_ERROR] File utente non trovato per user_id: {user_id}")
                 return False
             
-            # Carica i dati esistenti
-            with open(user_file_path, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
-            
-            # Naviga alla struttura corretta
-            nutritional_data = user_data.get("nutritional_info_extracted", {})
-            
-            if day_number == 1:
-                # Per il giorno 1, controlla sia weekly_diet_day_1 che weekly_diet
-                if "weekly_diet_day_1" in nutritional_data:
-                    weekly_diet_data = nutritional_data["weekly_diet_day_1"]
-                elif "weekly_diet" in nutritional_data:
-                    weekly_diet_data = nutritional_data["weekly_diet"]
-                else:
-                    print(f"[PDF_WARNING] Struttura weekly_diet non trovata per giorno 1")
-                    return False
+            def add_substitutes(nutritional_data):
+                # Naviga alla struttura corretta (sezione estratta corrente)
+                if day_number == 1:
+                    # Per il giorno 1, controlla sia weekly_diet_day_1 che weekly_diet
+                    if "weekly_diet_day_1" in nutritional_data:
+                        weekly_diet_data = nutritional_data["weekly_diet_day_1"]
+                    elif "weekly_diet" in nutritional_data:
+                        weekly_diet_data = nutritional_data["weekly_diet"]
+                    else:
+                        print(f"[PDF_WARNING] Struttura weekly_diet non trovata per giorno 1")
+                        return None
                     
-                # Trova il pasto nella lista
-                for meal in weekly_diet_data:
-                    if meal.get("nome_pasto") == meal_name:
-                        alimenti = meal.get("alimenti", [])
+                    # Trova il pasto nella lista
+                    for meal in weekly_diet_data:
+                        if meal.get("nome_pasto") == meal_name:
+                            alimenti = meal.get("alimenti", [])
                         
-                        # Trova l'alimento specifico
-                        for alimento in alimenti:
-                            if alimento.get("nome_alimento") == alimento_name:
-                                alimento["sostituti"] = substitutes
-                                break
-                        break
-            else:
-                # Per i giorni 2-7, usa weekly_diet_days_2_7
-                if "weekly_diet_days_2_7" not in nutritional_data:
-                    print(f"[PDF_WARNING] Struttura weekly_diet_days_2_7 non trovata")
-                    return False
+                            # Trova l'alimento specifico
+                            for alimento in alimenti:
+                                if alimento.get("nome_alimento") == alimento_name:
+                                    alimento["sostituti"] = substitutes
+                                    break
+                            break
+                else:
+                    # Per i giorni 2-7, usa weekly_diet_days_2_7
+                    if "weekly_diet_days_2_7" not in nutritional_data:
+                        print(f"[PDF_WARNING] Struttura weekly_diet_days_2_7 non trovata")
+                        return None
                 
-                day_key = f"giorno_{day_number}"
-                if day_key not in nutritional_data["weekly_diet_days_2_7"]:
-                    print(f"[PDF_WARNING] Giorno {day_number} non trovato in weekly_diet_days_2_7")
-                    return False
+                    day_key = f"giorno_{day_number}"
+                    if day_key not in nutritional_data["weekly_diet_days_2_7"]:
+                        print(f"[PDF_WARNING] Giorno {day_number} non trovato in weekly_diet_days_2_7")
+                        return None
                 
-                day_data = nutritional_data["weekly_diet_days_2_7"][day_key]
+                    day_data = nutritional_data["weekly_diet_days_2_7"][day_key]
                 
-                if meal_name not in day_data:
-                    print(f"[PDF_WARNING] Pasto {meal_name} non trovato nel giorno {day_number}")
-                    return False
+                    if meal_name not in day_data:
+                        print(f"[PDF_WARNING] Pasto {meal_name} non trovato nel giorno {day_number}")
+                        return None
                 
-                meal_data = day_data[meal_name]
-                if "alimenti" not in meal_data:
-                    print(f"[PDF_WARNING] Alimenti non trovati nel pasto {meal_name}")
-                    return False
+                    meal_data = day_data[meal_name]
+                    if "alimenti" not in meal_data:
+                        print(f"[PDF_WARNING] Alimenti non trovati nel pasto {meal_name}")
+                        return None
                 
-                alimenti = meal_data["alimenti"]
+                    alimenti = meal_data["alimenti"]
                 
-                # Trova l'alimento specifico
-                for alimento in alimenti:
-                    if alimento.get("nome_alimento") == alimento_name:
-                        alimento["sostituti"] = substitutes
-                        break
+                    # Trova l'alimento specifico
+                    for alimento in alimenti:
+                        if alimento.get("nome_alimento") == alimento_name:
+                            alimento["sostituti"] = substitutes
+                            break
+                
+                return nutritional_data
             
-            # Salva i dati aggiornati
-            with open(user_file_path, 'w', encoding='utf-8') as f:
-                json.dump(user_data, f, ensure_ascii=False, indent=2)
+            # Lettura, modifica e scrittura della sola sezione estratta sotto il lock
+            # dell'utente: le scritture concorrenti (chat, DeepSeek, altri worker) non vanno perse
+            if get_user_storage().modify_field(document_id, "nutritional_info_extracted", add_substitutes, {}) is None:
+                return False
             
             print(f"[PDF_INFO] Sostituti salvati per {alimento_name} nel pasto {meal_name} del giorno {day_number}")
             return True
@@ -828,46 +799,32 @@ class PDFGenerator:
             bool: True se il salvataggio è riuscito, False altrimenti
         """
         try:
-            # Percorsi possibili per il file utente
-            possible_paths = [
-                f"user_data/{user_id}.json",
-                f"user_data/user_{user_id}.json"
-            ]
-            
-            user_file_path = None
-            
-            # Trova il file esistente
-            for path in possible_paths:
-                if os.path.exists(path):
-                    user_file_path = path
-                    break
+            document_id, _ = self._find_user_document(user_id)
             
-            if not user_file_path:
+            if not document_id:
                 print(f"[PDF_ERROR] File utente non trovato per user_id: {user_id}")
                 return False
             
-            # Carica i dati esistenti
-            with open(user_file_path, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
-            
-            # Naviga alla struttura corretta
-            nutritional_data = user_data.get("nutritional_info_extracted", {})
-            
-            if "weekly_diet_days_2_7" not in nutritional_data:
-                print(f"[PDF_WARNING] Struttura weekly_diet_days_2_7 non trovata")
-                return False
+            def add_meal(nutritional_data):
+                # Naviga alla struttura corretta (sezione estratta corrente)
+                if "weekly_diet_days_2_7" not in nutritional_data:
+                    print(f"[PDF_WARNING] Struttura weekly_diet_days_2_7 non trovata")
+                    return None
             
-            day_key = f"giorno_{day_number}"
-            if day_key not in nutritional_data["weekly_diet_days_2_7"]:
-                # Crea la struttura del giorno se non esiste
-                nutritional_data["weekly_diet_days_2_7"][day_key] = {}
+                day_key = f"giorno_{day_number}"
+                if day_key not in nutritional_data["weekly_diet_days_2_7"]:
+                    # Crea la struttura del giorno se non esiste
+                    nutritional_data["weekly_diet_days_2_7"][day_key] = {}
             
-            # Aggiungi il pasto generato
-            nutritional_data["weekly_diet_days_2_7"][day_key][meal_name] = meal_data
+                # Aggiungi il pasto generato
+                nutritional_data["weekly_diet_days_2_7"][day_key][meal_name] = meal_data
+                
+                return nutritional_data
             
-            # Salva i dati aggiornati
-            with open(user_file_path, 'w', encoding='utf-8') as f:
-                json.dump(user_data, f, ensure_ascii=False, indent=2)
+            # Lettura, modifica e scrittura della sola sezione estratta sotto il lock
+            # dell'utente: le scritture concorrenti (chat, DeepSeek, altri worker) non vanno perse
+            if get_user_storage().modify_field(document_id, "nutritional_info_extracted", add_meal, {}) is None:
+                return False
             
             print(f"[PDF_INFO] Pasto {meal_name} salvato nel giorno {day_number}")
             return True
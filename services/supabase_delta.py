@@ -0,0 +1,153 @@
+"""
+Sincronizzazione delta dei documenti utente verso Supabase.
+
+Ogni sincronizzazione inviava il documento utente completo (chat_history intera,
+nutritional_info_extracted, ...), quindi il traffico cresceva con la lunghezza
+della conversazione. Qui il documento è diviso nelle sezioni di primo livello,
+ognuna con il proprio hash del contenuto (JSON canonico). Rispetto all'ultima
+versione confermata da Supabase si inviano solo:
+
+- "set": le sezioni cambiate, con il nuovo valore;
+- "append": per le liste cresciute in coda (tipicamente chat_history), solo i
+  nuovi elementi;
+- "remove": le sezioni eliminate.
+
+La patch porta l'hash della versione di partenza (base_hash) e di quella
+risultante (new_hash): la funzione SQL apply_user_data_patches (vedi DELTA_SQL)
+la applica solo se content_hash su Supabase coincide con base_hash. Se le
+versioni divergono (scrittura di un'altra istanza, riavvio del processo) il
+chiamante invia il documento completo.
+"""
+
+import copy
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+PATCH_FUNCTION = "apply_user_data_patches"
+
+DELTA_SQL = """
+ALTER TABLE user_data ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+CREATE OR REPLACE FUNCTION apply_user_data_patches(patches JSONB)
+RETURNS SETOF TEXT LANGUAGE plpgsql AS $$
+DECLARE
+    patch JSONB;
+    doc JSONB;
+    item RECORD;
+BEGIN
+    FOR patch IN SELECT * FROM jsonb_array_elements(patches) LOOP
+        SELECT CASE WHEN jsonb_typeof(data) = 'string' THEN (data #>> '{}')::jsonb ELSE data END
+          INTO doc FROM user_data
+         WHERE user_id = patch->>'user_id' AND content_hash = patch->>'base_hash'
+           FOR UPDATE;
+        IF NOT FOUND THEN
+            CONTINUE;
+        END IF;
+        doc := (doc - ARRAY(SELECT jsonb_array_elements_text(COALESCE(patch->'remove', '[]'::jsonb))))
+               || COALESCE(patch->'set', '{}'::jsonb);
+        FOR item IN SELECT key, value FROM jsonb_each(COALESCE(patch->'append', '{}'::jsonb)) LOOP
+            doc := jsonb_set(doc, ARRAY[item.key], COALESCE(doc->item.key, '[]'::jsonb) || item.value);
+        END LOOP;
+        UPDATE user_data SET data = doc, content_hash = patch->>'new_hash', updated_at = NOW()
+         WHERE user_id = patch->>'user_id';
+        RETURN NEXT patch->>'user_id';
+    END LOOP;
+END;
+$$;
+"""
+
+
+def content_hash(value: Any) -> str:
+    """Hash del contenuto di un valore JSON (indipendente dall'ordine delle chiavi)."""
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class DocumentState:
+    """Hash di un documento e delle sue sezioni, con la lunghezza delle sezioni lista."""
+    document_hash: str
+    section_hashes: Dict[str, str] = field(default_factory=dict)
+    list_lengths: Dict[str, int] = field(default_factory=dict)
+
+
+def document_state(document: Dict[str, Any]) -> DocumentState:
+    """
+    Calcola gli hash delle sezioni di primo livello di un documento utente.
+
+    Args:
+        document: Documento utente
+
+    Returns:
+        DocumentState: hash del documento (derivato da quelli delle sezioni) e delle sezioni
+    """
+    section_hashes = {key: content_hash(value) for key, value in document.items()}
+    list_lengths = {key: len(value) for key, value in document.items() if isinstance(value, list)}
+    document_hash = content_hash(sorted(section_hashes.items()))
+    return DocumentState(document_hash, section_hashes, list_lengths)
+
+
+def compute_patch(user_id: str, acknowledged: DocumentState, document: Dict[str, Any],
+                  state: Optional[DocumentState] = None) -> Optional[Dict[str, Any]]:
+    """
+    Calcola la patch che porta la versione confermata al documento attuale.
+
+    Args:
+        user_id: ID dell'utente
+        acknowledged: Stato dell'ultima versione confermata da Supabase
+        document: Documento attuale
+        state: Stato del documento attuale (calcolato se assente)
+
+    Returns:
+        Dict: patch per apply_user_data_patches, o None se il documento non è cambiato
+    """
+    state = state or document_state(document)
+    if state.document_hash == acknowledged.document_hash:
+        return None
+
+    set_sections = {}
+    append_sections = {}
+    for key, value in document.items():
+        previous_hash = acknowledged.section_hashes.get(key)
+        if previous_hash == state.section_hashes[key]:
+            continue
+        previous_length = acknowledged.list_lengths.get(key)
+        if (isinstance(value, list) and previous_length and previous_length < len(value)
+                and content_hash(value[:previous_length]) == previous_hash):
+            append_sections[key] = value[previous_length:]
+        else:
+            set_sections[key] = value
+
+    return {
+        "user_id": user_id,
+        "base_hash": acknowledged.document_hash,
+        "new_hash": state.document_hash,
+        "set": set_sections,
+        "append": append_sections,
+        "remove": [key for key in acknowledged.section_hashes if key not in document]
+    }
+
+
+def apply_patch(document: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Applica una patch a un documento (equivalente Python di apply_user_data_patches).
+
+    Args:
+        document: Documento nella versione base_hash della patch
+        patch: Patch calcolata da compute_patch
+
+    Returns:
+        Dict: nuovo documento (quello di partenza non viene modificato)
+    """
+    result = {key: value for key, value in document.items() if key not in patch.get("remove", [])}
+    result.update(copy.deepcopy(patch.get("set", {})))
+    for key, items in patch.get("append", {}).items():
+        result[key] = list(result.get(key) or []) + copy.deepcopy(items)
+    return result
+
+
+def patch_size(patches: List[Dict[str, Any]]) -> int:
+    """Dimensione in byte (JSON) di un insieme di patch o righe."""
+    return len(json.dumps(patches, ensure_ascii=False, default=str).encode("utf-8"))
@@ -44,6 +44,7 @@ PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)  # Una directory sopra services/
 sys.path.append(PROJECT_ROOT)
 
 from services.supabase_service import SupabaseUserService
+from agent_tools.user_storage import JsonUserStorage
 
 # ==================== CONFIGURAZIONE PARAMETRI ====================
 # Modifica questi parametri per configurare le operazioni da eseguire
@@ -198,8 +199,8 @@ class SupabaseManager:
         
         # 2. Carica utenti locali
         try:
-            with open(users_file, 'r', encoding='utf-8') as f:
-                local_users = json.load(f)
+            # Include gli utenti non ancora compattati in users.json
+            local_users = JsonUserStorage(os.path.dirname(users_file)).load_users()
         except Exception as e:
             self.logger.error(f"❌ Errore nella lettura di {users_file}: {str(e)}")
             return False
@@ -413,8 +414,8 @@ class SupabaseManager:
         try:
             # 3. Carica utenti locali
             self.logger.info("📖 Caricamento utenti locali...")
-            with open(users_file, 'r', encoding='utf-8') as f:
-                local_users = json.load(f)
+            # Include gli utenti non ancora compattati in users.json
+            local_users = JsonUserStorage(os.path.dirname(users_file)).load_users()
             
             if not local_users:
                 self.logger.info("📝 Nessun utente trovato localmente")
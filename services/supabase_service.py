@@ -7,17 +7,143 @@ garantendo che i dati non vengano persi quando si usa Streamlit Cloud.
 
 import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 import streamlit as st
-from typing import Dict, List, Optional, Tuple, Any
-from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Any
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 from supabase import create_client, Client
 import logging
 
+from agent_tools.atomic_files import atomic_write_json
+from agent_tools.user_storage import get_user_storage
+from services.supabase_delta import (
+    DELTA_SQL, PATCH_FUNCTION, DocumentState, compute_patch, document_state, patch_size
+)
+from services.supabase_sync_worker import SUPABASE_SYNC_BATCH_SIZE, get_sync_worker
+
 # Configurazione logging
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Download di user_data: righe per pagina e thread di scrittura dei documenti locali
+SUPABASE_PAGE_SIZE = int(os.environ.get("NUTRICOACH_SUPABASE_PAGE_SIZE", "200"))
+SUPABASE_DOWNLOAD_WORKERS = int(os.environ.get("NUTRICOACH_SUPABASE_DOWNLOAD_WORKERS", "4"))
+# File con l'updated_at dell'ultima riga scaricata (non .json: non è un documento utente)
+SUPABASE_WATERMARK_PATH = os.path.join("user_data", "supabase_download.watermark")
+# Margine (secondi) riletto prima del watermark: righe confermate in ritardo o con
+# updated_at di orologi diversi non vengono perse dal filtro updated_at >= watermark
+SUPABASE_WATERMARK_OVERLAP_SECONDS = float(os.environ.get("NUTRICOACH_SUPABASE_WATERMARK_OVERLAP_SECONDS", "300"))
+
+# updated_at assegnato dal server a ogni scrittura di user_data (anche dalle patch delta)
+UPDATED_AT_SQL = """
+CREATE OR REPLACE FUNCTION set_user_data_updated_at()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS user_data_updated_at ON user_data;
+CREATE TRIGGER user_data_updated_at BEFORE INSERT OR UPDATE ON user_data
+    FOR EACH ROW EXECUTE FUNCTION set_user_data_updated_at();
+"""
+
+
+def user_row(username: str, user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte un utente di users.json in una riga della tabella users di Supabase."""
+    return {
+        "username": username,
+        "email": user_data.get("email", ""),
+        "password_hash": user_data["password_hash"],
+        "user_id": user_data["user_id"],
+        "created_at": datetime.fromtimestamp(user_data["created_at"]).isoformat()
+    }
+
+
+def record_data(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento utente di una riga di user_data (gestisce sia string JSON che dict diretto)."""
+    if isinstance(record["data"], str):
+        return json.loads(record["data"])
+    return record["data"]
+
+
+def load_watermark(path: str) -> Optional[str]:
+    """Legge l'updated_at dell'ultimo download incrementale (None se assente o illeggibile)."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("updated_at")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def parse_timestamp(value: str) -> Optional[datetime]:
+    """Converte un timestamp ISO di Supabase in datetime (None se non valido)."""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def watermark_since(watermark: Optional[str], overlap: float = None) -> Optional[str]:
+    """
+    Inizio del download incrementale: il watermark meno il margine di sovrapposizione.
+
+    Args:
+        watermark: updated_at dell'ultimo download (None: download completo)
+        overlap: Secondi da rileggere (default SUPABASE_WATERMARK_OVERLAP_SECONDS)
+
+    Returns:
+        str: updated_at da cui scaricare, o None per un download completo
+    """
+    if watermark is None:
+        return None
+    overlap = SUPABASE_WATERMARK_OVERLAP_SECONDS if overlap is None else overlap
+    parsed = parse_timestamp(watermark)
+    if parsed is None:
+        logger.warning(f"⚠️ Watermark non valido ({watermark}), download completo")
+        return None
+    return (parsed - timedelta(seconds=overlap)).isoformat()
+
+
+def watermark_before(updated_at: str, watermark: Optional[str]) -> bool:
+    """Indica se updated_at precede il watermark (False se uno dei due non è confrontabile)."""
+    first, second = parse_timestamp(updated_at), parse_timestamp(watermark)
+    if first is None or second is None:
+        return False
+    # Timestamp senza fuso orario: UTC, come per Supabase
+    if first.tzinfo is not None:
+        first = first.astimezone(timezone.utc).replace(tzinfo=None)
+    if second.tzinfo is not None:
+        second = second.astimezone(timezone.utc).replace(tzinfo=None)
+    return first < second
+
+
+def utc_now() -> str:
+    """Istante corrente in formato ISO con fuso orario (UTC)."""
+    return datetime.now(timezone.utc).isoformat()
+
+
+def save_watermark(path: str, updated_at: str) -> None:
+    """Salva atomicamente l'updated_at dell'ultimo download incrementale."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    atomic_write_json(path, {"updated_at": updated_at, "saved_at": datetime.now().isoformat()})
+
+
+def user_data_row(user_id: str, user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte un documento utente in una riga della tabella user_data di Supabase (data come oggetto JSONB)."""
+    return {
+        "user_id": user_id,
+        # Copia JSON: la riga può essere inviata più tardi dal worker mentre il documento cambia
+        "data": json.loads(json.dumps(user_data, ensure_ascii=False, default=str)),
+        # Riassegnato all'invio (send_user_data_rows) e dal trigger UPDATED_AT_SQL
+        "updated_at": utc_now()
+    }
+
 
 class SupabaseUserService:
     """Servizio per la gestione dei dati utente su Supabase."""
@@ -25,6 +151,12 @@ class SupabaseUserService:
     def __init__(self):
         """Inizializza il client Supabase."""
         self.supabase: Optional[Client] = None
+        # Ultima versione di ogni documento confermata da Supabase (sincronizzazione delta)
+        self._synced: Dict[str, DocumentState] = {}
+        self._synced_lock = threading.Lock()
+        # None: da verificare; False: colonna content_hash o funzione SQL assenti (vedi DELTA_SQL)
+        self._delta_enabled: Optional[bool] = None
+        self.sync_stats = {"full_rows": 0, "patches": 0, "unchanged": 0, "bytes_sent": 0}
         self._initialize_client()
     
     def _initialize_client(self) -> None:
@@ -72,23 +204,18 @@ class SupabaseUserService:
         
         try:
             # Converte users.json nel formato per Supabase
-            users_for_supabase = []
-            for username, user_data in local_users_data.items():
-                users_for_supabase.append({
-                    "username": username,
-                    "email": user_data.get("email", ""),
-                    "password_hash": user_data["password_hash"],
-                    "user_id": user_data["user_id"],
-                    "created_at": datetime.fromtimestamp(user_data["created_at"]).isoformat()
-                })
+            users_for_supabase = [
+                user_row(username, user_data)
+                for username, user_data in local_users_data.items()
+            ]
             
-            # Upsert su Supabase (insert o update se esiste già)
-            for user in users_for_supabase:
+            # Upsert multi-riga su Supabase (insert o update se esiste già)
+            for start in range(0, len(users_for_supabase), SUPABASE_SYNC_BATCH_SIZE):
+                batch = users_for_supabase[start:start + SUPABASE_SYNC_BATCH_SIZE]
                 try:
-                    self.supabase.table("users").upsert(user, on_conflict="user_id").execute()
-                    logger.info(f"✅ Utente {user['username']} sincronizzato su Supabase")
+                    self.supabase.table("users").upsert(batch, on_conflict="user_id").execute()
                 except Exception as e:
-                    logger.error(f"❌ Errore sincronizzazione utente {user['username']}: {str(e)}")
+                    logger.error(f"❌ Errore sincronizzazione di {len(batch)} utenti: {str(e)}")
                     return False
             
             logger.info(f"✅ {len(users_for_supabase)} utenti sincronizzati su Supabase")
@@ -98,6 +225,29 @@ class SupabaseUserService:
             logger.error(f"❌ Errore nella sincronizzazione utenti: {str(e)}")
             return False
     
+    def sync_user_to_supabase(self, username: str, user_data: Dict[str, Any]) -> bool:
+        """
+        Sincronizza su Supabase un singolo utente (upsert di una riga).
+        
+        Args:
+            username: Nome utente
+            user_data: Dati dell'utente nel formato di users.json
+            
+        Returns:
+            bool: True se la sincronizzazione è riuscita
+        """
+        if not self.is_available():
+            logger.warning(f"⚠️ Supabase non disponibile per sincronizzazione utente {username}")
+            return False
+        
+        try:
+            self.supabase.table("users").upsert(user_row(username, user_data), on_conflict="user_id").execute()
+            logger.info(f"✅ Utente {username} sincronizzato su Supabase")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Errore sincronizzazione utente {username}: {str(e)}")
+            return False
+    
     def download_users_from_supabase(self) -> Optional[Dict[str, Any]]:
         """
         Scarica tutti gli utenti da Supabase.
@@ -176,15 +326,8 @@ class SupabaseUserService:
             return False
         
         try:
-            # Prepara i dati per Supabase
-            supabase_data = {
-                "user_id": user_id,
-                "data": json.dumps(user_data, ensure_ascii=False),
-                "updated_at": datetime.now().isoformat()
-            }
-            
-            # Upsert su Supabase
-            self.supabase.table("user_data").upsert(supabase_data, on_conflict="user_id").execute()
+            # Upsert su Supabase (solo le modifiche, se la sincronizzazione delta è attiva)
+            self.send_user_data_rows([user_data_row(user_id, user_data)])
             logger.info(f"✅ Dati utente {user_id} sincronizzati su Supabase")
             return True
             
@@ -192,6 +335,96 @@ class SupabaseUserService:
             logger.error(f"❌ Errore sincronizzazione dati utente {user_id}: {str(e)}")
             return False
     
+    def _delta_available(self) -> bool:
+        """Verifica (una volta) che user_data abbia la colonna content_hash per la sincronizzazione delta."""
+        if self._delta_enabled is None:
+            try:
+                self.supabase.table("user_data").select("content_hash").limit(1).execute()
+                self._delta_enabled = True
+            except Exception as e:
+                logger.warning(f"⚠️ Sincronizzazione delta non disponibile, invio dei documenti completi: {str(e)}")
+                self._delta_enabled = False
+        return self._delta_enabled
+
+    def send_user_data_rows(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Invia a Supabase i documenti utente (righe di user_data_row).
+        
+        Con la sincronizzazione delta attiva (colonna content_hash e funzione
+        apply_user_data_patches, vedi supabase_delta) per ogni utente già confermato si
+        inviano solo le sezioni cambiate o i nuovi elementi delle liste; i documenti mai
+        inviati da questo processo o con versioni divergenti vengono inviati completi.
+        
+        updated_at è riassegnato al momento dell'invio: la riga può essere rimasta
+        in coda nel worker (accorpamento, tentativi) ben oltre la sua creazione. Con il
+        trigger di UPDATED_AT_SQL installato lo assegna comunque il server.
+        
+        Args:
+            rows: Righe da inviare (user_id, data, updated_at)
+            
+        Raises:
+            Exception: Se l'invio fallisce (le righe possono essere ritentate)
+        """
+        if not rows:
+            return
+        sent_at = utc_now()
+        rows = [dict(row, updated_at=sent_at) for row in rows]
+        if not self._delta_available():
+            self.supabase.table("user_data").upsert(rows, on_conflict="user_id").execute()
+            self.sync_stats["full_rows"] += len(rows)
+            self.sync_stats["bytes_sent"] += patch_size(rows)
+            return
+
+        states = {}
+        full_rows = {}
+        patches = []
+        for row in rows:
+            user_id = row["user_id"]
+            state = document_state(row["data"])
+            states[user_id] = state
+            with self._synced_lock:
+                acknowledged = self._synced.get(user_id)
+            if acknowledged is None:
+                full_rows[user_id] = row
+                continue
+            patch = compute_patch(user_id, acknowledged, row["data"], state)
+            if patch is None:
+                self.sync_stats["unchanged"] += 1
+            else:
+                patches.append((patch, row))
+
+        if patches and self._delta_enabled:
+            try:
+                response = self.supabase.rpc(PATCH_FUNCTION, {"patches": [patch for patch, _ in patches]}).execute()
+                applied = set(response.data or [])
+            except Exception as e:
+                if "PGRST202" not in str(e) and PATCH_FUNCTION not in str(e):
+                    raise
+                # Funzione SQL non installata: si torna all'invio completo
+                logger.warning(f"⚠️ Funzione {PATCH_FUNCTION} non disponibile, invio dei documenti completi")
+                self._delta_enabled = False
+                applied = set()
+            self.sync_stats["bytes_sent"] += patch_size([patch for patch, _ in patches])
+            for patch, row in patches:
+                if patch["user_id"] in applied:
+                    self.sync_stats["patches"] += 1
+                    with self._synced_lock:
+                        self._synced[patch["user_id"]] = states[patch["user_id"]]
+                else:
+                    # Versione su Supabase diversa da quella confermata: documento completo
+                    full_rows[patch["user_id"]] = row
+        else:
+            full_rows.update((patch["user_id"], row) for patch, row in patches)
+
+        if full_rows:
+            payload = [dict(row, content_hash=states[user_id].document_hash) for user_id, row in full_rows.items()]
+            self.supabase.table("user_data").upsert(payload, on_conflict="user_id").execute()
+            self.sync_stats["full_rows"] += len(payload)
+            self.sync_stats["bytes_sent"] += patch_size(payload)
+            with self._synced_lock:
+                for user_id in full_rows:
+                    self._synced[user_id] = states[user_id]
+
     def download_user_data_from_supabase(self, user_id: str) -> Optional[Dict[str, Any]]:
         """
         Scarica i dati di un utente specifico da Supabase.
@@ -217,10 +450,7 @@ class SupabaseUserService:
             user_record = response.data[0]
             
             # Gestisce sia string JSON che dict diretto da Supabase
-            if isinstance(user_record["data"], str):
-                user_data = json.loads(user_record["data"])
-            else:
-                user_data = user_record["data"]
+            user_data = record_data(user_record)
             
             logger.info(f"✅ Dati utente {user_id} scaricati da Supabase")
             return user_data
@@ -229,6 +459,51 @@ class SupabaseUserService:
             logger.error(f"❌ Errore nel download dati utente {user_id} da Supabase: {str(e)}")
             return None
     
+    def iter_user_data_pages(self, since: Optional[str] = None,
+                             page_size: Optional[int] = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Scarica le righe di user_data a pagine, in ordine di (updated_at, user_id).
+        
+        La paginazione è per chiave (updated_at) e non per offset assoluto: le righe
+        aggiornate durante il download si spostano in coda e vengono comunque lette.
+        
+        Args:
+            since: Scarica solo le righe con updated_at >= since (None: tutte)
+            page_size: Numero massimo di righe per pagina (default SUPABASE_PAGE_SIZE)
+            
+        Yields:
+            List[Dict]: righe di una pagina (user_id, data, updated_at, ...)
+        """
+        page_size = page_size or SUPABASE_PAGE_SIZE
+        cursor = since
+        skip = 0  # Righe con updated_at == cursor già lette
+        while True:
+            query = self.supabase.table("user_data").select("*")
+            if cursor is not None:
+                query = query.gte("updated_at", cursor)
+            response = query.order("updated_at").order("user_id").range(skip, skip + page_size - 1).execute()
+            rows = response.data or []
+            if not rows:
+                return
+            yield rows
+            if len(rows) < page_size:
+                return
+            last = rows[-1]["updated_at"]
+            ties = sum(1 for row in rows if row["updated_at"] == last)
+            skip = skip + ties if last == cursor else ties
+            cursor = last
+
+    def count_user_data(self, since: Optional[str] = None) -> Optional[int]:
+        """Numero di righe di user_data con updated_at >= since (None se il conteggio fallisce)."""
+        try:
+            query = self.supabase.table("user_data").select("user_id", count="exact")
+            if since is not None:
+                query = query.gte("updated_at", since)
+            return query.limit(1).execute().count
+        except Exception as e:
+            logger.warning(f"⚠️ Conteggio dati utente su Supabase non riuscito: {str(e)}")
+            return None
+
     def download_all_user_data_from_supabase(self) -> Dict[str, Any]:
         """
         Scarica tutti i dati utente da Supabase.
@@ -241,25 +516,16 @@ class SupabaseUserService:
             return {}
         
         try:
-            response = self.supabase.table("user_data").select("*").execute()
+            # Converte in formato {user_id: data}
+            all_user_data = {}
+            for page in self.iter_user_data_pages():
+                for record in page:
+                    all_user_data[record["user_id"]] = record_data(record)
             
-            if not response.data:
+            if not all_user_data:
                 logger.info("📝 Nessun dato utente trovato su Supabase")
                 return {}
             
-            # Converte in formato {user_id: data}
-            all_user_data = {}
-            for record in response.data:
-                user_id = record["user_id"]
-                
-                # Gestisce sia string JSON che dict diretto da Supabase
-                if isinstance(record["data"], str):
-                    user_data = json.loads(record["data"])
-                else:
-                    user_data = record["data"]
-                    
-                all_user_data[user_id] = user_data
-            
             logger.info(f"✅ Dati di {len(all_user_data)} utenti scaricati da Supabase")
             return all_user_data
             
@@ -310,7 +576,8 @@ class SupabaseUserService:
                 created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
                 updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
             );
-            """)
+            """ + "\n            Per updated_at assegnato dal server (download incrementale):\n" + UPDATED_AT_SQL
+                + "\n            Per la sincronizzazione delta:\n" + DELTA_SQL)
             return False
     
     def sync_all_local_data_to_supabase(self) -> bool:
@@ -328,37 +595,30 @@ class SupabaseUserService:
         
         success = True
         
+        storage = get_user_storage()
+        
         # 1. Sincronizza utenti
         try:
-            users_file = "user_data/users.json"
-            if os.path.exists(users_file):
-                with open(users_file, 'r', encoding='utf-8') as f:
-                    users_data = json.load(f)
-                
+            users_data = storage.load_users()
+            if users_data:
                 if not self.sync_users_to_supabase(users_data):
                     success = False
             else:
-                logger.warning("⚠️ File users.json non trovato")
+                logger.warning("⚠️ Nessun utente locale trovato")
         except Exception as e:
             logger.error(f"❌ Errore sincronizzazione utenti: {str(e)}")
             success = False
         
         # 2. Sincronizza dati utente individuali
-        user_data_dir = "user_data"
-        if os.path.exists(user_data_dir):
-            for filename in os.listdir(user_data_dir):
-                if filename.endswith(".json") and filename != "users.json":
-                    user_id = filename.replace(".json", "")
-                    
-                    try:
-                        with open(os.path.join(user_data_dir, filename), 'r', encoding='utf-8') as f:
-                            user_data = json.load(f)
-                        
-                        if not self.sync_user_data_to_supabase(user_id, user_data):
-                            success = False
-                    except Exception as e:
-                        logger.error(f"❌ Errore sincronizzazione dati {user_id}: {str(e)}")
-                        success = False
+        for user_id in storage.list_user_ids():
+            try:
+                user_data = storage.load_document(user_id)
+                
+                if not self.sync_user_data_to_supabase(user_id, user_data):
+                    success = False
+            except Exception as e:
+                logger.error(f"❌ Errore sincronizzazione dati {user_id}: {str(e)}")
+                success = False
         
         if success:
             logger.info("✅ Sincronizzazione completa locale → Supabase completata")
@@ -367,14 +627,32 @@ class SupabaseUserService:
         
         return success
     
-    def download_all_data_from_supabase(self) -> bool:
+    def download_all_data_from_supabase(self, full: bool = False,
+                                        progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                                        watermark_path: str = SUPABASE_WATERMARK_PATH,
+                                        storage=None) -> bool:
         """
-        Scarica tutti i dati da Supabase e li salva localmente.
+        Scarica i dati da Supabase e li salva localmente.
+        
+        Il download dei dati utente è incrementale: si leggono a pagine solo le righe
+        con updated_at successivo al watermark salvato in locale (watermark_path) meno
+        SUPABASE_WATERMARK_OVERLAP_SECONDS (righe confermate in ritardo), e
+        i documenti di ogni pagina sono scritti da un pool di SUPABASE_DOWNLOAD_WORKERS
+        thread mentre si scarica la pagina seguente. In memoria restano al più due
+        pagine. Il watermark avanza solo dopo che tutte le pagine precedenti sono state
+        scritte senza errori, quindi un download interrotto riprende da lì.
         
+        Args:
+            full: Se True ignora il watermark e scarica tutti i dati utente
+            progress: Funzione chiamata dopo ogni pagina con (documenti scritti, totale
+                previsto o None)
+            watermark_path: File del watermark del download incrementale
+            storage: Backend di persistenza locale (default: get_user_storage())
+            
         Returns:
             bool: True se il download è riuscito
         """
-        logger.info("⬇️ Avvio download completo Supabase → locale")
+        logger.info("⬇️ Avvio download Supabase → locale")
         
         if not self.is_available():
             logger.error("❌ Download interrotto: Supabase non disponibile")
@@ -382,38 +660,70 @@ class SupabaseUserService:
         
         success = True
         
-        # Crea directory user_data se non esiste
-        os.makedirs("user_data", exist_ok=True)
+        storage = storage or get_user_storage()
         
         # 1. Scarica utenti
         try:
             users_data = self.download_users_from_supabase()
             if users_data is not None:
-                with open("user_data/users.json", 'w', encoding='utf-8') as f:
-                    json.dump(users_data, f, ensure_ascii=False, indent=2)
-                logger.info("✅ File users.json aggiornato da Supabase")
+                storage.save_users(users_data)
+                logger.info("✅ Utenti locali aggiornati da Supabase")
             else:
                 success = False
         except Exception as e:
             logger.error(f"❌ Errore download utenti: {str(e)}")
             success = False
         
-        # 2. Scarica dati utente individuali
+        # 2. Scarica dati utente modificati dopo il watermark
+        saved_watermark = None if full else load_watermark(watermark_path)
+        since = watermark_since(saved_watermark)
+        total = self.count_user_data(since)
+        written = 0
+        watermark_valid = True
+        
+        def write_document(record):
+            storage.save_document(record["user_id"], record_data(record))
+        
+        def finish_page(futures, page_watermark):
+            nonlocal written, watermark_valid
+            wait(futures)
+            for future in futures:
+                if future.exception() is not None:
+                    logger.error(f"❌ Errore salvataggio dati utente: {str(future.exception())}")
+                    watermark_valid = False
+                else:
+                    written += 1
+            # Le righe non salvate saranno riscaricate al prossimo avvio; le pagine
+            # del margine di sovrapposizione non riportano indietro il watermark
+            if watermark_valid and not watermark_before(page_watermark, saved_watermark):
+                save_watermark(watermark_path, page_watermark)
+            if progress is not None:
+                progress(written, total)
+            logger.info(f"⬇️ Dati utente scaricati: {written}/{total if total is not None else '?'}")
+        
         try:
-            all_user_data = self.download_all_user_data_from_supabase()
-            
-            for user_id, user_data in all_user_data.items():
-                filename = f"user_data/{user_id}.json"
-                with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(user_data, f, ensure_ascii=False, indent=2)
-                logger.info(f"✅ File {filename} aggiornato da Supabase")
+            with ThreadPoolExecutor(max_workers=SUPABASE_DOWNLOAD_WORKERS,
+                                    thread_name_prefix="supabase-download") as executor:
+                previous = None
+                try:
+                    for page in self.iter_user_data_pages(since):
+                        futures = [executor.submit(write_document, record) for record in page]
+                        if previous is not None:
+                            finish_page(*previous)
+                        previous = (futures, page[-1]["updated_at"])
+                finally:
+                    if previous is not None:
+                        finish_page(*previous)
+            if not watermark_valid:
+                success = False
+            logger.info(f"✅ Dati di {written} utenti aggiornati da Supabase")
                 
         except Exception as e:
             logger.error(f"❌ Errore download dati utente: {str(e)}")
             success = False
         
         if success:
-            logger.info("✅ Download completo Supabase → locale completato")
+            logger.info("✅ Download Supabase → locale completato")
         else:
             logger.warning("⚠️ Download completato con alcuni errori")
         
@@ -457,18 +767,19 @@ def auto_sync_user_data(user_id: str, user_data: Dict[str, Any]) -> None:
     Sincronizza automaticamente i dati di un utente su Supabase quando vengono modificati.
     Funzione robusta che gestisce tutti i possibili errori senza interrompere l'applicazione.
     
+    L'invio è asincrono: la riga viene accodata al worker di sincronizzazione del
+    processo (vedi supabase_sync_worker), che accorpa gli aggiornamenti dello stesso
+    utente e li invia a blocchi.
+    
     Args:
         user_id: ID dell'utente
         user_data: Dati dell'utente da sincronizzare
     """
     try:
-        supabase_service = get_supabase_service()
-        if supabase_service and supabase_service.is_available():
-            success = supabase_service.sync_user_data_to_supabase(user_id, user_data)
-            if success:
-                logger.debug(f"✅ Auto-sync completato per {user_id}")
-            else:
-                logger.warning(f"⚠️ Auto-sync fallito per {user_id}, ma dati salvati localmente")
+        sync_worker = get_sync_worker()
+        if sync_worker is not None:
+            sync_worker.enqueue("user_data", user_id, user_data_row(user_id, user_data))
+            logger.debug(f"✅ Auto-sync accodato per {user_id}")
         else:
             logger.debug(f"📴 Auto-sync saltato per {user_id}: Supabase non disponibile")
     except Exception as e:
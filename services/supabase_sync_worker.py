@@ -0,0 +1,313 @@
+"""
+Sincronizzazione asincrona e a blocchi verso Supabase.
+
+auto_sync_user_data inviava il documento utente a Supabase in modo sincrono dopo
+ogni salvataggio, aggiungendo un round-trip di rete alla latenza della chat.
+SupabaseSyncWorker accoda invece le righe da scrivere e le invia da un thread in
+background:
+
+- le righe sono indicizzate per (tabella, user_id): aggiornamenti ripetuti dello
+  stesso utente prima dell'invio vengono accorpati e si invia solo l'ultimo;
+- il worker attende NUTRICOACH_SUPABASE_SYNC_DELAY_MS (default 250) dalla prima
+  modifica per raccogliere altri aggiornamenti, poi invia upsert multi-riga di al
+  più NUTRICOACH_SUPABASE_SYNC_BATCH_SIZE righe (default 50) per tabella;
+- in caso di errore le righe vengono ritentate con backoff esponenziale e jitter
+  (al più SUPABASE_SYNC_MAX_BACKOFF_SECONDS), senza sovrascrivere righe più recenti;
+- la coda è limitata a NUTRICOACH_SUPABASE_SYNC_QUEUE_SIZE utenti (default 1000):
+  se è piena il chiamante attende e, scaduto il timeout, invia la riga da sé;
+- stats espone profondità della coda e ritardo (lag) delle sincronizzazioni.
+
+Il worker usa solo table(...).upsert(...).execute() del client, quindi nei test
+può lavorare con un client Supabase finto in memoria. Per singole tabelle si può
+indicare una funzione di invio diversa (senders), ad esempio la sincronizzazione
+delta di user_data in SupabaseUserService.send_user_data_rows. Alla chiusura del
+processo (atexit) le righe in coda vengono inviate.
+"""
+
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Configurazione logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+SUPABASE_SYNC_QUEUE_SIZE = int(os.environ.get("NUTRICOACH_SUPABASE_SYNC_QUEUE_SIZE", "1000"))
+SUPABASE_SYNC_BATCH_SIZE = int(os.environ.get("NUTRICOACH_SUPABASE_SYNC_BATCH_SIZE", "50"))
+SUPABASE_SYNC_DELAY_MS = int(os.environ.get("NUTRICOACH_SUPABASE_SYNC_DELAY_MS", "250"))
+SUPABASE_SYNC_BASE_BACKOFF_SECONDS = 0.5
+SUPABASE_SYNC_MAX_BACKOFF_SECONDS = 30.0
+# Colonna di conflitto degli upsert (tabelle users e user_data)
+SUPABASE_CONFLICT_COLUMN = "user_id"
+
+
+@dataclass
+class PendingRow:
+    """Ultima versione di una riga in attesa di invio."""
+    row: Dict[str, Any]
+    enqueued_at: float
+    ready_at: float
+    attempts: int = 0
+
+
+class SupabaseSyncWorker:
+    """Coda di sincronizzazione verso Supabase con accorpamento, batch e retry.
+
+    Thread-safe: enqueue può essere chiamata da qualsiasi thread; l'invio avviene
+    nel thread del worker, fuori dal lock.
+    """
+
+    def __init__(self, client: Any, queue_size: int = SUPABASE_SYNC_QUEUE_SIZE,
+                 batch_size: int = SUPABASE_SYNC_BATCH_SIZE, delay: float = SUPABASE_SYNC_DELAY_MS / 1000,
+                 base_backoff: float = SUPABASE_SYNC_BASE_BACKOFF_SECONDS,
+                 max_backoff: float = SUPABASE_SYNC_MAX_BACKOFF_SECONDS, put_timeout: float = 5.0,
+                 senders: Optional[Dict[str, Callable[[List[Dict[str, Any]]], None]]] = None):
+        """
+        Args:
+            client: Client Supabase (o un finto con la stessa interfaccia table/upsert/execute)
+            queue_size: Numero massimo di righe distinte in coda
+            batch_size: Numero massimo di righe per upsert
+            delay: Secondi di attesa dalla prima modifica per accorpare gli aggiornamenti
+            base_backoff: Attesa (secondi) prima del primo retry
+            max_backoff: Attesa massima (secondi) tra due retry
+            put_timeout: Secondi di attesa di enqueue con la coda piena
+            senders: Funzioni di invio per tabella (al posto dell'upsert multi-riga)
+        """
+        self.client = client
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.delay = delay
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.put_timeout = put_timeout
+        self.senders = dict(senders or {})
+        self._pending: "OrderedDict[Tuple[str, str], PendingRow]" = OrderedDict()
+        self._in_flight = 0
+        self._urgent = False
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._worker = None
+        self._closed = False
+        # Metriche
+        self.sent_rows = 0
+        self.sent_batches = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.direct_sends = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        atexit.register(self.close)
+
+    # ==================== CODA ====================
+
+    def enqueue(self, table: str, key: str, row: Dict[str, Any]) -> None:
+        """
+        Accoda una riga da inviare con upsert, sostituendo quella in attesa per la stessa chiave.
+
+        Args:
+            table: Tabella Supabase (users, user_data)
+            key: Chiave della riga (user_id)
+            row: Riga completa da inviare
+        """
+        now = time.monotonic()
+        with self._condition:
+            pending = self._pending.get((table, key))
+            if pending is not None:
+                pending.row = row
+                self.coalesced += 1
+                return
+
+            deadline = now + self.put_timeout
+            while len(self._pending) >= self.queue_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            queue_full = len(self._pending) >= self.queue_size
+            if not queue_full and not self._closed:
+                self._pending[(table, key)] = PendingRow(row=row, enqueued_at=now, ready_at=now + self.delay)
+                self._start_worker()
+                self._condition.notify_all()
+                return
+            self.direct_sends += 1
+
+        # Coda piena (o worker chiuso): invio diretto dal thread chiamante
+        logger.warning(f"⚠️ Coda di sincronizzazione piena, invio diretto di {table}/{key}")
+        try:
+            self._upsert(table, [row])
+        except Exception as e:
+            logger.error(f"❌ Errore nell'invio diretto di {table}/{key} a Supabase: {str(e)}")
+
+    def _start_worker(self) -> None:
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="supabase-sync", daemon=True)
+            self._worker.start()
+
+    def _take_batch(self) -> Optional[Tuple[str, List[Tuple[str, PendingRow]]]]:
+        """Estrae dalla coda un batch di righe pronte della stessa tabella (chiamata sotto lock)."""
+        now = time.monotonic()
+        table = None
+        batch = []
+        for (row_table, key), pending in self._pending.items():
+            if pending.ready_at > now and not (self._urgent and pending.attempts == 0):
+                continue
+            if table is None:
+                table = row_table
+            if row_table == table:
+                batch.append((key, pending))
+                if len(batch) >= self.batch_size:
+                    break
+        for key, _ in batch:
+            del self._pending[(table, key)]
+        return (table, batch) if batch else None
+
+    def _run(self) -> None:
+        """Thread in background: invia i batch pronti finché il worker non viene chiuso."""
+        while True:
+            with self._condition:
+                taken = self._take_batch()
+                while taken is None:
+                    if self._closed and not self._pending:
+                        return
+                    now = time.monotonic()
+                    timeout = min((p.ready_at for p in self._pending.values()), default=now + 60) - now
+                    self._condition.wait(max(timeout, 0.001))
+                    taken = self._take_batch()
+                table, batch = taken
+                self._in_flight += len(batch)
+                # Si libera spazio in coda per i chiamanti in attesa
+                self._condition.notify_all()
+
+            try:
+                self._upsert(table, [pending.row for _, pending in batch])
+                self._record_success(batch)
+            except Exception as e:
+                logger.warning(f"⚠️ Errore nella sincronizzazione di {len(batch)} righe di {table}: {str(e)}")
+                self._requeue(table, batch)
+            finally:
+                with self._condition:
+                    self._in_flight -= len(batch)
+                    self._condition.notify_all()
+
+    def _upsert(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        sender = self.senders.get(table)
+        if sender is not None:
+            sender(rows)
+            return
+        self.client.table(table).upsert(rows, on_conflict=SUPABASE_CONFLICT_COLUMN).execute()
+
+    def _record_success(self, batch: List[Tuple[str, PendingRow]]) -> None:
+        lag = time.monotonic() - min(pending.enqueued_at for _, pending in batch)
+        with self._condition:
+            self.sent_rows += len(batch)
+            self.sent_batches += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def _requeue(self, table: str, batch: List[Tuple[str, PendingRow]]) -> None:
+        """Rimette in coda le righe fallite con backoff esponenziale e jitter."""
+        now = time.monotonic()
+        with self._condition:
+            self.failures += 1
+            for key, pending in batch:
+                attempts = pending.attempts + 1
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+                ready_at = now + backoff * random.uniform(0.5, 1.5)
+                newer = self._pending.get((table, key))
+                if newer is not None:
+                    # Una versione più recente è già in coda: si conserva quella
+                    newer.enqueued_at = min(newer.enqueued_at, pending.enqueued_at)
+                    newer.attempts = attempts
+                    newer.ready_at = max(newer.ready_at, ready_at)
+                    continue
+                pending.attempts = attempts
+                pending.ready_at = ready_at
+                self._pending[(table, key)] = pending
+            self._condition.notify_all()
+
+    # ==================== CONTROLLO ====================
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Invia subito le righe in coda (senza attendere il ritardo di accorpamento) e
+        attende che siano state scritte.
+
+        Args:
+            timeout: Secondi massimi di attesa (None: senza limite)
+
+        Returns:
+            bool: True se la coda è vuota al termine
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._urgent = True
+            self._condition.notify_all()
+            try:
+                while self._pending or self._in_flight:
+                    if self._worker is None or not self._worker.is_alive():
+                        return False
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining if remaining is not None else 0.5)
+                return True
+            finally:
+                self._urgent = False
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Invia le righe in coda (al più timeout secondi) e ferma il worker."""
+        self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._worker is not None and self._worker is not threading.current_thread():
+            self._worker.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Restituisce profondità della coda, ritardi e contatori del worker."""
+        now = time.monotonic()
+        with self._condition:
+            oldest = min((p.enqueued_at for p in self._pending.values()), default=None)
+            return {
+                "queue_depth": len(self._pending),
+                "in_flight": self._in_flight,
+                "oldest_pending_seconds": now - oldest if oldest is not None else 0.0,
+                "last_lag_seconds": self.last_lag,
+                "max_lag_seconds": self.max_lag,
+                "sent_rows": self.sent_rows,
+                "sent_batches": self.sent_batches,
+                "coalesced": self.coalesced,
+                "failures": self.failures,
+                "direct_sends": self.direct_sends,
+            }
+
+
+_worker = None
+_worker_checked = False
+_worker_lock = threading.Lock()
+
+
+def get_sync_worker() -> Optional[SupabaseSyncWorker]:
+    """
+    Restituisce il worker di sincronizzazione condiviso dal processo.
+
+    Returns:
+        SupabaseSyncWorker: worker condiviso, o None se Supabase non è disponibile
+    """
+    global _worker, _worker_checked
+    with _worker_lock:
+        if not _worker_checked:
+            # Le credenziali non cambiano durante il processo: il controllo avviene una volta
+            _worker_checked = True
+            from services.supabase_service import SupabaseUserService
+            service = SupabaseUserService()
+            if service.is_available():
+                _worker = SupabaseSyncWorker(service.supabase, senders={"user_data": service.send_user_data_rows})
+        return _worker
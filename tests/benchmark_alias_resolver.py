@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark del resolver degli alias di NutriDB: latenza di hit e miss
+per la ricerca storica, il resolver compilato senza cache e con cache LRU.
+
+Uso: python tests/benchmark_alias_resolver.py
+"""
+
+import os
+import sys
+import timeit
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_tools.nutridb import NutriDB
+from tests.test_alias_resolver import legacy_alias_get
+
+CASES = {
+    "hit diretto": "pollo_petto",
+    "hit con underscore": "petto_di_pollo",
+    "hit dopo preparazione": "petto di pollo grigliato al forno",
+    "miss semplice": "tofu",
+    "miss con preparazione": "seitan alla griglia marinato",
+}
+
+
+def bench(func, name, number=20000):
+    """Restituisce la latenza media in microsecondi."""
+    return timeit.timeit(lambda: func(name), number=number) / number * 1e6
+
+
+def main():
+    alias = NutriDB("Dati_processed").alias
+
+    print(f"{'caso':<24}{'storico':>12}{'compilato':>12}{'con cache':>12}  (µs/lookup)")
+    for label, name in CASES.items():
+        legacy = bench(lambda key: legacy_alias_get(alias, key), name)
+        compiled = bench(alias._resolve, name)
+        cached = bench(alias.get, name)
+        print(f"{label:<24}{legacy:>12.2f}{compiled:>12.2f}{cached:>12.2f}")
+
+    print(f"\nCache: {alias.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
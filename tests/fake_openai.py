@@ -0,0 +1,191 @@
+"""
+Client OpenAI finto per i test delle run dell'assistente.
+
+Implementa il sottoinsieme di client.beta usato da ChatManager e AssistantManager:
+creazione e recupero di assistenti, creazione ed eliminazione di thread, messaggi,
+runs.create/retrieve/cancel/submit_tool_outputs per il polling e
+runs.stream/submit_tool_outputs_stream per lo streaming. Gli stream
+restituiscono, nell'ordine, le sequenze di eventi registrate passate al
+costruttore (dizionari convertiti in oggetti con attributi, come gli eventi
+dell'SDK), con un ritardo opzionale tra un evento e l'altro.
+"""
+
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+
+
+def to_namespace(value):
+    """Converte ricorsivamente dizionari e liste in oggetti con attributi."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: to_namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(item) for item in value]
+    return value
+
+
+def text_delta(value):
+    return {"event": "thread.message.delta",
+            "data": {"delta": {"content": [{"index": 0, "type": "text", "text": {"value": value}}]}}}
+
+
+def message_completed(value):
+    return {"event": "thread.message.completed",
+            "data": {"role": "assistant", "content": [{"type": "text", "text": {"value": value}}]}}
+
+
+def run_event(event, run_id="run_1", **fields):
+    return {"event": event, "data": dict({"id": run_id, "status": event.rsplit(".", 1)[-1]}, **fields)}
+
+
+def requires_action(run_id, tool_calls):
+    """Evento thread.run.requires_action con tool_calls [(id, nome, argomenti JSON)]."""
+    calls = [{"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+             for call_id, name, arguments in tool_calls]
+    return run_event("thread.run.requires_action", run_id,
+                     required_action={"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": calls}})
+
+
+class FakeStream:
+    """Stream di eventi (context manager iterabile, come AssistantStreamManager)."""
+
+    def __init__(self, client, events):
+        self.client = client
+        self.events = events
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+        return False
+
+    def __iter__(self):
+        for event in self.events:
+            if self.client.event_delay:
+                time.sleep(self.client.event_delay)
+            if isinstance(event, Exception):
+                raise event
+            if event["event"].startswith("thread.run."):
+                # Stato della run visto da runs.retrieve
+                self.client.run_statuses[event["data"]["id"]] = event["data"]["status"]
+            yield to_namespace(event)
+
+
+class FakeRuns:
+    def __init__(self, client):
+        self.client = client
+
+    def _next_stream(self):
+        if not self.client.streams:
+            raise AssertionError("Nessuno stream registrato disponibile")
+        return FakeStream(self.client, self.client.streams.pop(0))
+
+    def stream(self, thread_id, assistant_id, timeout=None):
+        self.client.calls.append(("stream", thread_id))
+        return self._next_stream()
+
+    def submit_tool_outputs_stream(self, thread_id, run_id, tool_outputs, timeout=None):
+        self.client.calls.append(("submit_tool_outputs_stream", run_id))
+        self.client.submitted.append(tool_outputs)
+        return self._next_stream()
+
+    def create(self, thread_id, assistant_id):
+        self.client.calls.append(("create", thread_id))
+        return SimpleNamespace(id="run_polling", status="queued")
+
+    def retrieve(self, thread_id, run_id):
+        self.client.calls.append(("retrieve", run_id))
+        if self.client.polled_statuses:
+            status = self.client.polled_statuses.pop(0)
+        else:
+            status = self.client.run_statuses.get(run_id, "completed")
+        return SimpleNamespace(id=run_id, status=status, required_action=None)
+
+    def submit_tool_outputs(self, thread_id, run_id, tool_outputs):
+        self.client.calls.append(("submit_tool_outputs", run_id))
+        self.client.submitted.append(tool_outputs)
+
+    def cancel(self, thread_id, run_id):
+        self.client.calls.append(("cancel", run_id))
+        self.client.run_statuses[run_id] = "cancelling"
+
+
+class FakeMessages:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, thread_id, role, content):
+        self.client.messages.setdefault(thread_id, []).append((role, content))
+
+    def list(self, thread_id):
+        self.client.calls.append(("messages.list", thread_id))
+        return to_namespace({"data": [{"content": [{"text": {"value": self.client.last_message}}]}]})
+
+
+class FakeNotFoundError(Exception):
+    """Errore 404 dell'API (come openai.NotFoundError)."""
+    status_code = 404
+
+
+class FakeAssistants:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, **fields):
+        self.client.calls.append(("assistants.create", fields["name"]))
+        self.client.assistants_created += 1
+        assistant = SimpleNamespace(id=f"asst_{self.client.assistants_created}", **fields)
+        self.client.assistants[assistant.id] = assistant
+        return assistant
+
+    def retrieve(self, assistant_id):
+        self.client.calls.append(("assistants.retrieve", assistant_id))
+        if assistant_id not in self.client.assistants:
+            raise FakeNotFoundError(f"No assistant found with id '{assistant_id}'.")
+        return self.client.assistants[assistant_id]
+
+
+class FakeThreads:
+    def __init__(self, client):
+        self.client = client
+        self.runs = FakeRuns(client)
+        self.messages = FakeMessages(client)
+
+    def create(self):
+        if self.client.thread_create_delay:
+            time.sleep(self.client.thread_create_delay)
+        with self.client.lock:
+            self.client.threads_created += 1
+            return SimpleNamespace(id=f"thread_{self.client.threads_created}")
+
+    def delete(self, thread_id):
+        self.client.calls.append(("threads.delete", thread_id))
+
+
+_client_ids = itertools.count(1)
+
+
+class FakeOpenAI:
+    """Client OpenAI in memoria che riproduce stream di eventi registrati."""
+
+    def __init__(self, streams=None, event_delay=0.0, polled_statuses=None, last_message="",
+                 thread_create_delay=0.0):
+        # Chiave distinta per client: i pool condivisi per chiave API non si mescolano tra i test
+        self.api_key = f"sk-fake-{next(_client_ids)}"
+        self.lock = threading.Lock()
+        self.thread_create_delay = thread_create_delay
+        self.streams = list(streams or [])
+        self.event_delay = event_delay
+        self.polled_statuses = list(polled_statuses or [])
+        self.last_message = last_message
+        self.calls = []
+        self.submitted = []
+        self.run_statuses = {}
+        self.messages = {}
+        self.assistants = {}
+        self.assistants_created = 0
+        self.threads_created = 0
+        self.beta = SimpleNamespace(threads=FakeThreads(self), assistants=FakeAssistants(self))
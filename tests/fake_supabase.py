@@ -0,0 +1,198 @@
+"""
+Client Supabase finto in memoria per i test.
+
+Implementa il sottoinsieme dell'interfaccia di supabase.Client usato dal progetto:
+table(nome) con select/upsert/insert/update/delete, i filtri eq/neq/gt/gte/lt/lte/in_,
+order, range, limit ed execute, più rpc(funzione, parametri) per le funzioni
+registrate con register_function. Registra le chiamate eseguite e può simulare errori
+e latenza di rete.
+"""
+
+import copy
+import threading
+import time
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """Query costruita con l'interfaccia fluente di postgrest."""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.operation = "select"
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []
+        self.order_by = []
+        self.bounds = None
+        self.max_rows = None
+
+    def select(self, columns="*", count=None):
+        self.operation = "select"
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self.operation = "upsert"
+        self.payload = rows if isinstance(rows, list) else [rows]
+        self.on_conflict = on_conflict
+        return self
+
+    def insert(self, rows):
+        self.operation = "insert"
+        self.payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def update(self, values):
+        self.operation = "update"
+        self.payload = values
+        return self
+
+    def delete(self):
+        self.operation = "delete"
+        return self
+
+    def _filter(self, column, test):
+        self.filters.append((column, test))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, lambda v: v == value)
+
+    def neq(self, column, value):
+        return self._filter(column, lambda v: v != value)
+
+    def gt(self, column, value):
+        return self._filter(column, lambda v: v is not None and v > value)
+
+    def gte(self, column, value):
+        return self._filter(column, lambda v: v is not None and v >= value)
+
+    def lt(self, column, value):
+        return self._filter(column, lambda v: v is not None and v < value)
+
+    def lte(self, column, value):
+        return self._filter(column, lambda v: v is not None and v <= value)
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._filter(column, lambda v: v in values)
+
+    def order(self, column, desc=False):
+        self.order_by.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def limit(self, count):
+        self.max_rows = count
+        return self
+
+    def execute(self):
+        return self.client._execute(self)
+
+
+class FakeRpc:
+    """Chiamata a una funzione SQL (rpc) costruita dal client finto."""
+
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        return self.client._execute_rpc(self)
+
+
+class FakeSupabaseClient:
+    """Database Supabase in memoria: tabella -> lista di righe."""
+
+    def __init__(self, latency=0.0):
+        self.tables = {}
+        self.calls = []
+        self.latency = latency
+        self._failures = []
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self, name, params or {})
+
+    def register_function(self, name, function):
+        """Registra una funzione SQL finta: function(client, params) -> dati della risposta."""
+        self._functions[name] = function
+
+    def fail_next(self, count=1, error=None):
+        """Fa fallire le prossime count esecuzioni con error (default ConnectionError)."""
+        with self._lock:
+            self._failures.extend([error or ConnectionError("rete non disponibile")] * count)
+
+    def rows(self, table):
+        with self._lock:
+            return copy.deepcopy(self.tables.get(table, []))
+
+    def _execute_rpc(self, call):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls.append(("rpc", call.name, None))
+            if self._failures:
+                raise self._failures.pop(0)
+            function = self._functions.get(call.name)
+            if function is None:
+                # Errore restituito da PostgREST per le funzioni inesistenti
+                raise Exception(f"{{'code': 'PGRST202', 'message': 'Could not find the function public.{call.name}'}}")
+            return FakeResponse(function(self, copy.deepcopy(call.params)))
+
+    def _matches(self, query, row):
+        return all(test(row.get(column)) for column, test in query.filters)
+
+    def _execute(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            rows_count = len(query.payload) if isinstance(query.payload, list) else None
+            self.calls.append((query.table, query.operation, rows_count))
+            if self._failures:
+                raise self._failures.pop(0)
+
+            rows = self.tables.setdefault(query.table, [])
+            if query.operation in ("upsert", "insert"):
+                for new_row in copy.deepcopy(query.payload):
+                    key = query.on_conflict
+                    existing = next((r for r in rows if key and r.get(key) == new_row.get(key)), None)
+                    if existing is not None:
+                        existing.update(new_row)
+                    else:
+                        rows.append(new_row)
+                return FakeResponse(copy.deepcopy(query.payload))
+            if query.operation == "update":
+                updated = [row for row in rows if self._matches(query, row)]
+                for row in updated:
+                    row.update(copy.deepcopy(query.payload))
+                return FakeResponse(copy.deepcopy(updated))
+            if query.operation == "delete":
+                deleted = [row for row in rows if self._matches(query, row)]
+                self.tables[query.table] = [row for row in rows if not self._matches(query, row)]
+                return FakeResponse(copy.deepcopy(deleted))
+
+            selected = [row for row in rows if self._matches(query, row)]
+            # Come count="exact": numero di righe che soddisfano i filtri, prima di range/limit
+            total = len(selected)
+            for column, desc in reversed(query.order_by):
+                selected.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+            if query.bounds is not None:
+                selected = selected[query.bounds[0]:query.bounds[1] + 1]
+            if query.max_rows is not None:
+                selected = selected[:query.max_rows]
+            return FakeResponse(copy.deepcopy(selected), count=total)
@@ -0,0 +1,102 @@
+import copy
+import random
+import unittest
+
+from agent_tools.nutridb import NutriDB, SmartAliasDict
+
+
+def legacy_alias_get(alias, key):
+    """Implementazione storica della ricerca a 4 step, usata come riferimento."""
+    for apostrophe in ['`', '‘', '’', '‛', '′']:
+        key = key.replace(apostrophe, "'")
+
+    result = dict.get(alias, key, None)
+    if result is not None:
+        return result
+
+    key_with_spaces = key.replace("_", " ")
+    result = dict.get(alias, key_with_spaces, None)
+    if result is not None:
+        return result
+
+    cleaned_key = key_with_spaces
+    for prep_word in alias.preparation_words:
+        cleaned_key = cleaned_key.replace(prep_word, "").strip()
+        cleaned_key = " ".join(cleaned_key.split())
+
+    if cleaned_key != key_with_spaces and cleaned_key:
+        return dict.get(alias, cleaned_key, None)
+    return None
+
+
+class TestAliasResolver(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.alias = NutriDB("Dati_processed").alias
+
+    def _corpus(self):
+        rng = random.Random(42)
+        words = self.alias.preparation_words
+        names = list(self.alias.keys())
+        corpus = set(names)
+        corpus.update(name.replace(" ", "_") for name in names)
+        corpus.update(name.upper() for name in names[:50])
+        corpus.update([
+            "petto di pollo grigliato", "filetto di salmone al forno", "riso basmati bollito",
+            "pane integrale tostato", "tonno sott’olio sgocciolato", "fiocchi d‘avena",
+            "  pasta   al  forno  ", "al  forno pollo", "biscotti secchi integrali",
+            "passata di pomodoro", "arrosto di tacchino", "riso Jasmine", "", "   ", "fritto",
+            "olio d`oliva", "yogurt greco 0%", "alimento_inesistente", "pollo al forno con patate",
+        ])
+        for _ in range(3000):
+            parts = [rng.choice(names)]
+            for _ in range(rng.randint(1, 3)):
+                parts.insert(rng.randint(0, len(parts)), rng.choice(words))
+            separator = rng.choice([" ", "_", "  "])
+            corpus.add(separator.join(parts))
+        return sorted(corpus)
+
+    def test_same_resolution_as_legacy(self):
+        """Il resolver compilato restituisce gli stessi risultati della ricerca storica"""
+        for name in self._corpus():
+            self.assertEqual(self.alias.get(name), legacy_alias_get(self.alias, name), name)
+
+    def test_cache_records_negative_results(self):
+        """Anche i nomi non trovati vengono memorizzati nella cache"""
+        alias = SmartAliasDict({"pollo": "pollo_petto"}, ["alla griglia"])
+        self.assertIsNone(alias.get("tofu alla griglia"))
+        self.assertEqual(alias.get("tofu alla griglia", "default"), "default")
+        self.assertEqual(alias.cache_info().hits, 1)
+
+    def test_cache_invalidated_on_update(self):
+        """Le modifiche al mapping invalidano la cache"""
+        alias = SmartAliasDict({"pollo": "pollo_petto"}, ["alla griglia"])
+        self.assertIsNone(alias.get("tofu alla griglia"))
+        alias["tofu"] = "tofu"
+        self.assertEqual(alias.get("tofu alla griglia"), "tofu")
+
+    def test_cache_invalidated_on_every_mutation(self):
+        """Anche pop, popitem, setdefault, clear e |= invalidano la cache"""
+        alias = SmartAliasDict({"pollo": "pollo_petto"}, ["alla griglia"])
+        self.assertIsNone(alias.get("tofu alla griglia"))
+        self.assertEqual(alias.setdefault("tofu", "tofu"), "tofu")
+        self.assertEqual(alias.get("tofu alla griglia"), "tofu")
+        self.assertEqual(alias.pop("tofu"), "tofu")
+        self.assertIsNone(alias.get("tofu alla griglia"))
+        alias |= {"tofu": "tofu"}
+        self.assertIsInstance(alias, SmartAliasDict)
+        self.assertEqual(alias.get("tofu alla griglia"), "tofu")
+        self.assertEqual(alias.popitem(), ("tofu", "tofu"))
+        self.assertIsNone(alias.get("tofu alla griglia"))
+        self.assertEqual(alias.get("pollo alla griglia"), "pollo_petto")
+        alias.clear()
+        self.assertIsNone(alias.get("pollo alla griglia"))
+
+    def test_copy_keeps_behaviour(self):
+        """Una copia profonda mantiene mapping e parole di preparazione"""
+        alias_copy = copy.deepcopy(self.alias)
+        self.assertEqual(alias_copy.get("petto di pollo grigliato"), "pollo_petto")
+
+
+if __name__ == '__main__':
+    unittest.main()
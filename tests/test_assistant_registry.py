@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test del registro degli assistenti OpenAI: un solo assistente per configurazione
+tra sessioni e riavvii, nuovo assistente quando prompt, tool o modello cambiano,
+ricreazione se l'assistente è stato eliminato.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import streamlit as st
+
+from fake_openai import FakeOpenAI
+from chat import assistant_manager
+from chat.assistant_manager import AssistantManager, AssistantRegistry, assistant_config_hash
+
+TOOLS = [{"type": "function", "function": {"name": "get_LARN_fibre", "parameters": {"type": "object"}}}]
+
+
+class TestAssistantRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "assistants.json")
+        self.client = FakeOpenAI()
+
+    def get(self, registry, instructions="Sei un coach", tools=TOOLS, model="gpt-4.1"):
+        return registry.get_or_create(self.client, name="Coach", instructions=instructions, tools=tools, model=model)
+
+    def creates(self):
+        return [call for call in self.client.calls if call[0] == "assistants.create"]
+
+    def test_reused_within_process(self):
+        registry = AssistantRegistry(self.path)
+        first = self.get(registry)
+        self.assertIs(self.get(registry), first)
+        self.assertEqual(self.client.calls, [("assistants.create", "Coach")])
+
+    def test_reused_after_restart(self):
+        first = self.get(AssistantRegistry(self.path))
+        second = self.get(AssistantRegistry(self.path))
+
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(len(self.creates()), 1)
+        self.assertEqual(self.client.calls[-1], ("assistants.retrieve", first.id))
+
+    def test_changed_config_creates_new_assistant(self):
+        registry = AssistantRegistry(self.path)
+        base = self.get(registry)
+        changed = [
+            self.get(registry, instructions="Sei un coach sportivo"),
+            self.get(registry, tools=TOOLS + [{"type": "function", "function": {"name": "get_LARN_protein"}}]),
+            self.get(registry, model="gpt-4.1-mini"),
+        ]
+
+        self.assertEqual(len({base.id} | {assistant.id for assistant in changed}), 4)
+        with open(self.path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        self.assertEqual(entries[assistant_config_hash("Coach", "Sei un coach", TOOLS, "gpt-4.1")]["assistant_id"],
+                         base.id)
+        self.assertEqual(base.metadata["config_hash"], assistant_config_hash("Coach", "Sei un coach", TOOLS, "gpt-4.1"))
+
+    def test_deleted_assistant_recreated(self):
+        first = self.get(AssistantRegistry(self.path))
+        del self.client.assistants[first.id]
+
+        second = self.get(AssistantRegistry(self.path))
+        self.assertNotEqual(second.id, first.id)
+        self.assertEqual(self.get(AssistantRegistry(self.path)).id, second.id)
+
+    def test_retrieve_errors_propagate(self):
+        self.get(AssistantRegistry(self.path))
+        with mock.patch.object(self.client.beta.assistants, "retrieve", side_effect=ConnectionError("rete")):
+            with self.assertRaises(ConnectionError):
+                self.get(AssistantRegistry(self.path))
+        self.assertEqual(len(self.creates()), 1)
+
+
+class TestAssistantManagerSessions(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(assistant_manager, "ASSISTANT_REGISTRY_PATH", os.path.join(tmp.name, "a.json"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = FakeOpenAI()
+
+    def new_session(self):
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        return AssistantManager(self.client).create_assistant()
+
+    def test_sessions_share_assistant(self):
+        assistants = [self.new_session() for _ in range(3)]
+
+        self.assertEqual({assistant.id for assistant in assistants}, {"asst_1"})
+        self.assertEqual(self.client.calls, [("assistants.create", "NutrAICoach Assistant")])
+        self.assertEqual(st.session_state.assistant_type, "standard")
+
+
+if __name__ == "__main__":
+    unittest.main()
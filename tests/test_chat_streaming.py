@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Test delle run dell'assistente in streaming contro un client OpenAI finto che
+riproduce stream di eventi registrati: testo incrementale, tool eseguiti
+nello stesso flusso, errori, timeout e confronto con il polling.
+"""
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import streamlit as st
+
+from fake_openai import FakeOpenAI, message_completed, requires_action, run_event, text_delta
+from chat import chat_manager, thread_pool
+from chat.chat_manager import ChatManager, RUN_TIMEOUT_MESSAGE
+
+# Turno con sola risposta testuale
+TEXT_TURN = [
+    run_event("thread.run.created"),
+    run_event("thread.run.in_progress"),
+    {"event": "thread.message.created", "data": {"role": "assistant", "content": []}},
+    text_delta("Il tuo fabbisogno "),
+    text_delta("è di 2200 kcal."),
+    message_completed("Il tuo fabbisogno è di 2200 kcal."),
+    run_event("thread.run.completed"),
+]
+
+# Turno con due chiamate a tool: il secondo stream riprende dopo submit_tool_outputs
+TOOL_TURN = [
+    [
+        run_event("thread.run.created", "run_2"),
+        requires_action("run_2", [
+            ("call_1", "get_LARN_fibre", '{"kcal": 2200}'),
+            ("call_2", "get_protein_multiplier", '{"sport_type": "fitness"}'),
+        ]),
+    ],
+    [
+        {"event": "thread.message.created", "data": {"role": "assistant", "content": []}},
+        text_delta("Fibre: 30 g."),
+        message_completed("Fibre: 30 g."),
+        run_event("thread.run.completed", "run_2"),
+    ],
+]
+
+FAILED_TURN = [run_event("thread.run.created", "run_3"), run_event("thread.run.failed", "run_3")]
+
+
+class TestStreamingRuns(unittest.TestCase):
+    def setUp(self):
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.session_state.thread_id = "thread_0"
+        st.session_state.assistant = SimpleNamespace(id="asst_1")
+        self.partials = []
+        # Senza thread di riserva: i nuovi thread vengono creati solo dopo gli errori
+        for patcher in (mock.patch.object(chat_manager, "ASSISTANT_STREAMING", True),
+                        mock.patch.object(thread_pool, "PREWARMED_THREADS", 0),
+                        mock.patch.object(chat_manager.st, "error")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def chat(self, client, text="Quante calorie?"):
+        manager = ChatManager(client, user_data_manager=None)
+        return manager.chat_with_assistant(text, on_text=self.partials.append)
+
+    def test_text_rendered_incrementally(self):
+        client = FakeOpenAI(streams=[TEXT_TURN])
+        with mock.patch.object(chat_manager.time, "sleep") as sleep:
+            response = self.chat(client)
+
+        self.assertEqual(response, "Il tuo fabbisogno è di 2200 kcal.")
+        self.assertEqual(self.partials, ["Il tuo fabbisogno ", "Il tuo fabbisogno è di 2200 kcal."])
+        sleep.assert_not_called()
+        self.assertNotIn("retrieve", [call[0] for call in client.calls])
+        self.assertIsNone(st.session_state.current_run_id)
+
+    def test_tool_calls_handled_inline(self):
+        client = FakeOpenAI(streams=TOOL_TURN)
+        outputs = [{"tool_call_id": "call_1", "output": "{}"}, {"tool_call_id": "call_2", "output": "{}"}]
+        with mock.patch.object(chat_manager, "handle_tool_calls", return_value=outputs) as tools:
+            response = self.chat(client)
+
+        self.assertEqual(response, "Fibre: 30 g.")
+        run = tools.call_args[0][0]
+        self.assertEqual([call.function.name for call in run.required_action.submit_tool_outputs.tool_calls],
+                         ["get_LARN_fibre", "get_protein_multiplier"])
+        self.assertIn(("submit_tool_outputs_stream", "run_2"), client.calls)
+        self.assertEqual(client.submitted, [outputs])
+
+    def test_failed_run_retried_on_new_thread(self):
+        client = FakeOpenAI(streams=[FAILED_TURN, TEXT_TURN])
+        with mock.patch.object(chat_manager.time, "sleep"):
+            response = self.chat(client)
+
+        self.assertEqual(response, "Il tuo fabbisogno è di 2200 kcal.")
+        self.assertEqual(client.threads_created, 1)
+        self.assertEqual(st.session_state.thread_id, "thread_1")
+
+    def test_repeated_failures_return_error_message(self):
+        client = FakeOpenAI(streams=[FAILED_TURN] * 3)
+        with mock.patch.object(chat_manager.time, "sleep"):
+            response = self.chat(client)
+        self.assertEqual(response, "Mi dispiace, si è verificato un errore. Riprova.")
+
+    def test_interrupted_stream_fails_run(self):
+        client = FakeOpenAI(streams=[TEXT_TURN[:4] + [ConnectionError("connessione chiusa")], TEXT_TURN])
+        with mock.patch.object(chat_manager.time, "sleep"):
+            response = self.chat(client)
+        self.assertEqual(response, "Il tuo fabbisogno è di 2200 kcal.")
+        self.assertIn(("cancel", "run_1"), client.calls)
+
+    def test_timeout_cancels_run(self):
+        client = FakeOpenAI(streams=[TEXT_TURN], event_delay=0.05)
+        with mock.patch.object(chat_manager, "RUN_TIMEOUT_SECONDS", 0.08):
+            response = self.chat(client)
+
+        self.assertEqual(response, RUN_TIMEOUT_MESSAGE)
+        self.assertIn(("cancel", "run_1"), client.calls)
+        self.assertEqual(client.threads_created, 1)
+
+    def test_polling_mode_still_available(self):
+        client = FakeOpenAI(polled_statuses=["in_progress", "completed"], last_message="Risposta")
+        with mock.patch.object(chat_manager, "ASSISTANT_STREAMING", False), \
+                mock.patch.object(chat_manager.time, "sleep") as sleep:
+            response = self.chat(client)
+
+        self.assertEqual(response, "Risposta")
+        self.assertEqual(self.partials, [])
+        # Il polling attende un secondo per ogni controllo dello stato
+        self.assertEqual(sleep.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
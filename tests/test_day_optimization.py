@@ -0,0 +1,180 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from agent_tools import meal_optimization_tool, weekly_diet_generator_tool
+from agent_tools.meal_optimization_tool import (
+    get_food_nutrition_per_100g, get_portion_constraints, optimize_day_meals
+)
+from agent_tools.weekly_diet_generator_tool import optimize_days, shutdown_day_pools
+from agent_tools.portion_solver import (
+    build_day_problem, build_portion_problem, portion_error, solve_lp, solve_portions_discrete,
+    split_day_solution, DiscreteSearchTimeout
+)
+
+MEAL_TARGETS = {
+    "colazione": {"kcal": 450, "proteine_g": 25, "carboidrati_g": 55, "grassi_g": 14},
+    "pranzo": {"kcal": 750, "proteine_g": 45, "carboidrati_g": 90, "grassi_g": 22},
+    "cena": {"kcal": 650, "proteine_g": 45, "carboidrati_g": 65, "grassi_g": 20},
+}
+
+DAY_MEALS = {
+    "colazione": ["avena", "latte_scremato", "banana"],
+    "pranzo": ["pasta_di_semola", "tonno_naturale", "zucchine", "olio_oliva"],
+    "cena": ["pollo_petto", "patate", "zucchine", "olio_oliva"],
+}
+
+
+def build_meal_problems():
+    constraints = get_portion_constraints()
+    return [
+        build_portion_problem(MEAL_TARGETS[meal], get_food_nutrition_per_100g(foods), constraints)
+        for meal, foods in DAY_MEALS.items()
+    ]
+
+
+class TestDayProblem(unittest.TestCase):
+    def test_stacked_structure(self):
+        """Il problema del giorno affianca i pasti e aggiunge le righe dei totali giornalieri"""
+        meal_problems = build_meal_problems()
+        day_problem = build_day_problem(meal_problems)
+        n_foods = sum(len(problem["foods"]) for problem in meal_problems)
+
+        self.assertEqual(day_problem["nutrients"].shape, (4 * len(meal_problems) + 4, n_foods))
+        np.testing.assert_allclose(day_problem["targets"][-4:], sum(problem["targets"] for problem in meal_problems))
+        self.assertIsNone(day_problem["limit_matrix"])
+
+        grams = np.concatenate([(problem["lower"] + problem["upper"]) / 2 for problem in meal_problems])
+        for problem, meal_grams in zip(meal_problems, split_day_solution(day_problem, grams)):
+            np.testing.assert_array_equal(meal_grams, (problem["lower"] + problem["upper"]) / 2)
+
+    def test_joint_reduces_daily_error(self):
+        """La soluzione congiunta non è peggiore delle soluzioni indipendenti sull'obiettivo del giorno"""
+        meal_problems = build_meal_problems()
+        day_problem = build_day_problem(meal_problems)
+        independent = np.concatenate([solve_lp(problem) for problem in meal_problems])
+        self.assertLessEqual(portion_error(day_problem, solve_lp(day_problem)), portion_error(day_problem, independent) + 1e-9)
+
+    def test_daily_food_limits(self):
+        """I limiti giornalieri valgono sulla somma delle porzioni dello stesso alimento"""
+        day_problem = build_day_problem(build_meal_problems(), food_limits={"olio_oliva": 20, "zucchine": 300})
+        columns = {food: [i for i, (_, name) in enumerate(day_problem["foods"]) if name == food]
+                   for food in ("olio_oliva", "zucchine")}
+
+        relaxation = solve_lp(day_problem)
+        grams = solve_portions_discrete(day_problem, relaxation=relaxation)
+        for food, limit in (("olio_oliva", 20), ("zucchine", 300)):
+            self.assertLessEqual(relaxation[columns[food]].sum(), limit + 1e-6)
+            self.assertLessEqual(grams[columns[food]].sum(), limit)
+        np.testing.assert_array_equal(grams % 10, 0)
+
+
+class UserDataTestCase(unittest.TestCase):
+    """Esegue i test in una directory temporanea con un file utente di prova."""
+
+    def setUp(self):
+        self.original_cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.work_dir, "user_data"))
+        user_data = {
+            "nutritional_info_extracted": {"daily_macros": {"distribuzione_pasti": MEAL_TARGETS}},
+            "user_preferences": {"excluded_foods": []}
+        }
+        with open(os.path.join(self.work_dir, "user_data", "user_day_test.json"), "w", encoding="utf-8") as f:
+            json.dump(user_data, f)
+        os.chdir(self.work_dir)
+
+    def tearDown(self):
+        os.chdir(self.original_cwd)
+        shutil.rmtree(self.work_dir)
+
+
+class TestOptimizeDayMeals(UserDataTestCase):
+    def test_single_user_file_read(self):
+        """Il file utente viene letto una sola volta per tutto il giorno"""
+        with mock.patch.object(meal_optimization_tool, "load_user_data",
+                               wraps=meal_optimization_tool.load_user_data) as load_user_data:
+            results = optimize_day_meals(DAY_MEALS, "day_test", include_substitutes=False)
+        self.assertEqual(load_user_data.call_count, 1)
+        self.assertTrue(all(result["success"] for result in results.values()))
+
+    def test_search_timeout_falls_back_to_rounding(self):
+        """Se la ricerca discreta supera il tempo massimo le porzioni continue vengono arrotondate"""
+        with mock.patch.object(meal_optimization_tool, "get_portion_cache", return_value=None), \
+                mock.patch.object(meal_optimization_tool, "solve_portions_discrete",
+                                  side_effect=DiscreteSearchTimeout("tempo massimo")):
+            results = optimize_day_meals(DAY_MEALS, "day_test", include_substitutes=False)
+        for result in results.values():
+            self.assertTrue(result["success"])
+            self.assertTrue(all(grams % 10 == 0 for grams in result["portions"].values()))
+            self.assertIn("arrotondate", result["optimization_summary"])
+
+    def test_joint_not_worse_than_independent_meals(self):
+        """Le porzioni congiunte riducono (o mantengono) l'errore sui totali giornalieri"""
+        def daily_error(results):
+            errors = []
+            for key in ("kcal", "proteine_g", "carboidrati_g", "grassi_g"):
+                target = sum(result["target_nutrients"][key] for result in results.values())
+                actual = sum(result["actual_nutrients"][key] for result in results.values())
+                errors.append(abs(actual - target) / target)
+            return np.dot([3, 2, 1, 1], errors)
+
+        independent = optimize_day_meals(DAY_MEALS, "day_test", include_substitutes=False, joint=False)
+        joint = optimize_day_meals(DAY_MEALS, "day_test", include_substitutes=False)
+        self.assertLessEqual(daily_error(joint), daily_error(independent) + 1e-9)
+        for result in joint.values():
+            self.assertTrue(all(grams % 10 == 0 for grams in result["portions"].values()))
+
+    def test_missing_meal_reported(self):
+        """Un pasto senza target viene riportato come errore senza bloccare gli altri"""
+        results = optimize_day_meals(dict(DAY_MEALS, spuntino_serale_extra=["yogurt_greco"]), "day_test",
+                                     include_substitutes=False)
+        self.assertTrue(results["pranzo"]["success"])
+        self.assertIn("spuntino_serale_extra", results)
+
+
+
+class TestParallelDays(UserDataTestCase):
+    def tearDown(self):
+        shutdown_day_pools()
+        super().tearDown()
+
+    def _days(self):
+        return {
+            "giorno_2": DAY_MEALS,
+            "giorno_3": dict(DAY_MEALS, pranzo=["riso", "merluzzo", "zucchine"]),
+            "giorno_4": dict(DAY_MEALS, cena=["salmone_al_naturale", "patate", "zucchine"]),
+        }
+
+    def test_parallel_matches_sequential(self):
+        """Thread e processi restituiscono gli stessi giorni, nello stesso ordine, del calcolo sequenziale"""
+        days = self._days()
+        sequential = optimize_days(days, "day_test", include_substitutes=False, workers=1)
+        self.assertEqual(list(sequential), list(days))
+        for executor in ("thread", "process"):
+            parallel = optimize_days(days, "day_test", include_substitutes=False, workers=3, executor=executor)
+            self.assertEqual(list(parallel), list(days))
+            self.assertEqual(parallel, sequential, executor)
+
+    def test_pending_user_writes_flushed_for_processes(self):
+        """Prima di usare i processi le modifiche dell'utente ancora nel buffer vengono scritte"""
+        with mock.patch.object(weekly_diet_generator_tool, "flush_user_document") as flush, \
+                mock.patch.object(weekly_diet_generator_tool, "_get_day_pool", side_effect=RuntimeError("no pool")):
+            optimize_days(self._days(), "day_test", include_substitutes=False, workers=3, executor="thread")
+            flush.assert_not_called()
+            optimize_days(self._days(), "day_test", include_substitutes=False, workers=3, executor="process")
+            flush.assert_called_once_with("day_test")
+
+    def test_unknown_executor(self):
+        """Un tipo di pool sconosciuto solleva ValueError"""
+        with self.assertRaises(ValueError):
+            optimize_days(self._days(), "day_test", executor="gpu")
+
+
+if __name__ == '__main__':
+    unittest.main()
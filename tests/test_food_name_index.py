@@ -0,0 +1,63 @@
+import unittest
+
+from agent_tools.food_name_index import FoodNameIndex
+from agent_tools.nutridb import NutriDB
+
+
+def legacy_find_containing(alias, generic_term):
+    """Scansione storica di tutti gli alias di find_generic_food_variants, usata come riferimento."""
+    matches = []
+    for alias_name, canonical_name in alias.items():
+        alias_words = alias_name.lower().split()
+        generic_words = generic_term.lower().split()
+        if all(generic_word in alias_words for generic_word in generic_words):
+            matches.append((alias_name, canonical_name))
+        elif generic_term in alias_name:
+            matches.append((alias_name, canonical_name))
+    return matches
+
+
+class TestFoodNameIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = NutriDB("Dati_processed")
+
+    def test_find_containing_same_as_full_scan(self):
+        """La ricerca per parole/sottostringa coincide con la scansione completa degli alias"""
+        terms = {"yogurt", "pollo", "di", "riso integrale", "oli", "ma", "a", "latte di", "tonno_", "inesistente", "  "}
+        for alias_name in self.db.alias:
+            terms.update(alias_name.split())
+            terms.add(alias_name[:4])
+        for term in sorted(terms):
+            self.assertEqual(self.db.name_index.find_containing(term), legacy_find_containing(self.db.alias, term), term)
+
+    def test_suggest_ranks_typos_first(self):
+        """I refusi suggeriscono per primo l'alimento corretto"""
+        cases = {"mozarella": "mozzarella", "parmiggiano": "parmigiano_reggiano", "zuchine": "zucchine",
+                 "petto di polo": "pollo_petto", "fiocchi davena": "avena"}
+        for name, expected in cases.items():
+            suggestions = self.db.suggest_foods(name)
+            self.assertEqual(suggestions[0]["food"], expected, name)
+            self.assertEqual(len({s["food"] for s in suggestions}), len(suggestions))
+
+    def test_suggest_unknown_food(self):
+        """Un nome senza somiglianze non produce suggerimenti"""
+        self.assertEqual(self.db.suggest_foods("tofu"), [])
+        self.assertEqual(FoodNameIndex({}).suggest("pollo"), [])
+
+    def test_resolve_food_names(self):
+        """I nomi riconoscibili vengono risolti, quelli ambigui restano invariati"""
+        resolved, mapping = self.db.resolve_food_names(["pollo", "petto di pollo grigliato", "mozarella", "riso venere"])
+        self.assertEqual(resolved, ["pollo", "pollo_petto", "mozzarella", "riso venere"])
+        self.assertEqual(mapping, {"petto di pollo grigliato": "pollo_petto", "mozarella": "mozzarella"})
+
+    def test_food_suggestions(self):
+        """I suggerimenti per gli alimenti non trovati contengono chiavi canoniche"""
+        suggestions = self.db.get_food_suggestions(["riso venere"])
+        self.assertIn("riso", suggestions["riso venere"])
+        for food in suggestions["riso venere"]:
+            self.assertIn(food, self.db.alimenti)
+
+
+if __name__ == '__main__':
+    unittest.main()
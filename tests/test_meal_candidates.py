@@ -0,0 +1,62 @@
+import unittest
+
+from agent_tools.meal_optimization_tool import (
+    MealCandidateEvaluator, build_meal_candidate_lists, calculate_actual_nutrients,
+    calculate_meal_error, get_food_nutrition_per_100g, optimize_portions
+)
+
+
+class TestMealCandidates(unittest.TestCase):
+    def setUp(self):
+        self.targets = {"kcal": 750, "proteine_g": 45, "carboidrati_g": 90, "grassi_g": 22}
+
+    def test_lunch_candidates(self):
+        """Per pranzo/cena vengono elencati olio, pollo, rimozione proteine, pane e sostituzioni"""
+        food_list = ["pasta_di_semola", "tonno_naturale", "zucchine"]
+        candidates = build_meal_candidate_lists(food_list, True, False, False)
+        self.assertEqual(candidates[0], food_list)
+        for expected in (
+            food_list + ["olio_oliva"],
+            food_list + ["pollo"],
+            ["pasta_di_semola", "zucchine"],
+            food_list + ["olio_oliva", "pane"],
+            ["riso", "tonno_naturale", "zucchine", "olio_oliva"],
+        ):
+            self.assertIn(expected, candidates)
+        self.assertEqual(len(candidates), len({tuple(foods) for foods in candidates}))
+
+    def test_breakfast_candidates(self):
+        """Per la colazione si provano mandorle e proteine in polvere, anche insieme"""
+        candidates = build_meal_candidate_lists(["avena", "latte_scremato"], False, True, False)
+        self.assertEqual(len(candidates), 4)
+        self.assertIn(["avena", "latte_scremato", "mandorle", "iso_fuji_yamamoto"], candidates)
+
+    def test_evaluator_matches_optimize_portions(self):
+        """I risultati in blocco coincidono con l'ottimizzazione della singola lista"""
+        evaluator = MealCandidateEvaluator(self.targets, solver="lp")
+        candidates = build_meal_candidate_lists(["riso_integrale", "pollo_petto", "zucchine"], True, False, False)
+        evaluator.prefetch(candidates)
+        self.assertEqual(evaluator.solve_calls, 1)
+
+        for foods in candidates:
+            trial = evaluator.evaluate(foods)
+            nutrition = get_food_nutrition_per_100g(foods)
+            portions = optimize_portions(self.targets, nutrition, "lp")
+            for food in foods:
+                self.assertAlmostEqual(trial["portions"][food], portions[food], delta=0.1)
+            self.assertAlmostEqual(
+                trial["error"], calculate_meal_error(calculate_actual_nutrients(portions, nutrition), self.targets), places=2
+            )
+        self.assertEqual(evaluator.solve_calls, 1)
+
+    def test_evaluator_without_batching(self):
+        """Con il risolutore storico le liste vengono risolte solo quando richieste"""
+        evaluator = MealCandidateEvaluator(self.targets, solver="legacy")
+        evaluator.prefetch([["riso", "pollo_petto"], ["riso", "pollo_petto", "olio_oliva"]])
+        self.assertEqual(evaluator.solve_calls, 0)
+        evaluator.evaluate(["riso", "pollo_petto"])
+        self.assertEqual(evaluator.solve_calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
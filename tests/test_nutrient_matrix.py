@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from agent_tools.nutridb import NutriDB, NUTRIENT_COLUMNS, SNAPSHOT_FILENAME, get_shared_nutridb
+
+
+class TestNutrientMatrix(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db = NutriDB("Dati_processed")
+
+    def test_matrix_shape_and_index(self):
+        """La matrice ha una riga per alimento e una colonna per nutriente"""
+        self.assertEqual(self.db.nutrient_matrix.shape, (len(self.db.alimenti), len(NUTRIENT_COLUMNS)))
+        self.assertEqual(len(self.db.food_index), len(self.db.alimenti))
+        self.assertFalse(self.db.nutrient_matrix.flags.writeable)
+
+    def test_rows_match_food_data(self):
+        """Ogni riga coincide con i valori per 100g della banca alimenti"""
+        for key, info in self.db.alimenti.items():
+            row = self.db.nutrient_matrix[self.db.food_index[key]]
+            for nutrient in ("energia_kcal", "proteine_g", "carboidrati_g", "grassi_g", "fibra_g"):
+                self.assertAlmostEqual(row[self.db.nutrient_columns[nutrient]], float(info[nutrient]))
+
+    def test_get_nutrients_many(self):
+        """Il batch restituisce contributi per alimento e totali coerenti"""
+        result = self.db.get_nutrients_many(["pollo", "riso_integrale", "olio d'oliva"], [150, 80, 10])
+        self.assertEqual(result["foods"], ["pollo_petto", "riso_integrale", "olio_oliva"])
+        self.assertEqual(result["per_food"].shape, (3, len(NUTRIENT_COLUMNS)))
+        np.testing.assert_allclose(result["totals"], result["per_food"].sum(axis=0))
+
+        kcal = self.db.nutrient_columns["energia_kcal"]
+        expected = self.db.get_macros("pollo", 150)["energia_kcal"]
+        self.assertAlmostEqual(result["per_food"][0, kcal], expected, places=2)
+
+    def test_get_nutrients_many_default_grams(self):
+        """Senza quantità si ottengono i valori per 100g"""
+        result = self.db.get_nutrients_many(["mandorle"])
+        np.testing.assert_allclose(result["per_food"][0], self.db.nutrient_matrix[self.db.food_index["mandorle"]])
+
+    def test_get_nutrients_many_not_found(self):
+        """Gli alimenti sconosciuti sollevano ValueError"""
+        with self.assertRaises(ValueError):
+            self.db.get_nutrients_many(["pollo", "alimento_inesistente"])
+
+
+class TestNutriDBSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        for filename in os.listdir("Dati_processed"):
+            shutil.copy(os.path.join("Dati_processed", filename), self.data_dir)
+        self.snapshot_path = os.path.join(self.data_dir, SNAPSHOT_FILENAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_snapshot_roundtrip(self):
+        """Lo snapshot ricaricato equivale al database costruito dai JSON"""
+        built = NutriDB.from_snapshot(self.data_dir)
+        self.assertTrue(os.path.exists(self.snapshot_path))
+
+        loaded = NutriDB.from_snapshot(self.data_dir)
+        np.testing.assert_array_equal(loaded.nutrient_matrix, built.nutrient_matrix)
+        self.assertEqual(loaded.food_index, built.food_index)
+        self.assertEqual(dict(loaded.alias), dict(built.alias))
+        self.assertEqual(loaded.larn_vitamine, built.larn_vitamine)
+        self.assertEqual(loaded.get_macros("pollo", 150), built.get_macros("pollo", 150))
+        self.assertEqual(loaded.alias.get("petto di pollo grigliato"), "pollo_petto")
+
+    def test_snapshot_rebuilt_when_sources_change(self):
+        """Una modifica ai JSON invalida lo snapshot"""
+        NutriDB.from_snapshot(self.data_dir)
+
+        alimenti_path = os.path.join(self.data_dir, "banca_alimenti_crea_60alimenti.json")
+        with open(alimenti_path, 'r', encoding='utf-8') as f:
+            alimenti = json.load(f)
+        alimenti["mandorle"]["energia_kcal"] = 1
+        with open(alimenti_path, 'w', encoding='utf-8') as f:
+            json.dump(alimenti, f)
+
+        reloaded = NutriDB.from_snapshot(self.data_dir)
+        kcal = reloaded.nutrient_columns["energia_kcal"]
+        self.assertEqual(reloaded.nutrient_matrix[reloaded.food_index["mandorle"], kcal], 1)
+
+    def test_shared_instance(self):
+        """get_shared_nutridb restituisce sempre la stessa istanza per directory"""
+        self.assertIs(get_shared_nutridb(self.data_dir), get_shared_nutridb(self.data_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from agent_tools import meal_optimization_tool
+from agent_tools.meal_optimization_tool import get_food_nutrition_per_100g, get_portion_constraints
+from agent_tools.portion_cache import PortionCache, problem_key
+from agent_tools.portion_solver import build_portion_problem, canonical_problem, restore_food_order
+
+TARGETS = {"kcal": 650, "proteine_g": 40, "carboidrati_g": 70, "grassi_g": 18}
+
+
+def build_problem(foods, targets=TARGETS):
+    return build_portion_problem(targets, get_food_nutrition_per_100g(foods), get_portion_constraints())
+
+
+class TestPortionCache(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_canonical_key(self):
+        """Ordine degli alimenti e differenze di target sotto la quantizzazione non cambiano la chiave"""
+        first, _ = canonical_problem(build_problem(["pollo_petto", "riso", "zucchine"]))
+        second, _ = canonical_problem(build_problem(
+            ["zucchine", "riso", "pollo_petto"], dict(TARGETS, kcal=650.3, grassi_g=18.1)
+        ))
+        other, _ = canonical_problem(build_problem(["pollo_petto", "riso", "zucchine"], dict(TARGETS, kcal=660)))
+        self.assertEqual(problem_key("discrete", first), problem_key("discrete", second))
+        self.assertNotEqual(problem_key("discrete", first), problem_key("discrete", other))
+        self.assertNotEqual(problem_key("discrete", first), problem_key("discrete", first, node_budget=10))
+
+    def test_restore_food_order(self):
+        """Le soluzioni canoniche tornano nell'ordine originale degli alimenti"""
+        problem = build_problem(["zucchine", "riso", "pollo_petto"])
+        canonical, order = canonical_problem(problem)
+        grams = np.arange(len(canonical["foods"]), dtype=float)
+        restored = restore_food_order(grams, order)
+        for i, food in enumerate(problem["foods"]):
+            self.assertEqual(restored[i], grams[canonical["foods"].index(food)])
+
+    def test_lru_eviction_and_counters(self):
+        """La cache rimuove le soluzioni usate meno di recente e conta hit e miss"""
+        cache = PortionCache(maxsize=2)
+        cache.put("a", [1.0])
+        cache.put("b", [2.0])
+        self.assertEqual(cache.get("a").tolist(), [1.0])
+        cache.put("c", [3.0])
+        self.assertIsNone(cache.get("b"))
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["hits"], stats["misses"], stats["evictions"]), (2, 1, 1, 1))
+
+    def test_returned_solutions_are_copies(self):
+        """Modificare una soluzione restituita non altera la cache"""
+        cache = PortionCache()
+        cache.put("a", [1.0, 2.0])
+        cache.get("a")[0] = 99.0
+        self.assertEqual(cache.get("a").tolist(), [1.0, 2.0])
+
+    def test_disk_tier_survives_restart(self):
+        """Le soluzioni salvate su SQLite sono disponibili a una nuova istanza"""
+        path = os.path.join(self.work_dir, "cache", "portions.sqlite")
+        PortionCache(path=path).put("a", [10.0, 20.0])
+        cache = PortionCache(path=path)
+        self.assertEqual(cache.get("a").tolist(), [10.0, 20.0])
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+        # Il secondo accesso è servito dalla memoria
+        cache.get("a")
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_solve_batch_only_solves_misses(self):
+        """solve_batch risolve in un'unica chiamata solo i problemi non in cache"""
+        cache = PortionCache()
+        problems = [canonical_problem(build_problem(foods))[0]
+                    for foods in (["pollo_petto", "riso"], ["merluzzo", "patate"])]
+        calls = []
+
+        def solve_batch(pending):
+            calls.append(len(pending))
+            return [problem["lower"] for problem in pending]
+
+        cache.solve_batch("continuous", problems[:1], solve_batch)
+        cache.solve_batch("continuous", problems, solve_batch)
+        self.assertEqual(calls, [1, 1])
+
+    def test_cached_discrete_matches_uncached(self):
+        """Con o senza cache optimize_portions_discrete restituisce le stesse porzioni"""
+        foods_nutrition = get_food_nutrition_per_100g(["zucchine", "riso", "pollo_petto", "olio_oliva"])
+        cache = PortionCache()
+        with mock.patch.object(meal_optimization_tool, "get_portion_cache", return_value=None):
+            uncached = meal_optimization_tool.optimize_portions_discrete(TARGETS, foods_nutrition)
+        with mock.patch.object(meal_optimization_tool, "get_portion_cache", return_value=cache):
+            first = meal_optimization_tool.optimize_portions_discrete(TARGETS, foods_nutrition)
+            second = meal_optimization_tool.optimize_portions_discrete(TARGETS, foods_nutrition)
+        self.assertEqual(list(first), list(foods_nutrition))
+        self.assertEqual(first, uncached)
+        self.assertEqual(second, uncached)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import itertools
+import random
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from agent_tools.meal_optimization_tool import get_food_nutrition_per_100g, get_portion_constraints, optimize_portions, db
+from agent_tools import portion_solver
+from agent_tools.portion_solver import (
+    build_portion_problem, portion_error, round_to_step, solve_lp_batch, solve_portions,
+    solve_portions_discrete, DiscreteSearchTimeout, SOLVERS
+)
+
+
+class TestPortionSolver(unittest.TestCase):
+    def _random_problems(self, count, seed=3):
+        rng = random.Random(seed)
+        foods = sorted(db.alimenti)
+        for _ in range(count):
+            food_list = rng.sample(foods, rng.randint(2, 6))
+            targets = {
+                "kcal": rng.uniform(200, 900),
+                "proteine_g": rng.uniform(10, 60),
+                "carboidrati_g": rng.uniform(10, 110),
+                "grassi_g": rng.uniform(5, 30)
+            }
+            yield build_portion_problem(targets, get_food_nutrition_per_100g(food_list), get_portion_constraints())
+
+    def test_lp_not_worse_than_legacy(self):
+        """Il programma lineare trova un errore mai peggiore del risolutore storico"""
+        for problem in self._random_problems(60):
+            lp_error = portion_error(problem, solve_portions(problem, "lp"))
+            legacy_error = portion_error(problem, solve_portions(problem, "legacy"))
+            self.assertLessEqual(lp_error, legacy_error + 1e-6)
+
+    def test_solutions_respect_bounds(self):
+        """Tutti i backend rispettano i vincoli di porzione per categoria"""
+        for problem in self._random_problems(20):
+            for solver in SOLVERS:
+                grams = solve_portions(problem, solver)
+                self.assertTrue(np.all(grams >= problem["lower"] - 1e-6), solver)
+                self.assertTrue(np.all(grams <= problem["upper"] + 1e-6), solver)
+
+    def test_fixed_portions(self):
+        """Le categorie con min == max (es. caffè) restano fisse anche nei minimi quadrati"""
+        targets = {"kcal": 300, "proteine_g": 15, "carboidrati_g": 40, "grassi_g": 8}
+        foods_nutrition = get_food_nutrition_per_100g(["pane_integrale", "latte_scremato"])
+        foods_nutrition["caffè"] = {"energia_kcal": 2, "proteine_g": 0.1, "carboidrati_g": 0.3, "grassi_g": 0, "categoria": "caffè"}
+        for solver in SOLVERS:
+            self.assertEqual(optimize_portions(targets, foods_nutrition, solver)["caffè"], 5.0)
+
+    def test_lp_deterministic(self):
+        """Lo stesso problema produce sempre le stesse porzioni"""
+        targets = {"kcal": 750, "proteine_g": 45, "carboidrati_g": 90, "grassi_g": 22}
+        foods_nutrition = get_food_nutrition_per_100g(["riso_integrale", "pollo_petto", "zucchine", "olio_oliva"])
+        first = optimize_portions(targets, foods_nutrition, "lp")
+        for _ in range(5):
+            self.assertEqual(optimize_portions(targets, foods_nutrition, "lp"), first)
+
+    def test_lp_batch_matches_single_solves(self):
+        """La risoluzione a blocchi dà gli stessi ottimi delle risoluzioni singole"""
+        problems = list(self._random_problems(15))
+        for problem, grams in zip(problems, solve_lp_batch(problems)):
+            self.assertAlmostEqual(portion_error(problem, grams), portion_error(problem, solve_portions(problem, "lp")), places=6)
+
+    def test_unknown_solver(self):
+        """Un backend sconosciuto solleva ValueError"""
+        problem = next(self._random_problems(1))
+        with self.assertRaises(ValueError):
+            solve_portions(problem, "simplex")
+
+
+
+class TestDiscretePortions(unittest.TestCase):
+    _random_problems = TestPortionSolver._random_problems
+
+    def test_multiples_of_step_within_bounds(self):
+        """Le porzioni discrete sono multipli di 10g entro i vincoli arrotondati"""
+        for problem in self._random_problems(30):
+            grams = solve_portions_discrete(problem)
+            np.testing.assert_array_equal(grams % 10, 0)
+            self.assertTrue(np.all(grams >= round_to_step(problem["lower"])))
+            self.assertTrue(np.all(grams <= round_to_step(problem["upper"])))
+
+    def test_not_worse_than_rounding(self):
+        """L'ottimizzazione discreta non è mai peggiore dell'arrotondamento"""
+        for problem in self._random_problems(60):
+            relaxation = solve_portions(problem, "lp")
+            rounded_error = portion_error(problem, round_to_step(relaxation))
+            discrete_error = portion_error(problem, solve_portions_discrete(problem, relaxation=relaxation))
+            self.assertLessEqual(discrete_error, rounded_error + 1e-9)
+
+    def test_optimal_on_small_problems(self):
+        """Con tempo sufficiente trova l'ottimo della griglia (confronto con enumerazione)"""
+        for problem in self._random_problems(15, seed=8):
+            if len(problem["foods"]) > 3:
+                continue
+            ranges = [
+                np.arange(low, high + 1, 10)
+                for low, high in zip(round_to_step(problem["lower"]), round_to_step(problem["upper"]))
+            ]
+            best = min(portion_error(problem, np.array(grams)) for grams in itertools.product(*ranges))
+            grams = solve_portions_discrete(problem, time_budget=5.0, node_budget=10 ** 7)
+            self.assertAlmostEqual(portion_error(problem, grams), best, places=9)
+
+    def test_fixed_grams(self):
+        """Gli alimenti con grammi fissi mantengono la quantità esatta, anche fuori griglia"""
+        problem = build_portion_problem(
+            {"kcal": 550, "proteine_g": 35, "carboidrati_g": 60, "grassi_g": 15},
+            get_food_nutrition_per_100g(["pollo_petto", "riso", "olio_oliva"]),
+            get_portion_constraints()
+        )
+        grams = solve_portions_discrete(problem, fixed_grams={"olio_oliva": 7})
+        self.assertEqual(grams[problem["foods"].index("olio_oliva")], 7)
+        self.assertTrue(np.all(np.delete(grams, problem["foods"].index("olio_oliva")) % 10 == 0))
+
+    def test_time_budget(self):
+        """Il tempo massimo di protezione fa fallire la ricerca invece di restituire un risultato parziale"""
+        problem = next(p for p in self._random_problems(40, seed=5) if len(p["foods"]) == 6)
+        relaxation = solve_portions(problem, "lp")
+        start = time.perf_counter()
+        with self.assertRaises(DiscreteSearchTimeout):
+            solve_portions_discrete(problem, relaxation=relaxation, time_budget=0.0, node_budget=10 ** 7)
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+    def test_result_independent_of_load(self):
+        """Senza tempo massimo il risultato non cambia anche se l'orologio avanza di molto (macchina carica)"""
+        clock = itertools.count(step=10.0)
+        for problem in self._random_problems(10, seed=5):
+            relaxation = solve_portions(problem, "lp")
+            expected = solve_portions_discrete(problem, relaxation=relaxation)
+            with mock.patch.object(portion_solver.time, "perf_counter", side_effect=lambda: next(clock)):
+                loaded = solve_portions_discrete(problem, relaxation=relaxation)
+            np.testing.assert_array_equal(loaded, expected)
+
+    def test_move_budget(self):
+        """La ricerca locale si ferma dopo move_budget mosse, in modo deterministico"""
+        for problem in self._random_problems(10, seed=5):
+            relaxation = solve_portions(problem, "lp")
+            first = solve_portions_discrete(problem, relaxation=relaxation, node_budget=0, move_budget=1)
+            second = solve_portions_discrete(problem, relaxation=relaxation, node_budget=0, move_budget=1)
+            np.testing.assert_array_equal(first, second)
+            rounded_steps = np.clip(round_to_step(relaxation), round_to_step(problem["lower"]),
+                                    round_to_step(problem["upper"]))
+            # Al più una mossa: due alimenti cambiano di un passo
+            self.assertLessEqual(np.count_nonzero(first != rounded_steps), 2)
+
+
+    def test_node_budget_deterministic(self):
+        """Con il solo budget di nodi il risultato non dipende dal tempo disponibile"""
+        for problem in self._random_problems(10, seed=5):
+            relaxation = solve_portions(problem, "lp")
+            first = solve_portions_discrete(problem, relaxation=relaxation, node_budget=50, time_budget=10.0)
+            second = solve_portions_discrete(problem, relaxation=relaxation, node_budget=50, time_budget=10.0)
+            np.testing.assert_array_equal(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
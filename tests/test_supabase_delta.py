@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Test della sincronizzazione delta dei documenti utente: hash delle sezioni, patch
+con soli nuovi messaggi della chat, documenti invariati non inviati, fallback al
+documento completo se le versioni divergono o la funzione SQL non esiste.
+"""
+
+import os
+import sys
+import unittest
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_supabase import FakeSupabaseClient
+from services.supabase_delta import (
+    PATCH_FUNCTION, apply_patch, compute_patch, content_hash, document_state
+)
+from services.supabase_service import SupabaseUserService, user_data_row
+
+
+def install_patch_function(client):
+    """Registra sul client finto l'equivalente di apply_user_data_patches."""
+    def apply_user_data_patches(fake, params):
+        applied = []
+        for patch in params["patches"]:
+            row = next((r for r in fake.tables.get("user_data", []) if r["user_id"] == patch["user_id"]), None)
+            if row is None or row.get("content_hash") != patch["base_hash"]:
+                continue
+            row["data"] = apply_patch(row["data"], patch)
+            row["content_hash"] = patch["new_hash"]
+            applied.append(patch["user_id"])
+        return applied
+    client.register_function(PATCH_FUNCTION, apply_user_data_patches)
+
+
+def make_document(messages):
+    return {
+        "user_info": {"età": 30, "peso": 70},
+        "chat_history": [{"role": "user", "content": f"messaggio {index} " * 20} for index in range(messages)],
+        "nutritional_info_extracted": {"caloric_needs": {"fabbisogno_finale": 2200}},
+    }
+
+
+class TestDeltaFunctions(unittest.TestCase):
+    def test_hash_independent_of_key_order(self):
+        self.assertEqual(content_hash({"a": 1, "b": [1, 2]}), content_hash({"b": [1, 2], "a": 1}))
+        self.assertNotEqual(content_hash({"a": 1}), content_hash({"a": 2}))
+
+    def test_patch_round_trip(self):
+        old = make_document(3)
+        new = make_document(5)
+        new["user_info"]["peso"] = 68
+        del new["nutritional_info_extracted"]
+        new["weight_history"] = [{"peso": 68}]
+
+        patch = compute_patch("user_1", document_state(old), new)
+        self.assertEqual(len(patch["append"]["chat_history"]), 2)
+        self.assertEqual(set(patch["set"]), {"user_info", "weight_history"})
+        self.assertEqual(patch["remove"], ["nutritional_info_extracted"])
+        self.assertEqual(apply_patch(old, patch), new)
+        self.assertIsNone(compute_patch("user_1", document_state(new), dict(reversed(list(new.items())))))
+
+    def test_rewritten_list_sent_whole(self):
+        old = make_document(3)
+        new = make_document(4)
+        new["chat_history"][0] = {"role": "user", "content": "modificato"}
+        patch = compute_patch("user_1", document_state(old), new)
+        self.assertNotIn("chat_history", patch["append"])
+        self.assertEqual(patch["set"]["chat_history"], new["chat_history"])
+
+
+class TestDeltaSync(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeSupabaseClient()
+        install_patch_function(self.client)
+        self.service = self.make_service(self.client)
+
+    def make_service(self, client):
+        service = SupabaseUserService()
+        service.supabase = client
+        return service
+
+    def send(self, user_id, document, service=None):
+        (service or self.service).send_user_data_rows([user_data_row(user_id, document)])
+
+    def stored(self, user_id):
+        return next(r for r in self.client.rows("user_data") if r["user_id"] == user_id)
+
+    def test_first_sync_full_then_chat_appends(self):
+        self.send("user_1", make_document(20))
+        full_bytes = self.service.sync_stats["bytes_sent"]
+        self.assertEqual(self.service.sync_stats["full_rows"], 1)
+
+        document = make_document(21)
+        self.send("user_1", document)
+        patch_bytes = self.service.sync_stats["bytes_sent"] - full_bytes
+
+        self.assertEqual(self.service.sync_stats["patches"], 1)
+        self.assertLess(patch_bytes * 10, full_bytes)
+        self.assertEqual(self.client.calls[-1], ("rpc", PATCH_FUNCTION, None))
+        self.assertEqual(self.stored("user_1")["data"], document)
+        self.assertEqual(self.stored("user_1")["content_hash"], document_state(document).document_hash)
+
+    def test_unchanged_document_not_sent(self):
+        self.send("user_1", make_document(3))
+        calls = len(self.client.calls)
+        self.send("user_1", make_document(3))
+
+        self.assertEqual(len(self.client.calls), calls)
+        self.assertEqual(self.service.sync_stats["unchanged"], 1)
+
+    def test_diverged_version_resent_whole(self):
+        self.send("user_1", make_document(3))
+        # Un'altra istanza scrive una versione diversa del documento
+        other = self.make_service(self.client)
+        self.send("user_1", make_document(1), service=other)
+
+        document = make_document(4)
+        self.send("user_1", document)
+        self.assertEqual(self.service.sync_stats["patches"], 0)
+        self.assertEqual(self.service.sync_stats["full_rows"], 2)
+        self.assertEqual(self.stored("user_1")["data"], document)
+
+    def test_missing_function_falls_back_to_full_rows(self):
+        client = FakeSupabaseClient()
+        service = self.make_service(client)
+        self.send("user_1", make_document(3), service=service)
+        document = make_document(4)
+        self.send("user_1", document, service=service)
+
+        self.assertFalse(service._delta_enabled)
+        self.assertEqual(service.sync_stats["full_rows"], 2)
+        self.assertEqual(client.rows("user_data")[0]["data"], document)
+
+    def test_patches_batched_in_one_call(self):
+        for index in range(3):
+            self.send(f"user_{index}", make_document(2))
+        self.service.send_user_data_rows([user_data_row(f"user_{index}", make_document(3)) for index in range(3)])
+
+        self.assertEqual(self.client.calls[-1], ("rpc", PATCH_FUNCTION, None))
+        self.assertEqual(self.service.sync_stats["patches"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Test del download incrementale dei dati utente da Supabase: paginazione per
+updated_at (anche con timestamp uguali a cavallo delle pagine), watermark locale
+con margine di sovrapposizione (righe confermate in ritardo), scrittura parallela
+dei documenti e avanzamento.
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_supabase import FakeSupabaseClient
+from agent_tools.user_storage import JsonUserStorage
+from services import supabase_service
+from services.supabase_service import SupabaseUserService, load_watermark, watermark_since
+
+
+def remote_row(user_id, updated_at, version=1):
+    return {"user_id": user_id, "data": {"user_info": {"versione": version}}, "updated_at": updated_at}
+
+
+class FailingStorage(JsonUserStorage):
+    """Storage che non riesce a salvare i documenti di alcuni utenti."""
+
+    def __init__(self, data_dir, failing):
+        super().__init__(data_dir)
+        self.failing = set(failing)
+
+    def save_document(self, user_id, data):
+        if user_id in self.failing:
+            raise OSError("disco pieno")
+        super().save_document(user_id, data)
+
+
+class TestIncrementalDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.client = FakeSupabaseClient()
+        self.service = SupabaseUserService()
+        self.service.supabase = self.client
+        self.storage = JsonUserStorage(self.tmp.name)
+        self.watermark = os.path.join(self.tmp.name, "supabase_download.watermark")
+        patcher = mock.patch.object(supabase_service, "SUPABASE_PAGE_SIZE", 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # 5 righe con lo stesso updated_at: il pareggio attraversa due pagine
+        rows = [remote_row(f"user_{index}", "2025-01-01T10:00:00") for index in range(5)]
+        rows += [remote_row(f"user_{index}", f"2025-01-01T11:00:0{index}") for index in range(5, 9)]
+        self.client.tables["user_data"] = rows
+
+    def download(self, storage=None, **kwargs):
+        self.progress = []
+        return self.service.download_all_data_from_supabase(
+            progress=lambda done, total: self.progress.append((done, total)),
+            watermark_path=self.watermark, storage=storage or self.storage, **kwargs
+        )
+
+    def test_paged_full_download(self):
+        self.assertTrue(self.download())
+
+        self.assertEqual(sorted(self.storage.list_user_ids()), sorted(f"user_{index}" for index in range(9)))
+        self.assertEqual(self.progress, [(3, 9), (6, 9), (9, 9)])
+        selects = [call for call in self.client.calls if call[:2] == ("user_data", "select")]
+        # Conteggio + tre pagine piene + una pagina vuota
+        self.assertEqual(len(selects), 5)
+        self.assertEqual(load_watermark(self.watermark), "2025-01-01T11:00:08")
+
+    def test_second_download_only_changed_rows(self):
+        self.download()
+        rows = self.client.tables["user_data"]
+        rows[1].update(remote_row("user_1", "2025-01-02T09:00:00", version=2))
+        rows[6].update(remote_row("user_6", "2025-01-02T09:00:01", version=2))
+
+        self.assertTrue(self.download())
+        # Righe modificate più quelle nel margine prima del watermark (user_5, user_7, user_8)
+        self.assertEqual(self.progress, [(3, 5), (5, 5)])
+        self.assertEqual(self.storage.load_document("user_1")["user_info"], {"versione": 2})
+        self.assertEqual(load_watermark(self.watermark), "2025-01-02T09:00:01")
+
+    def test_late_committed_row_downloaded(self):
+        self.download()
+        # Riga di un'altra istanza confermata dopo il download, con updated_at precedente al watermark
+        self.client.tables["user_data"].append(remote_row("user_late", "2025-01-01T10:59:30"))
+
+        self.assertTrue(self.download())
+        self.assertEqual(self.storage.load_document("user_late")["user_info"], {"versione": 1})
+        self.assertEqual(load_watermark(self.watermark), "2025-01-01T11:00:08")
+
+        # Senza margine la riga sarebbe stata persa
+        with mock.patch.object(supabase_service, "SUPABASE_WATERMARK_OVERLAP_SECONDS", 0):
+            self.client.tables["user_data"].append(remote_row("user_late_2", "2025-01-01T11:00:00"))
+            self.download()
+        self.assertFalse(self.storage.user_exists("user_late_2"))
+
+    def test_watermark_since(self):
+        self.assertIsNone(watermark_since(None))
+        self.assertIsNone(watermark_since("non una data"))
+        self.assertEqual(watermark_since("2025-01-01T11:00:08", overlap=60), "2025-01-01T10:59:08")
+        self.assertEqual(watermark_since("2025-01-01T11:00:08.123456+00:00", overlap=8),
+                         "2025-01-01T11:00:00.123456+00:00")
+
+    def test_rows_stamped_at_send_time(self):
+        row = supabase_service.user_data_row("user_1", {"user_info": {}})
+        row["updated_at"] = "2025-01-01T00:00:00+00:00"
+        with mock.patch.object(supabase_service, "utc_now", return_value="2025-01-01T00:00:45+00:00"):
+            self.service.send_user_data_rows([row])
+        sent = next(r for r in self.client.rows("user_data") if r["user_id"] == "user_1")
+        self.assertEqual(sent["updated_at"], "2025-01-01T00:00:45+00:00")
+
+    def test_full_ignores_watermark(self):
+        self.download()
+        self.download(full=True)
+        self.assertEqual(self.progress[-1], (9, 9))
+
+    def test_failed_write_keeps_watermark(self):
+        self.download()
+        self.client.tables["user_data"][2].update(remote_row("user_2", "2025-01-03T00:00:00", version=3))
+        self.assertFalse(self.download(storage=FailingStorage(self.tmp.name, ["user_2"])))
+        self.assertEqual(load_watermark(self.watermark), "2025-01-01T11:00:08")
+
+        # Al download successivo la riga viene riscaricata
+        self.assertTrue(self.download())
+        self.assertEqual(self.storage.load_document("user_2")["user_info"], {"versione": 3})
+
+    def test_download_all_user_data_paginated(self):
+        all_user_data = self.service.download_all_user_data_from_supabase()
+        self.assertEqual(len(all_user_data), 9)
+        self.assertEqual(all_user_data["user_4"], {"user_info": {"versione": 1}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Test del worker di sincronizzazione Supabase contro un client finto in memoria:
+accorpamento degli aggiornamenti, upsert multi-riga, retry dopo errori, coda
+limitata e metriche.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_supabase import FakeSupabaseClient
+from services.supabase_sync_worker import SupabaseSyncWorker
+
+
+def data_row(user_id, version):
+    return {"user_id": user_id, "data": f'{{"versione": {version}}}', "updated_at": f"2025-01-01T00:00:{version:02d}"}
+
+
+class TestSupabaseSyncWorker(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeSupabaseClient()
+
+    def make_worker(self, **kwargs):
+        options = dict(delay=0.05, base_backoff=0.01, max_backoff=0.05)
+        options.update(kwargs)
+        worker = SupabaseSyncWorker(self.client, **options)
+        self.addCleanup(worker.close, 1.0)
+        return worker
+
+    def test_updates_coalesced_into_one_row(self):
+        worker = self.make_worker()
+        for version in range(5):
+            worker.enqueue("user_data", "user_1", data_row("user_1", version))
+        self.assertTrue(worker.flush(2.0))
+
+        self.assertEqual(self.client.calls, [("user_data", "upsert", 1)])
+        self.assertEqual(self.client.rows("user_data"), [data_row("user_1", 4)])
+        stats = worker.stats()
+        self.assertEqual((stats["coalesced"], stats["sent_rows"], stats["queue_depth"]), (4, 1, 0))
+
+    def test_multi_row_batches_per_table(self):
+        worker = self.make_worker(batch_size=3)
+        for index in range(7):
+            worker.enqueue("user_data", f"user_{index}", data_row(f"user_{index}", index))
+        worker.enqueue("users", "user_0", {"user_id": "user_0", "username": "mario"})
+        self.assertTrue(worker.flush(2.0))
+
+        upserts = [call for call in self.client.calls if call[0] == "user_data"]
+        self.assertEqual([rows for _, _, rows in upserts], [3, 3, 1])
+        self.assertIn(("users", "upsert", 1), self.client.calls)
+        self.assertEqual(len(self.client.rows("user_data")), 7)
+        self.assertEqual(worker.stats()["sent_batches"], 4)
+
+    def test_retry_after_failures(self):
+        self.client.fail_next(2)
+        worker = self.make_worker()
+        worker.enqueue("user_data", "user_1", data_row("user_1", 1))
+        self.assertTrue(worker.flush(5.0))
+
+        self.assertEqual(self.client.rows("user_data"), [data_row("user_1", 1)])
+        self.assertEqual(len(self.client.calls), 3)
+        self.assertEqual(worker.stats()["failures"], 2)
+
+    def test_failed_row_does_not_overwrite_newer_update(self):
+        self.client.fail_next(1)
+        worker = self.make_worker()
+        worker.enqueue("user_data", "user_1", data_row("user_1", 1))
+        # Attende il primo tentativo (fallito) e accoda una versione più recente
+        while not self.client.calls:
+            time.sleep(0.01)
+        worker.enqueue("user_data", "user_1", data_row("user_1", 2))
+        self.assertTrue(worker.flush(5.0))
+
+        self.assertEqual(self.client.rows("user_data"), [data_row("user_1", 2)])
+
+    def test_full_queue_sends_directly(self):
+        self.client.latency = 0.2
+        worker = self.make_worker(queue_size=1, put_timeout=0.01, delay=1.0)
+        worker.enqueue("user_data", "user_1", data_row("user_1", 1))
+        worker.enqueue("user_data", "user_2", data_row("user_2", 1))
+
+        # La seconda riga non entra in coda: inviata subito dal chiamante
+        self.assertEqual(worker.stats()["direct_sends"], 1)
+        self.assertEqual(self.client.rows("user_data"), [data_row("user_2", 1)])
+        self.assertTrue(worker.flush(5.0))
+        self.assertEqual(len(self.client.rows("user_data")), 2)
+
+    def test_lag_metrics(self):
+        worker = self.make_worker(delay=0.1)
+        worker.enqueue("user_data", "user_1", data_row("user_1", 1))
+        self.assertEqual(worker.stats()["queue_depth"], 1)
+        self.assertTrue(worker.flush(2.0))
+        stats = worker.stats()
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertGreater(stats["last_lag_seconds"], 0)
+        self.assertEqual(stats["oldest_pending_seconds"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
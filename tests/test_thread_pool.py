@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Test del pool di thread OpenAI pre-creati: thread pronto senza attese, reintegro
+in background, creazione sincrona a pool vuoto, scarto dei thread scaduti,
+errori di creazione e uso in ChatManager.create_new_thread.
+"""
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import streamlit as st
+
+from fake_openai import FakeOpenAI
+from chat import thread_pool
+from chat.chat_manager import ChatManager
+from chat.thread_pool import PrewarmedThreadPool, get_thread_pool
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestPrewarmedThreadPool(unittest.TestCase):
+    def test_acquire_uses_ready_thread_and_refills(self):
+        client = FakeOpenAI(thread_create_delay=0.2)
+        pool = PrewarmedThreadPool(client, size=2)
+        pool.warm()
+        self.assertTrue(wait_until(lambda: pool.stats()["ready"] == 2))
+
+        start = time.monotonic()
+        thread_id = pool.acquire()
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(thread_id, "thread_1")
+
+        self.assertTrue(wait_until(lambda: pool.stats()["ready"] == 2))
+        self.assertEqual(pool.acquire(), "thread_2")
+        self.assertEqual(pool.stats()["hits"], 2)
+        self.assertEqual(client.threads_created, 3)
+
+    def test_empty_pool_creates_synchronously(self):
+        client = FakeOpenAI()
+        pool = PrewarmedThreadPool(client, size=0)
+
+        self.assertEqual([pool.acquire(), pool.acquire()], ["thread_1", "thread_2"])
+        self.assertEqual(pool.stats(), {"ready": 0, "hits": 0, "misses": 2, "created": 2, "failures": 0})
+
+    def test_thread_ids_are_never_shared(self):
+        client = FakeOpenAI()
+        pool = PrewarmedThreadPool(client, size=3)
+        pool.warm()
+        self.assertTrue(wait_until(lambda: pool.stats()["ready"] == 3))
+
+        acquired = [pool.acquire() for _ in range(10)]
+        self.assertEqual(len(set(acquired)), 10)
+
+    def test_stale_threads_are_discarded(self):
+        client = FakeOpenAI()
+        pool = PrewarmedThreadPool(client, size=1, max_age=0.05)
+        pool.warm()
+        self.assertTrue(wait_until(lambda: pool.stats()["ready"] == 1))
+        time.sleep(0.1)
+
+        self.assertNotEqual(pool.acquire(), "thread_1")
+        self.assertEqual(pool.stats()["misses"], 1)
+        self.assertTrue(wait_until(lambda: ("threads.delete", "thread_1") in client.calls))
+
+    def test_refill_failure_does_not_break_acquire(self):
+        client = FakeOpenAI()
+        pool = PrewarmedThreadPool(client, size=2)
+        with mock.patch.object(client.beta.threads, "create", side_effect=ConnectionError("rete")):
+            pool.warm()
+            self.assertTrue(wait_until(lambda: pool.stats()["failures"] == 1))
+            with self.assertRaises(ConnectionError):
+                pool.acquire()
+            self.assertTrue(wait_until(lambda: pool.stats()["failures"] == 2))
+
+        # Il pool si riprende alla richiesta successiva
+        self.assertTrue(pool.acquire().startswith("thread_"))
+        self.assertTrue(wait_until(lambda: pool.stats()["ready"] == 2))
+
+
+class TestCreateNewThread(unittest.TestCase):
+    def setUp(self):
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+
+    def test_new_conversation_takes_prewarmed_thread(self):
+        client = FakeOpenAI(thread_create_delay=0.2)
+        pool = get_thread_pool(client)
+        self.assertIs(get_thread_pool(client), pool)
+        self.assertTrue(wait_until(lambda: pool.stats()["ready"] == thread_pool.PREWARMED_THREADS))
+
+        start = time.monotonic()
+        thread_id = ChatManager(client, None).create_new_thread()
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(thread_id, "thread_1")
+        self.assertEqual(st.session_state.thread_id, "thread_1")
+
+
+if __name__ == "__main__":
+    unittest.main()
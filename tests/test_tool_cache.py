@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Test della cache dei risultati dei tool puri: chiavi in JSON canonico, scadenza,
+LRU, invalidazione al cambio dei dati, errori non memorizzati, metriche per tool
+e uso in ToolHandler.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent import tool_handler
+from agent.tool_cache import ToolResultCache, data_version, tool_cache_key
+from agent.tool_handler import ToolHandler
+
+
+class CountingTool:
+    def __init__(self, result=None):
+        self.calls = 0
+        self.result = result
+
+    def __call__(self, **arguments):
+        self.calls += 1
+        return self.result if self.result is not None else {"arguments": arguments, "call": self.calls}
+
+
+class TestToolResultCache(unittest.TestCase):
+    def setUp(self):
+        self.current_version = 1
+        self.cache = ToolResultCache(maxsize=3, ttl=60, version=lambda: self.current_version)
+        self.tool = CountingTool()
+
+    def call(self, arguments, name="get_LARN_fibre"):
+        return self.cache.call(name, arguments, self.tool)
+
+    def test_canonical_key(self):
+        self.assertEqual(tool_cache_key("t", {"sesso": "maschio", "età": 30}),
+                         tool_cache_key("t", {"età": 30, "sesso": "maschio"}))
+        self.assertNotEqual(tool_cache_key("t", {"foods": ["riso", "pollo"]}),
+                            tool_cache_key("t", {"foods": ["pollo", "riso"]}))
+        self.assertNotEqual(tool_cache_key("t", {"kcal": 2000}), tool_cache_key("u", {"kcal": 2000}))
+
+    def test_repeated_call_skips_tool(self):
+        first = self.call({"kcal": 2000})
+        second = self.call({"kcal": 2000})
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.tool.calls, 1)
+        second["call"] = 99
+        self.assertEqual(self.call({"kcal": 2000})["call"], 1)
+
+    def test_ttl_expiration(self):
+        cache = ToolResultCache(ttl=0.05, version=lambda: 1)
+        cache.call("get_LARN_fibre", {"kcal": 2000}, self.tool)
+        time.sleep(0.1)
+        cache.call("get_LARN_fibre", {"kcal": 2000}, self.tool)
+
+        self.assertEqual(self.tool.calls, 2)
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_lru_eviction(self):
+        for kcal in (1000, 2000, 3000):
+            self.call({"kcal": kcal})
+        self.call({"kcal": 1000})
+        self.call({"kcal": 4000})
+        self.call({"kcal": 1000})
+        self.call({"kcal": 2000})
+
+        self.assertEqual(self.tool.calls, 5)
+        self.assertEqual(self.cache.stats()["evictions"], 2)
+
+    def test_data_version_change_invalidates(self):
+        self.call({"kcal": 2000})
+        self.current_version = 2
+        self.call({"kcal": 2000})
+        self.call({"kcal": 2000})
+
+        self.assertEqual(self.tool.calls, 2)
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+    def test_errors_not_cached(self):
+        for result in ({"error": "kcal deve essere positivo"}, {"success": False, "error_message": "x"}):
+            tool = CountingTool(result)
+            self.cache.call("calculate_kcal_from_foods", {"foods_with_grams": {}}, tool)
+            self.cache.call("calculate_kcal_from_foods", {"foods_with_grams": {}}, tool)
+            self.assertEqual(tool.calls, 2)
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_per_tool_metrics(self):
+        self.call({"kcal": 2000})
+        self.call({"kcal": 2000})
+        self.call({"kcal": 2000})
+        self.call({"sesso": "maschio", "età": 30}, name="get_LARN_protein")
+
+        tools = self.cache.stats()["tools"]
+        self.assertEqual(tools["get_LARN_fibre"], {"hits": 2, "misses": 1, "hit_rate": 2 / 3})
+        self.assertEqual(tools["get_LARN_protein"], {"hits": 0, "misses": 1, "hit_rate": 0.0})
+
+
+class TestDataVersion(unittest.TestCase):
+    def test_changes_with_data_files(self):
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "larn.json"), "w") as f:
+                f.write("{}")
+            before = data_version(path)
+            with open(os.path.join(path, "larn.json"), "w") as f:
+                f.write('{"a": 1}')
+            self.assertNotEqual(data_version(path), before)
+        self.assertEqual(data_version(os.path.join(path, "assente")), ())
+
+
+class TestToolHandlerCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ToolResultCache(version=lambda: 1)
+        patcher = mock.patch.object(tool_handler, "get_tool_cache", return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.handler = ToolHandler()
+
+    def run_calls(self, *calls):
+        tool_calls = [SimpleNamespace(id=f"call_{i}", function=SimpleNamespace(name=name, arguments=json.dumps(args)))
+                      for i, (name, args) in enumerate(calls)]
+        run = SimpleNamespace(required_action=SimpleNamespace(submit_tool_outputs=SimpleNamespace(tool_calls=tool_calls)))
+        return [json.loads(output["output"]) for output in self.handler.handle_tool_calls(run, user_id="user_1")]
+
+    def test_pure_tools_cached(self):
+        first = self.run_calls(("get_LARN_fibre", {"kcal": 2000}), ("get_LARN_lipidi_percentuali", {}))
+        second = self.run_calls(("get_LARN_fibre", {"kcal": 2000}), ("get_LARN_lipidi_percentuali", {}))
+
+        self.assertEqual(first, second)
+        self.assertIn("fibra_min", first[0])
+        tools = self.cache.stats()["tools"]
+        self.assertEqual(tools["get_LARN_fibre"]["hits"], 1)
+        self.assertEqual(tools["get_LARN_lipidi_percentuali"]["hits"], 1)
+
+    def test_impure_tools_not_cached(self):
+        tool = CountingTool({"ok": True})
+        self.handler.function_map["get_nutritional_info"] = tool
+        self.run_calls(("get_nutritional_info", {}))
+        self.run_calls(("get_nutritional_info", {}))
+
+        self.assertEqual(tool.calls, 2)
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_execute_single_tool_uses_cache(self):
+        tool = CountingTool()
+        self.handler.function_map["get_LARN_protein"] = tool
+        self.handler.execute_single_tool("get_LARN_protein", sesso="femmina", età=40)
+        self.handler.execute_single_tool("get_LARN_protein", età=40, sesso="femmina")
+        self.assertEqual(tool.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
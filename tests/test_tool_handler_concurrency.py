@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test dell'esecuzione parallela delle chiamate ai tool di una run: durata pari al
+tool più lento, ordine degli output, utente esplicito nei thread del pool,
+timeout per tool ed errori isolati.
+"""
+
+import json
+import os
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent import tool_handler
+from agent.tool_handler import ToolHandler
+from agent_tools.nutridb_tool import get_user_id
+
+
+def make_run(*calls):
+    """Run in stato requires_action con le chiamate [(nome, argomenti)]."""
+    tool_calls = [
+        SimpleNamespace(id=f"call_{index}", function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+        for index, (name, arguments) in enumerate(calls)
+    ]
+    return SimpleNamespace(required_action=SimpleNamespace(submit_tool_outputs=SimpleNamespace(tool_calls=tool_calls)))
+
+
+def slow_meal(meal_name, food_list, delay=0.2):
+    time.sleep(delay)
+    return {"meal_name": meal_name, "user_id": get_user_id(), "foods": food_list}
+
+
+class TestConcurrentToolCalls(unittest.TestCase):
+    def setUp(self):
+        self.handler = ToolHandler()
+        self.handler.function_map["optimize_meal_portions"] = slow_meal
+        patcher = mock.patch.object(tool_handler.st, "error")
+        self.st_error = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def outputs(self, run, user_id="user_42"):
+        return [json.loads(output["output"]) for output in self.handler.handle_tool_calls(run, user_id=user_id)]
+
+    def test_meals_run_in_parallel_in_order(self):
+        meals = ["colazione", "pranzo", "spuntino_pomeridiano", "cena"]
+        run = make_run(*[("optimize_meal_portions", {"meal_name": meal, "food_list": ["pasta"]}) for meal in meals])
+
+        start = time.monotonic()
+        outputs = self.outputs(run)
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual([output["meal_name"] for output in outputs], meals)
+        self.assertEqual({output["user_id"] for output in outputs}, {"user_42"})
+
+    def test_output_ids_follow_call_order(self):
+        run = make_run(
+            ("optimize_meal_portions", {"meal_name": "cena", "food_list": [], "delay": 0.2}),
+            ("optimize_meal_portions", {"meal_name": "pranzo", "food_list": [], "delay": 0.0}),
+        )
+        tool_outputs = self.handler.handle_tool_calls(run, user_id="user_1")
+        self.assertEqual([output["tool_call_id"] for output in tool_outputs], ["call_0", "call_1"])
+
+    def test_timeout_per_tool(self):
+        run = make_run(
+            ("optimize_meal_portions", {"meal_name": "cena", "food_list": [], "delay": 0.5}),
+            ("get_LARN_fibre", {"kcal": 2000}),
+        )
+        with mock.patch.dict(tool_handler.TOOL_TIMEOUTS, {"optimize_meal_portions": 0.05}):
+            outputs = self.outputs(run)
+
+        self.assertIn("Timeout", outputs[0]["error"])
+        self.assertNotIn("error", outputs[1])
+        self.st_error.assert_called_once()
+
+    def test_failing_tool_does_not_affect_others(self):
+        run = make_run(
+            ("tool_inesistente", {}),
+            ("optimize_meal_portions", {"food_list": []}),
+            ("optimize_meal_portions", {"meal_name": "pranzo", "food_list": [], "delay": 0.0}),
+        )
+        outputs = self.outputs(run)
+
+        self.assertEqual(outputs[0], {"error": "Tool tool_inesistente non supportato"})
+        self.assertIn("meal_name", outputs[1]["error"])
+        self.assertEqual(outputs[2]["meal_name"], "pranzo")
+        self.assertEqual(self.st_error.call_count, 2)
+
+    def test_user_context_not_leaked(self):
+        self.outputs(make_run(("optimize_meal_portions", {"meal_name": "cena", "food_list": [], "delay": 0.0})))
+        outputs = self.outputs(make_run(("optimize_meal_portions", {"meal_name": "cena", "food_list": [],
+                                                                    "delay": 0.0})), user_id="user_7")
+        self.assertEqual(outputs[0]["user_id"], "user_7")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test del log append-only di chat e QA: vista unificata, compattazione e
+idempotenza dei record già compattati.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_tools import user_data_log
+from agent_tools.user_data_log import load_user_document, log_path
+from agent_tools.user_data_manager import UserDataManager
+
+USER_ID = "user_1"
+
+NUTRITIONAL_INFO = {
+    "età": 30, "sesso": "Maschio", "peso": 75.0, "altezza": 180,
+    "attività": "Moderata", "obiettivo": "Mantenimento", "nutrition_answers": {}
+}
+
+
+class TestUserDataLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self.tmp.name)
+        self.manager = UserDataManager(self.tmp.name)
+        self.manager.save_nutritional_info(USER_ID, NUTRITIONAL_INFO)
+        self.manager.flush(USER_ID)
+
+    def tearDown(self):
+        self.manager.flush()
+        self.tmp.cleanup()
+
+    def user_file(self):
+        return self.data_dir / f"{USER_ID}.json"
+
+    def read_file(self):
+        with open(self.user_file(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_messages_appended_without_rewriting_document(self):
+        before = self.user_file().read_bytes()
+        self.manager.save_chat_message(USER_ID, "user", "Ciao")
+        self.manager.save_chat_message(USER_ID, "assistant", "Ciao, come posso aiutarti?")
+        self.manager.save_agent_qa(USER_ID, "Quanto pesi?", "75 kg")
+        self.manager.flush(USER_ID)
+
+        self.assertEqual(self.user_file().read_bytes(), before)
+        self.assertEqual(len(user_data_log.read_log_records(log_path(self.data_dir, USER_ID))), 4)
+
+    def test_merged_view_matches_in_memory_state(self):
+        self.manager.save_chat_message(USER_ID, "user", "Ciao")
+        self.manager.save_chat_message(USER_ID, "assistant", "Ciao!")
+        self.manager.save_agent_qa(USER_ID, "Quanto pesi?", "75 kg")
+        self.manager.flush(USER_ID)
+
+        reloaded = UserDataManager(self.tmp.name)
+        reloaded._load_user_data(USER_ID)
+        self.assertEqual(reloaded.get_chat_history(USER_ID), self.manager.get_chat_history(USER_ID))
+        self.assertEqual(reloaded.get_agent_qa(USER_ID), self.manager.get_agent_qa(USER_ID))
+        self.assertEqual(reloaded.get_interactions_count(USER_ID), 1)
+
+        document = load_user_document(USER_ID, self.data_dir)
+        self.assertEqual([m["content"] for m in document["chat_history"]], ["Ciao", "Ciao!"])
+        self.assertEqual(document["nutritional_info"]["agent_qa"][0]["answer"], "75 kg")
+
+    def test_compaction_folds_log_into_document(self):
+        with mock.patch.object(user_data_log, "COMPACT_MIN_RECORDS", 9):
+            for i in range(3):
+                self.manager.save_chat_message(USER_ID, "user", f"domanda {i}")
+                self.manager.save_chat_message(USER_ID, "assistant", f"risposta {i}")
+            self.manager.flush(USER_ID)
+
+        self.assertFalse(log_path(self.data_dir, USER_ID).exists())
+        data = self.read_file()
+        self.assertEqual(len(data["chat_history"]), 6)
+        self.assertEqual(data["interazioni"], 3)
+        self.assertEqual(data["log_seq"], 9)
+
+        # I nuovi record continuano la sequenza dopo la compattazione
+        self.manager.save_chat_message(USER_ID, "user", "ancora")
+        self.manager.flush(USER_ID)
+        records = user_data_log.read_log_records(log_path(self.data_dir, USER_ID))
+        self.assertEqual([r["seq"] for r in records], [10, 11])
+        self.assertEqual(len(load_user_document(USER_ID, self.data_dir)["chat_history"]), 7)
+
+    def test_compacted_records_not_applied_twice(self):
+        self.manager.save_chat_message(USER_ID, "user", "Ciao")
+        self.manager.flush(USER_ID)
+        stale_log = log_path(self.data_dir, USER_ID).read_text(encoding='utf-8')
+
+        # Interruzione simulata tra la scrittura del documento e la rimozione del log
+        self.manager._save_user_data(USER_ID)
+        self.manager.flush(USER_ID)
+        log_path(self.data_dir, USER_ID).write_text(stale_log, encoding='utf-8')
+
+        document = load_user_document(USER_ID, self.data_dir)
+        self.assertEqual(len(document["chat_history"]), 1)
+        self.assertEqual(document["interazioni"], 1)
+
+    def test_truncated_last_line_ignored(self):
+        self.manager.save_chat_message(USER_ID, "assistant", "Ciao!")
+        self.manager.flush(USER_ID)
+        with open(log_path(self.data_dir, USER_ID), 'a', encoding='utf-8') as f:
+            f.write('{"seq": 2, "type": "chat", "role": "ass')
+
+        document = load_user_document(USER_ID, self.data_dir)
+        self.assertEqual([m["content"] for m in document["chat_history"]], ["Ciao!"])
+
+    def test_clear_chat_history_discards_log(self):
+        self.manager.save_chat_message(USER_ID, "assistant", "Ciao!")
+        self.manager.clear_chat_history(USER_ID)
+        self.manager.flush(USER_ID)
+
+        self.assertEqual(load_user_document(USER_ID, self.data_dir)["chat_history"], [])
+        self.assertFalse(log_path(self.data_dir, USER_ID).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Test del caricamento lazy di UserDataManager: nessun download completo all'avvio,
+stato utente caricato al primo accesso e rimosso in ordine LRU sotto il limite
+di memoria, senza perdere dati alle scritture successive.
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_tools.user_storage import JsonUserStorage
+from agent_tools.user_data_manager import UserDataManager, get_user_data_manager
+
+NUTRITIONAL_INFO = {
+    "età": 30, "sesso": "Maschio", "peso": 75, "altezza": 180,
+    "attività": "Moderata", "obiettivo": "Mantenimento"
+}
+
+
+def make_document(user_id):
+    return {
+        "user_preferences": {"excluded_foods": ["tonno"], "preferred_foods": [], "user_notes": []},
+        "chat_history": [{"role": "user", "content": f"Ciao da {user_id} " + "x" * 500, "timestamp": 1.0}],
+        "nutritional_info": dict(NUTRITIONAL_INFO, nutrition_answers={}, agent_qa=[]),
+        "interazioni": 1
+    }
+
+
+class FakeSupabaseService:
+    """Servizio Supabase in memoria che conta i download."""
+
+    def __init__(self, users=None, documents=None):
+        self.users = users or {}
+        self.documents = documents or {}
+        self.user_downloads = []
+        self.users_downloads = 0
+        self.full_downloads = 0
+
+    def is_available(self):
+        return True
+
+    def download_users_from_supabase(self):
+        self.users_downloads += 1
+        return dict(self.users)
+
+    def download_user_data_from_supabase(self, user_id):
+        self.user_downloads.append(user_id)
+        return self.documents.get(user_id)
+
+    def download_all_data_from_supabase(self):
+        self.full_downloads += 1
+        return True
+
+
+class TestLazyUserState(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = JsonUserStorage(self.tmp.name)
+        for index in range(1, 4):
+            self.storage.save_document(f"user_{index}", make_document(f"user_{index}"))
+        self.supabase = FakeSupabaseService()
+        patcher = mock.patch.object(UserDataManager, "_get_supabase_service", lambda manager: self.supabase)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_manager(self, max_state_bytes=None):
+        return UserDataManager(self.tmp.name, storage=self.storage, max_state_bytes=max_state_bytes)
+
+    def test_startup_loads_no_user_state(self):
+        manager = self.make_manager()
+        self.assertEqual(manager.state_stats()["loaded_users"], 0)
+        self.assertEqual((self.supabase.full_downloads, self.supabase.users_downloads), (0, 0))
+        self.assertEqual(self.supabase.user_downloads, [])
+
+    def test_state_faulted_in_on_first_access(self):
+        manager = self.make_manager()
+        self.assertEqual(manager.get_chat_history("user_2")[0].content[:14], "Ciao da user_2")
+        self.assertEqual(manager.get_nutritional_info("user_2").peso, 75)
+        self.assertEqual(manager.state_stats()["loaded_users"], 1)
+
+    def test_lru_eviction_under_memory_cap(self):
+        manager = self.make_manager(max_state_bytes=2000)
+        for user_id in ("user_1", "user_2", "user_3"):
+            manager.get_chat_history(user_id)
+        stats = manager.state_stats()
+        self.assertLess(stats["loaded_users"], 3)
+        self.assertGreater(stats["evictions"], 0)
+        self.assertLessEqual(stats["state_bytes"], 2000)
+
+        # Lo stato rimosso viene ricaricato dal backend
+        self.assertEqual(manager.get_agent_qa("user_1"), [])
+        self.assertEqual(len(manager.get_chat_history("user_1")), 1)
+
+    def test_write_after_eviction_keeps_saved_data(self):
+        manager = self.make_manager(max_state_bytes=2000)
+        for user_id in ("user_1", "user_2", "user_3"):
+            manager.get_chat_history(user_id)
+
+        manager.save_nutritional_info("user_1", dict(NUTRITIONAL_INFO, peso=80))
+        manager.flush("user_1")
+
+        document = self.storage.load_document("user_1")
+        self.assertEqual(document["nutritional_info"]["peso"], 80)
+        self.assertEqual(len(document["chat_history"]), 1)
+        self.assertEqual(document["user_preferences"]["excluded_foods"], ["tonno"])
+
+    def test_missing_user_downloaded_once(self):
+        self.supabase.documents["user_9"] = make_document("user_9")
+        manager = self.make_manager()
+        self.assertEqual(len(manager.get_chat_history("user_9")), 1)
+        manager.get_chat_history("user_1")
+        self.assertEqual(self.supabase.user_downloads, ["user_9"])
+        self.assertTrue(self.storage.user_exists("user_9"))
+
+    def test_unknown_login_refreshes_users(self):
+        self.supabase.users["luigi"] = {
+            "username": "luigi", "email": "luigi@example.com",
+            "password_hash": hashlib.sha256(b"password123").hexdigest(),
+            "user_id": "user_2", "created_at": 1.0
+        }
+        manager = self.make_manager()
+        self.assertEqual(manager.login_user("luigi", "password123"), (True, "user_2"))
+        self.assertIn("luigi", self.storage.load_users())
+
+        # Un secondo utente sconosciuto entro l'intervallo non ripete il download
+        self.assertFalse(manager.login_user("nessuno", "password123")[0])
+        self.assertEqual(self.supabase.users_downloads, 1)
+
+    def test_shared_manager_per_directory(self):
+        with mock.patch.dict("agent_tools.user_data_manager._managers", clear=True):
+            self.assertIs(get_user_data_manager(self.tmp.name), get_user_data_manager(self.tmp.name))
+
+
+class TestSharedDirectoryWorkers(unittest.TestCase):
+    """Due worker (gestori con backend distinti) sulla stessa directory dati."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        JsonUserStorage(self.tmp.name).save_document("user_1", make_document("user_1"))
+        patcher = mock.patch.object(UserDataManager, "_get_supabase_service", lambda manager: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_worker(self):
+        return UserDataManager(self.tmp.name, storage=JsonUserStorage(self.tmp.name))
+
+    def test_saves_keep_records_of_other_workers(self):
+        worker_a, worker_b = self.make_worker(), self.make_worker()
+        self.assertEqual(len(worker_a.get_chat_history("user_1")), 1)
+
+        worker_b.save_chat_message("user_1", "user", "Messaggio da B")
+        worker_b.save_agent_qa("user_1", "Quanto pesi?", "75 kg")
+        worker_b.flush("user_1")
+
+        worker_a.update_user_preferences("user_1", {"excluded_foods": ["latte"]})
+        worker_a.save_nutritional_info("user_1", dict(NUTRITIONAL_INFO, peso=80))
+        worker_a.clear_user_preferences("user_1")
+        worker_a.flush("user_1")
+
+        document = JsonUserStorage(self.tmp.name).load_document("user_1")
+        self.assertEqual(document["chat_history"][-1]["content"], "Messaggio da B")
+        self.assertEqual([qa["answer"] for qa in document["nutritional_info"]["agent_qa"]], ["75 kg"])
+        self.assertEqual(document["nutritional_info"]["peso"], 80)
+        self.assertEqual(document["user_preferences"]["excluded_foods"], [])
+        self.assertEqual(document["interazioni"], 2)
+
+    def test_state_reloaded_after_write_of_other_worker(self):
+        worker_a, worker_b = self.make_worker(), self.make_worker()
+        self.assertEqual(worker_a.get_nutritional_info("user_1").peso, 75)
+
+        worker_b.save_nutritional_info("user_1", dict(NUTRITIONAL_INFO, peso=90))
+        worker_b.save_chat_message("user_1", "assistant", "Risposta da B")
+        worker_b.flush("user_1")
+
+        self.assertEqual(worker_a.get_nutritional_info("user_1").peso, 90)
+        self.assertEqual(worker_a.get_chat_history("user_1")[-1].content, "Risposta da B")
+
+
+if __name__ == "__main__":
+    unittest.main()
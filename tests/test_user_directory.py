@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Test della directory utenti: ricerche indicizzate per username, user_id, email e
+Google ID, salvataggio di un singolo utente e upsert di una sola riga su Supabase.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_tools import user_data_log
+from agent_tools.user_directory import UserDirectory
+from agent_tools.user_storage import JsonUserStorage, SQLiteUserStorage, USERS_LOG_NAME
+from agent_tools.user_data_manager import User, UserDataManager
+
+
+def make_user(index, google_id=None):
+    return User(
+        username=f"utente{index}", email=f"utente{index}@example.com", password_hash="hash",
+        user_id=f"user_{index}", created_at=float(index), google_id=google_id
+    )
+
+
+class DirectoryContract:
+    """Comportamento della directory comune a tutti i backend."""
+
+    def make_storage(self, directory):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = self.make_storage(self.tmp.name)
+        self.directory = UserDirectory(self.storage, User)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_indexed_lookups(self):
+        self.directory.add(make_user(1))
+        self.directory.add(make_user(2, google_id="g-2"))
+
+        self.assertIn("utente1", self.directory)
+        self.assertEqual(len(self.directory), 2)
+        self.assertEqual(self.directory.get_by_email("utente2@example.com").username, "utente2")
+        self.assertEqual(self.directory.get_by_id("user_1").username, "utente1")
+        self.assertEqual(self.directory.get_by_google_id("g-2").user_id, "user_2")
+        self.assertIsNone(self.directory.get_by_email("nessuno@example.com"))
+
+    def test_replaced_user_updates_indexes(self):
+        self.directory.add(make_user(1))
+        changed = make_user(1)
+        changed.email = "nuova@example.com"
+        self.directory.add(changed)
+
+        self.assertIsNone(self.directory.get_by_email("utente1@example.com"))
+        self.assertIs(self.directory.get_by_email("nuova@example.com"), changed)
+
+    def test_added_users_persisted(self):
+        for index in range(1, 6):
+            self.directory.add(make_user(index, google_id=f"g-{index}"))
+
+        reloaded = UserDirectory(self.make_storage(self.tmp.name), User)
+        self.assertEqual(len(reloaded), 5)
+        self.assertEqual(reloaded.get_by_google_id("g-3").username, "utente3")
+        self.assertEqual(reloaded["utente5"].email, "utente5@example.com")
+
+    def test_merge_adds_only_new_users(self):
+        self.directory.add(make_user(1))
+        remote = {
+            "utente1": {"username": "utente1", "email": "altra@example.com", "password_hash": "x",
+                        "user_id": "user_1", "created_at": 1.0},
+            "utente2": {"username": "utente2", "email": "utente2@example.com", "password_hash": "x",
+                        "user_id": "user_2", "created_at": 2.0},
+        }
+        self.assertEqual(self.directory.merge(remote), 1)
+        self.assertEqual(self.directory["utente1"].email, "utente1@example.com")
+        self.assertEqual(set(self.storage.load_users()), {"utente1", "utente2"})
+
+    def test_refresh_loads_users_of_other_process(self):
+        self.directory.add(make_user(1))
+        other_process = UserDirectory(self.make_storage(self.tmp.name), User)
+        other_process.add(make_user(2, google_id="g-2"))
+
+        self.assertIsNone(self.directory.get_by_id("user_2"))
+        self.assertTrue(self.directory.refresh())
+        self.assertEqual(self.directory.get_by_google_id("g-2").username, "utente2")
+        self.assertFalse(self.directory.refresh())
+
+    def test_merge_keeps_users_of_other_process(self):
+        other_process = UserDirectory(self.make_storage(self.tmp.name), User)
+        other_process.add(make_user(1))
+        remote = {"utente2": {"username": "utente2", "email": "utente2@example.com", "password_hash": "x",
+                              "user_id": "user_2", "created_at": 2.0}}
+        self.assertEqual(self.directory.merge(remote), 1)
+        self.assertEqual(set(self.storage.load_users()), {"utente1", "utente2"})
+
+
+class TestJsonUserDirectory(DirectoryContract, unittest.TestCase):
+    def make_storage(self, directory):
+        return JsonUserStorage(directory)
+
+    def test_single_user_appended_not_rewritten(self):
+        self.directory.add(make_user(1))
+        users_file = os.path.join(self.tmp.name, "users.json")
+        mtime = os.stat(users_file).st_mtime_ns
+
+        self.directory.add(make_user(2))
+        self.assertEqual(os.stat(users_file).st_mtime_ns, mtime)
+        with open(users_file, 'r', encoding='utf-8') as f:
+            self.assertEqual(list(json.load(f)), ["utente1"])
+        self.assertEqual(len(user_data_log.read_log_records(os.path.join(self.tmp.name, USERS_LOG_NAME))), 1)
+
+    def test_log_compacted_into_users_file(self):
+        with mock.patch.object(user_data_log, "COMPACT_MIN_RECORDS", 3):
+            for index in range(1, 6):
+                self.directory.add(make_user(index))
+
+        with open(os.path.join(self.tmp.name, "users.json"), 'r', encoding='utf-8') as f:
+            self.assertGreaterEqual(len(json.load(f)), 4)
+        self.assertEqual(len(self.storage.load_users()), 5)
+        # Il log delle modifiche non compare tra i documenti utente
+        self.assertEqual(self.storage.list_user_ids(), [])
+
+
+class TestSQLiteUserDirectory(DirectoryContract, unittest.TestCase):
+    def make_storage(self, directory):
+        return SQLiteUserStorage(os.path.join(directory, "user_data.db"))
+
+
+class FakeSupabaseService:
+    """Servizio Supabase in memoria che registra le sincronizzazioni degli utenti."""
+
+    def __init__(self):
+        self.synced_users = []
+        self.full_syncs = 0
+
+    def is_available(self):
+        return True
+
+    def download_users_from_supabase(self):
+        return {}
+
+    def sync_user_to_supabase(self, username, user_data):
+        self.synced_users.append(username)
+        return True
+
+    def sync_users_to_supabase(self, users_data):
+        self.full_syncs += 1
+        return True
+
+
+class TestManagerRegistration(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.supabase = FakeSupabaseService()
+        patcher = mock.patch.object(UserDataManager, "_get_supabase_service", lambda manager: self.supabase)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = UserDataManager(self.tmp.name, storage=JsonUserStorage(self.tmp.name))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_register_syncs_single_row(self):
+        for index in range(1, 4):
+            ok, _ = self.manager.register_user(f"utente{index}", f"utente{index}@example.com", "password123")
+            self.assertTrue(ok)
+
+        self.assertEqual(self.supabase.synced_users, ["utente1", "utente2", "utente3"])
+        self.assertEqual(self.supabase.full_syncs, 0)
+
+    def test_duplicate_email_and_username(self):
+        self.manager.register_user("mario", "mario@example.com", "password123")
+        self.assertEqual(self.manager.register_user("mario2", "mario@example.com", "password123"),
+                         (False, "Email già in uso"))
+        self.assertEqual(self.manager.register_user("mario", "altro@example.com", "password123"),
+                         (False, "Username già in uso"))
+        self.assertTrue(self.manager.is_username_taken("mario"))
+
+    def test_lookup_by_id_and_google_id(self):
+        self.manager.add_user(make_user(7, google_id="g-7"))
+        self.assertEqual(self.manager.get_user_by_id("user_7").username, "utente7")
+        self.assertEqual(self.manager.get_user_by_google_id("g-7").username, "utente7")
+        self.assertFalse(self.manager.login_user("utente7", "password123")[0])
+
+    def test_users_registered_by_other_worker(self):
+        other_worker = UserDataManager(self.tmp.name, storage=JsonUserStorage(self.tmp.name))
+        ok, user_id = self.manager.register_user("mario", "mario@example.com", "password123")
+        self.assertTrue(ok)
+
+        self.assertEqual(other_worker.login_user("mario", "password123"), (True, user_id))
+        self.assertEqual(other_worker.get_user_by_id(user_id).username, "mario")
+        self.assertEqual(other_worker.register_user("mario", "altro@example.com", "password123"),
+                         (False, "Username già in uso"))
+        self.manager.add_user(make_user(8, google_id="g-8"))
+        self.assertEqual(other_worker.get_user_by_google_id("g-8").username, "utente8")
+        self.assertTrue(other_worker.is_username_taken("utente8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
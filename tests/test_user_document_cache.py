@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test della cache condivisa dei documenti utente: hit, invalidazione per versione
+(scritture del processo e di altri processi), sola lettura, LRU e modifiche ancora
+nel buffer write-behind.
+"""
+
+import copy
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_tools.user_storage import JsonUserStorage, SQLiteUserStorage
+from agent_tools import user_data_manager
+from agent_tools.user_document_cache import UserDocumentCache, get_document_cache, thaw
+from agent_tools.user_data_manager import UserDataManager
+
+DOCUMENT = {
+    "user_preferences": {"excluded_foods": ["tonno"], "preferred_foods": [], "user_notes": []},
+    "chat_history": [],
+    "nutritional_info": {"età": 30, "sesso": "Maschio", "agent_qa": []},
+    "nutritional_info_extracted": {"daily_macros": {"totali_giornalieri": {"proteine_totali": 140}}},
+    "interazioni": 0
+}
+
+
+class CacheContract:
+    """Comportamento della cache comune a tutti i backend."""
+
+    def make_storage(self, directory):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = self.make_storage(self.tmp.name)
+        self.storage.save_document("user_1", DOCUMENT)
+        self.cache = UserDocumentCache(self.storage, maxsize=2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_repeated_reads_hit(self):
+        first = self.cache.get("user_1")
+        self.assertIs(self.cache.get("user_1"), first)
+        self.assertEqual(first["nutritional_info_extracted"], DOCUMENT["nutritional_info_extracted"])
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_write_invalidates(self):
+        self.cache.get("user_1")
+        self.storage.update_fields("user_1", {"interazioni": 5})
+        self.assertEqual(self.cache.get_field("user_1", "interazioni"), 5)
+
+        self.storage.append_agent_qa("user_1", {"question": "Peso?", "answer": "75", "timestamp": 1.0})
+        self.assertEqual(self.cache.get("user_1")["nutritional_info"]["agent_qa"][-1]["answer"], "75")
+        self.assertEqual(self.cache.stats()["hits"], 0)
+
+    def test_missing_document(self):
+        self.assertIsNone(self.cache.get("user_2"))
+        self.assertEqual(self.cache.get_field("user_2", "interazioni", 0), 0)
+
+    def test_view_is_read_only(self):
+        document = self.cache.get("user_1")
+        with self.assertRaises(TypeError):
+            document["interazioni"] = 1
+        with self.assertRaises(TypeError):
+            document["user_preferences"]["excluded_foods"].append("pollo")
+
+        # Le copie sono dict e liste ordinari, modificabili
+        for mutable in (thaw(document), copy.deepcopy(document)):
+            mutable["user_preferences"]["excluded_foods"].append("pollo")
+            self.assertEqual(type(mutable), dict)
+        self.assertEqual(json.loads(json.dumps(document))["interazioni"], 0)
+        self.assertEqual(document["user_preferences"]["excluded_foods"], ["tonno"])
+
+    def test_lru_eviction(self):
+        for user_id in ("user_1", "user_2", "user_3"):
+            self.cache.get(user_id)
+        stats = self.cache.stats()
+        self.assertEqual((stats["size"], stats["evictions"]), (2, 1))
+
+
+class TestJsonDocumentCache(CacheContract, unittest.TestCase):
+    def make_storage(self, directory):
+        return JsonUserStorage(directory)
+
+    def test_external_write_invalidates(self):
+        self.cache.get("user_1")
+        # Scrittura di un altro processo: non passa dal contatore di questo backend
+        path = os.path.join(self.tmp.name, "user_1.json")
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        data["interazioni"] = 42
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+        self.assertEqual(self.cache.get_field("user_1", "interazioni"), 42)
+
+
+class TestSQLiteDocumentCache(CacheContract, unittest.TestCase):
+    def make_storage(self, directory):
+        return SQLiteUserStorage(os.path.join(directory, "user_data.db"))
+
+    def test_external_write_invalidates(self):
+        self.cache.get("user_1")
+        other_process = SQLiteUserStorage(self.storage.path)
+        other_process.update_fields("user_1", {"interazioni": 42})
+
+        self.assertEqual(self.cache.get_field("user_1", "interazioni"), 42)
+
+
+
+class TestBufferedWritesVisible(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.storage = JsonUserStorage(self.tmp.name)
+        self.synced = []
+        patcher = mock.patch.object(user_data_manager, "auto_sync_user_data",
+                                    lambda user_id, data: self.synced.append(user_id))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pending_preferences_visible_before_flush(self):
+        cache = get_document_cache(self.storage)
+        self.assertIsNone(cache.get("user_x"))
+
+        manager = UserDataManager(self.tmp.name, storage=self.storage)
+        self.addCleanup(manager._storage.close)
+        manager.update_user_preferences("user_x", {"excluded_foods": ["pollo"]})
+
+        self.assertTrue(manager._storage.has_pending("user_x"))
+        self.assertEqual(cache.get("user_x")["user_preferences"]["excluded_foods"], ["pollo"])
+
+        # Il buffer creato dalla cache riceve la sincronizzazione del gestore
+        manager.flush("user_x")
+        self.assertEqual(self.synced, ["user_x"])
+        self.assertEqual(self.storage.load_document("user_x")["user_preferences"]["excluded_foods"], ["pollo"])
+        self.assertEqual(cache.get("user_x")["user_preferences"]["excluded_foods"], ["pollo"])
+
+
+if __name__ == "__main__":
+    unittest.main()
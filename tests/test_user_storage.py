@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Test dei backend di persistenza dei dati utente (JSON e SQLite) e della
+migrazione dalla directory JSON al database SQLite.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_tools.user_storage import (
+    JsonUserStorage, SQLiteUserStorage, UserStorage, get_user_storage, migrate_user_storage
+)
+from agent_tools.user_data_manager import UserDataManager
+
+USERS = {
+    "mario": {
+        "username": "mario", "email": "mario@example.com", "password_hash": "abc",
+        "user_id": "user_1", "created_at": 1.0
+    }
+}
+
+DOCUMENT = {
+    "user_preferences": {"excluded_foods": ["tonno"], "preferred_foods": [], "user_notes": []},
+    "chat_history": [
+        {"role": "user", "content": "Ciao", "timestamp": 1.0},
+        {"role": "assistant", "content": "Ciao!", "timestamp": 2.0}
+    ],
+    "nutritional_info": {
+        "età": 30, "sesso": "Maschio", "peso": 75.0, "altezza": 180,
+        "attività": "Moderata", "obiettivo": "Mantenimento", "nutrition_answers": {},
+        "agent_qa": [{"question": "Quanto pesi?", "answer": "75 kg", "timestamp": 3.0}]
+    },
+    "nutritional_info_extracted": {"caloric_needs": {"fabbisogno_finale": 2400}},
+    "conversation_costs": {"total_cost": 0.12},
+    "interazioni": 1
+}
+
+NUTRITIONAL_INFO = {
+    "età": 30, "sesso": "Maschio", "peso": 75.0, "altezza": 180,
+    "attività": "Moderata", "obiettivo": "Mantenimento", "nutrition_answers": {}
+}
+
+
+def without_log_seq(document):
+    return {k: v for k, v in document.items() if k != "log_seq"}
+
+
+class StorageContract:
+    """Comportamento comune a tutti i backend."""
+
+    def make_storage(self, directory):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = self.make_storage(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_users_round_trip(self):
+        self.storage.save_users(USERS)
+        self.assertEqual(self.storage.load_users(), USERS)
+
+    def test_document_round_trip(self):
+        self.assertIsNone(self.storage.load_document("user_1"))
+        self.storage.save_document("user_1", DOCUMENT)
+
+        self.assertTrue(self.storage.user_exists("user_1"))
+        self.assertEqual(self.storage.list_user_ids(), ["user_1"])
+        self.assertEqual(without_log_seq(self.storage.load_document("user_1")), DOCUMENT)
+
+    def test_update_fields_preserves_other_fields(self):
+        self.storage.save_document("user_1", DOCUMENT)
+        self.storage.update_fields("user_1", {"privacy_consent": {"accepted": True}}, defaults={"interazioni": 0})
+
+        document = without_log_seq(self.storage.load_document("user_1"))
+        self.assertEqual(document["privacy_consent"], {"accepted": True})
+        self.assertEqual(document["interazioni"], 1)
+        self.assertEqual(document["chat_history"], DOCUMENT["chat_history"])
+        self.assertEqual(self.storage.get_field("user_1", "conversation_costs"), {"total_cost": 0.12})
+        self.assertEqual(self.storage.get_field("user_2", "conversation_costs", "assente"), "assente")
+
+    def test_appends_visible_in_document(self):
+        self.storage.save_document("user_1", DOCUMENT)
+        self.storage.append_chat_message("user_1", {"role": "user", "content": "Nuovo", "timestamp": 4.0})
+        self.storage.append_agent_qa("user_1", {"question": "Obiettivo?", "answer": "Dimagrire", "timestamp": 5.0})
+        self.storage.increment_interactions("user_1")
+
+        document = self.storage.load_document("user_1")
+        self.assertEqual(document["chat_history"][-1]["content"], "Nuovo")
+        self.assertEqual(document["nutritional_info"]["agent_qa"][-1]["answer"], "Dimagrire")
+        self.assertEqual(self.storage.get_field("user_1", "interazioni"), 2)
+
+    def test_apply_batch(self):
+        self.storage.save_document("user_1", DOCUMENT)
+        self.storage.apply_batch(
+            "user_1",
+            fields={"conversation_costs": {"total_cost": 0.2}},
+            defaults={"interazioni": 0, "privacy_consent": None},
+            chat_messages=[{"role": "user", "content": "Nuovo", "timestamp": 4.0}],
+            agent_qa=[{"question": "Obiettivo?", "answer": "Dimagrire", "timestamp": 5.0}],
+            interactions=2
+        )
+
+        document = without_log_seq(self.storage.load_document("user_1"))
+        self.assertEqual(document["conversation_costs"], {"total_cost": 0.2})
+        self.assertIsNone(document["privacy_consent"])
+        self.assertEqual(document["interazioni"], 3)
+        self.assertEqual(document["chat_history"][-1]["content"], "Nuovo")
+        self.assertEqual(document["nutritional_info"]["agent_qa"][-1]["answer"], "Dimagrire")
+
+    def test_modify_and_remove_fields(self):
+        self.storage.save_document("user_1", DOCUMENT)
+
+        def add_day(extracted):
+            extracted["weekly_diet_days_2_7"] = {"giorno_2": {}}
+            return extracted
+
+        self.storage.modify_field("user_1", "nutritional_info_extracted", add_day)
+        self.assertIsNone(self.storage.modify_field("user_1", "conversation_costs", lambda costs: None))
+        self.assertEqual(self.storage.modify_field("user_1", "contatore", lambda value: value + 1, 0), 1)
+
+        document = self.storage.load_document("user_1")
+        self.assertEqual(document["nutritional_info_extracted"]["weekly_diet_days_2_7"], {"giorno_2": {}})
+        self.assertEqual(document["nutritional_info_extracted"]["caloric_needs"], {"fabbisogno_finale": 2400})
+        self.assertEqual(document["conversation_costs"], {"total_cost": 0.12})
+
+        self.storage.remove_fields("user_1", ["nutritional_info_extracted", "contatore"])
+        document = self.storage.load_document("user_1")
+        self.assertNotIn("nutritional_info_extracted", document)
+        self.assertNotIn("contatore", document)
+        self.assertEqual(document["chat_history"], DOCUMENT["chat_history"])
+
+    def test_manager_round_trip(self):
+        manager = UserDataManager(self.tmp.name, storage=self.storage)
+        ok, user_id = manager.register_user("mario", "mario@example.com", "password123")
+        self.assertTrue(ok)
+        manager.save_nutritional_info(user_id, NUTRITIONAL_INFO)
+        manager.update_user_preferences(user_id, {"excluded_foods": ["tonno"]})
+        manager.save_chat_message(user_id, "user", "Ciao")
+        manager.save_agent_qa(user_id, "Quanto pesi?", "75 kg")
+        manager.save_cost_stats(user_id, {"total_cost": 0.1, "timestamp": "2025-01-01"})
+        manager.flush(user_id)
+
+        reloaded = UserDataManager(self.tmp.name, storage=self.storage)
+        self.assertTrue(reloaded.login_user("mario", "password123")[0])
+        self.assertEqual([m.content for m in reloaded.get_chat_history(user_id)], ["Ciao"])
+        self.assertEqual([qa.answer for qa in reloaded.get_agent_qa(user_id)], ["75 kg"])
+        self.assertEqual(reloaded.get_user_preferences(user_id)["excluded_foods"], ["tonno"])
+        self.assertEqual(reloaded.get_interactions_count(user_id), 1)
+        self.assertEqual(self.storage.get_field(user_id, "conversation_costs")["total_cost"], 0.1)
+
+
+class TestJsonUserStorage(StorageContract, unittest.TestCase):
+    def make_storage(self, directory):
+        return JsonUserStorage(directory)
+
+
+class TestSQLiteUserStorage(StorageContract, unittest.TestCase):
+    def make_storage(self, directory):
+        return SQLiteUserStorage(os.path.join(directory, "user_data.db"))
+
+    def test_email_lookup(self):
+        self.storage.save_users(USERS)
+        self.assertEqual(self.storage.get_user_by_email("mario@example.com")["username"], "mario")
+        self.assertIsNone(self.storage.get_user_by_email("luigi@example.com"))
+
+    def test_concurrent_appends(self):
+        self.storage.save_document("user_1", DOCUMENT)
+
+        def append_messages(worker):
+            for i in range(25):
+                self.storage.append_chat_message("user_1", {"role": "user", "content": f"{worker}-{i}", "timestamp": i})
+                self.storage.increment_interactions("user_1")
+
+        threads = [threading.Thread(target=append_messages, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        document = self.storage.load_document("user_1")
+        self.assertEqual(len(document["chat_history"]), 2 + 100)
+        self.assertEqual(document["interazioni"], 1 + 100)
+
+
+class TestMigration(unittest.TestCase):
+    def test_json_to_sqlite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = JsonUserStorage(directory)
+            source.save_users(USERS)
+            source.save_document("user_1", DOCUMENT)
+            # Record ancora nel log append-only
+            source.append_chat_message("user_1", {"role": "user", "content": "Nel log", "timestamp": 4.0})
+
+            target = SQLiteUserStorage(os.path.join(directory, "user_data.db"))
+            result = migrate_user_storage(source, target)
+
+            self.assertTrue(result["success"])
+            self.assertEqual((result["users"], result["documents"]), (1, 1))
+            self.assertEqual(target.load_users(), source.load_users())
+            self.assertEqual(target.load_document("user_1"), without_log_seq(source.load_document("user_1")))
+            self.assertEqual(target.load_document("user_1")["chat_history"][-1]["content"], "Nel log")
+
+
+class TestGetUserStorage(unittest.TestCase):
+    def test_shared_instance_per_backend(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIs(get_user_storage(directory), get_user_storage(directory))
+            sqlite_storage = get_user_storage(directory, backend="sqlite")
+            self.assertIsInstance(sqlite_storage, SQLiteUserStorage)
+            self.assertTrue(Path(sqlite_storage.path).exists())
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_user_storage(backend="redis")
+
+
+class TestUserStorageInterface(unittest.TestCase):
+    def test_incomplete_backend_rejected(self):
+        """Un backend che non implementa tutta l'interfaccia non può essere istanziato"""
+        class PartialStorage(UserStorage):
+            def load_users(self):
+                return {}
+
+        with self.assertRaises(TypeError) as context:
+            PartialStorage()
+        self.assertIn("load_document", str(context.exception))
+        self.assertNotIn("get_field", str(context.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Stress test multi-processo del backend JSON: più processi scrivono lo stesso
+utente (append di chat e interazioni, aggiornamenti di campi, lettura-modifica-
+scrittura e compattazioni) mentre un lettore controlla di non vedere mai un file
+scritto a metà. Nessuna scrittura deve andare persa.
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_tools import user_data_log
+from agent_tools.atomic_files import atomic_write_json
+from agent_tools.user_storage import JsonUserStorage
+
+WORKERS = 4
+ITERATIONS = 25
+USER_ID = "user_1"
+
+
+def hammer_user(data_dir, worker):
+    """Scritture di un processo worker sullo stesso utente."""
+    # Compattazioni frequenti, così log e documento vengono riscritti da processi diversi
+    user_data_log.COMPACT_MIN_RECORDS = 4
+    storage = JsonUserStorage(data_dir)
+    for i in range(ITERATIONS):
+        storage.append_chat_message(USER_ID, {"role": "user", "content": f"{worker}-{i}", "timestamp": i})
+        storage.increment_interactions(USER_ID)
+        storage.update_fields(USER_ID, {f"worker_{worker}": i + 1})
+        storage.modify_field(USER_ID, "shared_counter", lambda value: value + 1, 0)
+
+
+class TestMultiProcessWrites(unittest.TestCase):
+    def test_concurrent_processes_lose_no_writes(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            JsonUserStorage(data_dir).save_document(USER_ID, {"chat_history": [], "interazioni": 0})
+
+            context = multiprocessing.get_context("spawn")
+            processes = [context.Process(target=hammer_user, args=(data_dir, worker)) for worker in range(WORKERS)]
+            for process in processes:
+                process.start()
+
+            # Il lettore non deve mai vedere un documento troncato o non valido
+            reads = 0
+            while any(process.is_alive() for process in processes):
+                document = user_data_log.load_user_document(USER_ID, data_dir)
+                self.assertIsInstance(document, dict)
+                reads += 1
+            for process in processes:
+                process.join()
+                self.assertEqual(process.exitcode, 0)
+
+            document = JsonUserStorage(data_dir).load_document(USER_ID)
+            contents = sorted(message["content"] for message in document["chat_history"])
+            expected = sorted(f"{worker}-{i}" for worker in range(WORKERS) for i in range(ITERATIONS))
+            self.assertEqual(contents, expected)
+            self.assertEqual(document["interazioni"], WORKERS * ITERATIONS)
+            self.assertEqual(document["shared_counter"], WORKERS * ITERATIONS)
+            for worker in range(WORKERS):
+                self.assertEqual(document[f"worker_{worker}"], ITERATIONS)
+            self.assertGreater(reads, 0)
+            # Nessun file temporaneo lasciato dalle scritture atomiche
+            self.assertEqual(list(Path(data_dir).glob("*.tmp")), [])
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def test_failed_write_keeps_previous_file(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            path = Path(data_dir) / "users.json"
+            atomic_write_json(path, {"mario": {"user_id": "user_1"}})
+
+            with self.assertRaises(TypeError):
+                atomic_write_json(path, {"non serializzabile": object()})
+
+            with open(path, 'r', encoding='utf-8') as f:
+                self.assertEqual(json.load(f), {"mario": {"user_id": "user_1"}})
+            self.assertEqual([p.name for p in Path(data_dir).iterdir()], ["users.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
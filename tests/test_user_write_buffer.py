@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Test del buffer write-behind dei documenti utente: unione delle modifiche di un
+turno in un'unica scrittura, letture coerenti, flush periodico e alla chiusura.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_tools.user_storage import JsonUserStorage
+from agent_tools.user_write_buffer import WriteBehindUserStorage
+from agent_tools.user_data_manager import UserDataManager
+
+USER_ID = "user_1"
+
+NUTRITIONAL_INFO = {
+    "età": 30, "sesso": "Maschio", "peso": 75.0, "altezza": 180,
+    "attività": "Moderata", "obiettivo": "Mantenimento", "nutrition_answers": {}
+}
+
+
+class CountingStorage(JsonUserStorage):
+    """Backend JSON che conta le scritture ricevute."""
+
+    def __init__(self, data_dir):
+        super().__init__(data_dir)
+        self.writes = []
+        self.fail_next = False
+
+    def apply_batch(self, user_id, **batch):
+        if self.fail_next:
+            self.fail_next = False
+            raise OSError("disco non disponibile")
+        self.writes.append(("apply_batch", user_id))
+        super().apply_batch(user_id, **batch)
+
+    def update_fields(self, user_id, fields, defaults=None):
+        self.writes.append(("update_fields", user_id))
+        super().update_fields(user_id, fields, defaults)
+
+    def _append(self, user_id, record_type, **fields):
+        self.writes.append((record_type, user_id))
+        return super()._append(user_id, record_type, **fields)
+
+
+class BlockingStorage(JsonUserStorage):
+    """Backend JSON in cui la scrittura di un batch di USER_ID attende un evento."""
+
+    def __init__(self, data_dir):
+        super().__init__(data_dir)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def apply_batch(self, user_id, **batch):
+        if user_id == USER_ID:
+            self.started.set()
+            self.release.wait(10)
+        super().apply_batch(user_id, **batch)
+
+
+class TestWriteBehindUserStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.inner = CountingStorage(self.tmp.name)
+        self.synced = []
+        self.storage = WriteBehindUserStorage(
+            self.inner, flush_interval=60, on_flush=lambda user_id, data: self.synced.append((user_id, data))
+        )
+        self.manager = UserDataManager(self.tmp.name, storage=self.storage)
+        self.manager.save_nutritional_info(USER_ID, NUTRITIONAL_INFO)
+        self.manager.flush(USER_ID)
+        self.inner.writes.clear()
+        self.synced.clear()
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp.cleanup()
+
+    def chat_turn(self, question, answer):
+        """Le scritture di un turno della chat principale."""
+        self.manager.save_chat_message(USER_ID, "user", question)
+        self.manager.save_cost_stats(USER_ID, {"total_cost": 0.1, "timestamp": "2025-01-01"})
+        self.manager.save_chat_message(USER_ID, "assistant", answer)
+        self.manager.save_agent_qa(USER_ID, question, answer)
+
+    def test_turn_written_once(self):
+        self.chat_turn("Quanto pesi?", "75 kg")
+        self.assertEqual(self.inner.writes, [])
+
+        self.manager.flush(USER_ID)
+        self.assertEqual(self.inner.writes, [("apply_batch", USER_ID)])
+        self.assertEqual(len(self.synced), 1)
+
+        document = self.inner.load_document(USER_ID)
+        self.assertEqual([m["content"] for m in document["chat_history"]], ["Quanto pesi?", "75 kg"])
+        self.assertEqual(document["nutritional_info"]["agent_qa"][-1]["answer"], "75 kg")
+        self.assertEqual(document["conversation_costs"]["total_cost"], 0.1)
+        self.assertEqual(document["interazioni"], 1)
+        self.assertEqual(self.synced[0][1]["interazioni"], 1)
+
+    def test_reads_see_pending_writes(self):
+        self.chat_turn("Quanto pesi?", "75 kg")
+
+        self.assertEqual(self.manager.get_interactions_count(USER_ID), 1)
+        self.assertEqual(self.storage.load_document(USER_ID)["chat_history"][-1]["content"], "75 kg")
+        self.assertIsNone(self.inner.get_field(USER_ID, "conversation_costs"))
+        self.assertEqual(self.inner.writes, [])
+
+    def test_full_chat_history_replaces_pending_messages(self):
+        self.manager.save_chat_message(USER_ID, "user", "Ciao")
+        self.manager.clear_chat_history(USER_ID)
+        self.manager.save_chat_message(USER_ID, "user", "Di nuovo")
+        self.manager.flush(USER_ID)
+
+        document = self.inner.load_document(USER_ID)
+        self.assertEqual([m["content"] for m in document["chat_history"]], ["Di nuovo"])
+        self.assertEqual(document["interazioni"], 2)
+
+    def test_periodic_flush(self):
+        self.storage.flush_interval = 0.05
+        self.manager.save_chat_message(USER_ID, "user", "Ciao")
+
+        deadline = time.monotonic() + 5
+        while self.storage.has_pending(USER_ID) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.storage.has_pending(USER_ID))
+        self.assertEqual(self.inner.load_document(USER_ID)["chat_history"][-1]["content"], "Ciao")
+
+    def test_close_flushes_pending_writes(self):
+        self.chat_turn("Quanto pesi?", "75 kg")
+        self.storage.close()
+
+        self.assertEqual(self.inner.load_document(USER_ID)["interazioni"], 1)
+
+    def test_failed_flush_is_retried(self):
+        self.chat_turn("Quanto pesi?", "75 kg")
+        self.inner.fail_next = True
+
+        self.manager.flush(USER_ID)
+        self.assertTrue(self.storage.has_pending(USER_ID))
+        self.manager.flush(USER_ID)
+
+        self.assertFalse(self.storage.has_pending(USER_ID))
+        self.assertEqual(len(self.inner.load_document(USER_ID)["chat_history"]), 2)
+
+
+class TestFlushOutsideLock(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.inner = BlockingStorage(self.tmp.name)
+        self.inner.save_document("user_2", {"chat_history": [], "interazioni": 0})
+        self.storage = WriteBehindUserStorage(self.inner, flush_interval=60)
+
+    def tearDown(self):
+        self.inner.release.set()
+        self.storage.close()
+        self.tmp.cleanup()
+
+    def message(self, content):
+        return {"role": "user", "content": content, "timestamp": time.time()}
+
+    def test_slow_flush_does_not_block_other_users(self):
+        self.storage.append_chat_message(USER_ID, self.message("Ciao"))
+        flusher = threading.Thread(target=self.storage.flush, args=(USER_ID,))
+        flusher.start()
+        self.assertTrue(self.inner.started.wait(5))
+
+        def other_user():
+            self.storage.increment_interactions("user_2")
+            self.storage.get_field("user_2", "interazioni")
+            self.storage.flush("user_2")
+
+        worker = threading.Thread(target=other_user)
+        worker.start()
+        worker.join(2)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(self.inner.get_field("user_2", "interazioni"), 1)
+
+        self.inner.release.set()
+        flusher.join(5)
+
+    def test_reads_see_batch_being_written(self):
+        self.storage.append_chat_message(USER_ID, self.message("Ciao"))
+        flusher = threading.Thread(target=self.storage.flush, args=(USER_ID,))
+        flusher.start()
+        self.assertTrue(self.inner.started.wait(5))
+
+        self.storage.append_chat_message(USER_ID, self.message("Di nuovo"))
+        self.assertFalse(self.inner.user_exists(USER_ID))
+        self.assertTrue(self.storage.has_pending(USER_ID))
+        contents = [m["content"] for m in self.storage.load_document(USER_ID)["chat_history"]]
+        self.assertEqual(contents, ["Ciao", "Di nuovo"])
+
+        self.inner.release.set()
+        flusher.join(5)
+        # Scritto il batch, il documento non contiene record duplicati
+        contents = [m["content"] for m in self.storage.load_document(USER_ID)["chat_history"]]
+        self.assertEqual(contents, ["Ciao", "Di nuovo"])
+
+        self.storage.flush(USER_ID)
+        self.assertFalse(self.storage.has_pending(USER_ID))
+        contents = [m["content"] for m in self.inner.load_document(USER_ID)["chat_history"]]
+        self.assertEqual(contents, ["Ciao", "Di nuovo"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,7 +13,7 @@ import logging
 # Aggiungi il percorso del progetto per importare i tool
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from agent_tools.user_data_manager import UserDataManager
+from agent_tools.user_data_manager import get_user_data_manager
 
 # Configurazione logging
 logging.basicConfig(level=logging.INFO)
@@ -51,7 +51,7 @@ def load_user_data(user_id: Optional[str] = None) -> Dict[str, Any]:
         user_id = get_user_id()
     
     # Inizializza il manager dei dati utente
-    user_manager = UserDataManager()
+    user_manager = get_user_data_manager()
     
     # Verifica che il file utente esista
     user_dir = "user_data"
@@ -82,10 +82,10 @@ def load_substitutes_database() -> Dict[str, Dict[str, Dict[str, float]]]:
         return data.get("substitutes", {})
 
 def load_nutridb():
-    """Carica l'istanza del database nutrizionale"""
+    """Restituisce l'istanza condivisa del database nutrizionale"""
     try:
-        from agent_tools.nutridb import NutriDB
-        return NutriDB("Dati_processed")
+        from agent_tools.nutridb import get_shared_nutridb
+        return get_shared_nutridb("Dati_processed")
     except Exception as e:
         logger.error(f"Errore nel caricamento del NutriDB: {str(e)}")
         raise
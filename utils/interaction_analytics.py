@@ -13,6 +13,8 @@ from typing import Dict, List, Tuple, Optional
 from datetime import datetime
 import logging
 
+from agent_tools.user_storage import get_user_storage
+
 # Configurazione logging
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
@@ -36,20 +38,16 @@ def get_total_interactions_count(user_data_dir: str = "user_data") -> int:
             return 0
         
         total_interactions = 0
+        storage = get_user_storage(user_data_dir)
         
-        # Trova tutti i file JSON utente (esclude users.json)
-        user_files = list(user_data_path.glob("*.json"))
-        user_files = [f for f in user_files if f.name != "users.json"]
-        
-        for user_file in user_files:
+        # Tutti gli utenti con un documento (esclude users.json)
+        for user_id in storage.list_user_ids():
             try:
-                with open(user_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    user_interactions = data.get("interazioni", 0)
-                    total_interactions += user_interactions
+                user_interactions = storage.get_field(user_id, "interazioni", 0)
+                total_interactions += user_interactions
                     
             except (json.JSONDecodeError, Exception) as e:
-                logger.warning(f"Errore nel leggere {user_file}: {str(e)}")
+                logger.warning(f"Errore nel leggere i dati di {user_id}: {str(e)}")
                 continue
         
         return total_interactions
@@ -71,40 +69,33 @@ def get_users_interactions_breakdown(user_data_dir: str = "user_data") -> Dict[s
     """
     try:
         user_data_path = Path(user_data_dir)
-        users_file = user_data_path / "users.json"
         
         if not user_data_path.exists():
             logger.warning(f"Directory {user_data_dir} non trovata")
             return {}
         
+        storage = get_user_storage(user_data_dir)
+        
         # Carica informazioni utenti per ottenere username
         users_info = {}
-        if users_file.exists():
-            try:
-                with open(users_file, 'r', encoding='utf-8') as f:
-                    users_data = json.load(f)
-                    # Crea mapping user_id -> username
-                    for username, user_data in users_data.items():
-                        users_info[user_data['user_id']] = {
-                            'username': username,
-                            'email': user_data.get('email', 'N/A'),
-                            'created_at': user_data.get('created_at', 0)
-                        }
-            except Exception as e:
-                logger.warning(f"Errore nel leggere users.json: {str(e)}")
+        try:
+            users_data = storage.load_users()
+            # Crea mapping user_id -> username
+            for username, user_data in users_data.items():
+                users_info[user_data['user_id']] = {
+                    'username': username,
+                    'email': user_data.get('email', 'N/A'),
+                    'created_at': user_data.get('created_at', 0)
+                }
+        except Exception as e:
+            logger.warning(f"Errore nel leggere gli utenti: {str(e)}")
         
         breakdown = {}
         
-        # Trova tutti i file JSON utente (esclude users.json)
-        user_files = list(user_data_path.glob("*.json"))
-        user_files = [f for f in user_files if f.name != "users.json"]
-        
-        for user_file in user_files:
+        # Tutti gli utenti con un documento (esclude users.json)
+        for user_id in storage.list_user_ids():
             try:
-                user_id = user_file.stem  # Nome file senza estensione
-                
-                with open(user_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                data = storage.load_document(user_id)
                 
                 # Estrai statistiche
                 total_interactions = data.get("interazioni", 0)
@@ -141,7 +132,7 @@ def get_users_interactions_breakdown(user_data_dir: str = "user_data") -> Dict[s
                 }
                 
             except (json.JSONDecodeError, Exception) as e:
-                logger.warning(f"Errore nel leggere {user_file}: {str(e)}")
+                logger.warning(f"Errore nel leggere i dati di {user_id}: {str(e)}")
                 continue
         
         return breakdown
@@ -0,0 +1,73 @@
+"""
+Script per migrare i dati utente dalla directory JSON al database SQLite.
+
+Questo script:
+1. Legge users.json e tutti i file utente (inclusi i record del log append-only)
+2. Scrive utenti e documenti nel database SQLite (sostituendo quelli già presenti)
+3. Lascia intatti i file JSON, che restano utilizzabili come backup
+
+Dopo la migrazione, impostare NUTRICOACH_USER_STORAGE=sqlite (e, se diverso dal
+default user_data/user_data.db, NUTRICOACH_USER_DB_PATH).
+
+Uso: python utils/migrate_user_data_to_sqlite.py [directory_json] [percorso_db]
+"""
+
+import os
+import sys
+import logging
+from typing import Dict, Any
+
+# Add the project root to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent_tools.user_storage import JsonUserStorage, SQLiteUserStorage, migrate_user_storage
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def print_report(result: Dict[str, Any], db_path: str) -> None:
+    """
+    Stampa un report della migrazione.
+
+    Args:
+        result: Risultato di migrate_user_storage
+        db_path: Percorso del database di destinazione
+    """
+    print("\n" + "="*60)
+    print("REPORT MIGRAZIONE DATI UTENTE JSON → SQLITE")
+    print("="*60)
+
+    print(f"🗄️ Database: {db_path}")
+    print(f"   👤 Utenti migrati: {result['users']}")
+    print(f"   📄 Documenti migrati: {result['documents']}")
+
+    if result['errors']:
+        print(f"\n❌ DOCUMENTI NON MIGRATI:")
+        for error in result['errors']:
+            print(f"   • {error['user_id']}: {error['error']}")
+
+    if result['success']:
+        print("\n🎉 Migrazione completata con successo!")
+    else:
+        print(f"\n⚠️ Migrazione completata con errori: {result['error_message']}")
+
+
+def main():
+    """Funzione principale."""
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else "user_data"
+    db_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(data_dir, "user_data.db")
+
+    print(f"🚀 Avvio migrazione da {data_dir} a {db_path}...")
+
+    result = migrate_user_storage(JsonUserStorage(data_dir), SQLiteUserStorage(db_path))
+
+    print_report(result, db_path)
+
+    return result['success']
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
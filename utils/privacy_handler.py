@@ -7,6 +7,9 @@ import json
 import os
 from typing import Dict, Any
 
+from agent_tools.user_storage import get_user_storage
+from agent_tools.user_document_cache import get_document_cache
+
 
 class PrivacyHandler:
     """Gestisce privacy e disclaimer in modo modulare."""
@@ -35,17 +38,10 @@ class PrivacyHandler:
     
     def has_user_accepted(self, user_id: str = "default") -> bool:
         """Verifica se l'utente ha accettato privacy e disclaimer controllando nel file utente."""
-        # Per utenti veri, controlla SEMPRE nel file utente
-        user_file_path = f"user_data/{user_id}.json"
-        
-        if not os.path.exists(user_file_path):
-            return False
-            
+        # Per utenti veri, controlla SEMPRE nei dati utente
         try:
-            with open(user_file_path, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
-                privacy_consent = user_data.get("privacy_consent", {})
-                return privacy_consent.get("accepted", False)
+            privacy_consent = get_document_cache().get_field(user_id, "privacy_consent") or {}
+            return privacy_consent.get("accepted", False)
         except Exception:
             return False
     
@@ -59,27 +55,9 @@ class PrivacyHandler:
             "version": "1.0"
         }
         
-        # Salva SEMPRE nel file utente
-        user_file_path = f"user_data/{user_id}.json"
-        
+        # Salva SEMPRE nei dati utente (crea il documento se non esiste)
         try:
-            # Carica dati utente esistenti o crea struttura vuota
-            if os.path.exists(user_file_path):
-                with open(user_file_path, 'r', encoding='utf-8') as f:
-                    user_data = json.load(f)
-            else:
-                user_data = {}
-            
-            # Aggiorna il consenso privacy
-            user_data["privacy_consent"] = consent_info
-            
-            # Assicurati che la directory esista
-            os.makedirs(os.path.dirname(user_file_path), exist_ok=True)
-            
-            # Salva il file utente aggiornato
-            with open(user_file_path, 'w', encoding='utf-8') as f:
-                json.dump(user_data, f, indent=2, ensure_ascii=False)
-                
+            get_user_storage().update_fields(user_id, {"privacy_consent": consent_info})
         except Exception as e:
             print(f"Errore nel salvataggio consenso privacy per {user_id}: {str(e)}")
 
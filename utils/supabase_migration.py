@@ -20,6 +20,7 @@ from typing import Dict, Any, Optional, List
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from services.supabase_service import SupabaseUserService
+from agent_tools.user_storage import JsonUserStorage
 
 
 class SupabaseMigrationManager:
@@ -150,10 +151,9 @@ class SupabaseMigrationManager:
     
     def _load_local_users(self) -> Dict[str, Any]:
         """Carica gli utenti dal file locale users.json"""
-        users_file = os.path.join(self.local_data_dir, "users.json")
-        if os.path.exists(users_file):
-            with open(users_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        if os.path.exists(self.local_data_dir):
+            # Include gli utenti non ancora compattati in users.json
+            return JsonUserStorage(self.local_data_dir).load_users()
         return {}
     
     def _load_local_user_data(self) -> Dict[str, Any]: